@@ -1,6 +1,12 @@
 from logging import info, exception, error, debug
 import sys
 import random
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
 
 from twisted.internet.defer import maybeDeferred, succeed
 
@@ -9,10 +15,68 @@ from landscape.lib.twisted_util import gather_results
 from landscape.client.amp import remote
 
 
+# The CPU time used by the process, C{time.clock} being the Python 2
+# equivalent on Unix.
+process_time = getattr(time, "process_time", getattr(time, "clock", None))
+
+
 class HandlerNotFoundError(Exception):
     """A handler for the given message type was not found."""
 
 
+class PluginStats(object):
+    """The cost of the runs of a L{BrokerClientPlugin}.
+
+    @ivar runs: The number of times the plugin was run.
+    @ivar failures: The number of runs which raised an error.
+    @ivar wall_time: The total number of seconds runs took, until the
+        C{Deferred} they returned fired.
+    @ivar max_wall_time: The number of seconds the longest run took.
+    @ivar cpu_time: The total number of CPU seconds used by the process
+        while running the plugin's C{run} method. Work done later by
+        callbacks of the returned C{Deferred} isn't accounted for.
+    @ivar memory: The total growth in bytes of the memory traced by
+        C{tracemalloc} while running C{run}, or C{None} if C{tracemalloc}
+        wasn't tracing, see C{PYTHONTRACEMALLOC}.
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.wall_time = 0.0
+        self.max_wall_time = 0.0
+        self.cpu_time = 0.0
+        self.memory = None
+
+    def add_run(self, wall_time, cpu_time, memory=None, failed=False):
+        """Account for a run of the plugin."""
+        self.runs += 1
+        if failed:
+            self.failures += 1
+        self.wall_time += wall_time
+        self.max_wall_time = max(self.max_wall_time, wall_time)
+        self.cpu_time += cpu_time
+        if memory is not None:
+            self.memory = (self.memory or 0) + memory
+
+    def as_dict(self):
+        """Return the statistics as a C{dict}, to be sent over AMP."""
+        return {"runs": self.runs, "failures": self.failures,
+                "wall-time": self.wall_time,
+                "max-wall-time": self.max_wall_time,
+                "cpu-time": self.cpu_time, "memory": self.memory}
+
+
+def get_traced_memory():
+    """
+    Return the size of the memory blocks traced by C{tracemalloc}, or C{None}
+    if it's not tracing.
+    """
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[0]
+
+
 class BrokerClientPlugin(object):
     """A convenience for writing L{BrokerClient} plugins.
 
@@ -120,8 +184,28 @@ class BrokerClientPlugin(object):
             self._run_with_error_log)
 
     def _run_with_error_log(self):
-        """Wrap self.run in a Deferred with a logging error handler."""
+        """Wrap self.run in a Deferred with a logging error handler.
+
+        The cost of the run is recorded with L{BrokerClient.add_plugin_run}.
+        """
+        reactor = self.client.reactor
+        start_time = reactor.time()
+        start_cpu_time = process_time()
+        start_memory = get_traced_memory()
         deferred = maybeDeferred(self.run)
+        cpu_time = process_time() - start_cpu_time
+        memory = get_traced_memory()
+        if memory is not None and start_memory is not None:
+            memory -= start_memory
+        else:
+            memory = None
+
+        def record(result, failed=False):
+            self.client.add_plugin_run(
+                self, reactor.time() - start_time, cpu_time, memory, failed)
+            return result
+
+        deferred.addCallbacks(record, record, errbackKeywords={"failed": True})
         return deferred.addErrback(self._error_log)
 
     def _error_log(self, failure):
@@ -158,6 +242,7 @@ class BrokerClient(object):
         self._registered_messages = {}
         self._plugins = []
         self._plugin_names = {}
+        self._plugin_stats = {}
 
         # Register event handlers
         self.reactor.call_on("impending-exchange", self.notify_exchange)
@@ -191,6 +276,39 @@ class BrokerClient(object):
         """Get a particular plugin by name."""
         return self._plugin_names[name]
 
+    def add_plugin_run(self, plugin, wall_time, cpu_time, memory=None,
+                       failed=False):
+        """Record the cost of a run of C{plugin}.
+
+        @see: L{PluginStats.add_run}.
+        """
+        name = format_object(plugin)
+        stats = self._plugin_stats.get(name)
+        if stats is None:
+            stats = self._plugin_stats[name] = PluginStats()
+        stats.add_run(wall_time, cpu_time, memory, failed)
+
+    @remote
+    def get_plugin_stats(self):
+        """Return the cost of the runs of the plugins.
+
+        @return: A C{dict} mapping the fully-qualified names of the plugins
+            which ran to the C{dict} returned by L{PluginStats.as_dict}.
+        """
+        return dict((name, stats.as_dict())
+                    for name, stats in self._plugin_stats.items())
+
+    @remote
+    def get_reactor_lag(self):
+        """Return the lag measurements of the client's reactor.
+
+        @return: The C{dict} returned by L{ReactorLagMonitor.get_stats}, or
+            C{None} if the reactor isn't monitored.
+        """
+        if self.reactor.lag_monitor is None:
+            return None
+        return self.reactor.lag_monitor.get_stats()
+
     def register_message(self, type, handler):
         """
         Register interest in a particular type of Landscape server->client
@@ -32,6 +32,7 @@ class BrokerConfiguration(Configuration):
               - C{urgent_exchange_interval} (C{1*60})
               - C{http_proxy}
               - C{https_proxy}
+              - C{metrics_file}
         """
         parser = super(BrokerConfiguration, self).make_parser()
 
@@ -53,6 +54,11 @@ class BrokerConfiguration(Configuration):
         parser.add_option("--ping-interval", default=30, type="int",
                           metavar="INTERVAL",
                           help="The number of seconds between pings.")
+        parser.add_option("--long-poll-timeout", default=0, type="int",
+                          metavar="TIMEOUT",
+                          help="The number of seconds the server may hold "
+                               "pings until messages are waiting, if it "
+                               "supports it (default: 0, disabled).")
         parser.add_option("--http-proxy", metavar="URL",
                           help="The URL of the HTTP proxy, if one is needed.")
         parser.add_option("--https-proxy", metavar="URL",
@@ -62,6 +68,10 @@ class BrokerConfiguration(Configuration):
         parser.add_option("--tags",
                           help="Comma separated list of tag names to be sent "
                                "to the server.")
+        parser.add_option("--metrics-file", metavar="FILE",
+                          help="Write exchange metrics to FILE in the "
+                               "Prometheus text format, for example for the "
+                               "textfile collector of the node exporter.")
 
         return parser
 
@@ -351,6 +351,7 @@ from twisted.python.compat import _PY3
 
 from landscape.lib.fetch import HTTPCodeError, PyCurlError
 from landscape.lib.format import format_delta
+from landscape.lib.metrics import MetricsRegistry
 from landscape.lib.message import got_next_expected, ANCIENT
 from landscape.lib.versioning import is_version_higher, sort_versions
 
@@ -376,7 +377,7 @@ class MessageExchange(object):
     _api = SERVER_API
 
     def __init__(self, reactor, store, transport, registration_info,
-                 exchange_store, config, max_messages=100):
+                 exchange_store, config, max_messages=100, metrics=None):
         """
         @param reactor: The L{LandscapeReactor} used to fire events in response
             to messages received by the server.
@@ -388,6 +389,8 @@ class MessageExchange(object):
             the time interval between subsequent exchanges of non-urgent
             messages, and the time interval between subsequent exchanges
             of urgent messages.
+        @param metrics: Optionally, the L{MetricsRegistry} to record the
+            timeline of exchanges in.
         """
         self._reactor = reactor
         self._message_store = store
@@ -401,6 +404,30 @@ class MessageExchange(object):
         self._exchange_id = None
         self._exchanging = False
         self._urgent_exchange = False
+        if metrics is None:
+            metrics = MetricsRegistry(enabled=False)
+        self._exchanges = metrics.counter(
+            "landscape_exchanges_total", "Message exchanges started.")
+        self._exchange_failures = metrics.counter(
+            "landscape_exchange_failures_total", "Message exchanges failed.")
+        self._exchange_seconds = metrics.histogram(
+            "landscape_exchange_seconds",
+            "Duration of message exchanges, from start to completion.")
+        self._payload_seconds = metrics.histogram(
+            "landscape_exchange_payload_build_seconds",
+            "Time spent building exchange payloads from the message store.")
+        self._handle_result_seconds = metrics.histogram(
+            "landscape_exchange_handle_result_seconds",
+            "Time spent handling server responses.")
+        self._messages_sent = metrics.counter(
+            "landscape_exchange_messages_sent_total",
+            "Messages sent to the server.")
+        self._messages_received = metrics.counter(
+            "landscape_exchange_messages_received_total",
+            "Messages received from the server.")
+        self._pending_messages = metrics.gauge(
+            "landscape_exchange_pending_messages",
+            "Messages pending delivery when the last exchange started.")
         self._client_accepted_types = set()
         self._client_accepted_types_hash = None
         self._message_handlers = {}
@@ -540,9 +567,13 @@ class MessageExchange(object):
 
         self._reactor.fire("pre-exchange")
 
+        start_time = time.time()
         payload = self._make_payload()
+        self._payload_seconds.observe(time.time() - start_time)
+        self._exchanges.inc()
+        self._messages_sent.inc(len(payload["messages"]))
+        self._pending_messages.set(payload["total-messages"])
 
-        start_time = time.time()
         if self._urgent_exchange:
             logging.info("Starting urgent message exchange with %s."
                          % self._transport.get_url())
@@ -555,8 +586,10 @@ class MessageExchange(object):
         def exchange_completed():
             self.schedule_exchange(force=True)
             self._reactor.fire("exchange-done")
+            duration = time.time() - start_time
+            self._exchange_seconds.observe(duration)
             logging.info("Message exchange completed in %s.",
-                         format_delta(time.time() - start_time))
+                         format_delta(duration))
             deferred.callback(None)
 
         def handle_result(result):
@@ -565,9 +598,13 @@ class MessageExchange(object):
                 if self._urgent_exchange:
                     logging.info("Switching to normal exchange mode.")
                     self._urgent_exchange = False
+                handle_time = time.time()
                 self._handle_result(payload, result)
+                self._handle_result_seconds.observe(time.time() - handle_time)
+                self._messages_received.inc(len(result.get("messages", ())))
                 self._message_store.record_success(int(self._reactor.time()))
             else:
+                self._exchange_failures.inc()
                 self._reactor.fire("exchange-failed")
                 logging.info("Message exchange failed.")
             exchange_completed()
@@ -594,6 +631,7 @@ class MessageExchange(object):
                 logging.error("Message exchange failed: %s" % error.message)
                 ssl_error = True
 
+            self._exchange_failures.inc()
             self._reactor.fire("exchange-failed", ssl_error=ssl_error)
 
             self._message_store.record_failure(int(self._reactor.time()))
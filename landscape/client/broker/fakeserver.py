@@ -0,0 +1,367 @@
+"""A local stand-in for the Landscape server.
+
+L{FakeLandscapeServer} speaks the message exchange protocol described in
+L{landscape.client.broker.exchange}, answers pings and serves script
+attachments, keeping everything in memory. It's meant to point clients at
+for integration and load tests, like the in-process clones started with
+C{--clones}, without needing a real server.
+
+The server can be scripted: handlers registered with
+L{FakeLandscapeServer.on_message} are called with each message of the given
+type received from a computer, and L{FakeLandscapeServer.queue_message}
+sends messages to computers.
+
+L{FakeServerResource} exposes it over HTTP, with C{bpickle} payloads as
+L{landscape.client.broker.transport.HTTPTransport} expects::
+
+    server = FakeLandscapeServer()
+    reactor.listenTCP(8080, Site(FakeServerResource(server)))
+
+    # url = http://localhost:8080/message-system
+    # ping_url = http://localhost:8080/ping
+"""
+import time
+import uuid
+from collections import defaultdict
+from hashlib import md5
+
+from twisted.python.compat import _PY3, unicode
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+from landscape import SERVER_API
+from landscape.lib import bpickle
+
+
+DEFAULT_ACCEPTED_TYPES = (
+    "active-process-info", "apt-preferences", "ceph-usage",
+    "change-packages-result", "cloud-instance-metadata", "computer-info",
+    "computer-uptime", "cpu-usage", "custom-graph", "distribution-info",
+    "free-space", "hardware-info", "keystone-token", "load-average",
+    "memory-info", "mount-info", "network-activity", "network-device",
+    "operation-result", "package-reporter-result", "packages",
+    "partial-operation-result", "processor-info", "reboot-required-info",
+    "register", "resynchronize", "swift-usage", "temperature",
+    "unknown-package-hashes", "update-manager-info", "users")
+
+
+def _to_text(value):
+    if isinstance(value, bytes):
+        return value.decode("ascii")
+    return value
+
+
+def hash_types(types):
+    """Hash message types like L{MessageExchange} does."""
+    return md5(";".join(types).encode("ascii")).digest()
+
+
+class FakeComputer(object):
+    """A computer registered with the L{FakeLandscapeServer}.
+
+    @ivar outbox: Messages sent to the computer which it didn't acknowledge
+        yet. The first one has the C{outbox_sequence} sequence number.
+    @ivar next_expected_sequence: The sequence number of the next message
+        expected from the computer.
+    @ivar messages: All the messages received from the computer.
+    """
+
+    def __init__(self, secure_id, insecure_id, title):
+        self.secure_id = secure_id
+        self.insecure_id = insecure_id
+        self.title = title
+        self.outbox = []
+        self.outbox_sequence = 0
+        self.next_expected_sequence = 0
+        self.exchange_token = None
+        self.client_accepted_types = ()
+        self.messages = []
+        self.exchanges = 0
+
+    def acknowledge(self, sequence):
+        """Forget the messages before C{sequence}, which the client got."""
+        if sequence > self.outbox_sequence:
+            del self.outbox[:sequence - self.outbox_sequence]
+            self.outbox_sequence = sequence
+
+
+class FakeLandscapeServer(object):
+    """An in-memory Landscape server.
+
+    @param accepted_types: The message types accepted from clients.
+    @ivar stats: Counters of C{"exchanges"}, C{"pings"}, C{"attachments"},
+        C{"messages"} and C{"stale-tokens"}, the latter being exchanges
+        with an unexpected exchange token.
+    @ivar message_counts: The number of messages received, by type.
+    """
+
+    def __init__(self, accepted_types=DEFAULT_ACCEPTED_TYPES,
+                 server_uuid=None, server_api=SERVER_API):
+        self.accepted_types = sorted(accepted_types)
+        if server_uuid is None:
+            server_uuid = unicode(uuid.uuid4())
+        self.server_uuid = server_uuid
+        self.server_api = server_api
+        self.computers = {}
+        self.attachments = {}
+        self.stats = defaultdict(int)
+        self.message_counts = defaultdict(int)
+        self._computers_by_insecure_id = {}
+        self._handlers = defaultdict(list)
+        self._waiters = defaultdict(list)
+        self._next_insecure_id = 1
+
+    def on_message(self, type, handler):
+        """Call C{handler} with each message of the given C{type}.
+
+        @param handler: A callable taking the L{FakeComputer} which sent the
+            message, or C{None} if it's not registered, and the message. It
+            can return a list of messages to send back.
+        """
+        self._handlers[type].append(handler)
+
+    def queue_message(self, message, computer=None):
+        """Send a message to C{computer}, or to all registered computers."""
+        if computer is None:
+            computers = self.computers.values()
+        else:
+            computers = [computer]
+        for computer in computers:
+            computer.outbox.append(message)
+            for callback in self._waiters.pop(computer.insecure_id, ()):
+                callback()
+
+    def set_accepted_types(self, types):
+        """Change the accepted message types, notifying the clients."""
+        self.accepted_types = sorted(types)
+
+    def add_attachment(self, attachment_id, data):
+        """Serve C{data} as the script attachment with the given ID."""
+        self.attachments[int(attachment_id)] = data
+
+    def get_computer(self, secure_id=None, insecure_id=None):
+        """Return a registered L{FakeComputer}, or C{None}."""
+        if insecure_id is not None:
+            return self._computers_by_insecure_id.get(int(insecure_id))
+        return self.computers.get(_to_text(secure_id))
+
+    def exchange(self, payload, computer_id=None, exchange_token=None):
+        """Handle a message exchange.
+
+        @param payload: The payload sent by the client.
+        @param computer_id: The secure ID sent in the C{X-Computer-ID} header.
+        @param exchange_token: The token sent in the C{X-Exchange-Token}
+            header.
+        @return: The payload to reply with.
+        """
+        self.stats["exchanges"] += 1
+        sequence = payload.get("sequence", 0)
+        messages = payload.get("messages", [])
+        server_sequence = payload.get("next-expected-sequence", 0)
+        response = {"server-uuid": self.server_uuid,
+                    "server-api": self.server_api}
+
+        computer = None
+        if computer_id:
+            computer = self.get_computer(computer_id)
+            if computer is None:
+                response["messages"] = [{"type": "unknown-id"}]
+                return response
+
+        if computer is not None:
+            computer.exchanges += 1
+            if computer.exchange_token is not None and (
+                    _to_text(exchange_token) != computer.exchange_token):
+                self.stats["stale-tokens"] += 1
+            computer.acknowledge(server_sequence)
+            if "client-accepted-types" in payload:
+                computer.client_accepted_types = [
+                    _to_text(type)
+                    for type in payload["client-accepted-types"]]
+            if sequence == computer.next_expected_sequence:
+                computer.next_expected_sequence += len(messages)
+            else:
+                # The reply makes the client resend from what we expect.
+                messages = []
+
+        replies = []
+        for message in messages:
+            type = _to_text(message["type"])
+            if computer is None and type == "register":
+                computer = self.register(message)
+                computer.next_expected_sequence = sequence + len(messages)
+                computer.outbox_sequence = server_sequence
+            replies.extend(self._handle_message(computer, type, message))
+
+        if computer is None:
+            outbox = replies
+            response["next-expected-sequence"] = sequence + len(messages)
+        else:
+            outbox = computer.outbox
+            outbox.extend(replies)
+            computer.exchange_token = unicode(uuid.uuid4())
+            response["next-expected-sequence"] = (
+                computer.next_expected_sequence)
+            response["next-exchange-token"] = computer.exchange_token
+            response["client-accepted-types-hash"] = hash_types(
+                computer.client_accepted_types)
+
+        if payload.get("accepted-types") != hash_types(self.accepted_types):
+            if not any(message["type"] == "accepted-types"
+                       for message in outbox):
+                outbox.append({"type": "accepted-types",
+                               "types": self.accepted_types})
+        response["messages"] = list(outbox)
+        return response
+
+    def register(self, message):
+        """Register a new computer, in reply to a C{register} message."""
+        secure_id = unicode(uuid.uuid4())
+        insecure_id = self._next_insecure_id
+        self._next_insecure_id += 1
+        computer = FakeComputer(secure_id, insecure_id,
+                                _to_text(message.get("computer_title")))
+        computer.outbox.append({"type": "set-id", "id": secure_id,
+                                "insecure-id": insecure_id})
+        self.computers[secure_id] = computer
+        self._computers_by_insecure_id[insecure_id] = computer
+        return computer
+
+    def _handle_message(self, computer, type, message):
+        self.stats["messages"] += 1
+        self.message_counts[type] += 1
+        if computer is not None:
+            computer.messages.append(message)
+        replies = []
+        for handler in self._handlers.get(type, ()):
+            replies.extend(handler(computer, message) or ())
+        return replies
+
+    def ping(self, insecure_id):
+        """Tell whether there are messages for the given computer."""
+        self.stats["pings"] += 1
+        computer = self.get_computer(insecure_id=insecure_id)
+        return computer is not None and bool(computer.outbox)
+
+    def wait_for_messages(self, insecure_id, callback):
+        """Call C{callback} when messages are queued for the given computer.
+
+        @return: A function cancelling the wait.
+        """
+        waiters = self._waiters[int(insecure_id)]
+        waiters.append(callback)
+
+        def cancel():
+            if callback in waiters:
+                waiters.remove(callback)
+
+        return cancel
+
+    def get_attachment(self, attachment_id):
+        """Return the content of an attachment, or C{None}."""
+        self.stats["attachments"] += 1
+        return self.attachments.get(attachment_id)
+
+
+class FakeServerResource(Resource):
+    """Expose a L{FakeLandscapeServer} over HTTP.
+
+    Message exchanges are handled at C{/message-system}, pings at C{/ping}
+    and attachments are served at C{/attachment/<id>}.
+
+    @param server: The L{FakeLandscapeServer} handling requests.
+    @param reactor: Optionally, the reactor to delay replies with, which is
+        required to hold long-polling pings.
+    @param long_poll: Whether to support long-polling pings.
+    @ivar delay: The number of seconds to wait before replying, to emulate
+        network latency or a busy server.
+    @ivar exchange_times: The time spent handling each exchange request.
+    """
+
+    isLeaf = True
+
+    def __init__(self, server, reactor=None, delay=0, long_poll=False):
+        Resource.__init__(self)
+        self.server = server
+        self.delay = delay
+        self.long_poll = long_poll
+        self.exchange_times = []
+        self._reactor = reactor
+
+    def render_POST(self, request):
+        path = request.path.rstrip(b"/")
+        if path.endswith(b"/ping"):
+            insecure_id = request.args.get(b"insecure_id", [None])[0]
+            wait = request.args.get(b"wait", [None])[0]
+            has_messages = self.server.ping(insecure_id)
+            if wait is None or not self.long_poll:
+                return self._reply(request, bpickle.dumps(
+                    {"messages": has_messages}))
+            if (has_messages or self._reactor is None or
+                    self.server.get_computer(insecure_id=insecure_id) is None):
+                return self._reply(request, bpickle.dumps(
+                    {"messages": has_messages, "long-poll": True}))
+            return self._hold_ping(request, insecure_id, float(wait))
+        start_time = time.time()
+        payload = bpickle.loads(request.content.read())
+        response = self.server.exchange(
+            payload,
+            computer_id=request.getHeader(b"x-computer-id"),
+            exchange_token=request.getHeader(b"x-exchange-token"))
+        data = bpickle.dumps(response)
+        self.exchange_times.append(time.time() - start_time)
+        return self._reply(request, data)
+
+    def _hold_ping(self, request, insecure_id, wait):
+        """Reply to a long-polling ping when messages are queued, or after
+        C{wait} seconds.
+        """
+
+        def reply(has_messages):
+            cancel_wait()
+            if timeout.active():
+                timeout.cancel()
+            if not finished:
+                finished.append(True)
+                request.write(bpickle.dumps(
+                    {"messages": has_messages, "long-poll": True}))
+                request.finish()
+
+        def lost(failure):
+            # The client went away, stop waiting for it.
+            finished.append(True)
+            reply(False)
+
+        request.setHeader(b"content-type", b"application/octet-stream")
+        finished = []
+        cancel_wait = self.server.wait_for_messages(
+            insecure_id, lambda: reply(True))
+        timeout = self._reactor.callLater(wait, reply, False)
+        request.notifyFinish().addErrback(lost)
+        return NOT_DONE_YET
+
+    def render_GET(self, request):
+        parts = request.path.rstrip(b"/").split(b"/")
+        if len(parts) >= 2 and parts[-2] == b"attachment":
+            try:
+                data = self.server.get_attachment(int(parts[-1]))
+            except ValueError:
+                data = None
+            if data is not None:
+                if _PY3 and not isinstance(data, bytes):
+                    data = data.encode("utf-8")
+                return self._reply(request, data)
+        request.setResponseCode(404)
+        return b""
+
+    def _reply(self, request, data):
+        request.setHeader(b"content-type", b"application/octet-stream")
+        if not self.delay or self._reactor is None:
+            return data
+
+        def write():
+            request.write(data)
+            request.finish()
+
+        self._reactor.callLater(self.delay, write)
+        return NOT_DONE_YET
@@ -31,6 +31,16 @@ Diagram::
   |
   --[End Loop]
 
+Long polling
+============
+
+With a C{long_poll_timeout}, pings ask the server to hold the request until
+messages are waiting for the computer, or until the timeout expires. Servers
+supporting it say so with a C{"long-poll"} key in their reply, and the next
+ping is sent right away, with a bit of jitter. Otherwise the reply is
+immediate and the L{Pinger} falls back to waiting for the ping interval
+between pings. After errors, the ping interval is jittered so that clients
+don't reconnect all at once when the server comes back.
 """
 
 try:
@@ -38,6 +48,7 @@ try:
 except ImportError:
     from urllib import urlencode
 
+import random
 from logging import info
 
 from twisted.python.failure import Failure
@@ -45,9 +56,19 @@ from twisted.internet import defer
 
 from landscape.lib import bpickle
 from landscape.lib.fetch import fetch
+from landscape.lib.metrics import MetricsRegistry
 from landscape.lib.log import log_failure
 
 
+# The maximum number of seconds to wait before sending the next ping, after
+# a long-polling one returned.
+LONG_POLL_JITTER = 2
+
+# How much longer than the long poll timeout to wait for the server to
+# reply, before giving up.
+LONG_POLL_MARGIN = 30
+
+
 class PingClient(object):
     """An HTTP client which knows how to talk to the ping server."""
 
@@ -68,20 +89,45 @@ class PingClient(object):
             and False otherwise.
         """
         if insecure_id is not None:
-            headers = {"Content-Type": "application/x-www-form-urlencoded"}
-            data = urlencode({"insecure_id": insecure_id})
-            page_deferred = defer.Deferred()
-
-            def errback(type, value, tb):
-                page_deferred.errback(Failure(value, type, tb))
-            self._reactor.call_in_thread(page_deferred.callback, errback,
-                                         self.get_page, url,
-                                         post=True, data=data,
-                                         headers=headers)
+            page_deferred = self._post(url, {"insecure_id": insecure_id})
             page_deferred.addCallback(self._got_result)
             return page_deferred
         return defer.succeed(False)
 
+    def long_poll(self, url, insecure_id, timeout):
+        """Wait for messages for this computer ID, up to C{timeout} seconds.
+
+        @param url: The URL of the ping server to hit.
+        @param insecure_id: This client's insecure ID, if C{None} no HTTP
+            request will be performed.
+        @param timeout: The number of seconds the server may hold the request
+            before replying that there are no messages.
+
+        @return: A deferred resulting in a C{(messages, long_polled)} tuple,
+            where C{messages} tells if there are messages and C{long_polled}
+            if the server supports long polling.
+        """
+        if insecure_id is None:
+            return defer.succeed((False, False))
+        page_deferred = self._post(
+            url, {"insecure_id": insecure_id, "wait": timeout},
+            total_timeout=timeout + LONG_POLL_MARGIN)
+        page_deferred.addCallback(self._got_long_poll_result)
+        return page_deferred
+
+    def _post(self, url, fields, **kwargs):
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        data = urlencode(fields)
+        page_deferred = defer.Deferred()
+
+        def errback(type, value, tb):
+            page_deferred.errback(Failure(value, type, tb))
+        self._reactor.call_in_thread(page_deferred.callback, errback,
+                                     self.get_page, url,
+                                     post=True, data=data,
+                                     headers=headers, **kwargs)
+        return page_deferred
+
     def _got_result(self, webtext):
         """
         Given a response that came from a ping server, return True if
@@ -91,6 +137,13 @@ class PingClient(object):
         if bpickle.loads(webtext) == {"messages": True}:
             return True
 
+    def _got_long_poll_result(self, webtext):
+        response = bpickle.loads(webtext)
+        if not isinstance(response, dict):
+            return (False, False)
+        return (response.get("messages") is True,
+                response.get("long-poll") is True)
+
 
 class Pinger(object):
     """
@@ -100,23 +153,39 @@ class Pinger(object):
     @param reactor: The reactor to schedule calls with.
     @param identity: The L{Identity} holding the insecure ID used when pinging.
     @param exchanger: The L{MessageExchange} to trigger exchanges with.
-    @param config: The L{BrokerConfiguration} to get the 'ping_url' and
-        'ping_interval' parameters from. The 'ping_url' specifies what URL
-        to hit when pinging, and 'ping_interval' how frequently to ping.
-        Changes in the configuration object will take effect from the next
-        scheduled ping.
+    @param config: The L{BrokerConfiguration} to get the 'ping_url',
+        'ping_interval' and 'long_poll_timeout' parameters from. The
+        'ping_url' specifies what URL to hit when pinging, 'ping_interval'
+        how frequently to ping, and 'long_poll_timeout' how long the server
+        may hold pings, if it supports long polling. Changes in the
+        configuration object will take effect from the next scheduled ping.
+    @param metrics: Optionally, the L{MetricsRegistry} to record pings in.
     """
 
     def __init__(self, reactor, identity, exchanger, config,
-                 ping_client_factory=PingClient):
+                 ping_client_factory=PingClient, metrics=None):
         self._config = config
         self._identity = identity
         self._reactor = reactor
         self._exchanger = exchanger
         self._call_id = None
         self._ping_client = None
+        self._running = False
+        self._waiting_for_exchange = False
         self.ping_client_factory = ping_client_factory
+        if metrics is None:
+            metrics = MetricsRegistry(enabled=False)
+        self._pings = metrics.counter(
+            "landscape_pings_total", "Pings sent to the server.")
+        self._ping_failures = metrics.counter(
+            "landscape_ping_failures_total", "Pings which failed.")
+        self._ping_messages = metrics.counter(
+            "landscape_ping_messages_available_total",
+            "Pings telling that messages are waiting on the server.")
+        self._ping_seconds = metrics.histogram(
+            "landscape_ping_seconds", "Duration of pings.")
         reactor.call_on("message", self._handle_set_intervals)
+        reactor.call_on("exchange-done", self._handle_exchange_done)
 
     def get_url(self):
         return self._config.ping_url
@@ -127,31 +196,80 @@ class Pinger(object):
     def start(self):
         """Start pinging."""
         self._ping_client = self.ping_client_factory(self._reactor)
+        self._running = True
         self._schedule()
 
     def ping(self):
         """Perform a ping; if there are messages, fire an exchange."""
+        self._call_id = None
+        self._waiting_for_exchange = False
+        self._pings.inc()
+        start_time = self._reactor.time()
+        long_poll_timeout = self._config.long_poll_timeout
+        if long_poll_timeout:
+            deferred = self._ping_client.long_poll(
+                self._config.ping_url, self._identity.insecure_id,
+                long_poll_timeout)
+            deferred.addBoth(self._record_time, start_time)
+            deferred.addCallback(self._got_long_poll_result)
+            deferred.addErrback(self._got_long_poll_error)
+            return
         deferred = self._ping_client.ping(
             self._config.ping_url, self._identity.insecure_id)
+        deferred.addBoth(self._record_time, start_time)
         deferred.addCallback(self._got_result)
         deferred.addErrback(self._got_error)
         deferred.addBoth(lambda _: self._schedule())
 
+    def _record_time(self, result, start_time):
+        self._ping_seconds.observe(self._reactor.time() - start_time)
+        return result
+
     def _got_result(self, exchange):
         if exchange:
+            self._ping_messages.inc()
             info("Ping indicates message available. "
                  "Scheduling an urgent exchange.")
             self._exchanger.schedule_exchange(urgent=True)
 
     def _got_error(self, failure):
+        self._ping_failures.inc()
         log_failure(failure,
                     "Error contacting ping server at %s" %
-                    (self._ping_client.url,))
+                    (self._config.ping_url,))
+
+    def _got_long_poll_result(self, result):
+        messages, long_polled = result
+        self._got_result(messages)
+        if long_polled and messages:
+            # The server would answer right away until the exchange fetches
+            # the messages, poll again once it's done, or after the ping
+            # interval if it doesn't happen before.
+            self._waiting_for_exchange = True
+            self._schedule()
+        elif long_polled:
+            self._schedule(random.uniform(0, LONG_POLL_JITTER))
+        else:
+            # The server doesn't hold pings, fall back to polling.
+            self._schedule()
 
-    def _schedule(self):
-        """Schedule a new ping using the current ping interval."""
-        self._call_id = self._reactor.call_later(self._config.ping_interval,
-                                                 self.ping)
+    def _got_long_poll_error(self, failure):
+        self._got_error(failure)
+        self._schedule(self._config.ping_interval * random.uniform(0.5, 1.5))
+
+    def _schedule(self, delay=None):
+        """Schedule a new ping, by default using the current ping interval."""
+        if not self._running:
+            return
+        if delay is None:
+            delay = self._config.ping_interval
+        self._call_id = self._reactor.call_later(delay, self.ping)
+
+    def _handle_exchange_done(self):
+        if self._waiting_for_exchange and self._call_id is not None:
+            self._waiting_for_exchange = False
+            self._reactor.cancel_call(self._call_id)
+            self._schedule(random.uniform(0, LONG_POLL_JITTER))
 
     def _handle_set_intervals(self, message):
         if message["type"] == "set-intervals" and "ping" in message:
@@ -165,6 +283,7 @@ class Pinger(object):
 
     def stop(self):
         """Stop pinging the message server."""
+        self._running = False
         if self._call_id is not None:
             self._reactor.cancel_call(self._call_id)
             self._call_id = None
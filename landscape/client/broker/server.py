@@ -228,6 +228,37 @@ class BrokerServer(object):
         result = gather_results(results, consume_errors=True)
         return result.addCallback(lambda ignored: None)
 
+    @remote
+    def get_plugin_stats(self):
+        """Return the cost of the plugins of the registered clients.
+
+        @return: A L{Deferred} resulting in a C{dict} mapping the names of
+            the clients to the result of their C{get_plugin_stats} method.
+            Clients which failed to reply are left out.
+        """
+        names = list(self._registered_clients.keys())
+        results = []
+        for name in names:
+            result = self._registered_clients[name].get_plugin_stats()
+            results.append(result.addErrback(lambda failure: None))
+
+        def got_stats(all_stats):
+            return dict((name, stats) for name, stats in zip(names, all_stats)
+                        if stats is not None)
+
+        return gather_results(results).addCallback(got_stats)
+
+    @remote
+    def get_reactor_lag(self):
+        """Return the lag measurements of the broker's reactor.
+
+        @return: The C{dict} returned by L{ReactorLagMonitor.get_stats}, or
+            C{None} if the reactor isn't monitored.
+        """
+        if self._reactor.lag_monitor is None:
+            return None
+        return self._reactor.lag_monitor.get_stats()
+
     @remote
     def reload_configuration(self):
         """Reload the configuration file, and stop all clients."""
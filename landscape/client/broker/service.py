@@ -1,7 +1,9 @@
 """Deployment code for the monitor."""
 
+import logging
 import os
 
+from landscape.lib.metrics import MetricsRegistry
 from landscape.client.service import LandscapeService, run_landscape_service
 from landscape.client.amp import ComponentPublisher
 from landscape.client.broker.registration import RegistrationHandler, Identity
@@ -35,6 +37,9 @@ class BrokerService(LandscapeService):
     @ivar pinger: The L{Pinger} checks if the server has new messages for us.
     @ivar registration: The L{RegistrationHandler} performs the initial
         registration.
+    @ivar metrics: The L{MetricsRegistry} fed by the components above, and
+        written to C{metrics_file} every C{metrics_interval} seconds. It's
+        disabled if no C{metrics_file} is configured.
 
     @param config: A L{BrokerConfiguration}.
     """
@@ -42,23 +47,28 @@ class BrokerService(LandscapeService):
     transport_factory = HTTPTransport
     pinger_factory = Pinger
     service_name = BrokerServer.name
+    metrics_interval = 30
 
     def __init__(self, config):
         self.persist_filename = os.path.join(
             config.data_path, "%s.bpickle" % (self.service_name,))
         super(BrokerService, self).__init__(config)
 
+        self.metrics = MetricsRegistry(enabled=bool(config.metrics_file))
         self.transport = self.transport_factory(
-            self.reactor, config.url, config.ssl_public_key)
+            self.reactor, config.url, config.ssl_public_key,
+            metrics=self.metrics)
         self.message_store = get_default_message_store(
-            self.persist, config.message_store_path)
+            self.persist, config.message_store_path, metrics=self.metrics)
         self.identity = Identity(self.config, self.persist)
         exchange_store = ExchangeStore(self.config.exchange_store_path)
         self.exchanger = MessageExchange(
             self.reactor, self.message_store, self.transport, self.identity,
-            exchange_store, config)
+            exchange_store, config, metrics=self.metrics)
         self.pinger = self.pinger_factory(
-            self.reactor, self.identity, self.exchanger, config)
+            self.reactor, self.identity, self.exchanger, config,
+            metrics=self.metrics)
+        self._metrics_call = None
         self.registration = RegistrationHandler(
             config, self.identity, self.reactor, self.exchanger, self.pinger,
             self.message_store)
@@ -79,14 +89,29 @@ class BrokerService(LandscapeService):
         self.publisher.start()
         self.exchanger.start()
         self.pinger.start()
+        if self.metrics.enabled:
+            self._metrics_call = self.reactor.call_every(
+                self.metrics_interval, self.write_metrics)
 
     def stopService(self):
         """Stop the broker."""
         self.publisher.stop()
         self.exchanger.stop()
         self.pinger.stop()
+        if self._metrics_call is not None:
+            self.reactor.cancel_call(self._metrics_call)
+            self._metrics_call = None
+            self.write_metrics()
         super(BrokerService, self).stopService()
 
+    def write_metrics(self):
+        """Write the current metrics to the configured C{metrics_file}."""
+        try:
+            self.metrics.write(self.config.metrics_file)
+        except (IOError, OSError) as error:
+            logging.warning("Couldn't write metrics to %s: %s",
+                            self.config.metrics_file, error)
+
 
 def run(args):
     """Run the application, given some command line arguments."""
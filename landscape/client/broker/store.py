@@ -95,6 +95,7 @@ strategy for updating the pending offset and the sequence is implemented.
 import itertools
 import logging
 import os
+import time
 import uuid
 
 from twisted.python.compat import iteritems
@@ -102,6 +103,7 @@ from twisted.python.compat import iteritems
 from landscape import DEFAULT_SERVER_API
 from landscape.lib import bpickle
 from landscape.lib.fs import create_binary_file, read_binary_file
+from landscape.lib.metrics import MetricsRegistry
 from landscape.lib.versioning import sort_versions, is_version_higher
 
 
@@ -125,6 +127,8 @@ class MessageStore(object):
     @param persist: a L{Persist} used to save state parameters like the
         accepted message types, sequence, server uuid etc.
     @param directory: base of the file system hierarchy
+    @param metrics: Optionally, the L{MetricsRegistry} to count queued and
+        dropped messages in.
     """
 
     # The initial message API version that we use to communicate with the
@@ -134,10 +138,22 @@ class MessageStore(object):
     # in case the server supports it.
     _api = DEFAULT_SERVER_API
 
-    def __init__(self, persist, directory, directory_size=1000):
+    def __init__(self, persist, directory, directory_size=1000,
+                 metrics=None):
         self._directory = directory
         self._directory_size = directory_size
         self._schemas = {}
+        if metrics is None:
+            metrics = MetricsRegistry(enabled=False)
+        self._messages_added = metrics.counter(
+            "landscape_message_store_added_total",
+            "Messages queued for delivery.")
+        self._messages_dropped = metrics.counter(
+            "landscape_message_store_dropped_total",
+            "Messages dropped while awaiting a resynchronisation.")
+        self._add_seconds = metrics.histogram(
+            "landscape_message_store_add_seconds",
+            "Time spent queueing messages.")
         self._original_persist = persist
         self._persist = persist.root_at("message-store")
         message_dir = self._message_dir()
@@ -370,9 +386,11 @@ class MessageStore(object):
         """
         assert "type" in message
         if self._persist.get("blackhole-messages"):
+            self._messages_dropped.inc()
             logging.debug("Dropped message, awaiting resync.")
             return
 
+        start_time = time.time()
         server_api = self.get_server_api()
 
         if "api" not in message:
@@ -405,6 +423,8 @@ class MessageStore(object):
         # will offer a more strong primary key.
         message_id = os.stat(filename).st_ino
 
+        self._messages_added.inc()
+        self._add_seconds.observe(time.time() - start_time)
         return message_id
 
     def _get_next_message_filename(self):
@@ -3,12 +3,13 @@ import mock
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 
+from landscape.lib.reactor import ReactorLagMonitor
 from landscape.lib.twisted_util import gather_results
 from landscape.client.tests.helpers import (
         LandscapeTest, DEFAULT_ACCEPTED_TYPES)
 from landscape.client.broker.tests.helpers import BrokerClientHelper
 from landscape.client.broker.client import (
-        BrokerClientPlugin, HandlerNotFoundError)
+        BrokerClientPlugin, HandlerNotFoundError, PluginStats, tracemalloc)
 
 
 class BrokerClientTest(LandscapeTest):
@@ -209,6 +210,70 @@ class BrokerClientTest(LandscapeTest):
         self.client.add(plugin)
         plugin.run.assert_called_once_with()
 
+    @mock.patch("landscape.client.broker.client.process_time")
+    def test_run_records_plugin_stats(self, mock_process_time):
+        """
+        The number of runs of a plugin, and the wall and CPU time they took,
+        are recorded and returned by L{BrokerClient.get_plugin_stats}.
+        """
+        mock_process_time.side_effect = [1.0, 1.5, 2.0, 2.25]
+        deferred = Deferred()
+        plugin = BrokerClientPlugin()
+        plugin.run = mock.Mock(return_value=deferred)
+        plugin.run_immediately = True
+        plugin.run_interval = None
+        self.client.add(plugin)
+        self.client_reactor.advance(3)
+        deferred.callback(None)
+        plugin.run.return_value = None
+        plugin._run_with_error_log()
+        stats = self.client.get_plugin_stats()
+        self.assertEqual(
+            {"landscape.client.broker.client.BrokerClientPlugin":
+             {"runs": 2, "failures": 0, "wall-time": 3.0,
+              "max-wall-time": 3.0, "cpu-time": 0.75, "memory": None}},
+            stats)
+
+    def test_run_records_plugin_failures(self):
+        """Runs raising an error are counted as failures."""
+        self.log_helper.ignore_errors("BrokerClientPlugin.*")
+        plugin = BrokerClientPlugin()
+        plugin.run = mock.Mock(side_effect=ZeroDivisionError())
+        plugin.run_immediately = True
+        plugin.run_interval = None
+        self.client.add(plugin)
+        self.assertEqual(1, len(self.flushLoggedErrors(ZeroDivisionError)))
+        [stats] = self.client.get_plugin_stats().values()
+        self.assertEqual((1, 1), (stats["runs"], stats["failures"]))
+
+    def test_run_records_traced_memory(self):
+        """
+        If C{tracemalloc} is tracing, the memory allocated by runs is
+        recorded.
+        """
+        if tracemalloc is None:
+            self.skipTest("tracemalloc is only available with Python 3")
+        memory = []
+        plugin = BrokerClientPlugin()
+        plugin.run = lambda: memory.append(bytearray(1024 * 1024))
+        plugin.run_immediately = True
+        plugin.run_interval = None
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        self.client.add(plugin)
+        [stats] = self.client.get_plugin_stats().values()
+        self.assertTrue(stats["memory"] >= 1024 * 1024)
+
+    def test_get_reactor_lag(self):
+        """
+        L{BrokerClient.get_reactor_lag} returns the measurements of the lag
+        monitor of the reactor, if any.
+        """
+        self.assertIsNone(self.client.get_reactor_lag())
+        monitor = ReactorLagMonitor(self.client_reactor, 5)
+        self.client_reactor.lag_monitor = monitor
+        self.assertEqual(monitor.get_stats(), self.client.get_reactor_lag())
+
     def test_register_message(self):
         """
         When L{BrokerClient.register_message} is called, the broker is notified
@@ -428,3 +493,19 @@ class BrokerClientTest(LandscapeTest):
         self.client.exit()
         self.client.reactor.advance(0.1)
         self.client.reactor.stop.assert_called_once_with()
+
+
+class PluginStatsTest(LandscapeTest):
+
+    def test_add_run(self):
+        """
+        L{PluginStats.add_run} accumulates the cost of runs, keeping the
+        longest wall time.
+        """
+        stats = PluginStats()
+        stats.add_run(2.0, 0.5)
+        stats.add_run(1.0, 0.25, memory=512, failed=True)
+        self.assertEqual(
+            {"runs": 2, "failures": 1, "wall-time": 3.0,
+             "max-wall-time": 2.0, "cpu-time": 0.75, "memory": 512},
+            stats.as_dict())
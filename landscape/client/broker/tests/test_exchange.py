@@ -4,6 +4,7 @@ from landscape import CLIENT_API
 from landscape.lib.persist import Persist
 from landscape.lib.fetch import HTTPCodeError, PyCurlError
 from landscape.lib.hashlib import md5
+from landscape.lib.metrics import MetricsRegistry
 from landscape.lib.schema import Int
 from landscape.message_schemas.message import Message
 from landscape.client.broker.config import BrokerConfiguration
@@ -615,6 +616,37 @@ class MessageExchangeTest(LandscapeTest):
         exchanger.exchange()
         self.assertEqual(self.transport.payloads[0]["total-messages"], 2)
 
+    def test_exchange_metrics(self):
+        """
+        Exchanges are recorded in the L{MetricsRegistry} passed to the
+        L{MessageExchange}, with the messages sent and received and the
+        number of messages pending.
+        """
+        metrics = MetricsRegistry()
+        exchanger = MessageExchange(self.reactor, self.mstore, self.transport,
+                                    self.identity, self.exchange_store,
+                                    self.config, max_messages=1,
+                                    metrics=metrics)
+        self.mstore.set_accepted_types(["empty"])
+        self.mstore.add({"type": "empty"})
+        self.mstore.add({"type": "empty"})
+        self.transport.responses.append([{"type": "noop"}])
+        exchanger.exchange()
+        self.transport.responses.append(PyCurlError(7, "refused"))
+        exchanger.exchange()
+        output = metrics.format()
+        self.assertIn("landscape_exchanges_total 2\n", output)
+        self.assertIn("landscape_exchange_failures_total 1\n", output)
+        self.assertIn("landscape_exchange_messages_sent_total 2\n", output)
+        self.assertIn("landscape_exchange_messages_received_total 1\n",
+                      output)
+        self.assertIn("landscape_exchange_pending_messages 1\n", output)
+        self.assertIn("landscape_exchange_seconds_count 2\n", output)
+        self.assertIn("landscape_exchange_payload_build_seconds_count 2\n",
+                      output)
+        self.assertIn("landscape_exchange_handle_result_seconds_count 1\n",
+                      output)
+
     def test_impending_exchange(self):
         """
         A reactor event is emitted shortly (10 seconds) before an exchange
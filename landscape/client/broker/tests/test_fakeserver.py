@@ -0,0 +1,238 @@
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThread
+from twisted.web import server
+
+from landscape.client.broker.fakeserver import (
+    FakeLandscapeServer, FakeServerResource, hash_types)
+from landscape.client.broker.transport import HTTPTransport
+from landscape.client.tests.helpers import LandscapeTest
+from landscape.lib import bpickle
+from landscape.lib.fetch import fetch
+
+
+class FakeLandscapeServerTest(LandscapeTest):
+
+    def setUp(self):
+        super(FakeLandscapeServerTest, self).setUp()
+        self.server = FakeLandscapeServer(accepted_types=["register", "test"])
+
+    def make_payload(self, messages=(), sequence=0, server_sequence=0,
+                     accepted_types=("register", "test")):
+        return {"sequence": sequence,
+                "next-expected-sequence": server_sequence,
+                "accepted-types": hash_types(sorted(accepted_types)),
+                "messages": list(messages)}
+
+    def register(self):
+        response = self.server.exchange(self.make_payload(
+            [{"type": "register", "computer_title": "Computer"}]))
+        [computer] = self.server.computers.values()
+        return computer, response
+
+    def test_accepted_types(self):
+        """
+        Clients with an outdated list of accepted types get the current one.
+        """
+        response = self.server.exchange(self.make_payload(accepted_types=()))
+        self.assertEqual(
+            [{"type": "accepted-types", "types": ["register", "test"]}],
+            response["messages"])
+        self.assertEqual(0, response["next-expected-sequence"])
+
+    def test_register(self):
+        """
+        A C{register} message registers a new computer, which is sent its
+        IDs in a C{set-id} message.
+        """
+        computer, response = self.register()
+        self.assertEqual("Computer", computer.title)
+        self.assertEqual(
+            [{"type": "set-id", "id": computer.secure_id,
+              "insecure-id": computer.insecure_id}],
+            response["messages"])
+        self.assertEqual(1, response["next-expected-sequence"])
+        self.assertEqual(computer.exchange_token,
+                         response["next-exchange-token"])
+        self.assertEqual(1, self.server.message_counts["register"])
+
+    def test_messages_sent_until_acknowledged(self):
+        """
+        Messages are sent to a computer until it tells it got them, with its
+        next expected sequence.
+        """
+        computer, response = self.register()
+        self.server.queue_message({"type": "hello"})
+        payload = self.make_payload(sequence=1, server_sequence=0)
+        response = self.server.exchange(
+            payload, computer.secure_id, computer.exchange_token)
+        self.assertEqual(["set-id", "hello"],
+                         [message["type"] for message in response["messages"]])
+        payload = self.make_payload(sequence=1, server_sequence=2)
+        response = self.server.exchange(
+            payload, computer.secure_id, computer.exchange_token)
+        self.assertEqual([], response["messages"])
+        self.assertFalse(self.server.ping(computer.insecure_id))
+
+    def test_messages_received(self):
+        """
+        Messages with the expected sequence are stored, and the next
+        expected sequence is sent back.
+        """
+        computer, response = self.register()
+        payload = self.make_payload([{"type": "test"}, {"type": "test"}],
+                                    sequence=1, server_sequence=1)
+        response = self.server.exchange(
+            payload, computer.secure_id, computer.exchange_token)
+        self.assertEqual(3, response["next-expected-sequence"])
+        self.assertEqual(["register", "test", "test"],
+                         [message["type"] for message in computer.messages])
+        self.assertEqual(3, self.server.stats["messages"])
+
+    def test_unexpected_sequence(self):
+        """
+        Messages with an unexpected sequence are ignored, and the client is
+        told which sequence is expected.
+        """
+        computer, response = self.register()
+        payload = self.make_payload([{"type": "test"}], sequence=5,
+                                    server_sequence=1)
+        response = self.server.exchange(
+            payload, computer.secure_id, computer.exchange_token)
+        self.assertEqual(1, response["next-expected-sequence"])
+        self.assertEqual(1, len(computer.messages))
+
+    def test_unknown_id(self):
+        response = self.server.exchange(self.make_payload(), "unknown")
+        self.assertEqual([{"type": "unknown-id"}], response["messages"])
+
+    def test_stale_token(self):
+        """Exchanges with an unexpected token are counted."""
+        computer, response = self.register()
+        self.server.exchange(self.make_payload(sequence=1, server_sequence=1),
+                             computer.secure_id, "old-token")
+        self.assertEqual(1, self.server.stats["stale-tokens"])
+
+    def test_on_message(self):
+        """
+        Message handlers are called with each message of their type, and
+        the messages they return are sent back.
+        """
+        calls = []
+
+        def handler(computer, message):
+            calls.append((computer, message))
+            return [{"type": "reply"}]
+
+        self.server.on_message("test", handler)
+        computer, response = self.register()
+        payload = self.make_payload([{"type": "test"}], sequence=1,
+                                    server_sequence=1)
+        response = self.server.exchange(
+            payload, computer.secure_id, computer.exchange_token)
+        self.assertEqual([(computer, {"type": "test"})], calls)
+        self.assertEqual([{"type": "reply"}], response["messages"])
+
+    def test_ping(self):
+        """
+        Pings tell whether there are messages for a computer.
+        """
+        computer, response = self.register()
+        self.assertTrue(self.server.ping(computer.insecure_id))
+        self.assertFalse(self.server.ping(12345))
+        self.assertEqual(2, self.server.stats["pings"])
+
+    def test_wait_for_messages(self):
+        """
+        Callbacks passed to L{FakeLandscapeServer.wait_for_messages} are
+        called when messages are queued for the computer, unless cancelled.
+        """
+        computer, response = self.register()
+        calls = []
+        self.server.wait_for_messages(computer.insecure_id,
+                                      lambda: calls.append(1))
+        cancel = self.server.wait_for_messages(computer.insecure_id,
+                                               lambda: calls.append(2))
+        cancel()
+        self.server.queue_message({"type": "hello"})
+        self.server.queue_message({"type": "hello"})
+        self.assertEqual([1], calls)
+
+
+class FakeServerResourceTest(LandscapeTest):
+
+    def setUp(self):
+        super(FakeServerResourceTest, self).setUp()
+        self.server = FakeLandscapeServer()
+        port = reactor.listenTCP(
+            0, server.Site(FakeServerResource(self.server, reactor,
+                                              long_poll=True)),
+            interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        self.url = "http://127.0.0.1:%d/" % port.getHost().port
+
+    def test_exchange(self):
+        """
+        Exchanges are made with bpickled payloads, like L{HTTPTransport}
+        sends.
+        """
+        transport = HTTPTransport(None, self.url + "message-system")
+        payload = {"sequence": 0, "next-expected-sequence": 0,
+                   "messages": [{"type": "register",
+                                 "computer_title": "Computer"}]}
+        result = deferToThread(transport.exchange, payload)
+
+        def check(response):
+            [computer] = self.server.computers.values()
+            self.assertEqual("set-id", response["messages"][0]["type"])
+            self.assertEqual(computer.secure_id,
+                             response["messages"][0]["id"])
+        return result.addCallback(check)
+
+    def test_ping(self):
+        """Pings are answered with a bpickled C{dict}."""
+        result = deferToThread(fetch, self.url + "ping", post=True,
+                               data="insecure_id=1")
+        result.addCallback(bpickle.loads)
+        return result.addCallback(self.assertEqual, {"messages": False})
+
+    def test_attachment(self):
+        """Attachments are served at C{/attachment/<id>}."""
+        self.server.add_attachment(14, b"#!/bin/sh\n")
+        result = deferToThread(fetch, self.url + "attachment/14")
+        return result.addCallback(self.assertEqual, b"#!/bin/sh\n")
+
+    def test_ping_without_wait(self):
+        """Pings which don't ask to wait are answered right away."""
+        computer = self.server.register({"computer_title": "Computer"})
+        data = "insecure_id=%d" % computer.insecure_id
+        result = deferToThread(fetch, self.url + "ping", post=True, data=data)
+        result.addCallback(bpickle.loads)
+        return result.addCallback(self.assertEqual, {"messages": True})
+
+    def test_long_poll(self):
+        """
+        Pings asking to wait are held until messages are queued for the
+        computer.
+        """
+        computer = self.server.register({"computer_title": "Computer"})
+        computer.acknowledge(1)
+        data = "insecure_id=%d&wait=30" % computer.insecure_id
+        result = deferToThread(fetch, self.url + "ping", post=True, data=data)
+        deferLater(reactor, 0.2, self.server.queue_message, {"type": "hello"})
+        result.addCallback(bpickle.loads)
+        return result.addCallback(
+            self.assertEqual, {"messages": True, "long-poll": True})
+
+    def test_long_poll_timeout(self):
+        """
+        Pings asking to wait are answered when the timeout expires, if no
+        messages were queued.
+        """
+        computer = self.server.register({"computer_title": "Computer"})
+        computer.acknowledge(1)
+        data = "insecure_id=%d&wait=0.1" % computer.insecure_id
+        result = deferToThread(fetch, self.url + "ping", post=True, data=data)
+        result.addCallback(bpickle.loads)
+        return result.addCallback(
+            self.assertEqual, {"messages": False, "long-poll": True})
@@ -1,11 +1,15 @@
+import mock
+
 from landscape.client.tests.helpers import LandscapeTest
 
-from twisted.internet.defer import fail
+from twisted.internet.defer import Deferred, fail, succeed
 
 from landscape.lib import bpickle
 from landscape.lib.fetch import fetch
+from landscape.lib.metrics import MetricsRegistry
 from landscape.lib.testing import FakeReactor
-from landscape.client.broker.ping import PingClient, Pinger
+from landscape.client.broker.ping import (
+    PingClient, Pinger, LONG_POLL_JITTER, LONG_POLL_MARGIN)
 from landscape.client.broker.tests.helpers import ExchangeHelper
 
 
@@ -15,8 +19,9 @@ class FakePageGetter(object):
     def __init__(self, response):
         self.response = response
         self.fetches = []
+        self.fetch_options = []
 
-    def get_page(self, url, post, headers, data):
+    def get_page(self, url, post, headers, data, **kwargs):
         """
         A method which is supposed to act like a limited version of
         L{landscape.lib.fetch.fetch}.
@@ -25,9 +30,10 @@ class FakePageGetter(object):
         data.
         """
         self.fetches.append((url, post, headers, data))
+        self.fetch_options.append(kwargs)
         return bpickle.dumps(self.response)
 
-    def failing_get_page(self, url, post, headers, data):
+    def failing_get_page(self, url, post, headers, data, **kwargs):
         """
         A method which is supposed to act like a limited version of
         L{landscape.lib.fetch.fetch}.
@@ -105,6 +111,43 @@ class PingClientTest(LandscapeTest):
         self.assertEqual(failures[0].getErrorMessage(), "That's a failure!")
         self.assertEqual(failures[0].type, AssertionError)
 
+    def test_long_poll(self):
+        """
+        L{PingClient.long_poll} asks the server to wait for messages, giving
+        it the time to do so before timing out.
+        """
+        client = FakePageGetter({"messages": True, "long-poll": True})
+        pinger = PingClient(self.reactor, get_page=client.get_page)
+        d = pinger.long_poll("http://ping/url", 10, 60)
+        d.addCallback(self.assertEqual, (True, True))
+        [(url, post, headers, data)] = client.fetches
+        self.assertIn("wait=60", data)
+        self.assertEqual([{"total_timeout": 60 + LONG_POLL_MARGIN}],
+                         client.fetch_options)
+        return d
+
+    def test_long_poll_not_supported(self):
+        """
+        L{PingClient.long_poll} tells if the server doesn't support long
+        polling, when it doesn't say it does.
+        """
+        client = FakePageGetter({"messages": False})
+        pinger = PingClient(self.reactor, get_page=client.get_page)
+        d = pinger.long_poll("http://ping/url", 10, 60)
+        return d.addCallback(self.assertEqual, (False, False))
+
+    def test_long_poll_no_insecure_id(self):
+        """
+        If a L{PingClient} does not have an insecure-id yet, no long poll
+        happens.
+        """
+        client = FakePageGetter(None)
+        pinger = PingClient(self.reactor, get_page=client.get_page)
+        d = pinger.long_poll("http://ping/url", None, 60)
+        d.addCallback(self.assertEqual, (False, False))
+        self.assertEqual([], client.fetches)
+        return d
+
 
 class PingerTest(LandscapeTest):
 
@@ -218,6 +261,29 @@ class PingerTest(LandscapeTest):
         self.assertIn("ZeroDivisionError", log)
         self.assertIn("Couldn't fetch page", log)
 
+    def test_metrics(self):
+        """
+        Pings, and the ones telling that messages are available, are counted
+        in the L{MetricsRegistry} passed to the L{Pinger}.
+        """
+        metrics = MetricsRegistry()
+
+        def factory(reactor):
+            return PingClient(reactor, get_page=self.page_getter.get_page)
+
+        pinger = Pinger(self.reactor, self.identity, self.exchanger,
+                        self.config, ping_client_factory=factory,
+                        metrics=metrics)
+        pinger.start()
+        self.identity.insecure_id = 42
+        self.page_getter.response = {"messages": True}
+        self.reactor.advance(20)
+        output = metrics.format()
+        self.assertIn("landscape_pings_total 2\n", output)
+        self.assertIn("landscape_ping_messages_available_total 2\n", output)
+        self.assertIn("landscape_ping_failures_total 0\n", output)
+        self.assertIn("landscape_ping_seconds_count 2\n", output)
+
     def test_get_interval(self):
         self.assertEqual(self.pinger.get_interval(), 10)
 
@@ -295,6 +361,144 @@ class PingerTest(LandscapeTest):
         self.reactor.advance(10)
         self.assertEqual(self.page_getter.fetches[0][0], url)
 
+    @mock.patch("random.uniform", return_value=1)
+    def test_long_poll(self, mock_uniform):
+        """
+        With a C{long_poll_timeout}, the L{Pinger} sends the next ping right
+        after the previous one returned, if the server supports long polling,
+        with a bit of jitter.
+        """
+        self.config.long_poll_timeout = 300
+        self.page_getter.response = {"messages": False, "long-poll": True}
+        self.identity.insecure_id = 23
+        self.pinger.start()
+        self.reactor.advance(10)
+        self.assertEqual(1, len(self.page_getter.fetches))
+        self.reactor.advance(1)
+        self.assertEqual(2, len(self.page_getter.fetches))
+        mock_uniform.assert_called_with(0, LONG_POLL_JITTER)
+
+    def test_long_poll_messages(self):
+        """
+        When a long poll returns because messages are waiting, an urgent
+        exchange is scheduled.
+        """
+        self.config.long_poll_timeout = 300
+        self.page_getter.response = {"messages": True, "long-poll": True}
+        self.identity.insecure_id = 23
+        self.pinger.start()
+        self.reactor.advance(10)
+        self.assertTrue(self.exchanger.is_urgent())
+
+    @mock.patch("random.uniform", return_value=1)
+    def test_long_poll_messages_waits_for_exchange(self, mock_uniform):
+        """
+        After a long poll telling that messages are waiting, the next one
+        is only sent once the exchange is done, since the server would
+        answer right away until then.
+        """
+        self.config.long_poll_timeout = 300
+        self.page_getter.response = {"messages": True, "long-poll": True}
+        self.identity.insecure_id = 23
+        self.pinger.start()
+        self.reactor.advance(10)
+        self.reactor.advance(5)
+        self.assertEqual(1, len(self.page_getter.fetches))
+        self.reactor.fire("exchange-done")
+        self.reactor.advance(1)
+        self.assertEqual(2, len(self.page_getter.fetches))
+
+    def test_long_poll_messages_without_exchange(self):
+        """
+        If no exchange happens after a long poll telling that messages are
+        waiting, the next one is sent after the ping interval.
+        """
+        self.config.long_poll_timeout = 300
+        self.page_getter.response = {"messages": True, "long-poll": True}
+        self.identity.insecure_id = 23
+        self.pinger.start()
+        self.reactor.advance(10)
+        self.reactor.advance(9)
+        self.assertEqual(1, len(self.page_getter.fetches))
+        self.reactor.advance(1)
+        self.assertEqual(2, len(self.page_getter.fetches))
+
+    def test_long_poll_fallback(self):
+        """
+        If the server doesn't support long polling, the L{Pinger} falls back
+        to waiting for the ping interval between pings.
+        """
+        self.config.long_poll_timeout = 300
+        self.page_getter.response = {"messages": False}
+        self.identity.insecure_id = 23
+        self.pinger.start()
+        self.reactor.advance(10)
+        self.reactor.advance(9)
+        self.assertEqual(1, len(self.page_getter.fetches))
+        self.reactor.advance(1)
+        self.assertEqual(2, len(self.page_getter.fetches))
+
+    @mock.patch("random.uniform", return_value=1.5)
+    def test_long_poll_error(self, mock_uniform):
+        """
+        After a failed long poll, the next one is sent after a jittered ping
+        interval.
+        """
+        self.log_helper.ignore_errors(ZeroDivisionError)
+        self.config.long_poll_timeout = 300
+        self.identity.insecure_id = 23
+        ping_client = mock.Mock()
+        ping_client.long_poll.side_effect = (
+            lambda *args: fail(ZeroDivisionError()))
+        pinger = Pinger(self.reactor, self.identity, self.exchanger,
+                        self.config, ping_client_factory=lambda r: ping_client)
+        pinger.start()
+        self.reactor.advance(10)
+        self.reactor.advance(14)
+        self.assertEqual(1, ping_client.long_poll.call_count)
+        self.reactor.advance(1)
+        self.assertEqual(2, ping_client.long_poll.call_count)
+        mock_uniform.assert_called_with(0.5, 1.5)
+        self.assertIn("Error contacting ping server", self.logfile.getvalue())
+
+    def test_set_intervals_during_long_poll(self):
+        """
+        Changing the ping interval while a long poll is waiting doesn't
+        schedule another ping.
+        """
+        self.config.long_poll_timeout = 300
+        self.identity.insecure_id = 23
+        ping_client = mock.Mock()
+        ping_client.long_poll.return_value = succeed((False, True))
+        pinger = Pinger(self.reactor, self.identity, self.exchanger,
+                        self.config, ping_client_factory=lambda r: ping_client)
+        pinger.start()
+        self.reactor.advance(10)
+        ping_client.long_poll.return_value = Deferred()
+        self.reactor.advance(LONG_POLL_JITTER)
+        self.reactor.fire("message", {"type": "set-intervals", "ping": 5})
+        self.reactor.advance(10)
+        self.assertEqual(2, ping_client.long_poll.call_count)
+
+    def test_stop_during_long_poll(self):
+        """
+        If the L{Pinger} is stopped while a long poll is waiting, no ping is
+        scheduled when it returns.
+        """
+        self.config.long_poll_timeout = 300
+        self.identity.insecure_id = 23
+        deferred = Deferred()
+        ping_client = mock.Mock()
+        ping_client.long_poll.return_value = deferred
+        pinger = Pinger(self.reactor, self.identity, self.exchanger,
+                        self.config, ping_client_factory=lambda r: ping_client)
+        pinger.start()
+        self.reactor.advance(10)
+        pinger.stop()
+        deferred.callback((False, True))
+        self.reactor.advance(300)
+        self.assertEqual(1, ping_client.long_poll.call_count)
+
     def test_ping_doesnt_ping_if_stopped(self):
         """If the L{Pinger} is stopped, no pings are performed."""
         self.pinger.start()
@@ -5,6 +5,7 @@ from mock import Mock
 from twisted.internet.defer import succeed, fail
 
 from landscape.client.manager.manager import FAILED
+from landscape.lib.reactor import ReactorLagMonitor
 from landscape.client.tests.helpers import (
         LandscapeTest, DEFAULT_ACCEPTED_TYPES)
 from landscape.client.broker.tests.helpers import (
@@ -193,6 +194,32 @@ class BrokerServerTest(LandscapeTest):
         client2.exit = Mock(return_value=fail(Exception()))
         return self.assertFailure(self.broker.stop_clients(), Exception)
 
+    def test_get_plugin_stats(self):
+        """
+        The L{BrokerServer.get_plugin_stats} method returns the plugin stats
+        of each registered client, leaving out the ones that failed.
+        """
+        self.broker.connectors_registry = {"foo": FakeCreator,
+                                           "bar": FakeCreator}
+        self.broker.register_client("foo")
+        self.broker.register_client("bar")
+        foo = self.broker.get_client("foo")
+        foo.get_plugin_stats = Mock(return_value=succeed({"Plugin": {}}))
+        bar = self.broker.get_client("bar")
+        bar.get_plugin_stats = Mock(return_value=fail(Exception()))
+        result = self.broker.get_plugin_stats()
+        return result.addCallback(self.assertEqual, {"foo": {"Plugin": {}}})
+
+    def test_get_reactor_lag(self):
+        """
+        L{BrokerServer.get_reactor_lag} returns the measurements of the lag
+        monitor of the reactor, if any.
+        """
+        self.assertIsNone(self.broker.get_reactor_lag())
+        monitor = ReactorLagMonitor(self.reactor, 5)
+        self.reactor.lag_monitor = monitor
+        self.assertEqual(monitor.get_stats(), self.broker.get_reactor_lag())
+
     def test_reload_configuration(self):
         """
         The L{BrokerServer.reload_configuration} method forces the config
@@ -60,6 +60,32 @@ class BrokerServiceTest(LandscapeTest):
         service = BrokerService(self.config)
         self.assertEqual(20, service.pinger.get_interval())
 
+    def test_metrics_disabled(self):
+        """
+        Without a C{metrics_file}, the L{BrokerService} doesn't record
+        metrics.
+        """
+        self.assertFalse(self.service.metrics.enabled)
+
+    def test_write_metrics(self):
+        """
+        With a C{metrics_file}, the metrics are written to it periodically
+        and when the service stops.
+        """
+        self.config.metrics_file = self.makeFile()
+        service = BrokerService(self.config)
+        service.reactor = FakeReactor()
+        service.publisher = Mock()
+        service.exchanger.start = Mock()
+        service.pinger.start = Mock()
+        service.startService()
+        service.reactor.advance(service.metrics_interval)
+        with open(self.config.metrics_file) as fd:
+            self.assertIn("landscape_exchanges_total 0\n", fd.read())
+        os.remove(self.config.metrics_file)
+        service.stopService()
+        self.assertTrue(os.path.exists(self.config.metrics_file))
+
     def test_registration(self):
         """
         A L{BrokerService} instance has a proper C{registration} attribute.
@@ -5,6 +5,7 @@ import mock
 from twisted.python.compat import intToBytes
 
 from landscape.lib.bpickle import dumps
+from landscape.lib.metrics import MetricsRegistry
 from landscape.lib.persist import Persist
 from landscape.lib.schema import InvalidError, Int, Bytes, Unicode
 from landscape.message_schemas.message import Message
@@ -631,6 +632,23 @@ class MessageStoreTest(LandscapeTest):
         self.store.record_success((7 * 24 * 60 * 60) + 2)
         self.assertIsNot(None, self.store.add({"type": "empty"}))
 
+    def test_metrics(self):
+        """
+        Queued and dropped messages are counted in the L{MetricsRegistry}
+        passed to the L{MessageStore}.
+        """
+        metrics = MetricsRegistry()
+        store = MessageStore(Persist(), self.temp_dir, metrics=metrics)
+        store.add_schema(Message("empty", {}))
+        store.add({"type": "empty"})
+        store.add({"type": "empty"})
+        store._persist.set("blackhole-messages", True)
+        store.add({"type": "empty"})
+        output = metrics.format()
+        self.assertIn("landscape_message_store_added_total 2\n", output)
+        self.assertIn("landscape_message_store_dropped_total 1\n", output)
+        self.assertIn("landscape_message_store_add_seconds_count 2\n", output)
+
     def test_resync_requested_after_one_week_of_failures(self):
         """After a week of failures, a resync is requested."""
         self.store.record_failure(0)
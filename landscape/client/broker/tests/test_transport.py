@@ -5,6 +5,7 @@ from landscape import VERSION
 from landscape.client.broker.transport import HTTPTransport
 from landscape.lib import bpickle
 from landscape.lib.fetch import PyCurlError
+from landscape.lib.metrics import MetricsRegistry
 from landscape.lib.testing import LogKeeperHelper
 
 from landscape.client.tests.helpers import LandscapeTest
@@ -98,6 +99,33 @@ class HTTPTransportTest(LandscapeTest):
         """
         return self.request_with_payload(payload="HI")
 
+    def test_metrics(self):
+        """
+        The time spent serializing, sending and decoding payloads and the
+        bytes sent and received are recorded in the L{MetricsRegistry}.
+        """
+        metrics = MetricsRegistry()
+        port = reactor.listenTCP(
+            0, server.Site(DataCollectingResource()), interface="127.0.0.1")
+        self.ports.append(port)
+        transport = HTTPTransport(
+            None, "http://localhost:%d/" % (port.getHost().port,),
+            metrics=metrics)
+        result = deferToThread(transport.exchange, "HI")
+
+        def got_result(ignored):
+            output = metrics.format()
+            self.assertIn("landscape_transport_sent_bytes_total %d\n"
+                          % len(bpickle.dumps("HI")), output)
+            self.assertIn("landscape_transport_received_bytes_total %d\n"
+                          % len(bpickle.dumps("Great.")), output)
+            for name in ("serialize", "request", "decode"):
+                self.assertIn("landscape_transport_%s_seconds_count 1\n"
+                              % name, output)
+            self.assertIn("landscape_transport_errors_total 0\n", output)
+
+        return result.addCallback(got_result)
+
     def test_request_data_unicode(self):
         """
         When a payload contains unicode characters they are properly handled
@@ -11,6 +11,7 @@ from twisted.python.compat import unicode, _PY3
 from landscape.lib import bpickle
 from landscape.lib.fetch import fetch
 from landscape.lib.format import format_delta
+from landscape.lib.metrics import MetricsRegistry
 from landscape import SERVER_API, VERSION
 
 
@@ -19,12 +20,35 @@ class HTTPTransport(object):
 
     @param url: URL of the remote Landscape server message system.
     @param pubkey: SSH public key used for secure communication.
+    @param metrics: Optionally, the L{MetricsRegistry} to record the time
+        spent serializing payloads, talking to the server and decoding
+        responses in.
     """
 
-    def __init__(self, reactor, url, pubkey=None):
+    def __init__(self, reactor, url, pubkey=None, metrics=None):
         self._reactor = reactor
         self._url = url
         self._pubkey = pubkey
+        if metrics is None:
+            metrics = MetricsRegistry(enabled=False)
+        self._serialize_seconds = metrics.histogram(
+            "landscape_transport_serialize_seconds",
+            "Time spent serializing exchange payloads.")
+        self._request_seconds = metrics.histogram(
+            "landscape_transport_request_seconds",
+            "Time spent in HTTP requests to the server, including TLS.")
+        self._decode_seconds = metrics.histogram(
+            "landscape_transport_decode_seconds",
+            "Time spent decoding server responses.")
+        self._bytes_sent = metrics.counter(
+            "landscape_transport_sent_bytes_total",
+            "Bytes of payload sent to the server.")
+        self._bytes_received = metrics.counter(
+            "landscape_transport_received_bytes_total",
+            "Bytes of response received from the server.")
+        self._errors = metrics.counter(
+            "landscape_transport_errors_total",
+            "Exchanges which failed to get a valid response.")
 
     def get_url(self):
         """Get the URL of the remote message system."""
@@ -73,27 +97,36 @@ class HTTPTransport(object):
         @note: This code is thread safe (HOPEFULLY).
 
         """
+        serialize_time = time.time()
         spayload = bpickle.dumps(payload)
         start_time = time.time()
+        self._serialize_seconds.observe(start_time - serialize_time)
         if logging.getLogger().getEffectiveLevel() <= logging.DEBUG:
             logging.debug("Sending payload:\n%s", pprint.pformat(payload))
         try:
             curly, data = self._curl(spayload, computer_id, exchange_token,
                                      message_api)
         except Exception:
+            self._errors.inc()
             logging.exception("Error contacting the server at %s." % self._url)
             raise
         else:
+            decode_time = time.time()
+            self._request_seconds.observe(decode_time - start_time)
+            self._bytes_sent.inc(len(spayload))
+            self._bytes_received.inc(len(data))
             logging.info("Sent %d bytes and received %d bytes in %s.",
                          len(spayload), len(data),
-                         format_delta(time.time() - start_time))
+                         format_delta(decode_time - start_time))
 
         try:
             response = bpickle.loads(data)
         except Exception:
+            self._errors.inc()
             logging.exception("Server returned invalid data: %r" % data)
             return None
         else:
+            self._decode_seconds.observe(time.time() - decode_time)
             if logging.getLogger().getEffectiveLevel() <= logging.DEBUG:
                 logging.debug(
                     "Received payload:\n%s", pprint.pformat(response))
@@ -104,7 +137,7 @@ class HTTPTransport(object):
 class FakeTransport(object):
     """Fake transport for testing purposes."""
 
-    def __init__(self, reactor=None, url=None, pubkey=None):
+    def __init__(self, reactor=None, url=None, pubkey=None, metrics=None):
         self._pubkey = pubkey
         self.payloads = []
         self.responses = []
@@ -14,6 +14,8 @@ import os
 import pwd
 import sys
 
+from twisted.python.failure import Failure
+
 from landscape.lib.compat import input
 
 from landscape.lib.tag import is_valid_tag
@@ -192,6 +194,9 @@ class LandscapeSetupConfiguration(BrokerConfiguration):
         parser.add_option("--init", action="store_true", default=False,
                           help="Set up the client directories structure "
                                "and exit.")
+        parser.add_option("--stats", action="store_true", default=False,
+                          help="Show the time and memory used by the "
+                               "plugins of the running client and exit.")
         return parser
 
 
@@ -750,6 +755,66 @@ def determine_exit_code(what_happened):
         return 2  # An error happened
 
 
+def get_plugin_stats(config, reactor=None,
+                     connector_factory=RemoteBrokerConnector):
+    """Return the cost of the plugins of the running client.
+
+    @see: L{BrokerServer.get_plugin_stats}.
+    @raise: C{SystemExit} if the broker can't be contacted.
+    """
+    if reactor is None:
+        reactor = LandscapeReactor()
+    results = []
+
+    def done(ignored):
+        connector.disconnect()
+        reactor.stop()
+
+    def connect():
+        connection = connector.connect(max_retries=0, quiet=True)
+        connection.addCallback(lambda remote: remote.get_plugin_stats())
+        connection.addBoth(results.append)
+        connection.addBoth(done)
+
+    connector = connector_factory(reactor, config)
+    reactor.call_when_running(connect)
+    reactor.run()
+
+    [result] = results
+    if isinstance(result, Failure):
+        raise SystemExit("Unable to contact the Landscape client, "
+                         "is it running?")
+    return result
+
+
+def format_plugin_stats(stats):
+    """Format the plugin statistics from L{get_plugin_stats} as a table.
+
+    Plugins are sorted by decreasing CPU time, the memory column being
+    only filled if the client runs with C{tracemalloc} tracing, see
+    C{PYTHONTRACEMALLOC}.
+    """
+    rows = []
+    for client, plugins in stats.items():
+        for plugin, plugin_stats in plugins.items():
+            rows.append((client, plugin, plugin_stats))
+    rows.sort(key=lambda row: (-row[2]["cpu-time"], row[0], row[1]))
+    lines = ["%-8s %-48s %6s %6s %10s %10s %10s %10s" % (
+        "Client", "Plugin", "Runs", "Errors", "Wall", "Max wall", "CPU",
+        "Memory")]
+    for client, plugin, plugin_stats in rows:
+        memory = plugin_stats["memory"]
+        if memory is None:
+            memory = "-"
+        else:
+            memory = "%.1fKiB" % (memory / 1024.0)
+        lines.append("%-8s %-48s %6d %6d %9.2fs %9.2fs %9.2fs %10s" % (
+            client, plugin.rsplit(".", 1)[-1], plugin_stats["runs"],
+            plugin_stats["failures"], plugin_stats["wall-time"],
+            plugin_stats["max-wall-time"], plugin_stats["cpu-time"], memory))
+    return "\n".join(lines)
+
+
 def is_registered(config):
     """Return whether the client is already registered."""
     persist_filename = os.path.join(
@@ -776,6 +841,10 @@ def main(args, print=print):
         bootstrap_tree(config)
         sys.exit(0)
 
+    if config.stats:
+        print(format_plugin_stats(get_plugin_stats(config)))
+        return
+
     # Disable startup on boot and stop the client, if one is running.
     if config.disable:
         stop_client_and_disable_init_script()
@@ -116,11 +116,19 @@ class Configuration(BaseConfiguration):
                           dest="stagger_launch", default=0.1, type=float,
                           help="Ratio, between 0 and 1, by which to scatter "
                                "various tasks of landscape.")
+        parser.add_option("--reactor-lag-threshold", metavar="SECONDS",
+                          default=0, type=float,
+                          help="Measure how late the event loop of each "
+                               "daemon runs, and log what it's running when "
+                               "it's blocked for more than SECONDS "
+                               "(default: 0, disabled).")
 
         # Hidden options, used for load-testing to run in-process clones
         parser.add_option("--clones", default=0, type=int, help=SUPPRESS_HELP)
         parser.add_option("--start-clones-over", default=25 * 60, type=int,
                           help=SUPPRESS_HELP)
+        parser.add_option("--clones-share-package-data", default=False,
+                          action="store_true", help=SUPPRESS_HELP)
 
         return parser
 
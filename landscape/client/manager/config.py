@@ -30,6 +30,17 @@ class ManagerConfiguration(Configuration):
                           help="Comma-delimited list of usernames that scripts"
                                " may be run as. Default is to allow all "
                                "users.")
+        parser.add_option("--script-concurrency", default=4, type="int",
+                          metavar="COUNT",
+                          help="The maximum number of scripts, including "
+                               "custom graph scripts, running at the same "
+                               "time.")
+        parser.add_option("--script-output-interval", default=0, type="int",
+                          metavar="INTERVAL",
+                          help="The number of seconds between messages "
+                               "reporting the output of running scripts. "
+                               "Default is 0, only report the output when "
+                               "the script is over.")
         return parser
 
     @property
@@ -9,6 +9,7 @@ from landscape.lib.scriptcontent import generate_script_hash
 from landscape.lib.user import get_user_info, UnknownUserError
 from landscape.client.accumulate import Accumulator
 from landscape.client.manager.plugin import ManagerPlugin
+from landscape.client.manager.scheduler import GRAPH_PRIORITY
 from landscape.client.manager.scriptexecution import (
     ProcessFailedError, ScriptRunnerMixin, ProcessTimeLimitReachedError)
 
@@ -75,11 +76,14 @@ class CustomGraphPlugin(ManagerPlugin, ScriptRunnerMixin):
     size_limit = 1000
     time_limit = 10
     message_type = "custom-graph"
+    script_priority = GRAPH_PRIORITY
 
     def __init__(self, process_factory=None, create_time=time.time):
         super(CustomGraphPlugin, self).__init__(process_factory)
         self._create_time = create_time
         self._data = {}
+        # The graphs whose script is queued or running.
+        self._scheduled_graphs = set()
         self.do_send = True
 
     def register(self, registry):
@@ -200,6 +204,10 @@ class CustomGraphPlugin(ManagerPlugin, ScriptRunnerMixin):
             self._data[graph_id]["error"] = self._format_exception(
                 failure.value)
 
+    def _unschedule_graph(self, result, graph_id):
+        self._scheduled_graphs.discard(graph_id)
+        return result
+
     def _get_script_hash(self, filename):
         with open(filename) as file_object:
             script_content = file_object.read()
@@ -248,8 +256,14 @@ class CustomGraphPlugin(ManagerPlugin, ScriptRunnerMixin):
                 continue
             if not os.path.isfile(filename):
                 continue
+            if graph_id in self._scheduled_graphs:
+                # The previous run of the script didn't get a slot or didn't
+                # finish yet, don't queue it again.
+                continue
+            self._scheduled_graphs.add(graph_id)
             result = self._run_script(
                 filename, uid, gid, path, {}, self.time_limit)
+            result.addBoth(self._unschedule_graph, graph_id)
             result.addCallback(self._handle_data, graph_id, now)
             result.addErrback(self._handle_error, graph_id)
             deferred_list.append(result)
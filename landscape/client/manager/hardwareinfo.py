@@ -1,23 +1,47 @@
+import difflib
+import logging
 import os
+from hashlib import sha256
 
+from twisted.internet.defer import succeed
 from twisted.internet.utils import getProcessOutput
 
 from landscape.lib.encoding import encode_values
+from landscape.lib.fs import create_binary_file, read_binary_file
+from landscape.lib.persist import Persist
 from landscape.client.manager.plugin import ManagerPlugin
 
 
 class HardwareInfo(ManagerPlugin):
-    """A plugin to retrieve hardware information."""
+    """A plugin to retrieve hardware information.
+
+    The digest of the last report sent is persisted, and a report is only
+    sent again if it changed. If the server accepts C{hardware-info-diff}
+    messages, changes are sent as a diff against the last report it
+    received, unless the full report is smaller.
+    """
 
     message_type = "hardware-info"
+    diff_message_type = "hardware-info-diff"
     run_interval = 60 * 60 * 24
     run_immediately = True
     command = "/usr/bin/lshw"
 
     def register(self, registry):
         super(HardwareInfo, self).register(registry)
+        self._persist_filename = os.path.join(
+            self.registry.config.data_path, "hardware-info.bpickle")
+        self._report_filename = os.path.join(
+            self.registry.config.data_path, "hardware-info.xml")
+        self._persist = Persist(filename=self._persist_filename)
         self.call_on_accepted(self.message_type, self.send_message)
 
+    def _reset(self):
+        """Forget about the last report, so the next one is sent in full."""
+        self._persist.remove("digest")
+        self._persist.remove("message-id")
+        self._persist.save(self._persist_filename)
+
     def run(self):
         return self.registry.broker.call_if_accepted(
             self.message_type, self.send_message)
@@ -29,5 +53,55 @@ class HardwareInfo(ManagerPlugin):
         return result.addCallback(self._got_output)
 
     def _got_output(self, output):
+        digest = sha256(output).hexdigest()
+        if digest == self._persist.get("digest"):
+            logging.debug("Hardware information unchanged, not sending it.")
+            return succeed(None)
+        result = self._get_base_report()
+        return result.addCallback(self._send_report, output, digest)
+
+    def _get_base_report(self):
+        """
+        Return a L{Deferred} firing with the last report, if the server
+        received it and accepts diffs against it, or C{None} otherwise.
+        """
+        message_id = self._persist.get("message-id")
+        if (message_id is None or
+                not os.path.exists(self._report_filename)):
+            return succeed(None)
+        broker = self.registry.broker
+
+        def got_types(types):
+            if self.diff_message_type not in types:
+                return None
+            return broker.is_message_pending(message_id).addCallback(
+                got_pending)
+
+        def got_pending(pending):
+            if pending:
+                return None
+            return read_binary_file(self._report_filename)
+
+        return broker.get_accepted_message_types().addCallback(got_types)
+
+    def _send_report(self, base, output, digest):
         message = {"type": self.message_type, "data": output}
-        return self.registry.broker.send_message(message, self._session_id)
+        if base is not None:
+            old_lines = base.decode("utf-8", "replace").splitlines(True)
+            new_lines = output.decode("utf-8", "replace").splitlines(True)
+            diff = u"".join(difflib.unified_diff(old_lines, new_lines))
+            if len(diff) < len(output):
+                message = {"type": self.diff_message_type,
+                           "base-digest": sha256(base).hexdigest(),
+                           "digest": digest,
+                           "diff": diff}
+
+        def sent(message_id):
+            create_binary_file(self._report_filename, output)
+            self._persist.set("digest", digest)
+            self._persist.set("message-id", message_id)
+            self._persist.save(self._persist_filename)
+            return message_id
+
+        result = self.registry.broker.send_message(message, self._session_id)
+        return result.addCallback(sent)
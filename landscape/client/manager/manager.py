@@ -1,3 +1,4 @@
+from landscape.client.manager.scheduler import ScriptScheduler
 from landscape.client.manager.store import ManagerStore
 from landscape.client.broker.client import BrokerClient
 
@@ -16,3 +17,5 @@ class Manager(BrokerClient):
         self.reactor = reactor
         self.config = config
         self.store = ManagerStore(self.config.store_filename)
+        self.script_scheduler = ScriptScheduler(
+            self.config.script_concurrency, create_time=self.reactor.time)
@@ -0,0 +1,115 @@
+"""
+Bounded-concurrency scheduling of the script processes run by the manager.
+
+@var OPERATION_PRIORITY: The priority of scripts run on behalf of an
+    operation sent by the server, like C{execute-script}.
+@var GRAPH_PRIORITY: The priority of custom graph scripts, only run when no
+    operation script is waiting.
+"""
+import logging
+import time
+from collections import deque, OrderedDict
+
+from twisted.internet.defer import Deferred, maybeDeferred
+
+
+OPERATION_PRIORITY = 0
+GRAPH_PRIORITY = 1
+
+
+class ScriptScheduler(object):
+    """Run script processes with a limit on how many run at the same time.
+
+    Jobs are started in priority order, and jobs of the same priority are
+    taken from each user in turn, so a single user queueing many scripts
+    can't starve the others.
+
+    @param max_concurrency: The maximum number of jobs running at once.
+    @param create_time: A function returning the current time, used to
+        measure how long jobs wait in the queue.
+    """
+
+    def __init__(self, max_concurrency=4, create_time=time.time):
+        self.max_concurrency = max_concurrency
+        self._create_time = create_time
+        self._queues = {}
+        self._running = 0
+        self._stats = {}
+
+    def run(self, priority, user, function, *args, **kwargs):
+        """Schedule C{function} to be called as soon as a slot is free.
+
+        @param priority: The priority of the job, lower values run first.
+        @param user: The user the job runs as, used for fairness.
+        @param function: The function starting the job. If it returns a
+            C{Deferred}, the slot is held until it fires.
+        @return: A C{Deferred} firing with the result of C{function}.
+        """
+        result = Deferred()
+        users = self._queues.setdefault(priority, OrderedDict())
+        users.setdefault(user, deque()).append(
+            (self._create_time(), result, function, args, kwargs))
+        self._start_jobs()
+        return result
+
+    def get_queued(self):
+        """Return the number of jobs waiting for a free slot."""
+        return sum(len(jobs) for users in self._queues.values()
+                   for jobs in users.values())
+
+    def get_running(self):
+        """Return the number of jobs currently running."""
+        return self._running
+
+    def get_stats(self):
+        """Return queue-time metrics for each priority.
+
+        @return: A C{dict} mapping priorities to C{dict}s with the number of
+            jobs started, and the total and maximum number of seconds they
+            spent in the queue.
+        """
+        return dict((priority, dict(stats))
+                    for priority, stats in self._stats.items())
+
+    def _pop_job(self):
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if not users:
+                continue
+            # Take the first job of the first user and move that user to the
+            # back of the line.
+            user, jobs = next(iter(users.items()))
+            job = jobs.popleft()
+            del users[user]
+            if jobs:
+                users[user] = jobs
+            return priority, job
+        return None, None
+
+    def _start_jobs(self):
+        while self._running < self.max_concurrency:
+            priority, job = self._pop_job()
+            if job is None:
+                return
+            queued_at, result, function, args, kwargs = job
+            self._record_queue_time(priority, queued_at)
+            self._running += 1
+            deferred = maybeDeferred(function, *args, **kwargs)
+            deferred.addBoth(self._job_done)
+            deferred.chainDeferred(result)
+
+    def _job_done(self, result):
+        self._running -= 1
+        self._start_jobs()
+        return result
+
+    def _record_queue_time(self, priority, queued_at):
+        waited = max(0, self._create_time() - queued_at)
+        stats = self._stats.setdefault(
+            priority, {"started": 0, "total-wait": 0.0, "max-wait": 0.0})
+        stats["started"] += 1
+        stats["total-wait"] += waited
+        stats["max-wait"] = max(stats["max-wait"], waited)
+        if waited >= 1:
+            logging.debug("Script of priority %d started after waiting "
+                          "%.2f seconds in the queue." % (priority, waited))
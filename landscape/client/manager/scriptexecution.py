@@ -3,25 +3,32 @@ Functionality for running arbitrary shell scripts.
 
 @var ALL_USERS: A token indicating all users should be allowed.
 """
+import codecs
 import os
 import sys
 import os.path
 import tempfile
 import shutil
+from collections import deque
 
 from twisted.internet.protocol import ProcessProtocol
 from twisted.internet.defer import (
-    Deferred, fail, inlineCallbacks, returnValue, succeed)
+    Deferred, DeferredList, DeferredSemaphore, fail, inlineCallbacks,
+    returnValue, succeed)
 from twisted.internet.error import ProcessDone
+from twisted.internet.threads import deferToThread
 from twisted.python.compat import unicode
+from twisted.python.failure import Failure
 
 from landscape import VERSION
 from landscape.constants import UBUNTU_PATH
-from landscape.lib.fetch import fetch_async, HTTPCodeError
+from landscape.lib.fetch import (
+    fetch_to_file_async, HTTPCodeError, PyCurlError)
 from landscape.lib.persist import Persist
 from landscape.lib.scriptcontent import build_script
 from landscape.lib.user import get_user_info
 from landscape.client.manager.plugin import ManagerPlugin, SUCCEEDED, FAILED
+from landscape.client.manager.scheduler import OPERATION_PRIORITY
 
 
 ALL_USERS = object()
@@ -72,9 +79,13 @@ class ScriptRunnerMixin(object):
     """
     @param process_factory: The L{IReactorProcess} provider to run the
         process with.
+
+    @cvar script_priority: The priority of the scripts in the manager's
+        L{ScriptScheduler}.
     """
 
     truncation_indicator = "\n**OUTPUT TRUNCATED**"
+    script_priority = OPERATION_PRIORITY
 
     def __init__(self, process_factory=None):
         if process_factory is None:
@@ -100,7 +111,18 @@ class ScriptRunnerMixin(object):
         script_file.write(script)
         script_file.close()
 
-    def _run_script(self, filename, uid, gid, path, env, time_limit):
+    def _run_script(self, filename, uid, gid, path, env, time_limit,
+                    output_handler=None):
+        """
+        Queue the script in the manager's L{ScriptScheduler}, so that only a
+        limited number of scripts run at once.
+        """
+        return self.registry.script_scheduler.run(
+            self.script_priority, uid, self._spawn_script, filename, uid, gid,
+            path, env, time_limit, output_handler)
+
+    def _spawn_script(self, filename, uid, gid, path, env, time_limit,
+                      output_handler=None):
 
         if uid == os.getuid():
             uid = None
@@ -114,8 +136,15 @@ class ScriptRunnerMixin(object):
             for key, value in env.items()
         }
 
-        pp = ProcessAccumulationProtocol(
-            self.registry.reactor, self.size_limit, self.truncation_indicator)
+        interval = self.registry.config.script_output_interval
+        if output_handler is not None and interval:
+            pp = StreamingProcessAccumulationProtocol(
+                self.registry.reactor, self.size_limit, output_handler,
+                interval, self.truncation_indicator)
+        else:
+            pp = ProcessAccumulationProtocol(
+                self.registry.reactor, self.size_limit,
+                self.truncation_indicator)
         args = (filename,)
         self.process_factory.spawnProcess(
             pp, filename, args=args, uid=uid, gid=gid, path=path, env=env)
@@ -128,12 +157,25 @@ class ScriptExecutionPlugin(ManagerPlugin, ScriptRunnerMixin):
     """A plugin which allows execution of arbitrary shell scripts.
 
     @ivar size_limit: The number of bytes at which to truncate process output.
+    @ivar max_attachment_fetches: The maximum number of attachments being
+        downloaded at the same time.
+    @ivar attachment_fetch_retries: How many times an interrupted attachment
+        download is resumed before giving up.
+    @ivar attachment_cache_size: The number of bytes of downloaded
+        attachments kept around for later script runs.
     """
 
     size_limit = 500000
+    max_attachment_fetches = 4
+    attachment_fetch_retries = 3
+    attachment_cache_size = 100 * 1024 * 1024
 
     def register(self, registry):
         super(ScriptExecutionPlugin, self).register(registry)
+        self._attachment_semaphore = DeferredSemaphore(
+            self.max_attachment_fetches)
+        self._pending_attachments = {}
+        self._attachments_in_use = {}
         registry.register_message(
             "execute-script", self._handle_execute_script)
 
@@ -165,7 +207,9 @@ class ScriptExecutionPlugin(ManagerPlugin, ScriptRunnerMixin):
             d = self.run_script(message["interpreter"], message["code"],
                                 time_limit=message["time-limit"], user=user,
                                 attachments=message["attachments"],
-                                server_supplied_env=server_supplied_env)
+                                server_supplied_env=server_supplied_env,
+                                output_handler=PartialResultSender(
+                                    self, opid))
             d.addCallback(self._respond_success, opid)
             d.addErrback(self._respond_failure, opid)
             return d
@@ -173,6 +217,11 @@ class ScriptExecutionPlugin(ManagerPlugin, ScriptRunnerMixin):
             self._respond(FAILED, self._format_exception(e), opid)
             raise
 
+    def _respond_partial(self, message):
+        return self.registry.broker.call_if_accepted(
+            message["type"], self.registry.broker.send_message, message,
+            self._session_id, True)
+
     def _format_exception(self, e):
         return u"%s: %s" % (e.__class__.__name__, e.args[0])
 
@@ -203,29 +252,147 @@ class ScriptExecutionPlugin(ManagerPlugin, ScriptRunnerMixin):
         headers = {"User-Agent": "landscape-client/%s" % VERSION,
                    "Content-Type": "application/octet-stream",
                    "X-Computer-ID": computer_id}
+        copies = []
+        used = []
+
+        def copy(cached, full_filename):
+            # Cached attachments being copied aren't pruned by other runs.
+            self._attachments_in_use[cached] = (
+                self._attachments_in_use.get(cached, 0) + 1)
+            used.append(cached)
+            return deferToThread(
+                self._copy_attachment, cached, full_filename, uid, gid)
+
         for filename, attachment_id in attachments.items():
+            full_filename = os.path.join(attachment_dir, filename)
             if isinstance(attachment_id, str):
                 # Backward compatible behavior
-                data = attachment_id.encode("utf-8")
-                yield succeed(None)
+                with self._open_attachment(full_filename, uid, gid) as target:
+                    target.write(attachment_id.encode("utf-8"))
             else:
-                data = yield fetch_async(
-                    "%s%d" % (root_path, attachment_id),
-                    cainfo=self.registry.config.ssl_public_key,
-                    headers=headers)
-            full_filename = os.path.join(attachment_dir, filename)
-            with open(full_filename, "wb") as attachment:
-                os.chmod(full_filename, 0o600)
-                if uid is not None:
-                    os.chown(full_filename, uid, gid)
-                attachment.write(data)
+                result = self._get_attachment(
+                    "%s%d" % (root_path, attachment_id), attachment_id,
+                    headers)
+                result.addCallback(copy, full_filename)
+                copies.append(result)
+        # Wait for all the downloads to be over even if one of them fails,
+        # so none of them writes in the directory after it's been cleaned up.
+        results = yield DeferredList(copies, consumeErrors=True)
+        for cached in used:
+            self._attachments_in_use[cached] -= 1
+            if not self._attachments_in_use[cached]:
+                del self._attachments_in_use[cached]
+        # Prune once the attachments are copied, keeping the ones this run
+        # just used even if they don't fit in the cache on their own.
+        self._prune_attachment_cache(keep=used)
+        for success, result in results:
+            if not success:
+                result.raiseException()
         os.chmod(attachment_dir, 0o700)
         if uid is not None:
             os.chown(attachment_dir, uid, gid)
         returnValue(attachment_dir)
 
+    def _open_attachment(self, filename, uid, gid):
+        """Create an attachment file only readable by the script user."""
+        attachment = open(filename, "wb")
+        os.chmod(filename, 0o600)
+        if uid is not None:
+            os.chown(filename, uid, gid)
+        return attachment
+
+    def _copy_attachment(self, cached, filename, uid, gid):
+        with open(cached, "rb") as source:
+            with self._open_attachment(filename, uid, gid) as target:
+                shutil.copyfileobj(source, target)
+
+    def _get_attachment_cache_dir(self):
+        cache_dir = os.path.join(
+            self.registry.config.data_path, "attachment-cache")
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+            os.chmod(cache_dir, 0o700)
+        return cache_dir
+
+    def _get_attachment(self, url, attachment_id, headers):
+        """Return a L{Deferred} firing with the path of a cached attachment.
+
+        Attachments are immutable on the server side, so the ones already
+        downloaded by previous script runs are reused. Concurrent requests
+        for the same attachment share a single download.
+        """
+        cached = os.path.join(
+            self._get_attachment_cache_dir(), str(attachment_id))
+        if os.path.exists(cached):
+            # Bump the modification time, the cache is pruned in LRU order.
+            os.utime(cached, None)
+            return succeed(cached)
+
+        result = Deferred()
+        waiters = self._pending_attachments.get(attachment_id)
+        if waiters is not None:
+            waiters.append(result)
+            return result
+
+        def fire(value):
+            for waiter in self._pending_attachments.pop(attachment_id):
+                if isinstance(value, Failure):
+                    waiter.errback(value)
+                else:
+                    waiter.callback(value)
+
+        self._pending_attachments[attachment_id] = [result]
+        download = self._attachment_semaphore.run(
+            self._download_attachment, url, cached, headers)
+        download.addBoth(fire)
+        return result
+
+    @inlineCallbacks
+    def _download_attachment(self, url, cached, headers):
+        attempts = 0
+        while True:
+            try:
+                # The content is streamed to a partial file, which is renamed
+                # to the cached one when complete.
+                yield fetch_to_file_async(
+                    url, cached, resume=True,
+                    cainfo=self.registry.config.ssl_public_key,
+                    headers=headers)
+            except PyCurlError:
+                # Network level error, resume where the transfer stopped.
+                attempts += 1
+                if attempts > self.attachment_fetch_retries:
+                    raise
+            else:
+                break
+        returnValue(cached)
+
+    def _prune_attachment_cache(self, keep=()):
+        """Remove the least recently used cached attachments over the limit.
+
+        @param keep: Paths of cached attachments not to remove. The ones
+            being copied by script runs are never removed either.
+        """
+        cache_dir = self._get_attachment_cache_dir()
+        entries = []
+        total = 0
+        for name in os.listdir(cache_dir):
+            if name.endswith(".partial"):
+                continue
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            total += stat.st_size
+            if path not in keep and path not in self._attachments_in_use:
+                entries.append((stat.st_mtime, stat.st_size, name))
+        for _, size, name in sorted(entries):
+            if total <= self.attachment_cache_size:
+                break
+            os.unlink(os.path.join(cache_dir, name))
+            total -= size
+
     def run_script(self, shell, code, user=None, time_limit=None,
-                   attachments=None, server_supplied_env=None):
+                   attachments=None, server_supplied_env=None,
+                   output_handler=None):
         """
         Run a script based on a shell and the code.
 
@@ -242,6 +409,9 @@ class ScriptExecutionPlugin(ManagerPlugin, ScriptRunnerMixin):
             before killing it and failing the returned Deferred with a
             L{ProcessTimeLimitReachedError}.
         @param attachments: C{dict} of filename/data attached to the script.
+        @param output_handler: Optionally, a function called periodically
+            with the new output of the script, if streaming is enabled with
+            the C{script_output_interval} configuration option.
 
         @return: A deferred that will fire with the data printed by the process
             or fail with a L{ProcessTimeLimitReachedError}.
@@ -286,7 +456,7 @@ class ScriptExecutionPlugin(ManagerPlugin, ScriptRunnerMixin):
         def prepare_script(attachment_dir):
 
             return self._run_script(
-                filename, uid, gid, path, env, time_limit)
+                filename, uid, gid, path, env, time_limit, output_handler)
 
         d.addCallback(prepare_script)
         return d.addBoth(self._cleanup, filename, env, old_umask)
@@ -355,7 +525,7 @@ class ProcessAccumulationProtocol(ProcessProtocol):
         # We get bytes with self.data, but want unicode with replace
         # characters. This is again attempted in
         # ScriptExecutionPlugin._respond, but it is not called in all cases.
-        data = b"".join(self.data).decode("utf-8", "replace")
+        data = self._get_data().decode("utf-8", "replace")
         if self._cancelled:
             self.result_deferred.errback(ProcessTimeLimitReachedError(data))
         else:
@@ -370,6 +540,10 @@ class ProcessAccumulationProtocol(ProcessProtocol):
                 self.result_deferred.errback(
                     ProcessFailedError(data, exit_code))
 
+    def _get_data(self):
+        """Return the output to report once the process is over."""
+        return b"".join(self.data)
+
     def _cancel(self):
         """
         Close filedescriptors, kill the process, and indicate that a
@@ -386,6 +560,116 @@ class ProcessAccumulationProtocol(ProcessProtocol):
         self._cancelled = True
 
 
+class RingBuffer(object):
+    """A buffer keeping only the last C{size} bytes written to it.
+
+    @ivar dropped: The number of bytes discarded to stay within C{size}.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.dropped = 0
+        self._chunks = deque()
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._length += len(data)
+        while self._length > self.size:
+            excess = self._length - self.size
+            chunk = self._chunks.popleft()
+            if len(chunk) > excess:
+                self._chunks.appendleft(chunk[excess:])
+                dropped = excess
+            else:
+                dropped = len(chunk)
+            self._length -= dropped
+            self.dropped += dropped
+
+    def getvalue(self):
+        return b"".join(self._chunks)
+
+    def clear(self):
+        self.dropped = 0
+        self._chunks.clear()
+        self._length = 0
+
+
+class StreamingProcessAccumulationProtocol(ProcessAccumulationProtocol):
+    """A L{ProcessAccumulationProtocol} periodically reporting new output.
+
+    Every C{interval} seconds the output received since the last report is
+    passed to C{output_handler}, along with the number of bytes that had to
+    be dropped because they didn't fit in C{size_limit}. Only the last
+    C{size_limit} bytes of output are kept for the final result, so memory
+    usage stays flat no matter how much the process prints.
+
+    @param output_handler: A function called with the new output, decoded
+        to unicode, and the number of skipped bytes.
+    @param interval: The number of seconds between reports.
+    """
+
+    def __init__(self, reactor, size_limit, output_handler, interval,
+                 truncation_indicator=""):
+        super(StreamingProcessAccumulationProtocol, self).__init__(
+            reactor, size_limit, truncation_indicator)
+        self._output_handler = output_handler
+        self._tail = RingBuffer(self._truncated_size_limit)
+        self._delta = RingBuffer(self.size_limit)
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._scheduled_flush = self.reactor.call_every(
+            interval, self._flush)
+
+    def childDataReceived(self, fd, data):
+        self._tail.write(data)
+        self._delta.write(data)
+
+    def processEnded(self, reason):
+        self.reactor.cancel_call(self._scheduled_flush)
+        super(StreamingProcessAccumulationProtocol, self).processEnded(
+            reason)
+
+    def _flush(self):
+        if not len(self._delta) and not self._delta.dropped:
+            return
+        data = self._decoder.decode(self._delta.getvalue())
+        skipped = self._delta.dropped
+        self._delta.clear()
+        if data or skipped:
+            self._output_handler(data, skipped)
+
+    def _get_data(self):
+        data = self._tail.getvalue()
+        if self._tail.dropped:
+            # The beginning of the output has been reported already.
+            data = self._truncation_indicator.lstrip() + b"\n" + data
+        return data
+
+
+class PartialResultSender(object):
+    """Send the output of a running script as partial-operation-result
+    messages, numbered in sequence.
+    """
+
+    def __init__(self, plugin, opid):
+        self._plugin = plugin
+        self._opid = opid
+        self._sequence = 0
+
+    def __call__(self, data, skipped):
+        message = {"type": "partial-operation-result",
+                   "operation-id": self._opid,
+                   "sequence": self._sequence,
+                   "result-text": data}
+        if skipped:
+            message["skipped-bytes"] = skipped
+        self._sequence += 1
+        return self._plugin._respond_partial(message)
+
+
 class ScriptExecution(ManagerPlugin):
     """
     Meta-plugin wrapping ScriptExecutionPlugin and CustomGraphPlugin.
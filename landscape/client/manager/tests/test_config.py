@@ -57,3 +57,12 @@ class ManagerConfigurationTest(LandscapeTest):
         self.config.load(["--script-users", "foo, bar,baz"])
         self.assertEqual(self.config.get_allowed_script_users(),
                          ["foo", "bar", "baz"])
+
+    def test_script_concurrency(self):
+        """
+        The C{--script-concurrency} option sets how many scripts may run at
+        the same time, 4 by default.
+        """
+        self.assertEqual(4, self.config.script_concurrency)
+        self.config.load(["--script-concurrency", "2"])
+        self.assertEqual(2, self.config.script_concurrency)
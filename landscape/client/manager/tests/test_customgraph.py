@@ -422,6 +422,33 @@ class CustomGraphManagerTests(LandscapeTest):
 
         return result.addCallback(check)
 
+    def test_run_skips_scheduled_graphs(self):
+        """
+        A graph whose script is still queued or running isn't queued again
+        by the next run, so the queue doesn't grow when scripts can't keep
+        up.
+        """
+        filename = self.makeFile("some content")
+        self.store.add_graph(123, filename, None)
+        factory = StubProcessFactory()
+        self.graph_manager.process_factory = factory
+        self.manager.script_scheduler.max_concurrency = 0
+        self.graph_manager.run()
+        self.graph_manager.run()
+        self.assertEqual(1, self.manager.script_scheduler.get_queued())
+
+        self.manager.script_scheduler.max_concurrency = 1
+        self.manager.script_scheduler._start_jobs()
+        self.assertEqual(1, len(factory.spawns))
+        protocol = factory.spawns[0][0]
+        protocol.makeConnection(DummyProcess())
+        self.graph_manager.run()
+        self.assertEqual(1, len(factory.spawns))
+
+        self._exit_process_protocol(protocol, b"1.0")
+        self.graph_manager.run()
+        self.assertEqual(2, len(factory.spawns))
+
     def test_run_removed_file(self):
         """
         If run is called on a script file that has been removed, it doesn't try
@@ -1,3 +1,5 @@
+from hashlib import sha256
+
 from landscape.client.tests.helpers import LandscapeTest, ManagerHelper
 
 from landscape.client.manager.hardwareinfo import HardwareInfo
@@ -61,3 +63,135 @@ class HardwareInfoTests(LandscapeTest):
             self.assertEqual([], calls)
 
         return deferred.addCallback(check)
+
+    def test_unchanged_report_not_sent(self):
+        """
+        A report identical to the last one sent isn't sent again, even by a
+        new plugin instance.
+        """
+        deferred = self.info._got_output(b"<report/>\n")
+        deferred.addCallback(lambda _: self.info._got_output(b"<report/>\n"))
+
+        def check(ignored):
+            info = HardwareInfo()
+            info.run_immediately = False
+            self.manager.add(info)
+            return info._got_output(b"<report/>\n")
+
+        def check_messages(ignored):
+            self.assertMessages(
+                self.broker_service.message_store.get_pending_messages(),
+                [{"data": u"<report/>\n", "type": "hardware-info"}])
+
+        deferred.addCallback(check)
+        return deferred.addCallback(check_messages)
+
+    def test_changed_report_sent(self):
+        """
+        A report different from the last one is sent in full if the server
+        doesn't accept diffs.
+        """
+        deferred = self.info._got_output(b"<report/>\n")
+        deferred.addCallback(
+            lambda _: self.info._got_output(b"<report>\n</report>\n"))
+
+        def check(ignored):
+            self.assertMessages(
+                self.broker_service.message_store.get_pending_messages(),
+                [{"data": u"<report/>\n", "type": "hardware-info"},
+                 {"data": u"<report>\n</report>\n", "type": "hardware-info"}])
+
+        return deferred.addCallback(check)
+
+    def test_reset(self):
+        """
+        After a resynchronization the report is sent again, even if it didn't
+        change.
+        """
+        deferred = self.info._got_output(b"<report/>\n")
+
+        def resynchronize(ignored):
+            self.info._reset()
+            return self.info._got_output(b"<report/>\n")
+
+        def check(ignored):
+            self.assertMessages(
+                self.broker_service.message_store.get_pending_messages(),
+                [{"data": u"<report/>\n", "type": "hardware-info"},
+                 {"data": u"<report/>\n", "type": "hardware-info"}])
+
+        deferred.addCallback(resynchronize)
+        return deferred.addCallback(check)
+
+    def _make_report(self, *lines):
+        return "".join(
+            u"<node id='%s'/>\n" % line for line in lines).encode("utf-8")
+
+    def test_diff(self):
+        """
+        If the server accepts diffs and received the last report, changes
+        are sent as a diff against it.
+        """
+        message_store = self.broker_service.message_store
+        message_store.set_accepted_types(
+            ["hardware-info", "hardware-info-diff"])
+        old_report = self._make_report(*range(20))
+        new_report = self._make_report(*range(1, 21))
+        deferred = self.info._got_output(old_report)
+
+        def delivered(ignored):
+            message_store.set_pending_offset(1)
+            return self.info._got_output(new_report)
+
+        def check(ignored):
+            [message] = message_store.get_pending_messages()
+            self.assertEqual("hardware-info-diff", message["type"])
+            self.assertEqual(
+                sha256(old_report).hexdigest(), message["base-digest"])
+            self.assertEqual(sha256(new_report).hexdigest(), message["digest"])
+            self.assertIn(u"-<node id='0'/>\n", message["diff"])
+            self.assertIn(u"+<node id='20'/>\n", message["diff"])
+
+        deferred.addCallback(delivered)
+        return deferred.addCallback(check)
+
+    def test_no_diff_if_base_not_delivered(self):
+        """
+        If the last report hasn't been delivered yet, the new one is sent in
+        full.
+        """
+        message_store = self.broker_service.message_store
+        message_store.set_accepted_types(
+            ["hardware-info", "hardware-info-diff"])
+        old_report = self._make_report(*range(20))
+        new_report = self._make_report(*range(1, 21))
+        deferred = self.info._got_output(old_report)
+        deferred.addCallback(lambda _: self.info._got_output(new_report))
+
+        def check(ignored):
+            messages = message_store.get_pending_messages()
+            self.assertEqual(["hardware-info", "hardware-info"],
+                             [message["type"] for message in messages])
+
+        return deferred.addCallback(check)
+
+    def test_no_diff_if_larger(self):
+        """
+        If the diff is larger than the report itself, the report is sent.
+        """
+        message_store = self.broker_service.message_store
+        message_store.set_accepted_types(
+            ["hardware-info", "hardware-info-diff"])
+        deferred = self.info._got_output(b"<a/>\n")
+
+        def delivered(ignored):
+            message_store.set_pending_offset(1)
+            return self.info._got_output(b"<b/>\n")
+
+        def check(ignored):
+            self.assertMessages(
+                message_store.get_pending_messages(),
+                [{"data": u"<b/>\n", "type": "hardware-info"}])
+
+        deferred.addCallback(delivered)
+        return deferred.addCallback(check)
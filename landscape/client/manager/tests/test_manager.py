@@ -1,3 +1,4 @@
+from landscape.client.manager.scheduler import ScriptScheduler
 from landscape.client.manager.store import ManagerStore
 
 from landscape.client.tests.helpers import LandscapeTest, ManagerHelper
@@ -31,3 +32,12 @@ class ManagerTest(LandscapeTest):
         A L{Manager} instance has a proper C{store} attribute.
         """
         self.assertTrue(isinstance(self.manager.store, ManagerStore))
+
+    def test_script_scheduler(self):
+        """
+        A L{Manager} instance has a L{ScriptScheduler} limited to the
+        configured script concurrency.
+        """
+        self.assertTrue(
+            isinstance(self.manager.script_scheduler, ScriptScheduler))
+        self.assertEqual(4, self.manager.script_scheduler.max_concurrency)
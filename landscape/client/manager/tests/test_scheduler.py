@@ -0,0 +1,105 @@
+from twisted.internet.defer import Deferred, succeed
+
+from landscape.client.manager.scheduler import (
+    ScriptScheduler, OPERATION_PRIORITY, GRAPH_PRIORITY)
+from landscape.client.tests.helpers import LandscapeTest
+
+
+class ScriptSchedulerTest(LandscapeTest):
+
+    def setUp(self):
+        super(ScriptSchedulerTest, self).setUp()
+        self.now = 0
+        self.scheduler = ScriptScheduler(
+            max_concurrency=1, create_time=lambda: self.now)
+        self.started = []
+        self.jobs = []
+
+    def job(self, name):
+        self.started.append(name)
+        deferred = Deferred()
+        self.jobs.append(deferred)
+        return deferred
+
+    def finish(self, result=None):
+        self.jobs.pop(0).callback(result)
+
+    def test_run_immediately(self):
+        """
+        Jobs are started right away when there's a free slot, and the
+        returned L{Deferred} fires with the result of the job.
+        """
+        result = self.scheduler.run(
+            OPERATION_PRIORITY, "user", lambda: succeed("result"))
+        self.assertEqual(0, self.scheduler.get_running())
+        return result.addCallback(self.assertEqual, "result")
+
+    def test_max_concurrency(self):
+        """
+        No more than C{max_concurrency} jobs run at the same time, the others
+        start as soon as a running one is over.
+        """
+        self.scheduler.max_concurrency = 2
+        for name in ("a", "b", "c"):
+            self.scheduler.run(OPERATION_PRIORITY, "user", self.job, name)
+        self.assertEqual(["a", "b"], self.started)
+        self.assertEqual(2, self.scheduler.get_running())
+        self.assertEqual(1, self.scheduler.get_queued())
+        self.finish()
+        self.assertEqual(["a", "b", "c"], self.started)
+        self.assertEqual(0, self.scheduler.get_queued())
+
+    def test_slot_released_on_failure(self):
+        """
+        A failing job releases its slot, and its failure is passed on to the
+        caller.
+        """
+        result = self.scheduler.run(
+            OPERATION_PRIORITY, "user", self.job, "a")
+        self.scheduler.run(OPERATION_PRIORITY, "user", self.job, "b")
+        self.jobs.pop(0).errback(RuntimeError("boom"))
+        self.assertEqual(["a", "b"], self.started)
+        self.assertFailure(result, RuntimeError)
+        return result
+
+    def test_priority(self):
+        """
+        Queued operation scripts run before queued graph scripts, regardless
+        of the order they were scheduled in.
+        """
+        self.scheduler.run(OPERATION_PRIORITY, "user", self.job, "first")
+        self.scheduler.run(GRAPH_PRIORITY, "user", self.job, "graph")
+        self.scheduler.run(OPERATION_PRIORITY, "user", self.job, "operation")
+        self.finish()
+        self.finish()
+        self.assertEqual(["first", "operation", "graph"], self.started)
+
+    def test_user_fairness(self):
+        """
+        Jobs of the same priority are taken from each user in turn.
+        """
+        self.scheduler.run(OPERATION_PRIORITY, "alice", self.job, "first")
+        for name in ("a1", "a2", "a3"):
+            self.scheduler.run(OPERATION_PRIORITY, "alice", self.job, name)
+        self.scheduler.run(OPERATION_PRIORITY, "bob", self.job, "b1")
+        self.scheduler.run(OPERATION_PRIORITY, "bob", self.job, "b2")
+        for i in range(5):
+            self.finish()
+        self.assertEqual(
+            ["first", "a1", "b1", "a2", "b2", "a3"], self.started)
+
+    def test_get_stats(self):
+        """
+        L{ScriptScheduler.get_stats} reports how many jobs were started for
+        each priority and how long they waited in the queue.
+        """
+        self.scheduler.run(OPERATION_PRIORITY, "user", self.job, "a")
+        self.scheduler.run(GRAPH_PRIORITY, "user", self.job, "b")
+        self.now = 5
+        self.finish()
+        self.assertEqual(
+            {OPERATION_PRIORITY: {
+                "started": 1, "total-wait": 0.0, "max-wait": 0.0},
+             GRAPH_PRIORITY: {
+                 "started": 1, "total-wait": 5.0, "max-wait": 5.0}},
+            self.scheduler.get_stats())
@@ -6,18 +6,20 @@ import stat
 
 import mock
 
-from twisted.internet.defer import gatherResults, succeed, fail
+from twisted.internet.defer import Deferred, gatherResults, succeed, fail
 from twisted.internet.error import ProcessDone
 from twisted.python.failure import Failure
 
 from landscape import VERSION
-from landscape.lib.fetch import HTTPCodeError
+from landscape.lib.fetch import HTTPCodeError, PyCurlError
 from landscape.lib.persist import Persist
-from landscape.lib.testing import StubProcessFactory, DummyProcess
+from landscape.lib.testing import (
+    StubProcessFactory, DummyProcess, FakeReactor)
 from landscape.lib.user import get_user_info, UnknownUserError
 from landscape.client.manager.scriptexecution import (
     ScriptExecutionPlugin, ProcessTimeLimitReachedError, PROCESS_FAILED_RESULT,
-    UBUNTU_PATH, UnknownInterpreterError, FETCH_ATTACHMENTS_FAILED_RESULT)
+    UBUNTU_PATH, UnknownInterpreterError, FETCH_ATTACHMENTS_FAILED_RESULT,
+    RingBuffer, StreamingProcessAccumulationProtocol)
 from landscape.client.manager.manager import SUCCEEDED, FAILED
 from landscape.client.tests.helpers import LandscapeTest, ManagerHelper
 
@@ -36,6 +38,24 @@ def get_default_environment():
     return env
 
 
+def fake_fetch_to_file(*bodies):
+    """
+    Return a side effect for a mocked L{fetch_to_file_async}, writing the
+    given bodies to the target file on each call.
+    """
+    bodies = list(bodies)
+
+    def fetch_to_file_async(url, filename, resume=False, **kwargs):
+        body = bodies.pop(0)
+        if isinstance(body, Exception):
+            return fail(body)
+        with open(filename, "ab" if resume else "wb") as fd:
+            fd.write(body)
+        return succeed(None)
+
+    return fetch_to_file_async
+
+
 def encoded_default_environment():
     return {
         key: value.encode('ascii', 'replace')
@@ -176,6 +196,32 @@ class RunScriptTests(LandscapeTest):
         d2.addCallback(self.assertEqual, "")
         return gatherResults([d1, d2])
 
+    def test_concurrency_limit(self):
+        """
+        Scripts are queued in the manager's L{ScriptScheduler}, so no more
+        than the configured number of scripts run at the same time.
+        """
+        factory = StubProcessFactory()
+        self.plugin.process_factory = factory
+        self.manager.script_scheduler.max_concurrency = 1
+        d1 = self.plugin.run_script("/bin/sh", "echo hi")
+        d2 = self.plugin.run_script("/bin/sh", "echo there")
+        self.assertEqual(1, len(factory.spawns))
+
+        protocol = factory.spawns[0][0]
+        protocol.makeConnection(DummyProcess())
+        protocol.childDataReceived(1, b"hi\n")
+        protocol.processEnded(Failure(ProcessDone(0)))
+        self.assertEqual(2, len(factory.spawns))
+
+        protocol = factory.spawns[1][0]
+        protocol.makeConnection(DummyProcess())
+        protocol.childDataReceived(1, b"there\n")
+        protocol.processEnded(Failure(ProcessDone(0)))
+        d1.addCallback(self.assertEqual, "hi\n")
+        d2.addCallback(self.assertEqual, "there\n")
+        return gatherResults([d1, d2])
+
     def test_accented_run_in_code(self):
         """
         Scripts can contain accented data both in the code and in the
@@ -281,9 +327,9 @@ class RunScriptTests(LandscapeTest):
         persist.save()
 
         patch_fetch = mock.patch(
-            "landscape.client.manager.scriptexecution.fetch_async")
+            "landscape.client.manager.scriptexecution.fetch_to_file_async")
         mock_fetch = patch_fetch.start()
-        mock_fetch.return_value = succeed(b"some other data")
+        mock_fetch.side_effect = fake_fetch_to_file(b"some other data")
 
         headers = {"User-Agent": "landscape-client/%s" % VERSION,
                    "Content-Type": "application/octet-stream",
@@ -297,8 +343,8 @@ class RunScriptTests(LandscapeTest):
         def check(result):
             self.assertEqual(result, "file1\nsome other data")
             mock_fetch.assert_called_with(
-                "https://localhost/attachment/14", headers=headers,
-                cainfo=None)
+                "https://localhost/attachment/14", mock.ANY, resume=True,
+                headers=headers, cainfo=None)
 
         def cleanup(result):
             patch_fetch.stop()
@@ -321,9 +367,9 @@ class RunScriptTests(LandscapeTest):
         persist.save()
 
         patch_fetch = mock.patch(
-            "landscape.client.manager.scriptexecution.fetch_async")
+            "landscape.client.manager.scriptexecution.fetch_to_file_async")
         mock_fetch = patch_fetch.start()
-        mock_fetch.return_value = succeed(b"some other data")
+        mock_fetch.side_effect = fake_fetch_to_file(b"some other data")
 
         headers = {"User-Agent": "landscape-client/%s" % VERSION,
                    "Content-Type": "application/octet-stream",
@@ -337,8 +383,8 @@ class RunScriptTests(LandscapeTest):
         def check(result):
             self.assertEqual(result, "file1\nsome other data")
             mock_fetch.assert_called_with(
-                "https://localhost/attachment/14", headers=headers,
-                cainfo="/some/key")
+                "https://localhost/attachment/14", mock.ANY, resume=True,
+                headers=headers, cainfo="/some/key")
 
         def cleanup(result):
             patch_fetch.stop()
@@ -346,6 +392,199 @@ class RunScriptTests(LandscapeTest):
 
         return result.addCallback(check).addBoth(cleanup)
 
+    def _set_up_attachment_ids(self):
+        self.manager.config.url = "https://localhost/message-system"
+        persist = Persist(
+            filename=os.path.join(self.config.data_path, "broker.bpickle"))
+        registration_persist = persist.root_at("registration")
+        registration_persist.set("secure-id", "secure_id")
+        persist.save()
+
+    def test_run_with_attachment_ids_cached(self):
+        """
+        Attachments fetched by a script run are kept in a local cache, keyed
+        by attachment ID, and reused by later runs.
+        """
+        self._set_up_attachment_ids()
+        patch_fetch = mock.patch(
+            "landscape.client.manager.scriptexecution.fetch_to_file_async")
+        mock_fetch = patch_fetch.start()
+        mock_fetch.side_effect = fake_fetch_to_file(b"some other data")
+
+        def run(ignored=None):
+            return self.plugin.run_script(
+                u"/bin/sh", u"cat $LANDSCAPE_ATTACHMENTS/file1",
+                attachments={u"file1": 14})
+
+        def check(result):
+            self.assertEqual(result, "some other data")
+            self.assertEqual(1, mock_fetch.call_count)
+            cached = os.path.join(
+                self.config.data_path, "attachment-cache", "14")
+            with open(cached, "rb") as fd:
+                self.assertEqual(b"some other data", fd.read())
+
+        def cleanup(result):
+            patch_fetch.stop()
+            return result
+
+        result = run()
+        result.addCallback(run)
+        return result.addCallback(check).addBoth(cleanup)
+
+    def test_run_with_attachment_ids_resumes_download(self):
+        """
+        If the download of an attachment is interrupted by a network error,
+        it's resumed from the bytes already written to disk.
+        """
+        self._set_up_attachment_ids()
+        patch_fetch = mock.patch(
+            "landscape.client.manager.scriptexecution.fetch_to_file_async")
+        mock_fetch = patch_fetch.start()
+        partial = fake_fetch_to_file(b"some ", b"other data")
+
+        def fetch_to_file_async(url, filename, resume=False, **kwargs):
+            if mock_fetch.call_count == 1:
+                partial(url, filename, resume=resume, **kwargs)
+                return fail(PyCurlError(18, "Transfer closed"))
+            return partial(url, filename, resume=resume, **kwargs)
+
+        mock_fetch.side_effect = fetch_to_file_async
+
+        result = self.plugin.run_script(
+            u"/bin/sh", u"cat $LANDSCAPE_ATTACHMENTS/file1",
+            attachments={u"file1": 14})
+
+        def check(result):
+            self.assertEqual(result, "some other data")
+            self.assertEqual(2, mock_fetch.call_count)
+
+        def cleanup(result):
+            patch_fetch.stop()
+            return result
+
+        return result.addCallback(check).addBoth(cleanup)
+
+    def test_run_with_attachment_ids_gives_up_retrying(self):
+        """
+        Interrupted downloads are retried at most C{attachment_fetch_retries}
+        times, after which the script fails.
+        """
+        self._set_up_attachment_ids()
+        self.plugin.attachment_fetch_retries = 1
+        patch_fetch = mock.patch(
+            "landscape.client.manager.scriptexecution.fetch_to_file_async")
+        mock_fetch = patch_fetch.start()
+        mock_fetch.side_effect = lambda *args, **kwargs: fail(
+            PyCurlError(18, "Transfer closed"))
+
+        result = self.plugin.run_script(
+            u"/bin/sh", u"cat $LANDSCAPE_ATTACHMENTS/file1",
+            attachments={u"file1": 14})
+        self.assertFailure(result, PyCurlError)
+
+        def check(ignored):
+            self.assertEqual(2, mock_fetch.call_count)
+
+        def cleanup(result):
+            patch_fetch.stop()
+            return result
+
+        return result.addCallback(check).addBoth(cleanup)
+
+    def test_run_with_attachment_ids_bounded_parallelism(self):
+        """
+        At most C{max_attachment_fetches} attachments are downloaded at the
+        same time.
+        """
+        self._set_up_attachment_ids()
+        self.plugin._attachment_semaphore.tokens = 1
+        self.plugin._attachment_semaphore.limit = 1
+        downloads = []
+
+        def fetch_to_file_async(url, filename, resume=False, **kwargs):
+            deferred = Deferred()
+            downloads.append((filename, deferred))
+            return deferred
+
+        patch_fetch = mock.patch(
+            "landscape.client.manager.scriptexecution.fetch_to_file_async",
+            side_effect=fetch_to_file_async)
+        patch_fetch.start()
+        self.addCleanup(patch_fetch.stop)
+
+        result = self.plugin.run_script(
+            u"/bin/sh",
+            u"cat $LANDSCAPE_ATTACHMENTS/file1 $LANDSCAPE_ATTACHMENTS/file2",
+            attachments={u"file1": 14, u"file2": 15})
+
+        def finish_next(ignored=None):
+            self.assertEqual(1, len(downloads))
+            filename, deferred = downloads.pop()
+            with open(filename, "wb") as fd:
+                fd.write(b"data")
+            deferred.callback(None)
+
+        finish_next()
+        finish_next()
+        return result.addCallback(self.assertEqual, "datadata")
+
+    def test_attachment_cache_is_pruned(self):
+        """
+        The least recently used attachments are removed from the cache when
+        its size goes over C{attachment_cache_size}.
+        """
+        self._set_up_attachment_ids()
+        self.plugin.attachment_cache_size = 10
+        cache_dir = self.plugin._get_attachment_cache_dir()
+        self.makeFile("12345", dirname=cache_dir, basename="1")
+        os.utime(os.path.join(cache_dir, "1"), (0, 0))
+        self.makeFile("12345", dirname=cache_dir, basename="2")
+        self.makeFile("12345", dirname=cache_dir, basename="3")
+        self.plugin._prune_attachment_cache()
+        self.assertEqual(["2", "3"], sorted(os.listdir(cache_dir)))
+
+    def test_attachment_cache_keeps_used_attachments(self):
+        """
+        Attachments being copied by script runs, or passed in C{keep}, are
+        never removed from the cache, but still count in its size.
+        """
+        self._set_up_attachment_ids()
+        self.plugin.attachment_cache_size = 10
+        cache_dir = self.plugin._get_attachment_cache_dir()
+        self.makeFile("12345", dirname=cache_dir, basename="1")
+        os.utime(os.path.join(cache_dir, "1"), (0, 0))
+        self.makeFile("12345", dirname=cache_dir, basename="2")
+        os.utime(os.path.join(cache_dir, "2"), (1, 1))
+        self.makeFile("12345", dirname=cache_dir, basename="3")
+        self.plugin._attachments_in_use[os.path.join(cache_dir, "1")] = 1
+        self.plugin._prune_attachment_cache(
+            keep=[os.path.join(cache_dir, "3")])
+        self.assertEqual(["1", "3"], sorted(os.listdir(cache_dir)))
+
+    def test_run_with_attachment_bigger_than_cache(self):
+        """
+        An attachment bigger than C{attachment_cache_size} is still copied
+        for the script, the cache is only pruned afterwards.
+        """
+        self._set_up_attachment_ids()
+        self.plugin.attachment_cache_size = 1
+        patch_fetch = mock.patch(
+            "landscape.client.manager.scriptexecution.fetch_to_file_async",
+            side_effect=fake_fetch_to_file(b"some other data"))
+        patch_fetch.start()
+        self.addCleanup(patch_fetch.stop)
+
+        result = self.plugin.run_script(
+            u"/bin/sh", u"cat $LANDSCAPE_ATTACHMENTS/file1",
+            attachments={u"file1": 14})
+
+        def check(result):
+            self.assertEqual("some other data", result)
+            self.assertEqual({}, self.plugin._attachments_in_use)
+
+        return result.addCallback(check)
+
     def test_self_remove_script(self):
         """
         If a script removes itself, it doesn't create an error when the script
@@ -756,6 +995,71 @@ class ScriptExecutionMessageTests(LandscapeTest):
         result.addCallback(got_result)
         return result
 
+    def test_partial_results(self):
+        """
+        When C{script_output_interval} is set and the server accepts them,
+        the output of a running script is sent periodically as
+        C{partial-operation-result} messages.
+        """
+        self.broker_service.message_store.set_accepted_types(
+            ["operation-result", "partial-operation-result"])
+        self.manager.config.script_output_interval = 10
+        factory = StubProcessFactory()
+        self.manager.add(ScriptExecutionPlugin(process_factory=factory))
+
+        result = self._send_script(sys.executable, "print 'hi'")
+        protocol = factory.spawns[0][0]
+        protocol.childDataReceived(1, b"hi")
+        self.manager.reactor.advance(10)
+        protocol.childDataReceived(1, b" there\n")
+        self.manager.reactor.advance(10)
+        # Nothing new, no message is sent.
+        self.manager.reactor.advance(10)
+        protocol.processEnded(Failure(ProcessDone(0)))
+
+        def got_result(r):
+            self.assertMessages(
+                self.broker_service.message_store.get_pending_messages(),
+                [{"type": "partial-operation-result",
+                  "operation-id": 123,
+                  "sequence": 0,
+                  "result-text": u"hi"},
+                 {"type": "partial-operation-result",
+                  "operation-id": 123,
+                  "sequence": 1,
+                  "result-text": u" there\n"},
+                 {"type": "operation-result",
+                  "operation-id": 123,
+                  "status": SUCCEEDED,
+                  "result-text": u"hi there\n"}])
+
+        return result.addCallback(got_result)
+
+    def test_partial_results_not_accepted(self):
+        """
+        No C{partial-operation-result} message is sent if the server doesn't
+        accept them.
+        """
+        self.manager.config.script_output_interval = 10
+        factory = StubProcessFactory()
+        self.manager.add(ScriptExecutionPlugin(process_factory=factory))
+
+        result = self._send_script(sys.executable, "print 'hi'")
+        protocol = factory.spawns[0][0]
+        protocol.childDataReceived(1, b"hi\n")
+        self.manager.reactor.advance(10)
+        protocol.processEnded(Failure(ProcessDone(0)))
+
+        def got_result(r):
+            self.assertMessages(
+                self.broker_service.message_store.get_pending_messages(),
+                [{"type": "operation-result",
+                  "operation-id": 123,
+                  "status": SUCCEEDED,
+                  "result-text": u"hi\n"}])
+
+        return result.addCallback(got_result)
+
     def test_success_with_server_supplied_env(self):
         """
         When a C{execute-script} message is received from the server, the
@@ -1024,7 +1328,8 @@ class ScriptExecutionMessageTests(LandscapeTest):
         result.addCallback(got_result)
         return result
 
-    @mock.patch("landscape.client.manager.scriptexecution.fetch_async")
+    @mock.patch(
+        "landscape.client.manager.scriptexecution.fetch_to_file_async")
     def test_fetch_attachment_failure(self, mock_fetch):
         """
         If the plugin fails to retrieve the attachments with a
@@ -1055,7 +1360,85 @@ class ScriptExecutionMessageTests(LandscapeTest):
                   "result-code": FETCH_ATTACHMENTS_FAILED_RESULT,
                   "status": FAILED}])
             mock_fetch.assert_called_with(
-                "https://localhost/attachment/14", headers=headers,
-                cainfo=None)
+                "https://localhost/attachment/14", mock.ANY, resume=True,
+                headers=headers, cainfo=None)
 
         return result.addCallback(got_result)
+
+
+class RingBufferTest(LandscapeTest):
+
+    def test_write(self):
+        """L{RingBuffer} keeps the data written to it."""
+        buffer = RingBuffer(10)
+        buffer.write(b"abc")
+        buffer.write(b"def")
+        self.assertEqual(b"abcdef", buffer.getvalue())
+        self.assertEqual(6, len(buffer))
+        self.assertEqual(0, buffer.dropped)
+
+    def test_write_over_size(self):
+        """
+        Only the last C{size} bytes are kept, the number of discarded bytes
+        is tracked in C{dropped}.
+        """
+        buffer = RingBuffer(5)
+        buffer.write(b"abc")
+        buffer.write(b"defg")
+        self.assertEqual(b"cdefg", buffer.getvalue())
+        buffer.write(b"0123456789")
+        self.assertEqual(b"56789", buffer.getvalue())
+        self.assertEqual(12, buffer.dropped)
+
+    def test_clear(self):
+        """L{RingBuffer.clear} empties the buffer and resets C{dropped}."""
+        buffer = RingBuffer(2)
+        buffer.write(b"abc")
+        buffer.clear()
+        self.assertEqual(b"", buffer.getvalue())
+        self.assertEqual(0, buffer.dropped)
+
+
+class StreamingProcessAccumulationProtocolTest(LandscapeTest):
+
+    def setUp(self):
+        super(StreamingProcessAccumulationProtocolTest, self).setUp()
+        self.reactor = FakeReactor()
+        self.reports = []
+        self.protocol = StreamingProcessAccumulationProtocol(
+            self.reactor, 30, lambda *args: self.reports.append(args), 10,
+            "\n**OUTPUT TRUNCATED**")
+
+    def test_report_skipped_output(self):
+        """
+        Output not fitting in the buffer between two reports is dropped and
+        the number of skipped bytes is reported.
+        """
+        self.protocol.childDataReceived(1, b"x" * 40)
+        self.reactor.advance(10)
+        self.assertEqual([(u"x" * 30, 10)], self.reports)
+
+    def test_incomplete_characters(self):
+        """
+        Multi-byte characters split across reports are decoded once
+        complete.
+        """
+        data = u"\N{SNOWMAN}".encode("utf-8")
+        self.protocol.childDataReceived(1, data[:1])
+        self.reactor.advance(10)
+        self.protocol.childDataReceived(1, data[1:])
+        self.reactor.advance(10)
+        self.assertEqual([(u"\N{SNOWMAN}", 0)], self.reports)
+
+    def test_final_result_keeps_tail(self):
+        """
+        The final result only holds the end of the output, marked as
+        truncated, since the beginning has already been reported.
+        """
+        self.protocol.childDataReceived(1, b"a" * 20)
+        self.protocol.childDataReceived(1, b"b" * 20)
+        self.protocol.processEnded(Failure(ProcessDone(0)))
+        data = self.successResultOf(self.protocol.result_deferred)
+        self.assertEqual(u"**OUTPUT TRUNCATED**\n" + u"b" * 9, data)
+        self.assertEqual(30, len(data))
+        self.assertEqual([], self.reactor._calls)
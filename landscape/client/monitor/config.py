@@ -23,6 +23,23 @@ class MonitorConfiguration(Configuration):
                           help="Comma-delimited list of monitor plugins to "
                                "use. ALL means use all plugins.",
                           default="ALL")
+        parser.add_option("--network-activity-include", metavar="PATTERNS",
+                          default="",
+                          help="Comma-delimited list of glob patterns of "
+                               "network interfaces to report the activity "
+                               "of. Default is all interfaces.")
+        parser.add_option("--network-activity-exclude", metavar="PATTERNS",
+                          default="",
+                          help="Comma-delimited list of glob patterns of "
+                               "network interfaces not to report the "
+                               "activity of.")
+        parser.add_option("--network-activity-aggregate", metavar="PATTERNS",
+                          default="",
+                          help="Comma-delimited list of glob patterns of "
+                               "network interfaces whose activity is "
+                               "reported as a whole for each pattern, like "
+                               "'veth*' for short-lived container "
+                               "interfaces. Default is none.")
         return parser
 
     @property
@@ -1,19 +1,37 @@
 import codecs
+import logging
 import time
 import os
+from hashlib import sha1
 
 from landscape.client.accumulate import Accumulator
-from landscape.lib.disk import get_mount_info, is_device_removable
+from landscape.lib.disk import (
+    is_device_removable, parse_mounts, stat_mounts, StatvfsPool)
+from landscape.lib.fs import read_text_file
 from landscape.lib.monitor import CoverageMonitor
 from landscape.client.monitor.plugin import MonitorPlugin
 
 
 class MountInfo(MonitorPlugin):
+    """
+    Report mounted filesystems and their free space.
+
+    C{statvfs} is called from a L{StatvfsPool}, so that a hung mount only
+    delays a run by C{statvfs_timeout} seconds once. No free space is
+    recorded for a mount point until its C{statvfs} completes again, and
+    mount points whose C{statvfs} takes C{slow_statvfs} seconds or more are
+    logged with how long it took.
+
+    The list of local mount points is only rebuilt when the content of
+    the mount table or of C{/etc/mtab} changes.
+    """
 
     persist_name = "mount-info"
     scope = "disk"
 
     max_free_space_items_to_exchange = 200
+    statvfs_timeout = 5
+    slow_statvfs = 1
 
     def __init__(self, interval=300, monitor_interval=60 * 60,
                  mounts_file="/proc/mounts", create_time=time.time,
@@ -25,11 +43,14 @@ class MountInfo(MonitorPlugin):
         self._mtab_file = mtab_file
         if statvfs is None:
             statvfs = os.statvfs
-        self._statvfs = statvfs
+        self._statvfs = StatvfsPool(statvfs, timeout=self.statvfs_timeout)
         self._create_time = create_time
         self._free_space = []
         self._mount_info = []
+        self._pending_mount_info = set()
         self._mount_info_to_persist = None
+        self._mount_tables_digest = None
+        self._local_mounts = []
         self.is_device_removable = is_device_removable
 
     def register(self, registry):
@@ -54,6 +75,7 @@ class MountInfo(MonitorPlugin):
             message = {"type": "mount-info", "mount-info": self._mount_info}
             self._mount_info_to_persist = self._mount_info[:]
             self._mount_info = []
+            self._pending_mount_info.clear()
             return message
         return None
 
@@ -98,7 +120,11 @@ class MountInfo(MonitorPlugin):
             free_space = mount_info.pop("free-space")
 
             key = ("accumulate-free-space", mount_point)
-            step_data = self._accumulate(now, free_space, key)
+            if mount_point in self._statvfs.stale:
+                # Don't report the last known value as the current one.
+                step_data = None
+            else:
+                step_data = self._accumulate(now, free_space, key)
             if step_data:
                 timestamp = step_data[0]
                 free_space = int(step_data[1])
@@ -106,37 +132,64 @@ class MountInfo(MonitorPlugin):
 
             prev_mount_info = self._persist.get(("mount-info", mount_point))
             if not prev_mount_info or prev_mount_info != mount_info:
-                if mount_info not in [m for t, m in self._mount_info]:
+                key = tuple(sorted(mount_info.items()))
+                if key not in self._pending_mount_info:
+                    self._pending_mount_info.add(key)
                     self._mount_info.append((now, mount_info))
 
             current_mount_points.add(mount_point)
 
+        for mount_point in sorted(current_mount_points):
+            latency = self._statvfs.latencies.get(mount_point, 0)
+            if (latency >= self.slow_statvfs and
+                    mount_point not in self._statvfs.stale):
+                logging.info("statvfs on %s took %.2f seconds."
+                             % (mount_point, latency))
+
     def _get_mount_info(self):
         """Generator yields local mount points worth recording data for."""
-        bound_mount_points = self._get_bound_mount_points()
-
-        for info in get_mount_info(self._mounts_file, self._statvfs):
-            device = info["device"]
-            mount_point = info["mount-point"]
-            if (device.startswith("/dev/") and
-                not mount_point.startswith("/dev/") and
-                not self.is_device_removable(device) and
-                mount_point not in bound_mount_points
-                ):
-
-                yield info
+        return stat_mounts(self._get_local_mounts(), self._statvfs)
 
-    def _get_bound_mount_points(self):
+    def _get_local_mounts(self):
+        """
+        Return the C{(device, mount_point, filesystem)} tuples of the local
+        mount points, parsing the mount tables again only if they changed.
+        """
+        mounts = read_text_file(self._mounts_file)
+        mtab = ""
+        if self._mtab_file and os.path.isfile(self._mtab_file):
+            mtab = read_text_file(self._mtab_file)
+        digest = sha1(mounts.encode("utf-8"))
+        digest.update(mtab.encode("utf-8"))
+        digest = digest.digest()
+        if digest == self._mount_tables_digest:
+            return self._local_mounts
+
+        bound_mount_points = self._get_bound_mount_points(mtab)
+        removable = {}
+        local_mounts = []
+        for device, mount_point, filesystem in parse_mounts(
+                mounts.splitlines()):
+            if (not device.startswith("/dev/") or
+                    mount_point.startswith("/dev/") or
+                    mount_point in bound_mount_points):
+                continue
+            # Many mount points can share a device, only check it once.
+            if device not in removable:
+                removable[device] = self.is_device_removable(device)
+            if not removable[device]:
+                local_mounts.append((device, mount_point, filesystem))
+        self._local_mounts = local_mounts
+        self._mount_tables_digest = digest
+        return local_mounts
+
+    def _get_bound_mount_points(self, mtab):
         """
         Returns a set of mount points that have the "bind" option
-        by parsing /etc/mtab.
+        by parsing the content of /etc/mtab.
         """
         bound_points = set()
-        if not self._mtab_file or not os.path.isfile(self._mtab_file):
-            return bound_points
-
-        file = open(self._mtab_file, "r")
-        for line in file:
+        for line in mtab.splitlines():
             try:
                 device, mount_point, filesystem, options = line.split()[:4]
                 mount_point = codecs.decode(mount_point, "unicode_escape")
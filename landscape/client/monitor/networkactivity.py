@@ -4,9 +4,10 @@ with the inbound/outbound traffic per interface per step interval.
 """
 
 import time
+from fnmatch import fnmatchcase
 
 from landscape.lib.network import get_network_traffic, is_64
-from landscape.client.accumulate import Accumulator
+from landscape.client.accumulate import accumulate
 
 from landscape.client.monitor.plugin import MonitorPlugin
 
@@ -14,6 +15,17 @@ from landscape.client.monitor.plugin import MonitorPlugin
 class NetworkActivity(MonitorPlugin):
     """
     Collect data regarding a machine's network activity.
+
+    The accumulated traffic of all interfaces is kept in a single
+    C{interfaces} table of the persist, mapping interface names to
+    C{(timestamp, accumulated out, accumulated in)} tuples, and interfaces
+    that had no traffic for C{interface_expiry} seconds are dropped from it.
+
+    Interfaces can be selected with the C{network_activity_include} and
+    C{network_activity_exclude} glob patterns of the configuration. The
+    traffic of interfaces matching one of the C{network_activity_aggregate}
+    patterns, like short-lived container interfaces, is summed up and
+    reported under the pattern itself.
     """
 
     message_type = "network-activity"
@@ -23,6 +35,7 @@ class NetworkActivity(MonitorPlugin):
     scope = "network"
 
     max_network_items_to_exchange = 200
+    interface_expiry = 60 * 60
 
     def __init__(self, network_activity_file="/proc/net/dev",
                  create_time=time.time):
@@ -38,25 +51,35 @@ class NetworkActivity(MonitorPlugin):
 
     def register(self, registry):
         super(NetworkActivity, self).register(registry)
-        self._accumulate = Accumulator(self._persist, self.registry.step_size)
+        config = registry.config
+        self._include = _split_patterns(config.network_activity_include)
+        self._exclude = _split_patterns(config.network_activity_exclude)
+        self._aggregate = _split_patterns(config.network_activity_aggregate)
+        # Older versions kept two accumulator keys per interface.
+        for key in list(self._persist.keys(())):
+            if key.startswith("delta-"):
+                self._persist.remove((key,))
         self.call_on_accepted("network-activity", self.exchange, True)
 
     def create_message(self):
         network_activity = {}
         items = 0
         for interface, data in list(self._network_activity.items()):
-            if data:
-                # The message schema requires the interface to be bytes, so we
-                # encode it here right before the message is created as it is
-                # used as string in other places.
-                interface = interface.encode("ascii")
-                network_activity[interface] = []
-                while data and items < self.max_network_items_to_exchange:
-                    item = data.pop(0)
-                    network_activity[interface].append(item)
-                    items += 1
-                if items >= self.max_network_items_to_exchange:
-                    break
+            if not data:
+                # Don't keep entries for interfaces that went away.
+                del self._network_activity[interface]
+                continue
+            # The message schema requires the interface to be bytes, so we
+            # encode it here right before the message is created as it is
+            # used as string in other places.
+            interface = interface.encode("ascii")
+            network_activity[interface] = []
+            while data and items < self.max_network_items_to_exchange:
+                item = data.pop(0)
+                network_activity[interface].append(item)
+                items += 1
+            if items >= self.max_network_items_to_exchange:
+                break
         if not network_activity:
             return
         return {"type": "network-activity", "activities": network_activity}
@@ -105,6 +128,20 @@ class NetworkActivity(MonitorPlugin):
             if interface not in new_traffic:
                 del self._last_activity[interface]
 
+    def _get_bucket(self, interface):
+        """
+        Return the name to report the traffic of C{interface} under, or
+        C{None} if it's filtered out.
+        """
+        if self._include and not _matches(interface, self._include):
+            return None
+        if _matches(interface, self._exclude):
+            return None
+        for pattern in self._aggregate:
+            if fnmatchcase(interface, pattern):
+                return pattern
+        return interface
+
     def run(self):
         """
         Sample network traffic statistics and store them into the
@@ -112,12 +149,26 @@ class NetworkActivity(MonitorPlugin):
         """
         new_timestamp = int(self._create_time())
         new_traffic = get_network_traffic(self._source_file)
+        deltas = {}
         for interface, delta_out, delta_in in self._traffic_delta(new_traffic):
-            out_step_data = self._accumulate(
-                new_timestamp, delta_out, "delta-out-%s" % interface)
-
-            in_step_data = self._accumulate(
-                new_timestamp, delta_in, "delta-in-%s" % interface)
+            bucket = self._get_bucket(interface)
+            if bucket is None:
+                continue
+            bucket_out, bucket_in = deltas.get(bucket, (0, 0))
+            deltas[bucket] = (bucket_out + delta_out, bucket_in + delta_in)
+
+        step_size = self.registry.step_size
+        interfaces = self._persist.get("interfaces", {})
+        for interface, (delta_out, delta_in) in deltas.items():
+            timestamp, accumulated_out, accumulated_in = interfaces.get(
+                interface, (0, 0, 0))
+            accumulated_out, out_step_data = accumulate(
+                timestamp, accumulated_out, new_timestamp, delta_out,
+                step_size)
+            accumulated_in, in_step_data = accumulate(
+                timestamp, accumulated_in, new_timestamp, delta_in, step_size)
+            interfaces[interface] = (
+                new_timestamp, accumulated_out, accumulated_in)
 
             # there's only data when we cross a step boundary
             if not (in_step_data and out_step_data):
@@ -126,3 +177,22 @@ class NetworkActivity(MonitorPlugin):
             steps = self._network_activity.setdefault(interface, [])
             steps.append(
                 (in_step_data[0], int(in_step_data[1]), int(out_step_data[1])))
+
+        for interface, (timestamp, _, _) in list(interfaces.items()):
+            if new_timestamp - timestamp > self.interface_expiry:
+                del interfaces[interface]
+        self._persist.set("interfaces", interfaces)
+
+
+def _split_patterns(patterns):
+    """Split a comma-separated list of glob patterns."""
+    return [pattern.strip() for pattern in (patterns or "").split(",")
+            if pattern.strip()]
+
+
+def _matches(interface, patterns):
+    """Return whether C{interface} matches any of the glob C{patterns}."""
+    for pattern in patterns:
+        if fnmatchcase(interface, pattern):
+            return True
+    return False
@@ -5,10 +5,15 @@ from twisted.internet.utils import getProcessOutput
 
 from landscape.lib.apt.package.store import PackageStore
 from landscape.lib.encoding import encode_values
+from landscape.lib.store import ConnectionPool
 from landscape.client.package.reporter import find_reporter_command
 from landscape.client.monitor.plugin import MonitorPlugin
 
 
+# The connections to the package stores of clones sharing package data.
+clone_connections = ConnectionPool()
+
+
 class PackageMonitor(MonitorPlugin):
 
     run_interval = 1800
@@ -34,7 +39,8 @@ class PackageMonitor(MonitorPlugin):
         if not self._package_store:
             filename = os.path.join(registry.config.data_path,
                                     "package/database")
-            self._package_store = PackageStore(filename)
+            self._package_store = PackageStore(
+                filename, self._get_connection_pool())
 
         registry.register_message("package-ids",
                                   self._enqueue_message_as_reporter_task)
@@ -56,6 +62,16 @@ class PackageMonitor(MonitorPlugin):
         if "packages" in message_types:
             self.spawn_reporter()
 
+    def _get_connection_pool(self):
+        """
+        Return the pool to get package store connections from, for clones
+        sharing package data.
+        """
+        if (self.config.clones and self.config.is_clone and
+                self.config.clones_share_package_data):
+            return clone_connections
+        return None
+
     def _run_fake_reporter(self, args):
         """Run a fake-reporter in-process."""
 
@@ -85,12 +101,15 @@ class PackageMonitor(MonitorPlugin):
             package_config = PackageReporterConfiguration()
             package_config.load(args + ["-d", self.config.data_path,
                                         "-l", self.config.log_dir])
-            package_store = FakePackageStore(package_config.store_filename)
+            package_store = FakePackageStore(package_config.store_filename,
+                                             self._get_connection_pool())
             self._fake_reporter = FakeReporter(package_store, package_facade,
                                                self.registry.broker,
                                                package_config)
             self._fake_reporter.global_store_filename = os.path.join(
                 self.config.master_data_path, "package", "database")
+            self._fake_reporter.share_package_data = (
+                self.config.clones_share_package_data)
             self._fake_reporter_running = False
 
         if self._fake_reporter_running:
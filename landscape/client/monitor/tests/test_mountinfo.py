@@ -1,6 +1,7 @@
 import mock
 import os
 import tempfile
+import threading
 
 from twisted.python.compat import StringType as basestring
 from twisted.python.compat import long
@@ -336,6 +337,45 @@ addr=ennui 0 0
         message = plugin.create_mount_info_message()
         self.assertEqual(message, None)
 
+    def test_mount_tables_parsed_once(self):
+        """
+        The mount tables are only parsed again, and removable devices
+        checked again, when their content changes.
+        """
+        mounts_file = self.makeFile("/dev/hda1 / ext3 rw 0 0\n")
+        plugin = self.get_mount_info(mounts_file=mounts_file)
+        devices = []
+        plugin.is_device_removable = lambda device: devices.append(device)
+        self.monitor.add(plugin)
+        plugin.run()
+        plugin.run()
+        self.assertEqual(["/dev/hda1"], devices)
+
+        self.makeFile("/dev/hda1 / ext3 rw 0 0\n/dev/hda2 /mnt ext3 rw 0 0\n",
+                      path=mounts_file)
+        plugin.run()
+        self.assertEqual(["/dev/hda1", "/dev/hda1", "/dev/hda2"], devices)
+        message = plugin.create_mount_info_message()
+        self.assertEqual(
+            ["/", "/mnt"],
+            [info["mount-point"] for now, info in message["mount-info"]])
+
+    def test_removable_checked_once_per_device(self):
+        """
+        Devices mounted on many mount points are checked only once for
+        being removable.
+        """
+        mounts_file = self.makeFile("/dev/hda1 /a ext3 rw 0 0\n"
+                                    "/dev/hda1 /b ext3 rw 0 0\n")
+        plugin = self.get_mount_info(mounts_file=mounts_file)
+        devices = []
+        plugin.is_device_removable = lambda device: devices.append(device)
+        self.monitor.add(plugin)
+        plugin.run()
+        self.assertEqual(["/dev/hda1"], devices)
+        message = plugin.create_mount_info_message()
+        self.assertEqual(2, len(message["mount-info"]))
+
     def test_sample_free_space(self):
         """Test collecting information about free space."""
         counter = mock_counter(1)
@@ -358,6 +398,46 @@ addr=ennui 0 0
         self.assertEqual(len(free_space), 1)
         self.assertEqual(free_space[0], (step_size, "/", 409600))
 
+    def test_skip_free_space_of_hung_mounts(self):
+        """
+        If C{statvfs} on a mount point doesn't complete in time, no free
+        space is recorded for it, instead of its last known value.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def statvfs(path):
+            calls.append(path)
+            if len(calls) > 1:
+                release.wait()
+            return statvfs_result_fixture(path)
+
+        plugin = self.get_mount_info(
+            statvfs=statvfs, create_time=self.reactor.time)
+        plugin._statvfs.timeout = 0.01
+        step_size = self.monitor.step_size
+        self.monitor.add(plugin)
+
+        self.reactor.advance(step_size)
+        self.reactor.advance(step_size)
+
+        message = plugin.create_free_space_message()
+        self.assertEqual([(step_size, "/", 409600)], message["free-space"])
+        self.assertEqual(set(["/"]), plugin._statvfs.stale)
+        self.log_helper.ignore_errors("statvfs on / didn't complete")
+
+    def test_log_slow_statvfs(self):
+        """
+        Mount points whose C{statvfs} took C{slow_statvfs} seconds or more
+        are logged with how long it took.
+        """
+        plugin = self.get_mount_info(create_time=self.reactor.time)
+        plugin.slow_statvfs = 0
+        self.monitor.add(plugin)
+        self.reactor.advance(self.monitor.step_size)
+        self.assertIn("statvfs on / took", self.logfile.getvalue())
+
     def test_never_exchange_empty_messages(self):
         """
         When the plugin has no data, it's various create_X_message()
@@ -218,3 +218,96 @@ Inter-|   Receive                           |  Transmit
         message = self.plugin.create_message()
         items = sum(len(i) for i in message["activities"].values())
         self.assertEqual(8, items)
+
+    def test_interface_table(self):
+        """
+        The accumulated traffic of all interfaces is kept in a single
+        table, and the keys used by older versions are removed.
+        """
+        self.monitor.persist.set("network-activity.delta-in-eth0", (1, 2))
+        plugin = NetworkActivity(
+            network_activity_file=self.activity_file.name,
+            create_time=self.reactor.time)
+        self.monitor.add(plugin)
+        self.assertEqual([], plugin.persist.keys(()))
+        plugin.run()
+        self.reactor.advance(10)
+        self.write_activity(eth0_in=500, eth0_out=1000)
+        plugin.run()
+        self.assertEqual(
+            {"eth0": (10, 10000, 5000)}, plugin.persist.get("interfaces"))
+
+    def test_expire_vanished_interfaces(self):
+        """
+        Interfaces without traffic for C{interface_expiry} seconds are
+        dropped from the table.
+        """
+        self.write_activity(extra="veth0: 0 0 0 0 0 0 0 0 0")
+        self.plugin.run()
+        self.reactor.advance(10)
+        self.write_activity(extra="veth0: 100 0 0 0 100 0 0 0 0")
+        self.plugin.run()
+        self.assertIn("veth0", self.plugin.persist.get("interfaces"))
+        self.write_activity()
+        self.reactor.advance(self.plugin.interface_expiry + 1)
+        self.write_activity(eth0_in=100)
+        self.plugin.run()
+        self.assertEqual(["eth0"],
+                         list(self.plugin.persist.get("interfaces")))
+
+    def test_include_exclude(self):
+        """
+        Only interfaces matching the include patterns, and not matching
+        the exclude patterns, are reported.
+        """
+        self.config.network_activity_include = "eth*, wlan*"
+        self.config.network_activity_exclude = "eth1"
+        plugin = NetworkActivity(
+            network_activity_file=self.activity_file.name,
+            create_time=self.reactor.time)
+        self.monitor.add(plugin)
+        extra = "eth1: %d 0 0 0 %d 0 0 0 0\n    wlan0: %d 0 0 0 %d 0 0 0 0"
+        self.write_activity(extra=extra % (0, 0, 0, 0))
+        plugin.run()
+        self.reactor.advance(self.monitor.step_size)
+        self.write_activity(lo_out=1000, eth0_out=1000,
+                            extra=extra % (0, 1000, 0, 1000))
+        plugin.run()
+        message = plugin.create_message()
+        self.assertEqual([b"eth0", b"wlan0"],
+                         sorted(message["activities"]))
+
+    def test_aggregate(self):
+        """
+        The traffic of interfaces matching an aggregate pattern is reported
+        as a whole under the pattern.
+        """
+        self.config.network_activity_aggregate = "veth*"
+        plugin = NetworkActivity(
+            network_activity_file=self.activity_file.name,
+            create_time=self.reactor.time)
+        self.monitor.add(plugin)
+        extra = "veth1: %d 0 0 0 %d 0 0 0 0\n    veth2: %d 0 0 0 %d 0 0 0 0"
+        self.write_activity(extra=extra % (0, 0, 0, 0))
+        plugin.run()
+        self.reactor.advance(self.monitor.step_size)
+        self.write_activity(extra=extra % (100, 1000, 200, 2000))
+        plugin.run()
+        message = plugin.create_message()
+        step_size = self.monitor.step_size
+        self.assertEqual({b"veth*": [(step_size, 300, 3000)]},
+                         message["activities"])
+
+    def test_no_aggregate_by_default(self):
+        """
+        By default, no interfaces are aggregated, each one is reported on
+        its own.
+        """
+        extra = "veth1: %d 0 0 0 %d 0 0 0 0\n    veth2: %d 0 0 0 %d 0 0 0 0"
+        self.write_activity(extra=extra % (0, 0, 0, 0))
+        self.plugin.run()
+        self.reactor.advance(self.monitor.step_size)
+        self.write_activity(extra=extra % (100, 1000, 200, 2000))
+        self.plugin.run()
+        message = self.plugin.create_message()
+        self.assertEqual([b"veth1", b"veth2"], sorted(message["activities"]))
@@ -9,18 +9,25 @@ import os
 import glob
 import apt_pkg
 import re
+from array import array
 
 from twisted.internet.defer import (
-    Deferred, succeed, inlineCallbacks, returnValue)
+    Deferred, succeed, inlineCallbacks, maybeDeferred, returnValue)
 
 from landscape.lib import bpickle
+from landscape.lib.apt.package.facade import (
+    PACKAGE_INSTALLED, PACKAGE_AVAILABLE, PACKAGE_UPGRADE, PACKAGE_LOCKED,
+    PACKAGE_AUTOREMOVABLE, PACKAGE_SECURITY)
 from landscape.lib.apt.package.store import (
-        UnknownHashIDRequest, FakePackageStore)
+        UnknownHashIDRequest, FakePackageStore, get_shared_fake_package_store,
+        HashIdStore, InvalidHashIdDelta, read_hash_id_delta)
 from landscape.lib.config import get_bindir
+from landscape.lib.idset import IdSet
 from landscape.lib.sequenceranges import sequence_to_ranges
 from landscape.lib.twisted_util import gather_results, spawn_process
-from landscape.lib.fetch import fetch_async
-from landscape.lib.fs import touch_file, create_binary_file
+from landscape.lib.fetch import (
+    fetch_async, fetch_to_file_async, FetchError, HTTPCodeError)
+from landscape.lib.fs import touch_file
 from landscape.lib.lsb_release import parse_lsb_release, LSB_RELEASE_FILENAME
 from landscape.client.package.taskhandler import (
     PackageTaskHandlerConfiguration, PackageTaskHandler, run_task_handler)
@@ -50,6 +57,16 @@ class PackageReporterConfiguration(PackageTaskHandlerConfiguration):
                           help="The URL of the HTTP proxy, if one is needed.")
         parser.add_option("--https-proxy", metavar="URL",
                           help="The URL of the HTTPS proxy, if one is needed.")
+        parser.add_option("--hash-id-db-deltas", default=False,
+                          action="store_true",
+                          help="Keep the hash=>id database up to date with "
+                               "the deltas published by the server.")
+        parser.add_option("--skeleton-hash-processes", type="int",
+                          default=0, metavar="N",
+                          help="Compute the hashes of the packages in N "
+                               "processes, parsing the package index "
+                               "files directly. 0 computes them in the "
+                               "reporter itself (default: 0).")
         return parser
 
 
@@ -69,6 +86,8 @@ class PackageReporter(PackageTaskHandler):
 
     def run(self):
         self._got_task = False
+        if self._config.skeleton_hash_processes:
+            self._facade.hash_processes = self._config.skeleton_hash_processes
 
         result = Deferred()
         # Set us up to communicate properly
@@ -79,6 +98,9 @@ class PackageReporter(PackageTaskHandler):
         # If the appropriate hash=>id db is not there, fetch it
         result.addCallback(lambda x: self.fetch_hash_id_db())
 
+        # Bring it up to date, if the server publishes deltas
+        result.addCallback(lambda x: self.update_hash_id_db())
+
         # Attach the hash=>id database if available
         result.addCallback(lambda x: self.use_hash_id_db())
 
@@ -134,8 +156,7 @@ class PackageReporter(PackageTaskHandler):
             # Cast to str as pycurl doesn't like unicode
             url = str(base_url + os.path.basename(hash_id_db_filename))
 
-            def fetch_ok(data):
-                create_binary_file(hash_id_db_filename, data)
+            def fetch_ok(ignored):
                 logging.info("Downloaded hash=>id database from %s" % url)
 
             def fetch_error(failure):
@@ -143,14 +164,11 @@ class PackageReporter(PackageTaskHandler):
                 logging.warning("Couldn't download hash=>id database: %s" %
                                 str(exception))
 
-            if url.startswith("https"):
-                proxy = self._config.get("https_proxy")
-            else:
-                proxy = self._config.get("http_proxy")
-
-            result = fetch_async(url,
-                                 cainfo=self._config.get("ssl_public_key"),
-                                 proxy=proxy)
+            # The database is streamed to disk, and only shows up under its
+            # final name once complete.
+            result = maybeDeferred(
+                fetch_to_file_async, url, hash_id_db_filename,
+                **self._get_fetch_options(url))
             result.addCallback(fetch_ok)
             result.addErrback(fetch_error)
 
@@ -160,6 +178,90 @@ class PackageReporter(PackageTaskHandler):
         result.addCallback(fetch_it)
         return result
 
+    @inlineCallbacks
+    def update_hash_id_db(self):
+        """
+        Apply the deltas published by the server to the pre-canned hash=>id
+        database, if the C{hash_id_db_deltas} option is set.
+
+        The deltas available for the <uuid>_<codename>_<arch> database are
+        listed in <uuid>_<codename>_<arch>.deltas, next to it, with one
+        "<from-version> <to-version> <sha256>" line per delta. Each delta is
+        a file named <uuid>_<codename>_<arch>.<from-version>-<to-version>.gz,
+        in the format read by L{read_hash_id_delta}.
+
+        Starting from the version of the database, the delta going to the
+        most recent version is applied, until none applies. Each delta is
+        applied in place, in a single transaction, so failures leave the
+        database at the version of the last applied delta.
+        """
+        if not self._config.get("hash_id_db_deltas"):
+            return
+
+        hash_id_db_filename = yield self._determine_hash_id_db_filename()
+        if (hash_id_db_filename is None or
+                not os.path.exists(hash_id_db_filename)):
+            return
+
+        base_url = self._get_hash_id_db_base_url()
+        if not base_url:
+            return
+
+        # Cast to str as pycurl doesn't like unicode
+        prefix = str(base_url + os.path.basename(hash_id_db_filename))
+        options = self._get_fetch_options(prefix)
+        try:
+            index = yield fetch_async(prefix + ".deltas", **options)
+        except FetchError as error:
+            if isinstance(error, HTTPCodeError) and error.http_code == 404:
+                logging.debug("No hash=>id database deltas available")
+                return
+            logging.warning("Couldn't download hash=>id database deltas: %s"
+                            % str(error))
+            return
+
+        deltas = {}
+        for line in index.decode("ascii", "replace").splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[0].isdigit() and (
+                    fields[1].isdigit()):
+                deltas.setdefault(int(fields[0]), []).append(
+                    (int(fields[1]), fields[2]))
+
+        store = HashIdStore(hash_id_db_filename)
+        initial_version = version = store.get_version()
+        delta_filename = hash_id_db_filename + ".delta"
+        while version in deltas:
+            to_version, sha256 = max(deltas.pop(version))
+            if to_version <= version:
+                break
+            url = "%s.%d-%d.gz" % (prefix, version, to_version)
+            try:
+                yield fetch_to_file_async(url, delta_filename, sha256=sha256,
+                                          **options)
+                store.apply_delta(version, to_version,
+                                  read_hash_id_delta(delta_filename))
+            except (FetchError, InvalidHashIdDelta, IOError, OSError) as e:
+                logging.warning("Couldn't update hash=>id database from %s: "
+                                "%s" % (url, str(e)))
+                break
+            finally:
+                if os.path.exists(delta_filename):
+                    os.remove(delta_filename)
+            version = to_version
+
+        if version != initial_version:
+            logging.info("Updated hash=>id database from version %d to %d" %
+                         (initial_version, version))
+
+    def _get_fetch_options(self, url):
+        """Return the options to pass to L{fetch} for C{url}."""
+        if url.startswith("https"):
+            proxy = self._config.get("https_proxy")
+        else:
+            proxy = self._config.get("http_proxy")
+        return {"cainfo": self._config.get("ssl_public_key"), "proxy": proxy}
+
     def _get_hash_id_db_base_url(self):
 
         base_url = self._config.get("package_hash_id_url")
@@ -620,68 +722,55 @@ class PackageReporter(PackageTaskHandler):
         """
         self._facade.ensure_channels_reloaded()
 
-        old_installed = set(self._store.get_installed())
-        old_available = set(self._store.get_available())
-        old_upgrades = set(self._store.get_available_upgrades())
-        old_locked = set(self._store.get_locked())
-        old_autoremovable = set(self._store.get_autoremovable())
-        old_security = set(self._store.get_security())
-
-        current_installed = set()
-        current_available = set()
-        current_upgrades = set()
-        current_locked = set()
-        current_autoremovable = set()
-        current_security = set()
-        lsb = parse_lsb_release(LSB_RELEASE_FILENAME)
-        backports_archive = "{}-backports".format(lsb["code-name"])
-        security_archive = "{}-security".format(lsb["code-name"])
+        old_state = self._store.get_package_state()
+        old_installed = old_state["installed"]
+        old_available = old_state["available"]
+        old_upgrades = old_state["available_upgrade"]
+        old_locked = old_state["locked"]
+        old_autoremovable = old_state["autoremovable"]
+        old_security = old_state["security"]
 
-        for package in self._facade.get_packages():
-            # Don't include package versions from the official backports
-            # archive. The backports archive is enabled by default since
-            # xenial with a pinning policy of 100. Ideally we would
-            # support pinning, but we don't yet. In the mean time, we
-            # ignore backports, so that packages don't get automatically
-            # upgraded to the backports version.
-            backport_origins = [
-                origin for origin in package.origins
-                if origin.archive == backports_archive]
-            if backport_origins and (
-                    len(backport_origins) == len(package.origins)):
-                # Ignore the version if it's only in the official
-                # backports archive. If it's somewhere else as well,
-                # e.g. a PPA, we assume it was added manually and the
-                # user wants to get updates from it.
-                continue
-            hash = self._facade.get_package_hash(package)
-            id = self._store.get_hash_id(hash)
-            if id is not None:
-                if self._facade.is_package_installed(package):
-                    current_installed.add(id)
-                    if self._facade.is_package_available(package):
-                        current_available.add(id)
-                    if self._facade.is_package_autoremovable(package):
-                        current_autoremovable.add(id)
-                else:
-                    current_available.add(id)
-
-                # Are there any packages that this package is an upgrade for?
-                if self._facade.is_package_upgrade(package):
-                    current_upgrades.add(id)
-
-                # Is this package present in the security pocket?
-                security_origins = any(
-                    origin for origin in package.origins
-                    if origin.archive == security_archive)
-                if security_origins:
-                    current_security.add(id)
-
-        for package in self._facade.get_locked_packages():
-            hash = self._facade.get_package_hash(package)
-            id = self._store.get_hash_id(hash)
-            if id is not None:
-                current_locked.add(id)
+        lsb = parse_lsb_release(LSB_RELEASE_FILENAME)
+        # Don't include package versions from the official backports
+        # archive. The backports archive is enabled by default since
+        # xenial with a pinning policy of 100. Ideally we would
+        # support pinning, but we don't yet. In the mean time, we
+        # ignore backports, so that packages don't get automatically
+        # upgraded to the backports version. Versions which are also
+        # somewhere else, e.g. a PPA, are kept, since we assume it was
+        # added manually and the user wants to get updates from it.
+        ids, flags = self._facade.classify_packages(
+            self._store.get_hash_id,
+            security_archive="{}-security".format(lsb["code-name"]),
+            backports_archive="{}-backports".format(lsb["code-name"]))
+
+        # Split the ids by flag, to turn them into IdSets.
+        current_installed = array("l")
+        current_available = array("l")
+        current_upgrades = array("l")
+        current_locked = array("l")
+        current_autoremovable = array("l")
+        current_security = array("l")
+        for id, version_flags in zip(ids, flags):
+            if version_flags & PACKAGE_INSTALLED:
+                current_installed.append(id)
+            if version_flags & PACKAGE_AVAILABLE:
+                current_available.append(id)
+            if version_flags & PACKAGE_UPGRADE:
+                current_upgrades.append(id)
+            if version_flags & PACKAGE_LOCKED:
+                current_locked.append(id)
+            if version_flags & PACKAGE_AUTOREMOVABLE:
+                current_autoremovable.append(id)
+            if version_flags & PACKAGE_SECURITY:
+                current_security.append(id)
+
+        current_installed = IdSet(current_installed)
+        current_available = IdSet(current_available)
+        current_upgrades = IdSet(current_upgrades)
+        current_locked = IdSet(current_locked)
+        current_autoremovable = IdSet(current_autoremovable)
+        current_security = IdSet(current_security)
 
         new_installed = current_installed - old_installed
         new_available = current_available - old_available
@@ -700,43 +789,43 @@ class PackageReporter(PackageTaskHandler):
         message = {}
         if new_installed:
             message["installed"] = \
-                list(sequence_to_ranges(sorted(new_installed)))
+                list(sequence_to_ranges(new_installed))
         if new_available:
             message["available"] = \
-                list(sequence_to_ranges(sorted(new_available)))
+                list(sequence_to_ranges(new_available))
         if new_upgrades:
             message["available-upgrades"] = \
-                list(sequence_to_ranges(sorted(new_upgrades)))
+                list(sequence_to_ranges(new_upgrades))
         if new_locked:
             message["locked"] = \
-                list(sequence_to_ranges(sorted(new_locked)))
+                list(sequence_to_ranges(new_locked))
 
         if new_autoremovable:
             message["autoremovable"] = list(
-                sequence_to_ranges(sorted(new_autoremovable)))
+                sequence_to_ranges(new_autoremovable))
         if not_autoremovable:
             message["not-autoremovable"] = list(
-                sequence_to_ranges(sorted(not_autoremovable)))
+                sequence_to_ranges(not_autoremovable))
 
         if new_security:
             message["security"] = list(
-                sequence_to_ranges(sorted(new_security)))
+                sequence_to_ranges(new_security))
         if not_security:
             message["not-security"] = list(
-                sequence_to_ranges(sorted(not_security)))
+                sequence_to_ranges(not_security))
 
         if not_installed:
             message["not-installed"] = \
-                list(sequence_to_ranges(sorted(not_installed)))
+                list(sequence_to_ranges(not_installed))
         if not_available:
             message["not-available"] = \
-                list(sequence_to_ranges(sorted(not_available)))
+                list(sequence_to_ranges(not_available))
         if not_upgrades:
             message["not-available-upgrades"] = \
-                list(sequence_to_ranges(sorted(not_upgrades)))
+                list(sequence_to_ranges(not_upgrades))
         if not_locked:
             message["not-locked"] = \
-                list(sequence_to_ranges(sorted(not_locked)))
+                list(sequence_to_ranges(not_locked))
 
         if not message:
             return succeed(False)
@@ -765,30 +854,19 @@ class PackageReporter(PackageTaskHandler):
                 not_security=len(not_security)))
 
         def update_currently_known(result):
-            if new_installed:
-                self._store.add_installed(new_installed)
-            if not_installed:
-                self._store.remove_installed(not_installed)
-            if new_available:
-                self._store.add_available(new_available)
-            if new_locked:
-                self._store.add_locked(new_locked)
-            if new_autoremovable:
-                self._store.add_autoremovable(new_autoremovable)
-            if not_available:
-                self._store.remove_available(not_available)
-            if new_upgrades:
-                self._store.add_available_upgrades(new_upgrades)
-            if not_upgrades:
-                self._store.remove_available_upgrades(not_upgrades)
-            if not_locked:
-                self._store.remove_locked(not_locked)
-            if not_autoremovable:
-                self._store.remove_autoremovable(not_autoremovable)
-            if new_security:
-                self._store.add_security(new_security)
-            if not_security:
-                self._store.remove_security(not_security)
+            self._store.apply_package_changes(
+                added={"installed": new_installed,
+                       "available": new_available,
+                       "available_upgrade": new_upgrades,
+                       "locked": new_locked,
+                       "autoremovable": new_autoremovable,
+                       "security": new_security},
+                removed={"installed": not_installed,
+                         "available": not_available,
+                         "available_upgrade": not_upgrades,
+                         "locked": not_locked,
+                         "autoremovable": not_autoremovable,
+                         "security": not_security})
             # Something has changed wrt the former run, let's update the
             # timestamp and return True.
             stamp_file = self._config.detect_package_changes_stamp
@@ -817,18 +895,24 @@ class FakeReporter(PackageReporter):
     """
     A fake reporter which only sends messages previously stored by a
     L{FakeGlobalReporter}.
+
+    @cvar share_package_data: Whether to read the global store through the
+        L{SharedFakePackageStore} of the process, and to rely on the
+        hash=>id database fetched by the global reporter.
     """
 
     package_store_class = FakePackageStore
     global_store_filename = None
+    share_package_data = False
 
     def run(self):
         result = succeed(None)
 
         result.addCallback(lambda x: self.get_session_id())
 
-        # If the appropriate hash=>id db is not there, fetch it
-        result.addCallback(lambda x: self.fetch_hash_id_db())
+        if not self.share_package_data:
+            # If the appropriate hash=>id db is not there, fetch it
+            result.addCallback(lambda x: self.fetch_hash_id_db())
 
         result.addCallback(lambda x: self._store.clear_tasks())
 
@@ -846,7 +930,11 @@ class FakeReporter(PackageReporter):
         if not os.path.exists(self.global_store_filename):
             return succeed(None)
         message_sent = set(self._store.get_message_ids())
-        global_store = FakePackageStore(self.global_store_filename)
+        if self.share_package_data:
+            global_store = get_shared_fake_package_store(
+                self.global_store_filename)
+        else:
+            global_store = FakePackageStore(self.global_store_filename)
         all_message_ids = set(global_store.get_message_ids())
         not_sent = all_message_ids - message_sent
         deferred = succeed(None)
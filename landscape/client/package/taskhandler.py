@@ -295,7 +295,7 @@ def run_task_handler(cls, args, reactor=None):
     # Delay importing of the facades so that we don't
     # import Apt unless we need to.
     from landscape.lib.apt.package.facade import AptFacade
-    package_facade = AptFacade()
+    package_facade = AptFacade(lazy=True)
 
     def finish():
         connector.disconnect()
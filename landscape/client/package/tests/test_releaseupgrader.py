@@ -10,6 +10,7 @@ from twisted.internet.defer import succeed, fail, Deferred
 from landscape.lib.apt.package.store import PackageStore
 from landscape.lib.gpg import InvalidGPGSignature
 from landscape.lib.fetch import HTTPCodeError
+from landscape.lib.fs import create_binary_file
 from landscape.lib.testing import LogKeeperHelper, EnvironSaverHelper
 from landscape.client.package.releaseupgrader import (
     ReleaseUpgrader, ReleaseUpgraderConfiguration, main)
@@ -50,7 +51,7 @@ class ReleaseUpgraderTest(LandscapeTest):
     def get_pending_messages(self):
         return self.broker_service.message_store.get_pending_messages()
 
-    @mock.patch("landscape.lib.fetch.fetch_async")
+    @mock.patch("landscape.lib.fetch.fetch_to_file_async")
     def test_fetch(self, fetch_mock):
         """
         L{ReleaseUpgrader.fetch} fetches the upgrade tool tarball and signature
@@ -59,12 +60,13 @@ class ReleaseUpgraderTest(LandscapeTest):
         tarball_url = "http://some/where/karmic.tar.gz"
         signature_url = "http://some/where/karmic.tar.gz.gpg"
 
-        method_returns = {
-            tarball_url: succeed(b"tarball"),
-            signature_url: succeed(b"signature")}
+        contents = {
+            tarball_url: b"tarball",
+            signature_url: b"signature"}
 
-        def side_effect(param):
-            return method_returns[param]
+        def side_effect(url, filename):
+            create_binary_file(filename, contents[url])
+            return succeed(None)
 
         fetch_mock.side_effect = side_effect
 
@@ -80,13 +82,14 @@ class ReleaseUpgraderTest(LandscapeTest):
                 os.path.join(directory, "karmic.tar.gz.gpg"), b"signature")
             self.assertIn("INFO: Successfully fetched upgrade-tool files",
                           self.logfile.getvalue())
-            calls = [mock.call(tarball_url), mock.call(signature_url)]
+            calls = [mock.call(tarball_url, mock.ANY),
+                     mock.call(signature_url, mock.ANY)]
             fetch_mock.assert_has_calls(calls, any_order=True)
 
         result.addCallback(check_result)
         return result
 
-    @mock.patch("landscape.lib.fetch.fetch_async")
+    @mock.patch("landscape.lib.fetch.fetch_to_file_async")
     def test_fetch_with_errors(self, fetch_mock):
         """
         L{ReleaseUpgrader.fetch} logs a warning in case any of the upgrade tool
@@ -96,11 +99,11 @@ class ReleaseUpgraderTest(LandscapeTest):
         signature_url = "http://some/where/karmic.tar.gz.gpg"
 
         method_returns = {
-            tarball_url: succeed(b"tarball"),
+            tarball_url: succeed(None),
             signature_url: fail(HTTPCodeError(404, b"not found"))}
 
-        def side_effect(param):
-            return method_returns[param]
+        def side_effect(url, filename):
+            return method_returns[url]
 
         fetch_mock.side_effect = side_effect
 
@@ -113,7 +116,8 @@ class ReleaseUpgraderTest(LandscapeTest):
                           self.logfile.getvalue())
             self.assertIn("WARNING: Couldn't fetch all upgrade-tool files",
                           self.logfile.getvalue())
-            calls = [mock.call(tarball_url), mock.call(signature_url)]
+            calls = [mock.call(tarball_url, mock.ANY),
+                     mock.call(signature_url, mock.ANY)]
             fetch_mock.assert_has_calls(calls, any_order=True)
 
         result.addCallback(self.fail)
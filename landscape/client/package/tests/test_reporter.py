@@ -1,4 +1,5 @@
 import sys
+import gzip
 import os
 import time
 import apt_pkg
@@ -13,12 +14,13 @@ from twisted.internet import reactor
 from landscape.lib import bpickle
 from landscape.lib.apt.package.facade import AptFacade
 from landscape.lib.apt.package.store import (
-    PackageStore, UnknownHashIDRequest, FakePackageStore)
+    HashIdStore, PackageStore, UnknownHashIDRequest, FakePackageStore,
+    get_shared_fake_package_store)
 from landscape.lib.apt.package.testing import (
     AptFacadeHelper, SimpleRepositoryHelper,
     HASH1, HASH2, HASH3, PKGNAME1)
-from landscape.lib.fs import create_text_file, touch_file
-from landscape.lib.fetch import FetchError
+from landscape.lib.fs import create_binary_file, create_text_file, touch_file
+from landscape.lib.fetch import FetchError, HTTPCodeError
 from landscape.lib.lsb_release import parse_lsb_release, LSB_RELEASE_FILENAME
 from landscape.lib.testing import EnvironSaverHelper, FakeReactor
 from landscape.client.package.reporter import (
@@ -31,6 +33,22 @@ from landscape.client.tests.helpers import LandscapeTest, BrokerServiceHelper
 SAMPLE_LSB_RELEASE = "DISTRIB_CODENAME=codename\n"
 
 
+def fake_fetch_to_file(content):
+    """
+    Return a side effect for a mocked L{fetch_to_file_async}, writing the
+    given content to the target file.
+    """
+
+    def fetch_to_file_async(url, filename, **kwargs):
+        try:
+            create_binary_file(filename, content)
+        except (IOError, OSError):
+            return fail()
+        return succeed(None)
+
+    return fetch_to_file_async
+
+
 class PackageReporterConfigurationTest(LandscapeTest):
 
     def test_force_apt_update_option(self):
@@ -44,6 +62,28 @@ class PackageReporterConfigurationTest(LandscapeTest):
         config.load(["--force-apt-update"])
         self.assertTrue(config.force_apt_update)
 
+    def test_hash_id_db_deltas_option(self):
+        """
+        The L{PackageReporterConfiguration} supports a '--hash-id-db-deltas'
+        command line option.
+        """
+        config = PackageReporterConfiguration()
+        config.default_config_filenames = (self.makeFile(""), )
+        self.assertFalse(config.hash_id_db_deltas)
+        config.load(["--hash-id-db-deltas"])
+        self.assertTrue(config.hash_id_db_deltas)
+
+    def test_skeleton_hash_processes_option(self):
+        """
+        The L{PackageReporterConfiguration} supports a
+        '--skeleton-hash-processes' command line option.
+        """
+        config = PackageReporterConfiguration()
+        config.default_config_filenames = (self.makeFile(""), )
+        self.assertEqual(0, config.skeleton_hash_processes)
+        config.load(["--skeleton-hash-processes", "4"])
+        self.assertEqual(4, config.skeleton_hash_processes)
+
 
 class PackageReporterAptTest(LandscapeTest):
 
@@ -295,10 +335,10 @@ class PackageReporterAptTest(LandscapeTest):
         deferred = self.reporter.handle_tasks()
         return deferred.addCallback(got_result)
 
-    @mock.patch("landscape.client.package.reporter.fetch_async",
-                return_value=succeed(b"hash-ids"))
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async",
+                side_effect=fake_fetch_to_file(b"hash-ids"))
     @mock.patch("logging.info", return_value=None)
-    def test_fetch_hash_id_db(self, logging_mock, mock_fetch_async):
+    def test_fetch_hash_id_db(self, logging_mock, mock_fetch_to_file):
 
         # Assume package_hash_id_url is set
         self.config.data_path = self.makeDir()
@@ -313,7 +353,7 @@ class PackageReporterAptTest(LandscapeTest):
         self.reporter.lsb_release_filename = self.makeFile(SAMPLE_LSB_RELEASE)
         self.facade.set_arch("arch")
 
-        # Let's say fetch_async is successful
+        # Let's say fetch_to_file_async is successful
         hash_id_db_url = self.config.package_hash_id_url + "uuid_codename_arch"
 
         # We don't have our hash=>id database yet
@@ -329,14 +369,15 @@ class PackageReporterAptTest(LandscapeTest):
 
         logging_mock.assert_called_once_with(
             "Downloaded hash=>id database from %s" % hash_id_db_url)
-        mock_fetch_async.assert_called_once_with(
-            hash_id_db_url, cainfo=None, proxy=None)
+        mock_fetch_to_file.assert_called_once_with(
+            hash_id_db_url, mock.ANY, cainfo=None, proxy=None)
         return result
 
-    @mock.patch("landscape.client.package.reporter.fetch_async",
-                return_value=succeed(b"hash-ids"))
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async",
+                side_effect=fake_fetch_to_file(b"hash-ids"))
     @mock.patch("logging.info", return_value=None)
-    def test_fetch_hash_id_db_with_proxy(self, logging_mock, mock_fetch_async):
+    def test_fetch_hash_id_db_with_proxy(self, logging_mock,
+                                         mock_fetch_to_file):
         """fetching hash-id-db uses proxy settings"""
         # Assume package_hash_id_url is set
         self.config.data_path = self.makeDir()
@@ -349,19 +390,21 @@ class PackageReporterAptTest(LandscapeTest):
         self.reporter.lsb_release_filename = self.makeFile(SAMPLE_LSB_RELEASE)
         self.facade.set_arch("arch")
 
-        # Let's say fetch_async is successful
+        # Let's say fetch_to_file_async is successful
         hash_id_db_url = self.config.package_hash_id_url + "uuid_codename_arch"
 
         # set proxy settings
         self.config.https_proxy = "http://helloproxy:8000"
 
         result = self.reporter.fetch_hash_id_db()
-        mock_fetch_async.assert_called_once_with(
-            hash_id_db_url, cainfo=None, proxy="http://helloproxy:8000")
+        mock_fetch_to_file.assert_called_once_with(
+            hash_id_db_url, mock.ANY, cainfo=None,
+            proxy="http://helloproxy:8000")
         return result
 
-    @mock.patch("landscape.client.package.reporter.fetch_async")
-    def test_fetch_hash_id_db_does_not_download_twice(self, mock_fetch_async):
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async")
+    def test_fetch_hash_id_db_does_not_download_twice(self,
+                                                      mock_fetch_to_file):
 
         # Let's say that the hash=>id database is already there
         self.config.package_hash_id_url = "http://fake.url/path/"
@@ -380,8 +423,8 @@ class PackageReporterAptTest(LandscapeTest):
         result = self.reporter.fetch_hash_id_db()
 
         def callback(ignored):
-            # Check that fetch_async hasn't been called
-            mock_fetch_async.assert_not_called()
+            # Check that fetch_to_file_async hasn't been called
+            mock_fetch_to_file.assert_not_called()
 
             # The hash=>id database is still there
             self.assertEqual(open(hash_id_db_filename).read(), "test")
@@ -439,9 +482,9 @@ class PackageReporterAptTest(LandscapeTest):
             "unknown dpkg architecture")
         return result
 
-    @mock.patch("landscape.client.package.reporter.fetch_async",
-                return_value=succeed(b"hash-ids"))
-    def test_fetch_hash_id_db_with_default_url(self, mock_fetch_async):
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async",
+                side_effect=fake_fetch_to_file(b"hash-ids"))
+    def test_fetch_hash_id_db_with_default_url(self, mock_fetch_to_file):
         # Let's say package_hash_id_url is not set but url is
         self.config.data_path = self.makeDir()
         self.config.package_hash_id_url = None
@@ -456,7 +499,7 @@ class PackageReporterAptTest(LandscapeTest):
         self.reporter.lsb_release_filename = self.makeFile(SAMPLE_LSB_RELEASE)
         self.facade.set_arch("arch")
 
-        # Check fetch_async is called with the default url
+        # Check fetch_to_file_async is called with the default url
         hash_id_db_url = "http://fake.url/path/hash-id-databases/" \
                          "uuid_codename_arch"
         result = self.reporter.fetch_hash_id_db()
@@ -466,15 +509,15 @@ class PackageReporterAptTest(LandscapeTest):
             self.assertTrue(os.path.exists(hash_id_db_filename))
             self.assertEqual(open(hash_id_db_filename).read(), "hash-ids")
         result.addCallback(callback)
-        mock_fetch_async.assert_called_once_with(
-            hash_id_db_url, cainfo=None, proxy=None)
+        mock_fetch_to_file.assert_called_once_with(
+            hash_id_db_url, mock.ANY, cainfo=None, proxy=None)
         return result
 
-    @mock.patch("landscape.client.package.reporter.fetch_async",
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async",
                 return_value=fail(FetchError("fetch error")))
     @mock.patch("logging.warning", return_value=None)
     def test_fetch_hash_id_db_with_download_error(
-            self, logging_mock, mock_fetch_async):
+            self, logging_mock, mock_fetch_to_file):
 
         # Assume package_hash_id_url is set
         self.config.data_path = self.makeDir()
@@ -486,7 +529,7 @@ class PackageReporterAptTest(LandscapeTest):
         self.reporter.lsb_release_filename = self.makeFile(SAMPLE_LSB_RELEASE)
         self.facade.set_arch("arch")
 
-        # Let's say fetch_async fails
+        # Let's say fetch_to_file_async fails
         hash_id_db_url = self.config.package_hash_id_url + "uuid_codename_arch"
 
         result = self.reporter.fetch_hash_id_db()
@@ -501,8 +544,30 @@ class PackageReporterAptTest(LandscapeTest):
 
         logging_mock.assert_called_once_with(
             "Couldn't download hash=>id database: fetch error")
-        mock_fetch_async.assert_called_once_with(
-            hash_id_db_url, cainfo=None, proxy=None)
+        mock_fetch_to_file.assert_called_once_with(
+            hash_id_db_url, mock.ANY, cainfo=None, proxy=None)
+        return result
+
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async",
+                side_effect=IOError("no such directory"))
+    @mock.patch("logging.warning", return_value=None)
+    def test_fetch_hash_id_db_with_synchronous_error(
+            self, logging_mock, mock_fetch_to_file):
+        """
+        Errors raised right away by L{fetch_to_file_async} are logged like
+        download errors, instead of escaping L{fetch_hash_id_db}.
+        """
+        self.config.data_path = self.makeDir()
+        self.config.package_hash_id_url = "http://fake.url/path/"
+        message_store = self.broker_service.message_store
+        message_store.set_server_uuid("uuid")
+        self.reporter.lsb_release_filename = self.makeFile(SAMPLE_LSB_RELEASE)
+        self.facade.set_arch("arch")
+
+        result = self.reporter.fetch_hash_id_db()
+
+        logging_mock.assert_called_once_with(
+            "Couldn't download hash=>id database: no such directory")
         return result
 
     @mock.patch("logging.warning", return_value=None)
@@ -532,9 +597,10 @@ class PackageReporterAptTest(LandscapeTest):
             "Can't determine the hash=>id database url")
         return result
 
-    @mock.patch("landscape.client.package.reporter.fetch_async",
-                return_value=succeed(b"hash-ids"))
-    def test_fetch_hash_id_db_with_custom_certificate(self, mock_fetch_async):
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async",
+                side_effect=fake_fetch_to_file(b"hash-ids"))
+    def test_fetch_hash_id_db_with_custom_certificate(self,
+                                                      mock_fetch_to_file):
         """
         The L{PackageReporter.fetch_hash_id_db} method takes into account the
         possible custom SSL certificate specified in the client configuration.
@@ -542,6 +608,7 @@ class PackageReporterAptTest(LandscapeTest):
 
         self.config.url = "http://fake.url/path/message-system/"
         self.config.ssl_public_key = "/some/key"
+        os.makedirs(self.config.hash_id_directory)
 
         # Fake uuid, codename and arch
         message_store = self.broker_service.message_store
@@ -549,17 +616,157 @@ class PackageReporterAptTest(LandscapeTest):
         self.reporter.lsb_release_filename = self.makeFile(SAMPLE_LSB_RELEASE)
         self.facade.set_arch("arch")
 
-        # Check fetch_async is called with the default url
+        # Check fetch_to_file_async is called with the default url
         hash_id_db_url = "http://fake.url/path/hash-id-databases/" \
                          "uuid_codename_arch"
 
         # Now go!
         result = self.reporter.fetch_hash_id_db()
-        mock_fetch_async.assert_called_once_with(
-            hash_id_db_url, cainfo=self.config.ssl_public_key, proxy=None)
+        mock_fetch_to_file.assert_called_once_with(
+            hash_id_db_url, mock.ANY, cainfo=self.config.ssl_public_key,
+            proxy=None)
 
         return result
 
+    def test_run_skeleton_hash_processes(self):
+        """
+        The package hashes are computed in the number of processes set with
+        the C{skeleton_hash_processes} option.
+        """
+        self.config.skeleton_hash_processes = 4
+        with mock.patch.object(self.reporter, "get_session_id",
+                               return_value=Deferred()):
+            self.reporter.run()
+        self.assertEqual(4, self.facade.hash_processes)
+
+    def _make_hash_id_db(self):
+        """Create a hash=>id database for the fake uuid, codename and arch."""
+        self.config.package_hash_id_url = "http://fake.url/path/"
+        self.config.data_path = self.makeDir()
+        self.config.hash_id_db_deltas = True
+        os.makedirs(os.path.join(self.config.data_path, "package", "hash-id"))
+        hash_id_db_filename = os.path.join(self.config.data_path, "package",
+                                           "hash-id", "uuid_codename_arch")
+        HashIdStore(hash_id_db_filename).set_hash_ids(
+            {b"hash1": 1, b"hash2": 2})
+        message_store = self.broker_service.message_store
+        message_store.set_server_uuid("uuid")
+        self.reporter.lsb_release_filename = self.makeFile(SAMPLE_LSB_RELEASE)
+        self.facade.set_arch("arch")
+        return hash_id_db_filename
+
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async")
+    @mock.patch("landscape.client.package.reporter.fetch_async")
+    def test_update_hash_id_db(self, mock_fetch, mock_fetch_to_file):
+        """
+        L{PackageReporter.update_hash_id_db} applies the deltas listed next
+        to the hash=>id database, jumping to the most recent version it can.
+        """
+        hash_id_db_filename = self._make_hash_id_db()
+        mock_fetch.return_value = succeed(
+            b"0 1 sha1\n0 2 sha2\n2 3 sha3\n")
+        deltas = {"2": b"6861736831 -\n6861736833 3\n",
+                  "3": b"6861736834 4\n"}
+
+        def fetch_to_file_async(url, filename, **kwargs):
+            with gzip.open(filename, "wb") as fd:
+                fd.write(deltas[url[-4]])
+            return succeed(None)
+
+        mock_fetch_to_file.side_effect = fetch_to_file_async
+        result = self.reporter.update_hash_id_db()
+
+        def callback(ignored):
+            prefix = "http://fake.url/path/uuid_codename_arch"
+            mock_fetch.assert_called_once_with(
+                prefix + ".deltas", cainfo=None, proxy=None)
+            self.assertEqual(
+                [mock.call(prefix + ".0-2.gz", mock.ANY, sha256="sha2",
+                           cainfo=None, proxy=None),
+                 mock.call(prefix + ".2-3.gz", mock.ANY, sha256="sha3",
+                           cainfo=None, proxy=None)],
+                mock_fetch_to_file.mock_calls)
+            store = HashIdStore(hash_id_db_filename)
+            self.assertEqual({b"hash2": 2, b"hash3": 3, b"hash4": 4},
+                             store.get_hash_ids())
+            self.assertEqual(3, store.get_version())
+            self.assertEqual(["uuid_codename_arch"],
+                             os.listdir(os.path.dirname(hash_id_db_filename)))
+
+        return result.addCallback(callback)
+
+    @mock.patch("landscape.client.package.reporter.fetch_async")
+    def test_update_hash_id_db_disabled(self, mock_fetch):
+        """
+        Deltas aren't looked for unless the C{hash_id_db_deltas} option is
+        set.
+        """
+        self._make_hash_id_db()
+        self.config.hash_id_db_deltas = False
+        result = self.reporter.update_hash_id_db()
+        mock_fetch.assert_not_called()
+        return result
+
+    @mock.patch("logging.debug")
+    @mock.patch("landscape.client.package.reporter.fetch_async")
+    def test_update_hash_id_db_without_deltas(self, mock_fetch, logging_mock):
+        """
+        The database is left alone if the server doesn't publish deltas
+        for it.
+        """
+        self._make_hash_id_db()
+        mock_fetch.return_value = fail(HTTPCodeError(404, b""))
+        result = self.reporter.update_hash_id_db()
+        logging_mock.assert_called_once_with(
+            "No hash=>id database deltas available")
+        return result
+
+    @mock.patch("logging.warning")
+    @mock.patch("landscape.client.package.reporter.fetch_async")
+    def test_update_hash_id_db_with_index_server_error(self, mock_fetch,
+                                                       logging_mock):
+        """
+        If the list of deltas can't be downloaded because of a server error,
+        the database is left alone and a warning is logged, instead of
+        failing the reporter run.
+        """
+        hash_id_db_filename = self._make_hash_id_db()
+        mock_fetch.return_value = fail(HTTPCodeError(500, b""))
+        result = self.reporter.update_hash_id_db()
+
+        def check(ignored):
+            logging_mock.assert_called_once_with(
+                "Couldn't download hash=>id database deltas: Server "
+                "returned HTTP code 500")
+            self.assertEqual(
+                0, HashIdStore(hash_id_db_filename).get_version())
+
+        return result.addCallback(check)
+
+    @mock.patch("logging.warning")
+    @mock.patch("landscape.client.package.reporter.fetch_to_file_async")
+    @mock.patch("landscape.client.package.reporter.fetch_async")
+    def test_update_hash_id_db_with_download_error(
+            self, mock_fetch, mock_fetch_to_file, logging_mock):
+        """
+        If a delta can't be downloaded, the database is left at the version
+        of the last applied delta and a warning is logged.
+        """
+        hash_id_db_filename = self._make_hash_id_db()
+        mock_fetch.return_value = succeed(b"0 1 sha1\n")
+        mock_fetch_to_file.return_value = fail(FetchError("boom"))
+        result = self.reporter.update_hash_id_db()
+
+        def callback(ignored):
+            logging_mock.assert_called_once_with(
+                "Couldn't update hash=>id database from "
+                "http://fake.url/path/uuid_codename_arch.0-1.gz: boom")
+            store = HashIdStore(hash_id_db_filename)
+            self.assertEqual({b"hash1": 1, b"hash2": 2}, store.get_hash_ids())
+            self.assertEqual(0, store.get_version())
+
+        return result.addCallback(callback)
+
     def test_wb_apt_sources_have_changed(self):
         """
         The L{PackageReporter._apt_sources_have_changed} method returns a bool
@@ -2103,6 +2310,30 @@ class FakePackageReporterTest(LandscapeTest):
 
         return self.reporter.run().addCallback(check1)
 
+    def test_share_package_data(self):
+        """
+        With C{share_package_data}, L{FakeReporter} reads the global store
+        through the shared store of the process, and doesn't fetch the
+        hash=>id database.
+        """
+        message_store = self.broker_service.message_store
+        message_store.set_accepted_types(["package-reporter-result"])
+        message = {"type": "package-reporter-result",
+                   "code": 0, "err": u"error"}
+        self.global_store.save_message(message)
+        self.reporter.share_package_data = True
+        self.reporter.fetch_hash_id_db = mock.Mock()
+
+        def check(ignore):
+            self.assertMessages(message_store.get_pending_messages(),
+                                [message])
+            self.assertFalse(self.reporter.fetch_hash_id_db.called)
+            shared_store = get_shared_fake_package_store(
+                os.environ["FAKE_PACKAGE_STORE"])
+            self.assertEqual([1], shared_store.get_message_ids())
+
+        return self.reporter.run().addCallback(check)
+
 
 class EqualsHashes(object):
 
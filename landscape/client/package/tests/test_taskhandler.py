@@ -365,6 +365,7 @@ class PackageTaskHandlerTest(LandscapeTest):
             # Verify the arguments passed to the reporter constructor.
             self.assertEqual(type(store), PackageStore)
             self.assertEqual(type(facade), AptFacade)
+            self.assertTrue(facade.lazy)
             self.assertEqual(type(broker), LazyRemoteBroker)
             self.assertEqual(type(config), PackageTaskHandlerConfiguration)
             self.assertIn("mock-reactor", repr(reactor))
@@ -5,6 +5,7 @@ from twisted.application.service import Application, Service
 from twisted.application.app import startApplication
 
 from landscape.lib.logging import rotate_logs
+from landscape.lib.reactor import ReactorLagMonitor
 from landscape.client.reactor import LandscapeReactor
 from landscape.client.deployment import get_versioned_persist, init_logging
 
@@ -19,6 +20,8 @@ class LandscapeService(Service, object):
     @ivar config: A L{Configuration} object.
     @ivar reactor: A L{LandscapeReactor} object.
     @ivar persist: A L{Persist} object, if C{persist_filename} is defined.
+    @ivar lag_monitor: A L{ReactorLagMonitor}, if the C{reactor_lag_threshold}
+        option is set.
     @ivar factory: A L{LandscapeComponentProtocolFactory}, it must be provided
         by instances of sub-classes.
     """
@@ -28,6 +31,7 @@ class LandscapeService(Service, object):
     def __init__(self, config):
         self.config = config
         self.reactor = self.reactor_factory()
+        self.lag_monitor = None
         if self.persist_filename:
             self.persist = get_versioned_persist(self)
         if not (self.config is not None and self.config.ignore_sigusr1):
@@ -38,6 +42,13 @@ class LandscapeService(Service, object):
 
     def startService(self):
         Service.startService(self)
+        # Clones share the Twisted reactor with the original service, which
+        # monitors it for all of them.
+        if (self.config.reactor_lag_threshold and
+                not getattr(self.config, "is_clone", False)):
+            self.lag_monitor = ReactorLagMonitor(
+                self.reactor, self.config.reactor_lag_threshold)
+            self.lag_monitor.start()
         logging.info("%s started with config %s" % (
             self.service_name.capitalize(), self.config.get_config_filename()))
 
@@ -45,6 +56,9 @@ class LandscapeService(Service, object):
         # We don't need to call port.stopListening(), because the reactor
         # shutdown sequence will do that for us.
         Service.stopService(self)
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
+            self.lag_monitor = None
         logging.info("%s stopped with config %s" % (
             self.service_name.capitalize(), self.config.get_config_filename()))
 
@@ -21,7 +21,8 @@ from landscape.client.configuration import (
     ImportOptionError, store_public_key_data,
     bootstrap_tree, got_connection, success, failure, exchange_failure,
     handle_registration_errors, done, got_error, report_registration_outcome,
-    determine_exit_code, is_registered)
+    determine_exit_code, is_registered, get_plugin_stats,
+    format_plugin_stats)
 from landscape.lib.amp import MethodCallError
 from landscape.lib.fetch import HTTPCodeError, PyCurlError
 from landscape.lib.fs import read_binary_file
@@ -1886,6 +1887,79 @@ class RegisterRealFunctionTest(LandscapeConfigurationTest):
         self.assertEqual("max-pending-computers", result)
 
 
+class GetPluginStatsTest(LandscapeConfigurationTest):
+
+    helpers = [FakeBrokerServiceHelper]
+
+    def setUp(self):
+        super(GetPluginStatsTest, self).setUp()
+        self.config = LandscapeSetupConfiguration()
+        self.config.load(["-c", self.config_filename])
+
+    def test_get_plugin_stats(self):
+        """
+        L{get_plugin_stats} returns the plugin statistics of the clients
+        registered with the broker.
+        """
+        self.remote.get_plugin_stats = mock.Mock(
+            return_value=succeed({"monitor": {}}))
+        connector_factory = FakeConnectorFactory(self.remote)
+        self.assertEqual(
+            {"monitor": {}},
+            get_plugin_stats(self.config, self.reactor, connector_factory))
+
+    def test_get_plugin_stats_without_broker(self):
+        """
+        L{get_plugin_stats} exits with an error if the broker isn't running.
+        """
+        connector_factory = FakeConnectorFactory(None)
+        connector_factory.connect = mock.Mock(
+            return_value=fail(Exception("Not running")))
+        error = self.assertRaises(
+            SystemExit, get_plugin_stats, self.config, self.reactor,
+            connector_factory)
+        self.assertIn("Unable to contact", str(error))
+
+    def test_format_plugin_stats(self):
+        """
+        L{format_plugin_stats} returns a table of the plugins, sorted by
+        decreasing CPU time.
+        """
+        plugin_stats = {"runs": 3, "failures": 1, "wall-time": 1.5,
+                        "max-wall-time": 1.0, "cpu-time": 0.5,
+                        "memory": None}
+        stats = {"monitor": {"landscape.client.monitor.cpuusage.CPUUsage":
+                             plugin_stats},
+                 "manager": {"landscape.client.manager.usermanager.Users":
+                             dict(plugin_stats, **{"cpu-time": 2.0,
+                                                   "memory": 2048})}}
+        lines = format_plugin_stats(stats).splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(
+            ["Client", "Plugin", "Runs", "Errors", "Wall", "Max", "wall",
+             "CPU", "Memory"], lines[0].split())
+        self.assertEqual(
+            ["manager", "Users", "3", "1", "1.50s", "1.00s", "2.00s",
+             "2.0KiB"], lines[1].split())
+        self.assertEqual(
+            ["monitor", "CPUUsage", "3", "1", "1.50s", "1.00s", "0.50s",
+             "-"], lines[2].split())
+
+    @mock.patch("landscape.client.configuration.get_plugin_stats",
+                return_value={})
+    @mock.patch("landscape.client.configuration.setup")
+    def test_main_with_stats(self, mock_setup, mock_get_plugin_stats):
+        """
+        With C{--stats}, L{main} prints the plugin statistics and exits,
+        without setting up the client.
+        """
+        output = []
+        main(["-c", self.config_filename, "--stats"], print=output.append)
+        self.assertEqual(1, len(output))
+        self.assertTrue(output[0].startswith("Client"))
+        mock_setup.assert_not_called()
+
+
 class FauxConnection(object):
     def __init__(self):
         self.callbacks = []
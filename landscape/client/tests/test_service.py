@@ -92,3 +92,27 @@ class LandscapeServiceTest(LandscapeTest):
 
         handler = signal.getsignal(signal.SIGUSR1)
         self.assertFalse(handler)
+
+    def test_reactor_lag_monitor(self):
+        """
+        If the C{reactor_lag_threshold} option is set, the reactor is
+        monitored while the service runs.
+        """
+        self.config.reactor_lag_threshold = 5
+        service = TestService(self.config)
+        self.assertIsNone(service.lag_monitor)
+        service.startService()
+        self.assertEqual(5, service.lag_monitor.threshold)
+        self.assertIs(service.lag_monitor, service.reactor.lag_monitor)
+        service.stopService()
+        self.assertIsNone(service.lag_monitor)
+        self.assertIsNone(service.reactor.lag_monitor)
+
+    def test_no_reactor_lag_monitor_for_clones(self):
+        """Clones leave monitoring the shared reactor to the original."""
+        self.config.reactor_lag_threshold = 5
+        self.config.is_clone = True
+        service = TestService(self.config)
+        service.startService()
+        self.addCleanup(service.stopService)
+        self.assertIsNone(service.lag_monitor)
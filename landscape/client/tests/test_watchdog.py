@@ -1018,6 +1018,103 @@ class DaemonBrokerTest(DaemonTestBase):
         result.addCallback(self.assertTrue)
         return result
 
+    def test_is_running_reuses_connection(self):
+        """
+        The AMP connection used to ping the daemon is kept open and reused
+        by the next pings.
+        """
+        self.daemon._connector._reactor = self.broker_service.reactor
+        self.addCleanup(self.daemon.stop)
+        connect = mock.Mock(wraps=self.daemon._connector.connect)
+        self.daemon._connector.connect = connect
+        result = self.daemon.is_running()
+        result.addCallback(lambda ignored: self.daemon.is_running())
+
+        def check(is_running):
+            self.assertTrue(is_running)
+            self.assertEqual(1, connect.call_count)
+            self.assertIsNot(None, self.daemon.ping_time)
+
+        return result.addCallback(check)
+
+
+class DaemonPingTest(LandscapeTest):
+
+    def setUp(self):
+        super(DaemonPingTest, self).setUp()
+        self.clock = Clock()
+        self.remote = mock.Mock()
+        self.connector = mock.Mock()
+        self.connector.connect.side_effect = (
+            lambda *args, **kwargs: succeed(self.remote))
+        self.daemon = Daemon(self.connector, reactor=self.clock)
+        self.daemon.program = "landscape-broker"
+
+    def test_ping_timeout(self):
+        """
+        If the daemon doesn't answer a ping within C{ping_timeout} seconds,
+        it's not considered running.
+        """
+        self.remote.ping.return_value = Deferred()
+        results = []
+        self.daemon.is_running().addCallback(results.append)
+        self.clock.advance(self.daemon.ping_timeout)
+        self.assertEqual([False], results)
+
+    def test_ping_timeout_reconnects(self):
+        """
+        If a ping times out, the connection is closed and a new one is made
+        for the next ping. A late failure of the timed out ping doesn't close
+        the new connection.
+        """
+        deferred = Deferred()
+        self.remote.ping.return_value = deferred
+        results = []
+        self.daemon.is_running().addCallback(results.append)
+        self.clock.advance(self.daemon.ping_timeout)
+        self.connector.disconnect.assert_called_once_with()
+
+        new_remote = mock.Mock()
+        new_remote.ping.return_value = succeed(True)
+        self.connector.connect.side_effect = (
+            lambda *args, **kwargs: succeed(new_remote))
+        self.daemon.is_running().addCallback(results.append)
+        deferred.errback(Exception("Connection lost"))
+        self.assertEqual([False, True], results)
+        self.assertEqual(2, self.connector.connect.call_count)
+        self.assertEqual(1, self.connector.disconnect.call_count)
+        self.assertIs(new_remote, self.daemon._remote)
+
+    def test_ping_failure_disconnects(self):
+        """
+        If a ping fails, the connection is closed and a new one is made for
+        the next ping.
+        """
+        self.remote.ping.return_value = fail(Exception("Connection lost"))
+        results = []
+        self.daemon.is_running().addCallback(results.append)
+        self.connector.disconnect.assert_called_once_with()
+        self.remote.ping.return_value = succeed(True)
+        self.daemon.is_running().addCallback(results.append)
+        self.assertEqual([False, True], results)
+        self.assertEqual(2, self.connector.connect.call_count)
+
+    def test_slow_ping(self):
+        """
+        The time the daemon took to answer is recorded, and a warning is
+        logged if its reactor is lagging.
+        """
+        deferred = Deferred()
+        self.remote.ping.return_value = deferred
+        results = []
+        self.daemon.is_running().addCallback(results.append)
+        self.clock.advance(2)
+        deferred.callback(True)
+        self.assertEqual([True], results)
+        self.assertEqual(2, self.daemon.ping_time)
+        self.assertIn("landscape-broker took 2.0 seconds to respond to a "
+                      "ping", self.logfile.getvalue())
+
 
 class WatchDogOptionsTest(LandscapeTest):
 
@@ -9,12 +9,16 @@ class UserChanges(object):
     If no snapshot is available all users and groups are reported.
     When a snapshot is available, only the changes between the current
     state and the snapshotted state are transmitted to the server.
+
+    The provider's fingerprint is stored with the snapshot, so users and
+    groups aren't enumerated again as long as it doesn't change.
     """
 
     def __init__(self, persist, provider):
         super(UserChanges, self).__init__()
         self._persist = persist
         self._provider = provider
+        self._fingerprint = None
         # FIXME This shouldn't really be necessary.  Not having it
         # here with the current factoring is also problematic.  Figure
         # out a clean way to factor this.  Gustavo suggested splitting
@@ -26,15 +30,35 @@ class UserChanges(object):
         """Load the previous snapshot and update current data."""
         self._old_users = self._persist.get("users", {})
         self._old_groups = self._persist.get("groups", {})
-        self._new_users = self._create_index(
-            "username", self._provider.get_users())
+        fingerprint = self._provider.get_fingerprint()
+        if fingerprint is not None:
+            if fingerprint == self._fingerprint:
+                # Nothing changed since the last refresh.
+                return
+            if (fingerprint == self._persist.get("fingerprint") and
+                    self._persist.has("users")):
+                # Nothing changed since the snapshot.
+                self._new_users = self._old_users
+                self._new_groups = self._old_groups
+                self._fingerprint = fingerprint
+                return
+        users = self._provider.get_users()
+        self._new_users = self._create_index("username", users)
         self._new_groups = self._create_index(
-            "name", self._provider.get_groups())
+            "name", self._provider.get_groups(users=users))
+        self._fingerprint = fingerprint
 
     def snapshot(self):
         """Save the current state and use it as a comparison snapshot."""
         self._persist.set("users", self._new_users)
         self._persist.set("groups", self._new_groups)
+        self._save_fingerprint()
+
+    def _save_fingerprint(self):
+        if self._fingerprint is None:
+            self._persist.remove("fingerprint")
+        else:
+            self._persist.set("fingerprint", self._fingerprint)
 
     def clear(self):
         """
@@ -43,6 +67,7 @@ class UserChanges(object):
         """
         self._persist.remove("users")
         self._persist.remove("groups")
+        self._persist.remove("fingerprint")
 
     def _create_index(self, key, sequence):
         """
@@ -64,6 +89,9 @@ class UserChanges(object):
         changes = {}
         changes.update(self._detect_user_changes())
         changes.update(self._detect_group_changes())
+        if not changes and self._persist.has("users"):
+            # The snapshot is up to date, remember which state it matches.
+            self._save_fingerprint()
         return changes
 
     def _detect_user_changes(self):
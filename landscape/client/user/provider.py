@@ -2,6 +2,7 @@ from grp import struct_group
 from pwd import struct_passwd
 import csv
 import logging
+import os
 import subprocess
 
 from twisted.python.compat import _PY3
@@ -55,13 +56,18 @@ class UserProviderBase(object):
             found_usernames.add(user.pw_name)
         return users
 
-    def get_groups(self):
+    def get_groups(self, users=None):
         """Returns a list of groups on the computer.
 
         Each group is represented as a dict with the keys: C{name},
         C{gid} and C{members}.
+
+        @param users: Optionally, the list returned by L{get_users}, to save
+            enumerating the users again.
         """
-        user_names = set([x["username"] for x in self.get_users()])
+        if users is None:
+            users = self.get_users()
+        user_names = set([x["username"] for x in users])
         groups = []
         found_groupnames = set()
         for group in self.get_group_data():
@@ -75,6 +81,14 @@ class UserProviderBase(object):
             found_groupnames.add(group.gr_name)
         return groups
 
+    def get_fingerprint(self):
+        """Return a value which changes whenever users or groups change.
+
+        Providers unable to tell return C{None}, meaning users and groups
+        must always be enumerated.
+        """
+        return None
+
     def get_uid(self, username):
         """Returns the UID for C{username}.
 
@@ -112,6 +126,22 @@ class UserProvider(UserProviderBase):
         self._passwd_file = passwd_file
         self._group_file = group_file
 
+    def get_fingerprint(self):
+        """
+        Return the inode, size and timestamps of the passwd and group files,
+        along with the locked users, or C{None} if the files can't be
+        examined.
+        """
+        fingerprint = [sorted(self.locked_users)]
+        for filename in (self._passwd_file, self._group_file):
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                return None
+            fingerprint.append(
+                [stat.st_ino, stat.st_size, stat.st_mtime, stat.st_ctime])
+        return fingerprint
+
     def get_user_data(self):
         """
         Parse passwd(5) formatted files and return tuples of user data in the
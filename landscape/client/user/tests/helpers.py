@@ -155,6 +155,8 @@ class FakeUserManagement(object):
 
 class FakeUserProvider(UserProviderBase):
 
+    fingerprint = None
+
     def __init__(self, users=None, groups=None, popen=None, shadow_file=None,
                  locked_users=None):
         self.users = users
@@ -162,9 +164,14 @@ class FakeUserProvider(UserProviderBase):
         if popen:
             self.popen = popen
         self.shadow_file = shadow_file
+        self.user_data_calls = 0
         super(FakeUserProvider, self).__init__(locked_users=locked_users)
 
+    def get_fingerprint(self):
+        return self.fingerprint
+
     def get_user_data(self, system=False):
+        self.user_data_calls += 1
         if self.users is None:
             self.users = []
         return self.users
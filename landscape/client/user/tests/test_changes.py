@@ -42,6 +42,85 @@ sbarnes:$1$q7sz09uw$q.A3526M/SHu8vUb.Jo1A/:13349:0:99999:7:::
                           "create-groups": [{"gid": 1000, "name": "webdev"}],
                           "create-group-members": {"webdev": ["jdoe"]}})
 
+    def test_users_enumerated_once(self):
+        """
+        Users are enumerated a single time to build both the user and the
+        group data.
+        """
+        users = [("jdoe", "x", 1000, 1000, "JD,,,,", "/home/jdoe", "/bin/sh")]
+        groups = [("webdev", "x", 1000, ["jdoe"])]
+        provider = FakeUserProvider(users=users, groups=groups)
+        UserChanges(self.persist, provider)
+        self.assertEqual(1, provider.user_data_calls)
+
+    def test_unchanged_fingerprint(self):
+        """
+        If the provider's fingerprint didn't change since the last snapshot,
+        users and groups aren't enumerated again.
+        """
+        users = [("jdoe", "x", 1000, 1000, "JD,,,,", "/home/jdoe", "/bin/sh")]
+        groups = [("webdev", "x", 1000, ["jdoe"])]
+        provider = FakeUserProvider(users=users, groups=groups)
+        provider.fingerprint = ["fingerprint"]
+
+        changes1 = UserChanges(self.persist, provider)
+        self.assertTrue(changes1.create_diff())
+        changes1.snapshot()
+        self.assertEqual(1, provider.user_data_calls)
+
+        changes2 = UserChanges(self.persist, provider)
+        self.assertEqual({}, changes2.create_diff())
+        self.assertEqual(1, provider.user_data_calls)
+
+    def test_changed_fingerprint(self):
+        """
+        When the provider's fingerprint changes, users and groups are
+        enumerated again and the changes reported.
+        """
+        users = [("jdoe", "x", 1000, 1000, "JD,,,,", "/home/jdoe", "/bin/sh")]
+        provider = FakeUserProvider(users=users, groups=[])
+        provider.fingerprint = ["fingerprint"]
+
+        changes1 = UserChanges(self.persist, provider)
+        changes1.create_diff()
+        changes1.snapshot()
+
+        provider.users = []
+        provider.fingerprint = ["new fingerprint"]
+        changes2 = UserChanges(self.persist, provider)
+        self.assertEqual({"delete-users": ["jdoe"]}, changes2.create_diff())
+        self.assertEqual(2, provider.user_data_calls)
+
+    def test_fingerprint_saved_without_changes(self):
+        """
+        If the provider's fingerprint changed but users and groups didn't,
+        the new fingerprint is remembered so they aren't enumerated next time.
+        """
+        users = [("jdoe", "x", 1000, 1000, "JD,,,,", "/home/jdoe", "/bin/sh")]
+        provider = FakeUserProvider(users=users, groups=[])
+        provider.fingerprint = ["fingerprint"]
+
+        changes = UserChanges(self.persist, provider)
+        changes.create_diff()
+        changes.snapshot()
+
+        provider.fingerprint = ["touched"]
+        self.assertEqual({}, UserChanges(self.persist, provider).create_diff())
+        self.assertEqual({}, UserChanges(self.persist, provider).create_diff())
+        self.assertEqual(2, provider.user_data_calls)
+        self.assertEqual(["touched"], self.persist.get("fingerprint"))
+
+    def test_clear_removes_fingerprint(self):
+        """
+        L{UserChanges.clear} forgets the fingerprint along with the snapshot.
+        """
+        provider = FakeUserProvider(users=[], groups=[])
+        provider.fingerprint = ["fingerprint"]
+        changes = UserChanges(self.persist, provider)
+        changes.snapshot()
+        changes.clear()
+        self.assertFalse(self.persist.has("fingerprint"))
+
     def test_snapshot(self):
         """
         When a snapshot is taken it should persist beyond instance
@@ -401,6 +401,50 @@ root:x:0:0:root:/root:/bin/bash
                                      "gid": 1000,
                                      "members": []})
 
+    def test_get_groups_with_users(self):
+        """
+        L{UserProvider.get_groups} uses the given users instead of enumerating
+        them again.
+        """
+        provider = UserProvider(passwd_file=self.passwd_file,
+                                group_file=self.group_file)
+        provider.get_users = lambda: self.fail("Users enumerated")
+        users = [{"username": "kevin"}]
+        groups = provider.get_groups(users=users)
+        cdrom = [group for group in groups if group["name"] == "cdrom"][0]
+        self.assertEqual(["kevin"], cdrom["members"])
+
+    def test_get_fingerprint(self):
+        """
+        The fingerprint of L{UserProvider} changes when the passwd file, the
+        group file or the locked users change.
+        """
+        provider = UserProvider(passwd_file=self.passwd_file,
+                                group_file=self.group_file)
+        fingerprint = provider.get_fingerprint()
+        self.assertEqual(fingerprint, provider.get_fingerprint())
+
+        with open(self.passwd_file, "a") as passwd_file:
+            passwd_file.write("jdoe:x:1002:1002:JD,,,,:/home/jdoe:/bin/sh\n")
+        passwd_fingerprint = provider.get_fingerprint()
+        self.assertNotEqual(fingerprint, passwd_fingerprint)
+
+        with open(self.group_file, "a") as group_file:
+            group_file.write("jdoe:x:1002:\n")
+        group_fingerprint = provider.get_fingerprint()
+        self.assertNotEqual(passwd_fingerprint, group_fingerprint)
+
+        provider.locked_users = ["kevin"]
+        self.assertNotEqual(group_fingerprint, provider.get_fingerprint())
+
+    def test_get_fingerprint_missing_file(self):
+        """
+        L{UserProvider.get_fingerprint} returns C{None} if a file is missing.
+        """
+        provider = UserProvider(passwd_file=self.passwd_file,
+                                group_file="/does/not/exist")
+        self.assertIs(None, provider.get_fingerprint())
+
     def test_get_users_incorrect_passwd_file(self):
         """
         This tests the functionality for parsing /etc/passwd style files.
@@ -38,6 +38,8 @@ GRACEFUL_WAIT_PERIOD = 10
 MAXIMUM_CONSECUTIVE_RESTARTS = 5
 RESTART_BURST_DELAY = 30  # seconds
 SIGKILL_DELAY = 10
+PING_TIMEOUT = 10  # seconds
+SLOW_PING_THRESHOLD = 1  # seconds
 
 
 class DaemonError(Exception):
@@ -64,6 +66,12 @@ class Daemon(object):
         trying to connect to the watched daemon.
     @cvar factor: The factor by which the delay between subsequent connection
         attempts will increase.
+    @cvar ping_timeout: The number of seconds to wait for the daemon to
+        answer a ping before considering it's not running.
+    @ivar ping_time: The number of seconds the daemon took to answer the
+        last successful ping. The daemon answers from its reactor loop, so
+        this is also how late its reactor is running, or C{None} if it
+        didn't answer yet.
 
     @param connector: The L{ComponentConnector} of the daemon.
     @param reactor: The reactor used to spawn the process and schedule timed
@@ -75,6 +83,7 @@ class Daemon(object):
     username = "landscape"
     max_retries = 3
     factor = 1.1
+    ping_timeout = PING_TIMEOUT
     options = None
 
     BIN_DIR = None
@@ -111,6 +120,8 @@ class Daemon(object):
         self._last_started = 0
         self._quick_starts = 0
         self._allow_restart = True
+        self._remote = None
+        self.ping_time = None
 
     def find_executable(self):
         """Find the fully-qualified path to the executable.
@@ -127,6 +138,7 @@ class Daemon(object):
     def start(self):
         """Start this daemon."""
         self._process = None
+        self._disconnect()
 
         now = time.time()
         if self._last_started + RESTART_BURST_DELAY > now:
@@ -155,40 +167,104 @@ class Daemon(object):
 
     def stop(self):
         """Stop this daemon."""
+        self._disconnect()
         if not self._process:
             return succeed(None)
         return self._process.kill()
 
+    def _get_remote(self):
+        """Return a L{Deferred} resulting in a remote object for the daemon.
+
+        The AMP connection is kept open and reused by subsequent calls, so
+        that the daemon isn't woken up by a new connection at every check.
+        """
+        if self._remote is not None:
+            return succeed(self._remote)
+
+        def connected(remote):
+            self._remote = remote
+            return remote
+
+        result = self._connector.connect(self.max_retries, self.factor,
+                                         quiet=True)
+        return result.addCallback(connected)
+
+    def _disconnect(self):
+        """Close the AMP connection to the daemon, if any."""
+        self._connector.disconnect()
+        self._remote = None
+
     def _connect_and_call(self, name, *args, **kwargs):
-        """Connect to the remote daemon over AMP and perform the given command.
+        """Perform the given command on the remote daemon over AMP.
+
+        If the command fails, the connection is closed and a new one will
+        be made by the next call.
 
         @param name: The name of the command to perform.
-        @param args: Arguments list to be passed to the connect method
-        @param kwargs: Keywords arguments to pass to the connect method.
+        @param args: Arguments list to be passed to the command.
+        @param kwargs: Keywords arguments to pass to the command.
         @return: A L{Deferred} resulting in C{True} if the command was
             successful or C{False} otherwise.
         @see: L{RemoteLandscapeComponentCreator.connect}.
         """
 
-        def disconnect(ignored):
-            self._connector.disconnect()
-            return True
-
-        connected = self._connector.connect(self.max_retries, self.factor,
-                                            quiet=True)
-        connected.addCallback(lambda remote: getattr(remote, name)())
-        connected.addCallback(disconnect)
-        connected.addErrback(lambda x: False)
-        return connected
+        def call(remote):
+            result = getattr(remote, name)(*args, **kwargs)
+            result.addCallback(lambda ignored: True)
+            return result.addErrback(failed, remote)
+
+        def failed(failure, remote=None):
+            # A late failure on a connection already replaced by a new one
+            # doesn't close the new one.
+            if remote is None or remote is self._remote:
+                self._disconnect()
+            return False
+
+        result = self._get_remote()
+        result.addCallback(call)
+        result.addErrback(failed)
+        return result
 
     def request_exit(self):
-        return self._connect_and_call("exit")
+        result = self._connect_and_call("exit")
+
+        def disconnect(exited):
+            self._disconnect()
+            return exited
+
+        return result.addCallback(disconnect)
 
     def is_running(self):
-        # FIXME Error cases may not be handled in the best possible way
-        # here. We're basically return False if any error happens from the
-        # AMP ping.
-        return self._connect_and_call("ping")
+        """Ping the daemon, recording how long it took to answer.
+
+        @return: A L{Deferred} resulting in C{False} if the daemon couldn't
+            be contacted or didn't answer within C{ping_timeout} seconds, in
+            which case the connection is closed.
+        """
+        result = Deferred()
+        start_time = self._reactor.seconds()
+
+        def answered(is_running):
+            if timeout.active():
+                timeout.cancel()
+            if is_running:
+                self.ping_time = self._reactor.seconds() - start_time
+                if self.ping_time > SLOW_PING_THRESHOLD:
+                    warning("%s took %.1f seconds to respond to a ping, its "
+                            "reactor is lagging."
+                            % (self.program, self.ping_time))
+            if not result.called:
+                result.callback(is_running)
+
+        def timed_out():
+            # The connection may be wedged, make a new one for the next ping.
+            self._disconnect()
+            if not result.called:
+                result.callback(False)
+
+        timeout = self._reactor.callLater(self.ping_timeout, timed_out)
+        self._connect_and_call("ping").addCallback(answered)
+        return result
 
     def wait(self):
         """
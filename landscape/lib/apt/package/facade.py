@@ -8,6 +8,7 @@ import sys
 import tempfile
 import time
 
+from array import array
 from operator import attrgetter
 
 import apt
@@ -17,13 +18,26 @@ import apt_pkg
 from aptsources.sourceslist import SourcesList
 from apt.progress.text import AcquireProgress
 from apt.progress.base import InstallProgress
-from twisted.python.compat import itervalues
+from twisted.python.compat import iteritems, itervalues
 
 
 from landscape.lib.compat import StringIO
 from landscape.lib.fs import append_text_file, create_text_file
 from landscape.lib.fs import read_text_file, read_binary_file, touch_file
-from .skeleton import build_skeleton_apt
+from .skeleton import build_skeleton_apt, get_index_hashes
+
+
+# The flags of package versions returned by AptFacade.classify_packages.
+PACKAGE_INSTALLED = 1
+PACKAGE_AVAILABLE = 2
+PACKAGE_UPGRADE = 4
+PACKAGE_AUTOREMOVABLE = 8
+PACKAGE_SECURITY = 16
+PACKAGE_LOCKED = 32
+
+# Whether a package file is from the security or the backports archive.
+_FILE_SECURITY = 1
+_FILE_BACKPORTS = 2
 
 
 class TransactionError(Exception):
@@ -122,6 +136,15 @@ class AptFacade(object):
     these features slightly more comfortable.
 
     @param root: The root dir of the Apt configuration files.
+    @param lazy: Whether to open the system Apt cache only when it's first
+        needed, to compute the hashes of the packages only when they're
+        asked for, and to skip reopening the cache when reloading the
+        channels if the package lists, the sources and the dpkg status
+        didn't change.
+    @param hash_processes: The number of processes to compute the hashes of
+        all the packages in, parsing the package index files directly
+        instead of going through the Apt cache, or C{None} to compute them
+        in this process.
     @ivar refetch_package_index: Whether to refetch the package indexes
         when reloading the channels, or reuse the existing local
         database.
@@ -131,18 +154,25 @@ class AptFacade(object):
     dpkg_retry_sleep = 5
     _dpkg_status = "/var/lib/dpkg/status"
 
-    def __init__(self, root=None):
+    def __init__(self, root=None, lazy=False, hash_processes=None):
         self._root = root
         self._dpkg_args = []
         if self._root is not None:
             self._ensure_dir_structure()
             self._dpkg_args.extend(["--root", self._root])
-        # don't use memonly=True here because of a python-apt bug on Natty when
-        # sources.list contains invalid lines (LP: #886208)
-        self._cache = apt.cache.Cache(rootdir=root)
+        self.lazy = lazy
+        self.hash_processes = hash_processes
+        self._apt_cache = None
+        self._cache_stamp = None
+        if not lazy or root is not None:
+            # The Apt configuration of a root is only set up when its cache
+            # is opened, and is needed to manage the channels.
+            self._open_cache()
         self._channels_loaded = False
         self._pkg2hash = {}
         self._hash2pkg = {}
+        self._hashes_complete = False
+        self._versions_by_name = {}
         self._version_installs = []
         self._package_installs = set()
         self._global_upgrade = False
@@ -175,8 +205,116 @@ class AptFacade(object):
             os.makedirs(full_path)
         return full_path
 
+    @property
+    def _cache(self):
+        """The L{apt.cache.Cache}, opened the first time it's needed."""
+        if self._apt_cache is None:
+            self._open_cache()
+        return self._apt_cache
+
+    @_cache.setter
+    def _cache(self, cache):
+        """
+        Use the given cache, which is reopened and has its channels loaded
+        the next time they're reloaded.
+        """
+        self._apt_cache = cache
+        self._cache_stamp = None
+        self._channels_loaded = False
+
+    def _open_cache(self):
+        """Open the Apt cache, or reopen it if it's already open."""
+        # Take the stamp first, so that changes made while the cache is
+        # being opened are seen at the next reload.
+        self._cache_stamp = self._get_cache_stamp()
+        if self._apt_cache is None:
+            # don't use memonly=True here because of a python-apt bug on
+            # Natty when sources.list contains invalid lines (LP: #886208)
+            self._apt_cache = apt.cache.Cache(rootdir=self._root)
+        else:
+            self._apt_cache.open(None)
+
+    def _get_cache_stamp(self):
+        """
+        Return the modification times, sizes and inodes of the files the
+        Apt cache is built from: the package lists, the sources and the
+        dpkg status.
+        """
+        if self._root is None:
+            lists_dir = apt_pkg.config.find_dir("Dir::State::lists")
+            sources_list = apt_pkg.config.find_file("Dir::Etc::sourcelist")
+            sources_dir = apt_pkg.config.find_dir("Dir::Etc::sourceparts")
+        else:
+            lists_dir = os.path.join(self._root, "var/lib/apt/lists")
+            sources_list = os.path.join(self._root, "etc/apt/sources.list")
+            sources_dir = os.path.join(self._root, "etc/apt/sources.list.d")
+        paths = [self._dpkg_status, sources_list]
+        for directory in [lists_dir, sources_dir]:
+            try:
+                paths.extend(os.path.join(directory, filename)
+                             for filename in sorted(os.listdir(directory)))
+            except OSError:
+                pass
+        stamp = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamp.append((path, stat.st_mtime, stat.st_size, stat.st_ino))
+        return stamp
+
+    def _add_package_hashes(self, package, index_hashes=None):
+        """Compute the hashes of the versions of a package.
+
+        @param index_hashes: Optionally, the result of L{get_index_hashes}
+            for the index files of the cache. The hashes it has for the
+            versions of the package are used, if they were computed from the
+            records the Apt cache uses.
+        @return: The versions of the package.
+        """
+        versions = []
+        for version in package.versions:
+            hash = None
+            if index_hashes is not None:
+                hashes, hashed_filenames = index_hashes
+                hash = hashes.get((package.name, version.version))
+                if hash is not None:
+                    # The record of a version is read from its first file.
+                    package_file = version._cand.file_list[0][0]
+                    if package_file.filename not in hashed_filenames:
+                        hash = None
+            if hash is None:
+                hash = self.get_package_skeleton(
+                    version, with_info=False).get_hash()
+            # Use a tuple including the package, since the Version
+            # objects of two different packages can have the same
+            # hash.
+            self._pkg2hash[(package, version)] = hash
+            self._hash2pkg[hash] = version
+            versions.append(version)
+        return versions
+
+    def _ensure_package_hashes(self):
+        """Compute the hashes of all the packages, if they were deferred."""
+        if self._channels_loaded and not self._hashes_complete:
+            self._pkg2hash.clear()
+            self._hash2pkg.clear()
+            index_hashes = None
+            if self.hash_processes:
+                index_hashes = get_index_hashes(
+                    [package_file.filename
+                     for package_file in self._cache._cache.file_list],
+                    apt_pkg.config.find("APT::Architecture"),
+                    self.hash_processes)
+            for package in self._cache:
+                if self._is_main_architecture(package):
+                    self._add_package_hashes(package, index_hashes)
+            self._hashes_complete = True
+
     def get_packages(self):
         """Get all the packages available in the channels."""
+        self._ensure_package_hashes()
         return itervalues(self._hash2pkg)
 
     def get_locked_packages(self):
@@ -230,12 +368,18 @@ class AptFacade(object):
             information about the binaries packages that are in the facade's
             internal repo.
         """
-        self._cache.open(None)
         internal_sources_list = self._get_internal_sources_list()
-        if (self.refetch_package_index or
-            (force_reload_binaries and os.path.exists(internal_sources_list))
-            ):
+        refetch = self.refetch_package_index or (
+            force_reload_binaries and os.path.exists(internal_sources_list))
+        if (self.lazy and self._channels_loaded and not refetch and
+                self._cache_stamp == self._get_cache_stamp()):
+            # Nothing the cache is built from changed since it was opened,
+            # only forget the changes marked since.
+            self._cache.clear()
+            return
 
+        self._open_cache()
+        if refetch:
             # Try to update only the internal repos, if the python-apt
             # version is new enough to accept a sources_list parameter.
             new_apt_args = {}
@@ -250,22 +394,15 @@ class AptFacade(object):
                 raise ChannelError(
                     "Apt failed to reload channels (%r)" % (
                         self.get_channels()))
-            self._cache.open(None)
+            self._open_cache()
 
         self._pkg2hash.clear()
         self._hash2pkg.clear()
-        for package in self._cache:
-            if not self._is_main_architecture(package):
-                continue
-            for version in package.versions:
-                hash = self.get_package_skeleton(
-                    version, with_info=False).get_hash()
-                # Use a tuple including the package, since the Version
-                # objects of two different packages can have the same
-                # hash.
-                self._pkg2hash[(package, version)] = hash
-                self._hash2pkg[hash] = version
+        self._versions_by_name.clear()
+        self._hashes_complete = False
         self._channels_loaded = True
+        if not self.lazy:
+            self._ensure_package_hashes()
 
     def ensure_channels_reloaded(self):
         """Reload the channels if they haven't been reloaded yet."""
@@ -406,6 +543,7 @@ class AptFacade(object):
         # Reload the cache, otherwise architecture change isn't reflected in
         # package list
         self._cache.open(None)
+        self._cache_stamp = None
         return result
 
     def get_package_skeleton(self, pkg, with_info=True):
@@ -427,10 +565,16 @@ class AptFacade(object):
 
         @param version: an L{apt.package.Version} object.
         """
-        return self._pkg2hash.get((version.package, version))
+        key = (version.package, version)
+        if (key not in self._pkg2hash and self._channels_loaded and
+                not self._hashes_complete and
+                self._is_main_architecture(version.package)):
+            self._add_package_hashes(version.package)
+        return self._pkg2hash.get(key)
 
     def get_package_hashes(self):
         """Get the hashes of all the packages available in the channels."""
+        self._ensure_package_hashes()
         return self._pkg2hash.values()
 
     def get_package_by_hash(self, hash):
@@ -440,6 +584,7 @@ class AptFacade(object):
 
         @return: The L{apt.package.Package} that has the given hash.
         """
+        self._ensure_package_hashes()
         return self._hash2pkg.get(hash)
 
     def is_package_installed(self, version):
@@ -460,6 +605,93 @@ class AptFacade(object):
         """Was the package auto-installed, but isn't required anymore?"""
         return version.package.is_auto_removable
 
+    def classify_packages(self, get_hash_id, security_archive=None,
+                          backports_archive=None):
+        """Classify all the package versions in the channels in one pass.
+
+        This gives the same results as calling L{is_package_installed},
+        L{is_package_available}, L{is_package_upgrade},
+        L{is_package_autoremovable} and L{get_locked_packages}, and looking
+        at the origins of the versions, but the cache is walked once, the
+        properties of each package are looked up once for all its versions,
+        and the archive of each package file is looked up once.
+
+        @param get_hash_id: A callable returning the id of a package hash,
+            or C{None} if it's unknown. Versions without an id are skipped.
+        @param security_archive: The archive of the security pocket, like
+            C{"bionic-security"}. Versions in it get C{PACKAGE_SECURITY}.
+        @param backports_archive: The archive of the official backports,
+            like C{"bionic-backports"}. Versions only in it are skipped.
+        @return: A tuple of two arrays of the same length, holding the ids
+            of the versions and their C{PACKAGE_*} flags.
+        """
+        file_kinds = {}
+        for package_file in self._cache._cache.file_list:
+            kind = 0
+            if package_file.archive == security_archive:
+                kind |= _FILE_SECURITY
+            if package_file.archive == backports_archive:
+                kind |= _FILE_BACKPORTS
+            file_kinds[package_file.id] = kind
+
+        self._ensure_package_hashes()
+        ids = array("l")
+        flags = array("B")
+        last_package = None
+        for hash, version in iteritems(self._hash2pkg):
+            package = version.package
+            if package is not last_package:
+                last_package = package
+                installed = package.installed
+                if installed is None:
+                    installed_version = None
+                    package_flags = 0
+                    upgradable = False
+                else:
+                    installed_version = installed.version
+                    package_flags = PACKAGE_INSTALLED
+                    if package.is_auto_removable:
+                        package_flags |= PACKAGE_AUTOREMOVABLE
+                    if self._is_package_held(package):
+                        package_flags |= PACKAGE_LOCKED
+                    upgradable = package.is_upgradable
+
+            backports = 0
+            security = False
+            files = version._cand.file_list
+            for package_file, _ in files:
+                kind = file_kinds.get(package_file.id, 0)
+                if kind & _FILE_BACKPORTS:
+                    backports += 1
+                if kind & _FILE_SECURITY:
+                    security = True
+            if backports and backports == len(files):
+                # Versions only in the official backports archive are
+                # ignored, since pinning isn't supported.
+                continue
+
+            id = get_hash_id(hash)
+            if id is None:
+                continue
+
+            version_flags = 0
+            if installed_version is not None:
+                comparison = apt_pkg.version_compare(
+                    version.version, installed_version)
+                if comparison == 0:
+                    version_flags = package_flags
+                    if version.downloadable:
+                        version_flags |= PACKAGE_AVAILABLE
+                elif upgradable and comparison > 0:
+                    version_flags = PACKAGE_UPGRADE
+            if not version_flags & PACKAGE_INSTALLED:
+                version_flags |= PACKAGE_AVAILABLE
+            if security:
+                version_flags |= PACKAGE_SECURITY
+            ids.append(id)
+            flags.append(version_flags)
+        return ids, flags
+
     def _is_main_architecture(self, package):
         """Is the package for the facade's main architecture?"""
         # package.name includes the architecture, if it's for a foreign
@@ -479,6 +711,17 @@ class AptFacade(object):
 
         @param name: The name the returned packages should have.
         """
+        if self._channels_loaded and not self._hashes_complete:
+            # Only compute the hashes of the package asked for.
+            versions = self._versions_by_name.get(name)
+            if versions is None:
+                versions = []
+                if name in self._cache:
+                    package = self._cache[name]
+                    if self._is_main_architecture(package):
+                        versions = self._add_package_hashes(package)
+                self._versions_by_name[name] = versions
+            return list(versions)
         return [
             version for version in self.get_packages()
             if version.package.name == name]
@@ -1,8 +1,12 @@
+import multiprocessing
+import os
+import signal
+
 from landscape.lib.hashlib import sha1
 
 import apt_pkg
 
-from twisted.python.compat import unicode, _PY3
+from twisted.python.compat import iteritems, unicode, _PY3
 
 
 PACKAGE   = 1 << 0
@@ -113,6 +117,28 @@ def parse_record_field(record, record_field, relation_type,
     return relations
 
 
+def _get_relations(name, version_string, record):
+    """Return the sorted skeleton relations of a package version.
+
+    @param name: The name of the package, as in C{apt.package.Package.name}.
+    @param version_string: The version of the package.
+    @param record: A mapping of the fields of the package record.
+    """
+    relations = set()
+    relations.update(parse_record_field(record, "Provides", DEB_PROVIDES))
+    relations.add((DEB_NAME_PROVIDES, "%s = %s" % (name, version_string)))
+    relations.update(parse_record_field(
+        record, "Pre-Depends", DEB_REQUIRES, DEB_OR_REQUIRES))
+    relations.update(parse_record_field(
+        record, "Depends", DEB_REQUIRES, DEB_OR_REQUIRES))
+
+    relations.add((DEB_UPGRADES, "%s < %s" % (name, version_string)))
+
+    relations.update(parse_record_field(record, "Conflicts", DEB_CONFLICTS))
+    relations.update(parse_record_field(record, "Breaks", DEB_CONFLICTS))
+    return sorted(relations)
+
+
 def build_skeleton_apt(version, with_info=False, with_unicode=False):
     """Build a package skeleton from an apt package.
 
@@ -126,25 +152,8 @@ def build_skeleton_apt(version, with_info=False, with_unicode=False):
     if with_unicode:
         name, version_string = unicode(name), unicode(version_string)
     skeleton = PackageSkeleton(DEB_PACKAGE, name, version_string)
-    relations = set()
-    relations.update(parse_record_field(
-        version.record, "Provides", DEB_PROVIDES))
-    relations.add((
-        DEB_NAME_PROVIDES,
-        "%s = %s" % (version.package.name, version.version)))
-    relations.update(parse_record_field(
-        version.record, "Pre-Depends", DEB_REQUIRES, DEB_OR_REQUIRES))
-    relations.update(parse_record_field(
-        version.record, "Depends", DEB_REQUIRES, DEB_OR_REQUIRES))
-
-    relations.add((
-        DEB_UPGRADES, "%s < %s" % (version.package.name, version.version)))
-
-    relations.update(parse_record_field(
-        version.record, "Conflicts", DEB_CONFLICTS))
-    relations.update(parse_record_field(
-        version.record, "Breaks", DEB_CONFLICTS))
-    skeleton.relations = sorted(relations)
+    skeleton.relations = _get_relations(
+        version.package.name, version.version, version.record)
 
     if with_info:
         skeleton.section = version.section
@@ -161,3 +170,114 @@ def build_skeleton_apt(version, with_info=False, with_unicode=False):
             if not isinstance(skeleton.description, unicode):
                 skeleton.description = skeleton.description.decode("utf-8")
     return skeleton
+
+
+def build_skeleton_record(section):
+    """Build a package skeleton from a record of a package index file.
+
+    The skeleton has the same hash as the one L{build_skeleton_apt} builds
+    from the Apt version of the record, but the Apt cache isn't needed.
+
+    @param section: An C{apt_pkg.TagSection} of a C{Packages} index or of
+        the dpkg status file.
+    """
+    # Apt lowercases package names, like dpkg does.
+    name = unicode(section["Package"].lower())
+    version_string = unicode(section["Version"])
+    skeleton = PackageSkeleton(DEB_PACKAGE, name, version_string)
+    skeleton.relations = _get_relations(name, version_string, section)
+    return skeleton
+
+
+def get_index_file_hashes(filename, architecture):
+    """Return the skeleton hashes of the packages of an index file.
+
+    @param filename: The path of a C{Packages} index or of the dpkg status
+        file, possibly compressed.
+    @param architecture: The native architecture. Packages for other
+        architectures, except C{all}, are skipped.
+    @return: A C{dict} mapping the names and versions of the packages to
+        their hashes. Packages listed more than once with different
+        relations are mapped to C{None}.
+    """
+    hashes = {}
+    with apt_pkg.TagFile(filename) as tag_file:
+        for section in tag_file:
+            if "Version" not in section:
+                continue
+            if section.get("Architecture", architecture) not in (
+                    architecture, "all"):
+                continue
+            skeleton = build_skeleton_record(section)
+            key = (skeleton.name, skeleton.version)
+            hash = skeleton.get_hash()
+            if hashes.setdefault(key, hash) != hash:
+                hashes[key] = None
+    return hashes
+
+
+def _get_index_file_hashes(args):
+    """Call L{get_index_file_hashes} in a pool worker.
+
+    @return: The file name and its hashes, or C{None} if it can't be read.
+    """
+    filename, architecture = args
+    try:
+        return filename, get_index_file_hashes(filename, architecture)
+    except (IOError, OSError, SystemError):
+        return filename, None
+
+
+def _reset_signal_handlers():
+    """Restore the default signal handlers in a pool worker.
+
+    Workers are forked from processes running the reactor, whose handlers
+    for C{SIGTERM} and C{SIGINT} only stop the reactor, and would keep
+    them from being terminated.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+def get_index_hashes(filenames, architecture, processes=None):
+    """Compute the skeleton hashes of index files in a process pool.
+
+    Each index file is parsed by one of the processes, the biggest files
+    first.
+
+    @param filenames: The paths of the index files.
+    @param architecture: The native architecture.
+    @param processes: The number of processes to use, by default the number
+        of CPUs.
+    @return: A tuple C{(hashes, hashed_filenames)}. C{hashes} maps the names
+        and versions of the packages to their hashes, or to C{None} if they
+        differ between files. C{hashed_filenames} is the set of the files
+        which could be read.
+    """
+    sizes = {}
+    for filename in filenames:
+        try:
+            sizes[filename] = os.path.getsize(filename)
+        except OSError:
+            continue
+    shards = [(filename, architecture)
+              for filename in sorted(sizes, key=sizes.get, reverse=True)]
+    hashes = {}
+    hashed_filenames = set()
+    pool = multiprocessing.Pool(processes, _reset_signal_handlers)
+    try:
+        for filename, file_hashes in pool.imap_unordered(
+                _get_index_file_hashes, shards):
+            if file_hashes is None:
+                continue
+            hashed_filenames.add(filename)
+            for key, hash in iteritems(file_hashes):
+                if hashes.setdefault(key, hash) != hash:
+                    hashes[key] = None
+    except BaseException:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    return hashes, hashed_filenames
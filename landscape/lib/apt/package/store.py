@@ -1,5 +1,8 @@
 """Provide access to the persistent data used by L{PackageTaskHandler}s."""
+import binascii
+import gzip
 import time
+from array import array
 
 try:
     import sqlite3
@@ -9,7 +12,18 @@ except ImportError:
 from twisted.python.compat import iteritems, long
 
 from landscape.lib import bpickle
-from landscape.lib.store import with_cursor
+from landscape.lib.idset import IdSet
+from landscape.lib.store import (
+    apply_migrations, transaction, with_cursor, ConnectionProfile)
+
+
+# The tables holding the ids of packages in a given state.
+PACKAGE_STATE_TABLES = ("installed", "available", "available_upgrade",
+                        "locked", "autoremovable", "security")
+
+PACKAGE_STORE_PROFILE = ConnectionProfile(
+    journal_mode="wal", synchronous="normal", mmap_size=64 * 1024 * 1024,
+    busy_timeout=30, cache_size=8 * 1024)
 
 
 class UnknownHashIDRequest(Exception):
@@ -20,6 +34,10 @@ class InvalidHashIdDb(Exception):
     """Raised when trying to add an invalid hash=>id lookaside database."""
 
 
+class InvalidHashIdDelta(Exception):
+    """Raised when a hash=>id delta can't be applied."""
+
+
 class HashIdStore(object):
     """C{HashIdStore} stores package hash=>id mappings in a file.
 
@@ -27,15 +45,30 @@ class HashIdStore(object):
     The table schema is defined in L{ensure_hash_id_schema}.
 
     @param filename: The file where the mappings are persisted to.
+    @param connection_pool: Optionally, the L{ConnectionPool} to get the
+        connection to C{filename} from.
+    @param connection_profile: Optionally, the L{ConnectionProfile} to open
+        the connection to C{filename} with.
     """
     _db = None
 
-    def __init__(self, filename):
+    def __init__(self, filename, connection_pool=None,
+                 connection_profile=None):
         self._filename = filename
+        self._connection_pool = connection_pool
+        self.connection_profile = connection_profile
 
     def _ensure_schema(self):
         ensure_hash_id_schema(self._db)
 
+    def transaction(self):
+        """Return a context manager running the operations of the store in
+        a single transaction.
+
+        @see: L{landscape.lib.store.transaction}
+        """
+        return transaction(self)
+
     @with_cursor
     def set_hash_ids(self, cursor, hash_ids):
         """Set the ids of a set of hashes.
@@ -80,6 +113,62 @@ class HashIdStore(object):
         """Delete all hash=>id mappings."""
         cursor.execute("DELETE FROM hash")
 
+    @with_cursor
+    def get_version(self, cursor):
+        """Return the version of the hash=>id mappings.
+
+        Versions are set by L{apply_delta}, mappings which never had one are
+        at version 0.
+        """
+        try:
+            cursor.execute("SELECT version FROM hash_id_version")
+        except sqlite3.OperationalError:
+            return 0
+        value = cursor.fetchone()
+        if value:
+            return value[0]
+        return 0
+
+    @with_cursor
+    def apply_delta(self, cursor, from_version, to_version, changes):
+        """Update the hash=>id mappings from one version to another.
+
+        The changes are applied, and the version updated, in a single
+        transaction.
+
+        @param from_version: The version the changes apply to, which must be
+            the current one.
+        @param to_version: The version of the mappings after the changes.
+        @param changes: An iterable of C{(hash, id)} tuples, where an C{id} of
+            C{None} removes the mapping of the hash.
+        @raise InvalidHashIdDelta: If the mappings aren't at C{from_version}.
+        """
+        cursor.execute("CREATE TABLE IF NOT EXISTS hash_id_version"
+                       " (version INTEGER)")
+        cursor.execute("SELECT version FROM hash_id_version")
+        value = cursor.fetchone()
+        version = value[0] if value else 0
+        if version != from_version:
+            raise InvalidHashIdDelta(
+                "Delta from version %d can't be applied to version %d" %
+                (from_version, version))
+        batch = []
+        for hash, id in changes:
+            if id is None:
+                if batch:
+                    cursor.executemany("REPLACE INTO hash VALUES (?, ?)",
+                                       batch)
+                    batch = []
+                cursor.execute("DELETE FROM hash WHERE hash=?",
+                               (sqlite3.Binary(hash),))
+            else:
+                batch.append((id, sqlite3.Binary(hash)))
+        if batch:
+            cursor.executemany("REPLACE INTO hash VALUES (?, ?)", batch)
+        cursor.execute("DELETE FROM hash_id_version")
+        cursor.execute("INSERT INTO hash_id_version VALUES (?)",
+                       (to_version,))
+
     @with_cursor
     def check_sanity(self, cursor):
         """Check database integrity.
@@ -104,10 +193,18 @@ class PackageStore(HashIdStore):
     The additional tables and schemas are defined in L{ensure_package_schema}.
 
     @param filename: The file where data is persisted to.
+    @param connection_pool: Optionally, the L{ConnectionPool} to get the
+        connection to C{filename} from.
+    @param connection_profile: The L{ConnectionProfile} to open the
+        connection to C{filename} with. By default, the database is opened
+        in WAL mode, since the reporter, the changer and the monitor use it
+        concurrently.
     """
 
-    def __init__(self, filename):
-        super(PackageStore, self).__init__(filename)
+    def __init__(self, filename, connection_pool=None,
+                 connection_profile=PACKAGE_STORE_PROFILE):
+        super(PackageStore, self).__init__(filename, connection_pool,
+                                           connection_profile)
         self._hash_id_stores = []
 
     def _ensure_schema(self):
@@ -176,8 +273,8 @@ class PackageStore(HashIdStore):
 
     @with_cursor
     def add_available(self, cursor, ids):
-        for id in ids:
-            cursor.execute("REPLACE INTO available VALUES (?)", (id,))
+        cursor.executemany("REPLACE INTO available VALUES (?)",
+                           ((id,) for id in ids))
 
     @with_cursor
     def remove_available(self, cursor, ids):
@@ -195,8 +292,8 @@ class PackageStore(HashIdStore):
 
     @with_cursor
     def add_available_upgrades(self, cursor, ids):
-        for id in ids:
-            cursor.execute("REPLACE INTO available_upgrade VALUES (?)", (id,))
+        cursor.executemany("REPLACE INTO available_upgrade VALUES (?)",
+                           ((id,) for id in ids))
 
     @with_cursor
     def remove_available_upgrades(self, cursor, ids):
@@ -215,8 +312,8 @@ class PackageStore(HashIdStore):
 
     @with_cursor
     def add_autoremovable(self, cursor, ids):
-        for id in ids:
-            cursor.execute("REPLACE INTO autoremovable VALUES (?)", (id,))
+        cursor.executemany("REPLACE INTO autoremovable VALUES (?)",
+                           ((id,) for id in ids))
 
     @with_cursor
     def remove_autoremovable(self, cursor, ids):
@@ -234,8 +331,8 @@ class PackageStore(HashIdStore):
 
     @with_cursor
     def add_security(self, cursor, ids):
-        for id in ids:
-            cursor.execute("REPLACE INTO security VALUES (?)", (id,))
+        cursor.executemany("REPLACE INTO security VALUES (?)",
+                           ((id,) for id in ids))
 
     @with_cursor
     def remove_security(self, cursor, ids):
@@ -253,8 +350,8 @@ class PackageStore(HashIdStore):
 
     @with_cursor
     def add_installed(self, cursor, ids):
-        for id in ids:
-            cursor.execute("REPLACE INTO installed VALUES (?)", (id,))
+        cursor.executemany("REPLACE INTO installed VALUES (?)",
+                           ((id,) for id in ids))
 
     @with_cursor
     def remove_installed(self, cursor, ids):
@@ -279,8 +376,8 @@ class PackageStore(HashIdStore):
     @with_cursor
     def add_locked(self, cursor, ids):
         """Add the given package ids to the list of locked packages."""
-        for id in ids:
-            cursor.execute("REPLACE INTO locked VALUES (?)", (id,))
+        cursor.executemany("REPLACE INTO locked VALUES (?)",
+                           ((id,) for id in ids))
 
     @with_cursor
     def remove_locked(self, cursor, ids):
@@ -292,6 +389,40 @@ class PackageStore(HashIdStore):
         """Remove all the package ids in the locked table."""
         cursor.execute("DELETE FROM locked")
 
+    @with_cursor
+    def get_package_state(self, cursor):
+        """Return the ids in each of the package state tables.
+
+        @return: A C{dict} mapping the names in C{PACKAGE_STATE_TABLES} to
+            L{IdSet}s of the ids in the tables.
+        """
+        state = {}
+        for table in PACKAGE_STATE_TABLES:
+            cursor.execute("SELECT id FROM %s" % table)
+            state[table] = IdSet(array("l", (row[0] for row in cursor)))
+        return state
+
+    @with_cursor
+    def apply_package_changes(self, cursor, added=None, removed=None):
+        """Update the package state tables in a single transaction.
+
+        @param added: A C{dict} mapping names in C{PACKAGE_STATE_TABLES} to
+            the ids to add to the table.
+        @param removed: A C{dict} mapping names in C{PACKAGE_STATE_TABLES}
+            to the ids to remove from the table.
+        """
+        added = added or {}
+        removed = removed or {}
+        for table in set(added) | set(removed):
+            if table not in PACKAGE_STATE_TABLES:
+                raise ValueError("Unknown package state table %r" % table)
+        for table, ids in removed.items():
+            cursor.executemany("DELETE FROM %s WHERE id=?" % table,
+                               ((id,) for id in ids))
+        for table, ids in added.items():
+            cursor.executemany("REPLACE INTO %s VALUES (?)" % table,
+                               ((id,) for id in ids))
+
     @with_cursor
     def add_hash_id_request(self, cursor, hashes):
         hashes = list(hashes)
@@ -374,6 +505,64 @@ class FakePackageStore(PackageStore):
         return [(row[0], bytes(row[1])) for row in result]
 
 
+class SharedFakePackageStore(object):
+    """A read-only view of a L{FakePackageStore}, shared by in-process clones.
+
+    The database is read through a single memory-mapped connection, and the
+    messages are kept in memory once loaded, instead of each clone opening
+    the store and loading them again.
+    """
+
+    mmap_size = 64 * 1024 * 1024
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._db = None
+        self._messages = {}
+
+    def _get_db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self._filename)
+            self._db.execute("PRAGMA query_only = ON")
+            self._db.execute("PRAGMA mmap_size = %d" % self.mmap_size)
+        return self._db
+
+    def get_message_ids(self):
+        try:
+            rows = self._get_db().execute("SELECT id FROM message").fetchall()
+        except sqlite3.OperationalError:
+            # The message table isn't created yet.
+            return []
+        return [row[0] for row in rows]
+
+    def get_messages_by_ids(self, message_ids):
+        missing = [message_id for message_id in message_ids
+                   if message_id not in self._messages]
+        if missing:
+            params = ", ".join(["?"] * len(missing))
+            rows = self._get_db().execute(
+                "SELECT id, data FROM message WHERE id IN (%s)" % params,
+                tuple(missing)).fetchall()
+            for message_id, data in rows:
+                self._messages[message_id] = bytes(data)
+        return [(message_id, self._messages[message_id])
+                for message_id in sorted(message_ids)
+                if message_id in self._messages]
+
+
+_shared_fake_package_stores = {}
+
+
+def get_shared_fake_package_store(filename):
+    """Return the L{SharedFakePackageStore} of C{filename} for this process.
+    """
+    store = _shared_fake_package_stores.get(filename)
+    if store is None:
+        store = SharedFakePackageStore(filename)
+        _shared_fake_package_stores[filename] = store
+    return store
+
+
 class HashIDRequest(object):
 
     def __init__(self, db, id):
@@ -441,6 +630,31 @@ class PackageTask(object):
         cursor.execute("DELETE FROM task WHERE id=?", (self.id,))
 
 
+def read_hash_id_delta(filename):
+    """Read the changes of a gzip-compressed hash=>id delta file.
+
+    Each line of the file holds a hex-encoded hash followed by its id, or by
+    C{-} if its mapping is removed.
+
+    @return: A generator of C{(hash, id)} tuples, as accepted by
+        L{HashIdStore.apply_delta}.
+    @raise InvalidHashIdDelta: If a line is malformed.
+    """
+    with gzip.open(filename, "rb") as fd:
+        for line in fd:
+            fields = line.split()
+            if not fields:
+                continue
+            try:
+                hash_hex, id = fields
+                hash = binascii.unhexlify(hash_hex)
+                id = None if id == b"-" else int(id)
+            except (ValueError, TypeError, binascii.Error):
+                raise InvalidHashIdDelta("Invalid line in %s: %r" %
+                                         (filename, line))
+            yield hash, id
+
+
 def ensure_hash_id_schema(db):
     """Create all tables needed by a L{HashIdStore}.
 
@@ -458,41 +672,49 @@ def ensure_hash_id_schema(db):
         db.commit()
 
 
+def _create_package_tables(cursor):
+    # Databases created before the schema was versioned may have some of
+    # these tables already.
+    cursor.execute("CREATE TABLE IF NOT EXISTS security"
+                   " (id INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS autoremovable"
+                   " (id INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS locked"
+                   " (id INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS available"
+                   " (id INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS available_upgrade"
+                   " (id INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS installed"
+                   " (id INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS hash_id_request"
+                   " (id INTEGER PRIMARY KEY, timestamp TIMESTAMP,"
+                   " message_id INTEGER, hashes BLOB)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS task"
+                   " (id INTEGER PRIMARY KEY, queue TEXT,"
+                   " timestamp TIMESTAMP, data BLOB)")
+
+
+def _index_task_queue(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS task_queue"
+                   " ON task (queue, timestamp)")
+
+
+PACKAGE_SCHEMA_MIGRATIONS = [
+    _create_package_tables,
+    _index_task_queue,
+]
+
+
 def ensure_package_schema(db):
     """Create all tables needed by a L{PackageStore}.
 
+    The schema is versioned, changes to it must be made by appending a
+    migration to C{PACKAGE_SCHEMA_MIGRATIONS}.
+
     @param db: A connection to a SQLite database.
     """
-    # FIXME This needs a "patch" table with a "version" column which will
-    #       help with upgrades.  It should also be used to decide when to
-    #       create the schema from the ground up, rather than that using
-    #       try block.
-    cursor = db.cursor()
-    try:
-        cursor.execute("CREATE TABLE security"
-                       " (id INTEGER PRIMARY KEY)")
-        cursor.execute("CREATE TABLE autoremovable"
-                       " (id INTEGER PRIMARY KEY)")
-        cursor.execute("CREATE TABLE locked"
-                       " (id INTEGER PRIMARY KEY)")
-        cursor.execute("CREATE TABLE available"
-                       " (id INTEGER PRIMARY KEY)")
-        cursor.execute("CREATE TABLE available_upgrade"
-                       " (id INTEGER PRIMARY KEY)")
-        cursor.execute("CREATE TABLE installed"
-                       " (id INTEGER PRIMARY KEY)")
-        cursor.execute("CREATE TABLE hash_id_request"
-                       " (id INTEGER PRIMARY KEY, timestamp TIMESTAMP,"
-                       " message_id INTEGER, hashes BLOB)")
-        cursor.execute("CREATE TABLE task"
-                       " (id INTEGER PRIMARY KEY, queue TEXT,"
-                       " timestamp TIMESTAMP, data BLOB)")
-    except sqlite3.OperationalError:
-        cursor.close()
-        db.rollback()
-    else:
-        cursor.close()
-        db.commit()
+    apply_migrations(db, PACKAGE_SCHEMA_MIGRATIONS)
 
 
 def ensure_fake_package_schema(db):
@@ -1,3 +1,4 @@
+from array import array
 from collections import namedtuple
 import os
 import sys
@@ -23,7 +24,8 @@ from landscape.lib.apt.package.testing import (
     create_simple_repository)
 from landscape.lib.apt.package.facade import (
     TransactionError, DependencyError, ChannelError, AptFacade,
-    LandscapeInstallProgress)
+    LandscapeInstallProgress, PACKAGE_INSTALLED, PACKAGE_AVAILABLE,
+    PACKAGE_UPGRADE, PACKAGE_AUTOREMOVABLE, PACKAGE_SECURITY, PACKAGE_LOCKED)
 
 
 _normalize_field = (lambda f: f.replace("-", "_").lower())
@@ -2681,6 +2683,201 @@ class AptFacadeTest(testing.HelperTestCase, testing.FSTestCase,
         foo_10 = sorted(self.facade.get_packages_by_name("foo"))[0]
         self.assertEqual([foo_10], self.facade.get_locked_packages())
 
+    def make_lazy_facade(self):
+        facade = AptFacade(root=self.apt_root, lazy=True)
+        facade.dpkg_retry_sleep = 0
+        return facade
+
+    def test_lazy_reload_channels_unchanged(self):
+        """
+        In lazy mode, the cache isn't reopened when reloading the channels
+        if the package lists and the dpkg status didn't change, but the
+        marked changes are forgotten.
+        """
+        self._add_system_package("foo")
+        facade = self.make_lazy_facade()
+        facade.reload_channels()
+        [foo] = facade.get_packages_by_name("foo")
+        foo.package.mark_delete()
+        with mock.patch.object(facade._cache, "open") as open_mock:
+            facade.reload_channels()
+        open_mock.assert_not_called()
+        self.assertFalse(foo.package.marked_delete)
+        self.assertEqual([foo], facade.get_packages_by_name("foo"))
+
+    def test_lazy_reload_channels_changed(self):
+        """
+        In lazy mode, the cache is reopened if the dpkg status changed.
+        """
+        self._add_system_package("foo")
+        facade = self.make_lazy_facade()
+        facade.reload_channels()
+        self._add_system_package("bar")
+        facade.reload_channels()
+        self.assertEqual(["bar", "foo"],
+                         sorted(version.package.name
+                                for version in facade.get_packages()))
+
+    def test_lazy_package_hashes(self):
+        """
+        In lazy mode, the hashes of the packages are computed when they are
+        asked for, or for the packages asked for by name.
+        """
+        self._add_system_package("foo")
+        self._add_system_package("bar")
+        facade = self.make_lazy_facade()
+        facade.reload_channels()
+        [foo] = facade.get_packages_by_name("foo")
+        self.assertEqual([], facade.get_packages_by_name("missing"))
+        self.assertEqual([(foo.package, foo)], list(facade._pkg2hash))
+        self.facade.reload_channels()
+        [eager_foo] = self.facade.get_packages_by_name("foo")
+        self.assertEqual(self.facade.get_package_hash(eager_foo),
+                         facade.get_package_hash(foo))
+        self.assertEqual(
+            sorted(self.facade.get_package_hashes()),
+            sorted(facade.get_package_hashes()))
+
+    def get_hashes_by_name(self, facade):
+        """Return a C{dict} mapping the names and versions to their hashes."""
+        return dict(
+            ((version.package.name, version.version),
+             facade.get_package_hash(version))
+            for version in facade.get_packages())
+
+    def test_hash_processes(self):
+        """
+        With C{hash_processes}, the hashes of the packages are computed in a
+        process pool from the package index files, and are the same as the
+        ones computed from the Apt cache.
+        """
+        deb_dir = self.makeDir()
+        create_simple_repository(deb_dir)
+        self.facade.add_channel_deb_dir(deb_dir)
+        self._add_system_package(
+            "installed", control_fields={"Depends": "name1 | name2"})
+        self._add_package_to_deb_dir(
+            deb_dir, "installed", control_fields={"Depends": "name1 | name2"})
+        self._add_package_to_deb_dir(deb_dir, "Upper", version="2.0")
+        self.facade.reload_channels()
+        hashes = self.get_hashes_by_name(self.facade)
+        self.assertEqual(HASH1, hashes[("name1", "version1-release1")])
+
+        facade = AptFacade(root=self.apt_root, hash_processes=2)
+        with mock.patch.object(facade, "get_package_skeleton") as skeleton:
+            facade.reload_channels()
+        skeleton.assert_not_called()
+        self.assertEqual(hashes, self.get_hashes_by_name(facade))
+
+    def test_hash_processes_conflicting_records(self):
+        """
+        The hashes of packages whose records differ between index files are
+        computed from the Apt cache, since they depend on the record Apt
+        uses. Apt keeps a version for each of the records.
+        """
+        self._add_system_package("foo", control_fields={"Depends": "bar"})
+        deb_dir = self.makeDir()
+        self._add_package_to_deb_dir(deb_dir, "foo")
+        self._add_package_to_deb_dir(deb_dir, "bar")
+        self.facade.add_channel_apt_deb(
+            "file://%s" % deb_dir, "./", trusted=True)
+        self.facade.reload_channels()
+        hashes = self.get_hashes_by_name(self.facade)
+
+        facade = AptFacade(root=self.apt_root, hash_processes=2)
+        get_package_skeleton = facade.get_package_skeleton
+        with mock.patch.object(facade, "get_package_skeleton",
+                               side_effect=get_package_skeleton) as skeleton:
+            facade.reload_channels()
+        self.assertEqual(
+            set(["foo"]),
+            set(call[0][0].package.name for call in skeleton.call_args_list))
+        self.assertEqual(hashes, self.get_hashes_by_name(facade))
+
+    def _classify_packages(self, **kwargs):
+        """
+        Classify the packages, giving them ids in order of name and version,
+        and return a C{dict} mapping the name and version of each package to
+        its flags.
+        """
+        versions = sorted(self.facade.get_packages(),
+                          key=self.version_sortkey)
+        hash_ids = dict(
+            (self.facade.get_package_hash(version), id)
+            for id, version in enumerate(versions))
+        ids, flags = self.facade.classify_packages(hash_ids.get, **kwargs)
+        return dict(
+            ((versions[id].package.name, versions[id].version), version_flags)
+            for id, version_flags in zip(ids, flags))
+
+    def test_classify_packages(self):
+        """
+        L{AptFacade.classify_packages} returns the C{PACKAGE_*} flags of
+        all the versions, like the C{is_package_*} methods tell them.
+        """
+        self._add_system_package(
+            "foo", version="1.0",
+            control_fields={"Status": "hold ok installed"})
+        self._add_system_package("bar", version="1.0")
+        deb_dir = self.makeDir()
+        self._add_package_to_deb_dir(deb_dir, "foo", version="1.5")
+        self._add_package_to_deb_dir(deb_dir, "bar", version="1.0")
+        self._add_package_to_deb_dir(deb_dir, "baz", version="1.0")
+        self.facade.add_channel_apt_deb(
+            "file://%s" % deb_dir, "./", trusted=True)
+        self.facade.reload_channels()
+        self.assertEqual(
+            {("foo", "1.0"): PACKAGE_INSTALLED | PACKAGE_LOCKED,
+             ("foo", "1.5"): PACKAGE_AVAILABLE | PACKAGE_UPGRADE,
+             ("bar", "1.0"): PACKAGE_INSTALLED | PACKAGE_AVAILABLE,
+             ("baz", "1.0"): PACKAGE_AVAILABLE},
+            self._classify_packages())
+
+    def test_classify_packages_autoremovable(self):
+        """
+        Installed versions which aren't required anymore are flagged with
+        C{PACKAGE_AUTOREMOVABLE}.
+        """
+        self._add_system_package("dep")
+        self.facade.reload_channels()
+        [dep] = self.facade.get_packages_by_name("dep")
+        dep.package.mark_auto(True)
+        self.assertEqual(
+            {("dep", "1.0"): PACKAGE_INSTALLED | PACKAGE_AUTOREMOVABLE},
+            self._classify_packages())
+
+    def test_classify_packages_unknown_ids(self):
+        """Versions without an id are skipped."""
+        self._add_system_package("foo")
+        self.facade.reload_channels()
+        self.assertEqual(
+            (array("l"), array("B")),
+            self.facade.classify_packages(lambda hash: None))
+
+    def test_classify_packages_archives(self):
+        """
+        Versions in the security archive are flagged with
+        C{PACKAGE_SECURITY}, and the ones only in the backports archive are
+        skipped.
+        """
+        security_dir = self.makeDir()
+        self._add_package_to_deb_dir(security_dir, "foo", version="1.5")
+        with open(os.path.join(security_dir, "Release"), "w") as release:
+            release.write("Suite: codename-security")
+        backports_dir = self.makeDir()
+        self._add_package_to_deb_dir(backports_dir, "foo", version="2.0")
+        with open(os.path.join(backports_dir, "Release"), "w") as release:
+            release.write("Suite: codename-backports")
+        for deb_dir in [security_dir, backports_dir]:
+            self.facade.add_channel_apt_deb(
+                "file://%s" % deb_dir, "./", trusted=True)
+        self.facade.reload_channels()
+        self.assertEqual(
+            {("foo", "1.5"): PACKAGE_AVAILABLE | PACKAGE_SECURITY},
+            self._classify_packages(
+                security_archive="codename-security",
+                backports_archive="codename-backports"))
+
     def test_perform_changes_dependency_error_same_version(self):
         """
         Apt's Version objects have the same hash if the version string
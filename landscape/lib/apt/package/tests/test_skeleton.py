@@ -1,5 +1,10 @@
+import multiprocessing
+import os
+import signal
 import unittest
 
+import apt_pkg
+
 from landscape.lib import testing
 from landscape.lib.apt.package.testing import (
     AptFacadeHelper, HASH1, create_simple_repository, create_deb,
@@ -10,9 +15,10 @@ from landscape.lib.apt.package.testing import (
     HASH_MULTIPLE_RELATIONS, PKGNAME_OR_RELATIONS, PKGDEB_OR_RELATIONS,
     HASH_OR_RELATIONS)
 from landscape.lib.apt.package.skeleton import (
-    build_skeleton_apt, DEB_PROVIDES, DEB_PACKAGE,
-    DEB_NAME_PROVIDES, DEB_REQUIRES, DEB_OR_REQUIRES, DEB_UPGRADES,
-    DEB_CONFLICTS, PackageSkeleton)
+    build_skeleton_apt, build_skeleton_record, get_index_file_hashes,
+    get_index_hashes, DEB_PROVIDES, DEB_PACKAGE, DEB_NAME_PROVIDES,
+    DEB_REQUIRES, DEB_OR_REQUIRES, DEB_UPGRADES, DEB_CONFLICTS,
+    PackageSkeleton)
 
 from twisted.python.compat import unicode
 
@@ -277,6 +283,128 @@ class SkeletonAptTest(BaseTestCase):
         self.assertEqual(HASH_OR_RELATIONS, skeleton.get_hash())
 
 
+class SkeletonRecordTest(BaseTestCase):
+    """Tests for building skeletons from package index records."""
+
+    helpers = [AptFacadeHelper, SkeletonTestHelper]
+
+    def setUp(self):
+        super(SkeletonRecordTest, self).setUp()
+        self.facade.add_channel_deb_dir(self.skeleton_repository_dir)
+        self.packages_file = os.path.join(
+            self.skeleton_repository_dir, "Packages")
+
+    def test_build_skeleton_record(self):
+        """
+        L{build_skeleton_record} builds skeletons with the same names,
+        versions, relations and hashes as L{build_skeleton_apt}, from the
+        records of a C{Packages} file.
+        """
+        self.facade._cache.open(None)
+        self.facade._cache.update(None)
+        self.facade._cache.open(None)
+        hashes = set()
+        with apt_pkg.TagFile(self.packages_file) as tag_file:
+            for section in tag_file:
+                skeleton = build_skeleton_record(section)
+                version = self.facade._cache[section["Package"]].candidate
+                apt_skeleton = build_skeleton_apt(version, with_unicode=True)
+                self.assertEqual(apt_skeleton.name, skeleton.name)
+                self.assertEqual(apt_skeleton.version, skeleton.version)
+                self.assertEqual(apt_skeleton.relations, skeleton.relations)
+                self.assertEqual(apt_skeleton.get_hash(), skeleton.get_hash())
+                hashes.add(skeleton.get_hash())
+        self.assertTrue(
+            set([HASH1, HASH_MINIMAL, HASH_SIMPLE_RELATIONS,
+                 HASH_VERSION_RELATIONS, HASH_MULTIPLE_RELATIONS,
+                 HASH_OR_RELATIONS]).issubset(hashes))
+
+    def test_get_index_file_hashes(self):
+        """
+        L{get_index_file_hashes} maps the names and versions of the packages
+        of an index file to their hashes.
+        """
+        hashes = get_index_file_hashes(self.packages_file, "amd64")
+        self.assertEqual(8, len(hashes))
+        self.assertEqual(HASH1, hashes[("name1", "version1-release1")])
+        self.assertEqual(HASH_MINIMAL, hashes[("minimal", "1.0")])
+        self.assertEqual(HASH_OR_RELATIONS, hashes[("or-relations", "1.0")])
+
+    def test_get_index_file_hashes_architecture(self):
+        """
+        Packages for other architectures than the native one and C{all} are
+        skipped.
+        """
+        deb_dir = self.makeDir()
+        self._add_package_to_deb_dir(deb_dir, "native", architecture="amd64")
+        self._add_package_to_deb_dir(deb_dir, "all")
+        self._add_package_to_deb_dir(deb_dir, "foreign", architecture="i386")
+        hashes = get_index_file_hashes(
+            os.path.join(deb_dir, "Packages"), "amd64")
+        self.assertEqual([("all", "1.0"), ("native", "1.0")], sorted(hashes))
+
+    def test_get_index_file_hashes_lowercase_names(self):
+        """Package names are lowercased, like Apt does."""
+        deb_dir = self.makeDir()
+        self._add_package_to_deb_dir(deb_dir, "Name")
+        hashes = get_index_file_hashes(
+            os.path.join(deb_dir, "Packages"), "amd64")
+        self.assertEqual([("name", "1.0")], list(hashes))
+
+    def test_get_index_file_hashes_conflicting_records(self):
+        """
+        Packages listed twice with different relations are mapped to
+        C{None}, since the hash Apt would use isn't known.
+        """
+        deb_dir = self.makeDir()
+        self._add_package_to_deb_dir(deb_dir, "name")
+        self._add_package_to_deb_dir(
+            deb_dir, "name", control_fields={"Depends": "other"})
+        hashes = get_index_file_hashes(
+            os.path.join(deb_dir, "Packages"), "amd64")
+        self.assertEqual({("name", "1.0"): None}, hashes)
+
+    def test_get_index_hashes(self):
+        """
+        L{get_index_hashes} merges the hashes of several index files, which
+        are computed in a process pool. Packages whose hashes differ between
+        files are mapped to C{None}, and files which can't be read are left
+        out of the hashed files.
+        """
+        deb_dir1 = self.makeDir()
+        deb_dir2 = self.makeDir()
+        self._add_package_to_deb_dir(deb_dir1, "name")
+        self._add_package_to_deb_dir(deb_dir1, "same")
+        self._add_package_to_deb_dir(
+            deb_dir2, "name", control_fields={"Depends": "other"})
+        self._add_package_to_deb_dir(deb_dir2, "same")
+        filenames = [os.path.join(deb_dir1, "Packages"),
+                     os.path.join(deb_dir2, "Packages"),
+                     self.packages_file, self.makeFile()]
+        hashes, hashed_filenames = get_index_hashes(
+            filenames, "amd64", processes=2)
+        self.assertEqual(set(filenames[:3]), hashed_filenames)
+        self.assertIs(None, hashes[("name", "1.0")])
+        self.assertEqual(
+            get_index_file_hashes(filenames[0], "amd64")[("same", "1.0")],
+            hashes[("same", "1.0")])
+        self.assertEqual(HASH_MINIMAL, hashes[("minimal", "1.0")])
+
+    def test_get_index_hashes_with_reactor_signal_handlers(self):
+        """
+        L{get_index_hashes} returns when called from a process running the
+        reactor, whose C{SIGTERM} handler is inherited by the pool workers,
+        and leaves no workers behind.
+        """
+        reactor_handler = signal.signal(signal.SIGTERM, lambda *args: None)
+        self.addCleanup(signal.signal, signal.SIGTERM, reactor_handler)
+        hashes, hashed_filenames = get_index_hashes(
+            [self.packages_file], "amd64", processes=2)
+        self.assertEqual(set([self.packages_file]), hashed_filenames)
+        self.assertEqual(HASH_MINIMAL, hashes[("minimal", "1.0")])
+        self.assertEqual([], multiprocessing.active_children())
+
+
 class SkeletonTest(BaseTestCase):
 
     def test_skeleton_set_hash(self):
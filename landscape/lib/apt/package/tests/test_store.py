@@ -1,12 +1,17 @@
+import gzip
 import mock
 import sqlite3
 import threading
 import time
 import unittest
 
-from landscape.lib import testing
+from landscape.lib import bpickle, testing
+from landscape.lib.idset import IdSet
 from landscape.lib.apt.package.store import (
-        HashIdStore, PackageStore, UnknownHashIDRequest, InvalidHashIdDb)
+        HashIdStore, PackageStore, UnknownHashIDRequest, InvalidHashIdDb,
+        InvalidHashIdDelta, FakePackageStore, SharedFakePackageStore,
+        get_shared_fake_package_store, read_hash_id_delta)
+from landscape.lib.store import ConnectionPool
 
 
 class BaseTestCase(testing.FSTestCase, unittest.TestCase):
@@ -125,6 +130,71 @@ class HashIdStoreTest(BaseTestCase):
         store = HashIdStore(store_filename)
         self.assertRaises(InvalidHashIdDb, store.check_sanity)
 
+    def test_get_version(self):
+        """Mappings which were never updated by a delta are at version 0."""
+        self.store1.set_hash_ids({b"hash1": 123})
+        self.assertEqual(0, self.store1.get_version())
+
+    def test_apply_delta(self):
+        """
+        L{HashIdStore.apply_delta} adds, replaces and removes mappings, and
+        updates the version.
+        """
+        self.store1.set_hash_ids({b"hash1": 123, b"hash2": 456})
+        self.store1.apply_delta(
+            0, 3, [(b"hash1", None), (b"hash2", 789), (b"hash3", 123)])
+        self.assertEqual({b"hash2": 789, b"hash3": 123},
+                         self.store2.get_hash_ids())
+        self.assertEqual(3, self.store2.get_version())
+        self.store2.apply_delta(3, 4, [(b"hash2", None)])
+        self.assertEqual({b"hash3": 123}, self.store1.get_hash_ids())
+        self.assertEqual(4, self.store1.get_version())
+
+    def test_apply_delta_wrong_version(self):
+        """
+        Deltas from another version than the current one aren't applied.
+        """
+        self.store1.set_hash_ids({b"hash1": 123})
+        self.assertRaises(InvalidHashIdDelta, self.store1.apply_delta,
+                          2, 3, [(b"hash1", None)])
+        self.assertEqual({b"hash1": 123}, self.store1.get_hash_ids())
+        self.assertEqual(0, self.store1.get_version())
+
+    def test_apply_delta_rolls_back(self):
+        """
+        Deltas are applied in a single transaction, so errors leave the
+        mappings untouched.
+        """
+        self.store1.set_hash_ids({b"hash1": 123})
+
+        def changes():
+            yield (b"hash1", None)
+            raise InvalidHashIdDelta()
+
+        self.assertRaises(InvalidHashIdDelta, self.store1.apply_delta,
+                          0, 1, changes())
+        self.assertEqual({b"hash1": 123}, self.store1.get_hash_ids())
+        self.assertEqual(0, self.store1.get_version())
+
+    def test_read_hash_id_delta(self):
+        """
+        L{read_hash_id_delta} reads hex-encoded hashes along with their ids,
+        or C{-} for removed ones.
+        """
+        filename = self.makeFile()
+        with gzip.open(filename, "wb") as fd:
+            fd.write(b"6861736831 123\n6861736832 -\n")
+        self.assertEqual([(b"hash1", 123), (b"hash2", None)],
+                         list(read_hash_id_delta(filename)))
+
+    def test_read_hash_id_delta_invalid(self):
+        """Malformed lines raise L{InvalidHashIdDelta}."""
+        filename = self.makeFile()
+        with gzip.open(filename, "wb") as fd:
+            fd.write(b"6861736831 abc\n")
+        self.assertRaises(InvalidHashIdDelta, list,
+                          read_hash_id_delta(filename))
+
 
 class PackageStoreTest(BaseTestCase):
 
@@ -321,6 +391,59 @@ class PackageStoreTest(BaseTestCase):
         self.assertTrue(time.time() - started < 5,
                         "Removing 20k installed ids took more than 5 seconds.")
 
+    def test_get_package_state(self):
+        """
+        L{PackageStore.get_package_state} returns the ids of each package
+        state table, as L{IdSet}s.
+        """
+        self.store1.add_installed([1, 2])
+        self.store1.add_available([3])
+        self.store1.add_available_upgrades([4])
+        self.store1.add_locked([5])
+        self.store1.add_autoremovable([2])
+        self.store1.add_security([3, 6])
+        self.assertEqual(
+            {"installed": IdSet([1, 2]), "available": IdSet([3]),
+             "available_upgrade": IdSet([4]), "locked": IdSet([5]),
+             "autoremovable": IdSet([2]), "security": IdSet([3, 6])},
+            self.store2.get_package_state())
+
+    def test_apply_package_changes(self):
+        """
+        L{PackageStore.apply_package_changes} adds and removes ids from the
+        package state tables, in a single transaction.
+        """
+        self.store1.add_installed([1, 2])
+        self.store1.add_locked([3])
+        db = self.store1._db
+        commits = []
+
+        class FakeDb(object):
+            def __getattr__(self, name):
+                if name == "commit":
+                    return self.commit
+                return getattr(db, name)
+
+            def commit(self):
+                commits.append(None)
+                db.commit()
+
+        self.store1._db = FakeDb()
+        self.store1.apply_package_changes(
+            added={"installed": IdSet([3]), "available": [1, 4],
+                   "security": IdSet()},
+            removed={"installed": [1], "locked": IdSet([3])})
+        self.assertEqual([None], commits)
+        self.assertEqual([2, 3], sorted(self.store2.get_installed()))
+        self.assertEqual([1, 4], sorted(self.store2.get_available()))
+        self.assertEqual([], self.store2.get_locked())
+        self.assertEqual([], self.store2.get_security())
+
+    def test_apply_package_changes_unknown_table(self):
+        """Only the package state tables can be changed."""
+        self.assertRaises(ValueError, self.store1.apply_package_changes,
+                          added={"task": [1]})
+
     def test_clear_installed(self):
         self.store1.add_installed([1, 2, 3, 4])
         self.store1.clear_installed()
@@ -580,3 +703,108 @@ class PackageStoreTest(BaseTestCase):
             thread.join()
 
         self.assertEqual(error, [])
+
+    def test_wal(self):
+        """
+        Package stores are opened in WAL mode, so that readers don't block
+        the reporter, the changer or the monitor writing to them.
+        """
+        self.store1.get_installed()
+        self.assertEqual(
+            "wal",
+            self.store1._db.execute("PRAGMA journal_mode").fetchone()[0])
+
+    def test_schema_version(self):
+        """
+        The version of the schema is recorded, along with the indexes added
+        by the migrations.
+        """
+        self.store1.get_installed()
+        db = sqlite3.connect(self.filename)
+        self.addCleanup(db.close)
+        self.assertEqual(
+            2, db.execute("SELECT MAX(version) FROM patch").fetchone()[0])
+        self.assertEqual(
+            [("task_queue",)],
+            db.execute("SELECT name FROM sqlite_master "
+                       "WHERE type='index' AND tbl_name='task'").fetchall())
+
+    def test_transaction(self):
+        """
+        Operations made within L{PackageStore.transaction} are committed
+        together.
+        """
+        with self.store1.transaction():
+            self.store1.add_installed([1, 2])
+            self.store1.add_available([3])
+            self.assertEqual([], self.store2.get_installed())
+        self.assertEqual([1, 2], self.store2.get_installed())
+        self.assertEqual([3], self.store2.get_available())
+
+    def test_connection_pool(self):
+        """
+        Stores of the same file with the same L{ConnectionPool} share their
+        connection.
+        """
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        store1 = PackageStore(self.filename, pool)
+        store2 = FakePackageStore(self.filename, pool)
+        store1.add_task("reporter", "data")
+        self.assertEqual("data", store2.get_next_task("reporter").data)
+        self.assertIs(store1._db, store2._db)
+        self.assertIsNot(store1._db, pool.connect(self.makeFile()))
+
+
+class SharedFakePackageStoreTest(BaseTestCase):
+
+    def setUp(self):
+        super(SharedFakePackageStoreTest, self).setUp()
+        self.filename = self.makeFile()
+        self.store = FakePackageStore(self.filename)
+        self.shared_store = SharedFakePackageStore(self.filename)
+
+    def test_get_messages(self):
+        """
+        L{SharedFakePackageStore} reads the messages of a L{FakePackageStore}.
+        """
+        self.store.save_message({"type": "test", "value": 1})
+        self.store.save_message({"type": "test", "value": 2})
+        self.assertEqual([1, 2], self.shared_store.get_message_ids())
+        self.assertEqual(
+            [(2, bpickle.dumps({"type": "test", "value": 2}))],
+            self.shared_store.get_messages_by_ids([2]))
+
+    def test_get_messages_cached(self):
+        """
+        Messages are read from the database once.
+        """
+        self.store.save_message({"type": "test"})
+        [(_, data)] = self.shared_store.get_messages_by_ids([1])
+        self.store._db.execute("DELETE FROM message")
+        self.store._db.commit()
+        self.assertEqual([(1, data)],
+                         self.shared_store.get_messages_by_ids([1]))
+
+    def test_read_only(self):
+        """The database can't be changed through the shared store."""
+        self.store.save_message({"type": "test"})
+        self.shared_store.get_message_ids()
+        self.assertRaises(sqlite3.OperationalError,
+                          self.shared_store._db.execute,
+                          "DELETE FROM message")
+
+    def test_no_message_table(self):
+        """
+        No messages are returned if the message table doesn't exist yet.
+        """
+        shared_store = SharedFakePackageStore(self.makeFile())
+        self.assertEqual([], shared_store.get_message_ids())
+
+    def test_get_shared_fake_package_store(self):
+        """
+        L{get_shared_fake_package_store} returns the same store for a file.
+        """
+        store = get_shared_fake_package_store(self.filename)
+        self.assertIs(store, get_shared_fake_package_store(self.filename))
+        self.assertIsNot(store, get_shared_fake_package_store(self.makeFile()))
@@ -1,8 +1,11 @@
 from __future__ import division
 
+import logging
 import os
 import re
 import codecs
+import threading
+import time
 
 from twisted.python.compat import _PY3
 
@@ -16,6 +19,111 @@ STABLE_FILESYSTEMS = frozenset(
 EXTRACT_DEVICE = re.compile("([a-z]+)[0-9]*")
 
 
+class StatvfsTimeout(OSError):
+    """Raised when C{statvfs} on a mount point didn't complete in time."""
+
+
+class StatvfsPool(object):
+    """Call C{statvfs} from worker threads, giving up after a timeout.
+
+    A hung network filesystem makes C{statvfs} block forever, so calling it
+    from the reactor thread would freeze the whole process. Instances of
+    this class can be used in place of C{os.statvfs}: each call is run by a
+    worker thread, and if it doesn't complete within C{timeout} seconds of
+    being started the last known result for that path is returned instead
+    and the path is added to L{stale}. While a call for a path is still
+    hanging no new one is issued for it, so there's at most one worker
+    thread per path, and a hung mount costs at most C{timeout} seconds once.
+
+    Calls for several paths can be started at once with L{prefetch}, so that
+    the time spent waiting for them is at most C{timeout} seconds overall,
+    instead of C{timeout} seconds per slow path.
+
+    @param statvfs: The function to call, C{os.statvfs} by default.
+    @param timeout: The number of seconds to wait for each call.
+    @param create_time: A function returning the current time.
+
+    @ivar stale: The set of paths for which the last call returned a stale
+        result, or failed because of a timeout.
+    @ivar latencies: A C{dict} mapping paths to the number of seconds their
+        last C{statvfs} call took, or has been running for if it's still
+        hanging.
+    """
+
+    def __init__(self, statvfs=os.statvfs, timeout=5, create_time=time.time):
+        self._statvfs = statvfs
+        self.timeout = timeout
+        self._create_time = create_time
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_results = {}
+        self.stale = set()
+        self.latencies = {}
+
+    def prefetch(self, paths):
+        """Start the C{statvfs} calls for C{paths}, without waiting for them.
+        """
+        for path in paths:
+            self._start(path)
+
+    def _start(self, path):
+        """Return the pending call for C{path}, starting it if needed."""
+        with self._lock:
+            call = self._pending.get(path)
+            if call is not None:
+                return call
+            call = self._pending[path] = _StatvfsCall(self._create_time())
+        thread = threading.Thread(target=self._run, args=(path, call))
+        thread.daemon = True
+        thread.start()
+        return call
+
+    def __call__(self, path):
+        call = self._start(path)
+        # A call still hanging from a previous run isn't waited for again.
+        timeout = max(0, call.started + self.timeout - self._create_time())
+        if call.done.wait(timeout):
+            # Completed calls are kept until their result is used, so that
+            # prefetched results aren't computed again.
+            with self._lock:
+                if self._pending.get(path) is call:
+                    del self._pending[path]
+            self.stale.discard(path)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self.stale.add(path)
+        self.latencies[path] = self._create_time() - call.started
+        if path in self._last_results:
+            logging.warning(
+                "statvfs on %s didn't complete within %s seconds, using "
+                "its last known values." % (path, self.timeout))
+            return self._last_results[path]
+        raise StatvfsTimeout(
+            "statvfs on %s didn't complete within %s seconds"
+            % (path, self.timeout))
+
+    def _run(self, path, call):
+        try:
+            call.result = self._statvfs(path)
+        except Exception as error:
+            call.error = error
+        else:
+            self._last_results[path] = call.result
+        self.latencies[path] = self._create_time() - call.started
+        call.done.set()
+
+
+class _StatvfsCall(object):
+
+    def __init__(self, started):
+        self.started = started
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
 def get_mount_info(mounts_file, statvfs_,
                    filesystems_whitelist=STABLE_FILESYSTEMS):
     """
@@ -31,7 +139,22 @@ def get_mount_info(mounts_file, statvfs_,
         is not available, C{None} is returned. Both C{total-space} and
         C{free-space} are in megabytes.
     """
-    for line in open(mounts_file):
+    mounts = parse_mounts(open(mounts_file), filesystems_whitelist)
+    return stat_mounts(mounts, statvfs_)
+
+
+def parse_mounts(lines, filesystems_whitelist=STABLE_FILESYSTEMS):
+    """
+    This is a generator that yields the mounted filesystems listed in the
+    content of a file like C{/proc/mounts}, without calling C{statvfs} on
+    them, so the result can be cached until the mount table changes.
+
+    @param lines: The lines of the mount table.
+    @param filesystems_whitelist: Optionally, a list of which filesystems to
+        include.
+    @return: C{(device, mount_point, filesystem)} tuples.
+    """
+    for line in lines:
         try:
             device, mount_point, filesystem = line.split()[:3]
             if _PY3:
@@ -44,7 +167,26 @@ def get_mount_info(mounts_file, statvfs_,
             filesystem not in filesystems_whitelist
             ):
             continue
-        megabytes = 1024 * 1024
+        yield device, mount_point, filesystem
+
+
+def stat_mounts(mounts, statvfs_):
+    """
+    This is a generator that yields information about the given mounted
+    filesystems, as returned by L{parse_mounts}, skipping the ones that
+    C{statvfs_} fails on.
+
+    If C{statvfs_} is a L{StatvfsPool}, the calls for all the mounts are
+    started at once.
+
+    @return: The same C{dict}s as L{get_mount_info}.
+    """
+    megabytes = 1024 * 1024
+    mounts = list(mounts)
+    prefetch = getattr(statvfs_, "prefetch", None)
+    if prefetch is not None:
+        prefetch([mount_point for _, mount_point, _ in mounts])
+    for device, mount_point, filesystem in mounts:
         try:
             stats = statvfs_(mount_point)
         except OSError:
@@ -72,10 +214,20 @@ def get_filesystem_for_path(path, mounts_file, statvfs_):
         is not available, C{None} is returned. Both C{total-space} and
         C{free-space} are in megabytes.
     """
+    return find_filesystem_for_path(
+        path, get_mount_info(mounts_file, statvfs_))
+
+
+def find_filesystem_for_path(path, mount_info):
+    """
+    Like L{get_filesystem_for_path}, but looking up C{path} in the given
+    C{mount_info} as returned by L{get_mount_info}, to save calling
+    C{statvfs} on every mount point again.
+    """
     candidate = None
     path = os.path.realpath(path)
     path_segments = path.split("/")
-    for info in get_mount_info(mounts_file, statvfs_):
+    for info in mount_info:
         mount_segments = info["mount-point"].split("/")
         if path.startswith(info["mount-point"]):
             if ((not candidate) or
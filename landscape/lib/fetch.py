@@ -1,3 +1,4 @@
+import hashlib
 import os
 import sys
 import io
@@ -44,6 +45,25 @@ class PyCurlError(FetchError):
         return self._message
 
 
+class SizeLimitError(FetchError):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+    def __str__(self):
+        return "Content is larger than %d bytes" % self.max_size
+
+
+class HashMismatchError(FetchError):
+
+    def __init__(self, expected, actual):
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        return "Expected SHA256 %s, got %s" % (self.expected, self.actual)
+
+
 def fetch(url, post=False, data="", headers={}, cainfo=None, curl=None,
           connect_timeout=30, total_timeout=600, insecure=False, follow=True,
           user_agent=None, proxy=None):
@@ -65,10 +85,41 @@ def fetch(url, post=False, data="", headers={}, cainfo=None, curl=None,
     @param proxy: The proxy url to use for the request.
     """
     import pycurl
+    input = io.BytesIO()
+    curl = _perform(
+        url, input.write, post=post, data=data, headers=headers,
+        cainfo=cainfo, curl=curl, connect_timeout=connect_timeout,
+        total_timeout=total_timeout, insecure=insecure, follow=follow,
+        user_agent=user_agent, proxy=proxy)
+
+    body = input.getvalue()
+
+    http_code = curl.getinfo(pycurl.HTTP_CODE)
+    if http_code != 200:
+        raise HTTPCodeError(http_code, body)
+
+    return body
+
+
+def _perform(url, write, post=False, data="", headers={}, cainfo=None,
+             curl=None, connect_timeout=30, total_timeout=600, insecure=False,
+             follow=True, user_agent=None, proxy=None, header_function=None,
+             resume_from=0):
+    """Set up a curl handle for C{url} and perform the transfer.
+
+    The response body is passed chunk by chunk to C{write}, see L{fetch} for
+    the meaning of the other parameters.
+
+    @param header_function: Optionally, a function called with each raw
+        header line received from the server.
+    @param resume_from: If non-zero, ask the server for the content starting
+        at this byte offset.
+    @return: The curl handle used for the transfer.
+    """
+    import pycurl
     if not isinstance(data, bytes):
         data = data.encode("utf-8")
     output = io.BytesIO(data)
-    input = io.BytesIO()
 
     if curl is None:
         curl = pycurl.Curl()
@@ -103,12 +154,20 @@ def fetch(url, post=False, data="", headers={}, cainfo=None, curl=None,
     if proxy is not None:
         curl.setopt(pycurl.PROXY, networkString(proxy))
 
+    if header_function is not None:
+        curl.setopt(pycurl.HEADERFUNCTION, header_function)
+
+    if resume_from:
+        # Unlike RESUME_FROM, a plain range doesn't make curl fail when the
+        # server ignores it and replies with the whole content.
+        curl.setopt(pycurl.RANGE, networkString("%d-" % resume_from))
+
     curl.setopt(pycurl.MAXREDIRS, 5)
     curl.setopt(pycurl.CONNECTTIMEOUT, connect_timeout)
     curl.setopt(pycurl.LOW_SPEED_LIMIT, 1)
     curl.setopt(pycurl.LOW_SPEED_TIME, total_timeout)
     curl.setopt(pycurl.NOSIGNAL, 1)
-    curl.setopt(pycurl.WRITEFUNCTION, input.write)
+    curl.setopt(pycurl.WRITEFUNCTION, write)
     curl.setopt(pycurl.DNS_CACHE_TIMEOUT, 0)
     curl.setopt(pycurl.ENCODING, b"gzip,deflate")
 
@@ -117,13 +176,141 @@ def fetch(url, post=False, data="", headers={}, cainfo=None, curl=None,
     except pycurl.error as e:
         raise PyCurlError(e.args[0], e.args[1])
 
-    body = input.getvalue()
+    return curl
+
+
+def fetch_to_file(url, filename, resume=False, sha256=None, max_size=None,
+                  progress=None, **kwargs):
+    """Retrieve a URL and stream its content straight into a file.
+
+    The body is written as it arrives to C{filename} with a C{.partial}
+    suffix, which is renamed to C{filename} once complete, so memory usage
+    doesn't depend on the size of the download and C{filename} never holds
+    incomplete content.
+
+    @param url: The url to be fetched.
+    @param filename: The path of the file to write the content to.
+    @param resume: If true and a previous download left a partial file, only
+        the missing bytes are requested with an HTTP range request. If the
+        server doesn't honour the range the file is rewritten from scratch.
+        Partial files are also kept after network errors, to be resumed.
+    @param sha256: Optionally, the expected hex SHA256 digest of the content.
+    @param max_size: Optionally, the maximum size of the content in bytes.
+    @param progress: Optionally, a function called from the downloading
+        thread with the number of bytes received so far and the total size
+        of the content, or C{None} if the server didn't send it.
+    @param kwargs: Other parameters accepted by L{fetch}.
+    @raises HTTPCodeError: If the server replied with an error, in which case
+        C{filename} is left untouched.
+    @raises SizeLimitError: If the content is larger than C{max_size}.
+    @raises HashMismatchError: If the content doesn't match C{sha256}.
+    """
+    import pycurl
+    partial = filename + ".partial"
+    offset = 0
+    if resume and os.path.exists(partial):
+        offset = os.path.getsize(partial)
+
+    # The status line of the last response tells us what to do with the
+    # body: append to the partial file (206), rewrite the whole file (200),
+    # or keep it aside as the body of an error.
+    response = {"code": None, "length": None}
+    state = {"received": 0, "too-large": False}
+    target = {}
+    error_body = io.BytesIO()
+    digest = hashlib.sha256() if sha256 else None
+
+    def header_function(line):
+        if line.startswith(b"HTTP/"):
+            parts = line.split()
+            if len(parts) > 1 and parts[1].isdigit():
+                response["code"] = int(parts[1])
+                response["length"] = None
+        elif line.lower().startswith(b"content-length:"):
+            value = line.split(b":", 1)[1].strip()
+            if value.isdigit():
+                response["length"] = int(value)
+
+    def open_target():
+        code = response["code"]
+        if code == 206 and offset:
+            if digest is not None:
+                _update_digest(digest, partial)
+            state["received"] = offset
+            return open(partial, "ab")
+        if code is None or code == 200:
+            return open(partial, "wb")
+        return error_body
+
+    def write(chunk):
+        if "file" not in target:
+            target["file"] = open_target()
+        if target["file"] is error_body:
+            error_body.write(chunk)
+            return
+        state["received"] += len(chunk)
+        total = response["length"]
+        if total is not None and response["code"] == 206:
+            total += offset
+        if max_size is not None and (state["received"] > max_size or
+                                     (total or 0) > max_size):
+            state["too-large"] = True
+            # Returning a different length makes curl abort the transfer.
+            return 0
+        target["file"].write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+        if progress is not None:
+            progress(state["received"], total)
+
+    try:
+        try:
+            curl = _perform(url, write, header_function=header_function,
+                            resume_from=offset, **kwargs)
+        finally:
+            if target.get("file") not in (None, error_body):
+                target["file"].close()
+        if state["too-large"]:
+            raise SizeLimitError(max_size)
+    except PyCurlError:
+        if state["too-large"]:
+            _remove(partial)
+            raise SizeLimitError(max_size)
+        if not resume:
+            _remove(partial)
+        raise
+    except SizeLimitError:
+        _remove(partial)
+        raise
 
     http_code = curl.getinfo(pycurl.HTTP_CODE)
-    if http_code != 200:
-        raise HTTPCodeError(http_code, body)
+    if http_code == 416 and offset:
+        # The partial file is already complete.
+        if digest is not None:
+            _update_digest(digest, partial)
+    elif http_code not in (200, 206):
+        if target.get("file") not in (None, error_body):
+            _remove(partial)
+        raise HTTPCodeError(http_code, error_body.getvalue())
+    elif "file" not in target:
+        # Empty body, make sure the file exists and is truncated.
+        open(partial, "ab" if http_code == 206 else "wb").close()
 
-    return body
+    if digest is not None and digest.hexdigest() != sha256.lower():
+        _remove(partial)
+        raise HashMismatchError(sha256, digest.hexdigest())
+    os.rename(partial, filename)
+
+
+def _update_digest(digest, filename):
+    with open(filename, "rb") as fd:
+        for chunk in iter(lambda: fd.read(65536), b""):
+            digest.update(chunk)
+
+
+def _remove(filename):
+    if os.path.exists(filename):
+        os.unlink(filename)
 
 
 def fetch_async(*args, **kwargs):
@@ -134,6 +321,16 @@ def fetch_async(*args, **kwargs):
     return deferToThread(fetch, *args, **kwargs)
 
 
+def fetch_to_file_async(*args, **kwargs):
+    """Retrieve a URL into a file asynchronously, see L{fetch_to_file}.
+
+    Note that a C{progress} function is called from the downloading thread.
+
+    @return: A C{Deferred} firing when the content has been written.
+    """
+    return deferToThread(fetch_to_file, *args, **kwargs)
+
+
 def fetch_many_async(urls, callback=None, errback=None, **kwargs):
     """
     Retrieve a list of URLs asynchronously.
@@ -175,25 +372,26 @@ def fetch_to_files(urls, directory, logger=None, **kwargs):
     """
     Retrieve a list of URLs and save their content as files in a directory.
 
+    The content is streamed to disk, see L{fetch_to_file}.
+
     @param urls: The list URLs to fetch.
     @param directory: The directory to save the files to, the name of the file
         will equal the last fragment of the URL.
     @param logger: Optional function to be used to log errors for failed URLs.
     """
 
-    def write(data, url):
-        filename = url_to_filename(url, directory=directory)
-        fd = open(filename, "wb")
-        fd.write(data)
-        fd.close()
-
     def log_error(failure, url):
         if logger:
             logger("Couldn't fetch file from %s (%s)" % (
                 url, str(failure.value)))
         return failure
 
-    return fetch_many_async(urls, callback=write, errback=log_error, **kwargs)
+    results = []
+    for url in urls:
+        filename = url_to_filename(url, directory=directory)
+        result = fetch_to_file_async(url, filename, **kwargs)
+        results.append(result.addErrback(log_error, url))
+    return DeferredList(results, fireOnOneErrback=True, consumeErrors=True)
 
 
 def test(args):
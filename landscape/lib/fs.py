@@ -1,5 +1,6 @@
 """File-system utils"""
 import os
+import tempfile
 import time
 
 
@@ -27,6 +28,32 @@ def create_binary_file(path, content):
         fd.write(content)
 
 
+def write_binary_file_atomically(path, content, mode=0o600):
+    """Replace a file with the given binary content, atomically.
+
+    The content is written to a new temporary file in the same directory,
+    created with an unpredictable name and without following symlinks,
+    which is then renamed to C{path}. Readers see either the old or the
+    new content, and it's safe to write to directories other users can
+    write to.
+
+    @param path: The path to the file.
+    @param content: The content to be written in the file.
+    @param mode: The permissions of the file.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(
+        prefix="." + name + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as temporary_file:
+            os.fchmod(temporary_file.fileno(), mode)
+            temporary_file.write(content)
+        os.rename(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
 def append_text_file(path, content):
     """Append a file with the given content.
 
@@ -0,0 +1,162 @@
+"""Compact sets of package ids.
+
+An L{IdSet} keeps non-negative integer ids as the bits of a single Python
+integer, instead of a C{set} of integer objects, when that takes less
+memory. Differences, unions and intersections of such sets are computed on
+the whole bitmap at once. Iterating over a set yields its ids in increasing
+order, as L{sequence_to_ranges} expects them::
+
+    new_installed = current_installed - old_installed
+    ranges = list(sequence_to_ranges(new_installed))
+
+A bitmap takes a bit for every id up to the highest one, while a C{set}
+takes about 64 bytes per id, so sets holding at least one id in 64 are kept
+as bitmaps, taking at most an eighth of the memory: a million ids up to a
+million take 125KiB instead of about 64MiB. The package ids allocated by the
+server are usually sparser than that, the ids known to a client being spread
+over millions, in which case the ids are kept in a C{frozenset}.
+
+Building and iterating over bitmaps is done in Python, so L{IdSet}s save
+memory rather than time. Diffing package states with 1% of changes, as
+measured with dev/idset-benchmark on Python 3.11, takes 1.3 to 2 times as
+long as with C{set}s: 150k ids up to 150k take 18KiB per state instead of
+about 9MiB, 150k ids up to 5M take 610KiB, and 60k ids up to 5M are kept in
+C{frozenset}s.
+"""
+import binascii
+from array import array
+
+
+# A block of 1024 bits without any id, as hexadecimal digits.
+_ZERO_BLOCK = "0" * 256
+
+
+class IdSet(object):
+    """An immutable set of non-negative integer ids.
+
+    The ids are stored as a bitmap, or in a C{frozenset} if they are too
+    sparse for the bitmap to take much less memory.
+
+    @param ids: An iterable of ids, like an C{array} of them.
+    """
+
+    __slots__ = ("_bits", "_ids")
+
+    def __init__(self, ids=()):
+        if not isinstance(ids, (array, list, tuple, set, frozenset)):
+            ids = array("l", ids)
+        self._bits = 0
+        self._ids = None
+        if not len(ids):
+            return
+        if min(ids) < 0:
+            raise ValueError("Ids must not be negative")
+        highest = max(ids)
+        if not _is_dense(highest, len(ids)):
+            self._bits = None
+            self._ids = frozenset(ids)
+            return
+        bitmap = bytearray((highest >> 3) + 1)
+        for id in ids:
+            bitmap[id >> 3] |= 1 << (id & 7)
+        bitmap.reverse()
+        self._bits = int(binascii.hexlify(bytes(bitmap)), 16)
+
+    @classmethod
+    def _from_bits(cls, bits):
+        id_set = cls()
+        id_set._bits = bits
+        return id_set
+
+    def __iter__(self):
+        """Iterate over the ids, in increasing order."""
+        if self._ids is not None:
+            return iter(sorted(self._ids))
+        return self._iter_bits()
+
+    def _iter_bits(self):
+        # The hexadecimal digits are walked from the last ones, holding the
+        # lowest ids, skipping blocks of zeros, in words of 64 bits.
+        digits = "%x" % self._bits
+        block_end = len(digits)
+        offset = 0
+        while block_end > 0:
+            block_start = max(0, block_end - 256)
+            if digits[block_start:block_end] != _ZERO_BLOCK:
+                end = block_end
+                word_offset = offset
+                while end > block_start:
+                    word = int(digits[max(block_start, end - 16):end], 16)
+                    while word:
+                        lowest = word & -word
+                        yield word_offset + lowest.bit_length() - 1
+                        word ^= lowest
+                    end -= 16
+                    word_offset += 64
+            block_end = block_start
+            offset += 1024
+
+    def _get_ids(self):
+        """Return the ids as a C{set} or C{frozenset}."""
+        if self._ids is not None:
+            return self._ids
+        return set(self._iter_bits())
+
+    def __len__(self):
+        if self._ids is not None:
+            return len(self._ids)
+        return bin(self._bits).count("1")
+
+    def __bool__(self):
+        if self._ids is not None:
+            return len(self._ids) != 0
+        return self._bits != 0
+
+    __nonzero__ = __bool__
+
+    def __contains__(self, id):
+        if id < 0:
+            return False
+        if self._ids is not None:
+            return id in self._ids
+        return bool(self._bits >> id & 1)
+
+    def __eq__(self, other):
+        if not isinstance(other, IdSet):
+            return NotImplemented
+        if self._ids is None and other._ids is None:
+            return self._bits == other._bits
+        return self._get_ids() == other._get_ids()
+
+    def __ne__(self, other):
+        if not isinstance(other, IdSet):
+            return NotImplemented
+        return not self == other
+
+    __hash__ = None
+
+    def __sub__(self, other):
+        if self._ids is None and other._ids is None:
+            return self._from_bits(self._bits & ~other._bits)
+        return IdSet(self._get_ids() - other._get_ids())
+
+    def __and__(self, other):
+        if self._ids is None and other._ids is None:
+            return self._from_bits(self._bits & other._bits)
+        return IdSet(self._get_ids() & other._get_ids())
+
+    def __or__(self, other):
+        if self._ids is None and other._ids is None:
+            return self._from_bits(self._bits | other._bits)
+        return IdSet(self._get_ids() | other._get_ids())
+
+    def __repr__(self):
+        return "IdSet(%r)" % list(self)
+
+
+def _is_dense(highest, count):
+    """
+    Whether a bitmap up to C{highest} takes at most 8 bytes per id, an
+    eighth of the memory of a C{set} of C{count} ids.
+    """
+    return highest < count * 64
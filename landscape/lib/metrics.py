@@ -0,0 +1,177 @@
+"""In-process metrics, in the Prometheus text exposition format.
+
+A L{MetricsRegistry} hands out counters, gauges and histograms, which
+components keep and update as they go::
+
+    registry = MetricsRegistry()
+    exchanges = registry.counter(
+        "landscape_exchanges_total", "Message exchanges started.")
+    exchanges.inc()
+
+The current values are exported with L{MetricsRegistry.format} or
+L{MetricsRegistry.write}, the latter being suitable for the textfile
+collector of the Prometheus node exporter.
+
+A registry created with C{enabled=False} hands out metrics which do
+nothing, so that components can be instrumented unconditionally at the
+cost of a method call.
+
+Metrics can be updated from threads other than the reactor one.
+"""
+import threading
+from bisect import bisect_left
+
+from landscape.lib.fs import write_binary_file_atomically
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class NullMetric(object):
+    """A metric which records nothing, handed out by disabled registries."""
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NULL_METRIC = NullMetric()
+
+
+class Counter(object):
+    """A value which only goes up, like a number of requests."""
+
+    type = "counter"
+
+    def __init__(self, name, help, lock):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = lock
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def get_samples(self):
+        """Return a list of C{(name, value)} tuples."""
+        return [(self.name, self.value)]
+
+
+class Gauge(Counter):
+    """A value which can go up and down, like the size of a queue."""
+
+    type = "gauge"
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class Histogram(object):
+    """The distribution of a value, like the duration of requests.
+
+    @param buckets: The sorted upper bounds of the buckets observations are
+        counted in.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, lock, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def get_samples(self):
+        """Return a list of C{(name, value)} tuples, with cumulative buckets.
+        """
+        samples = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            samples.append(
+                ('%s_bucket{le="%s"}' % (self.name, _format_value(bound)),
+                 total))
+        samples.append((self.name + "_sum", self.sum))
+        samples.append((self.name + "_count", self.count))
+        return samples
+
+
+class MetricsRegistry(object):
+    """Create and export metrics.
+
+    @param enabled: If C{False}, the metrics handed out record nothing and
+        nothing is exported.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_metric(self, factory, name, help, *args):
+        if not self.enabled:
+            return NULL_METRIC
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = factory(name, help, self._lock, *args)
+            self._metrics[name] = metric
+        elif not isinstance(metric, factory):
+            raise ValueError("%s is already a %s" % (name, metric.type))
+        return metric
+
+    def counter(self, name, help):
+        """Return the L{Counter} called C{name}, creating it if needed."""
+        return self._get_metric(Counter, name, help)
+
+    def gauge(self, name, help):
+        """Return the L{Gauge} called C{name}, creating it if needed."""
+        return self._get_metric(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        """Return the L{Histogram} called C{name}, creating it if needed."""
+        return self._get_metric(Histogram, name, help, buckets)
+
+    def format(self):
+        """Return the current value of the metrics in the text format."""
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                lines.append("# HELP %s %s" % (name, metric.help))
+                lines.append("# TYPE %s %s" % (name, metric.type))
+                for sample_name, value in metric.get_samples():
+                    lines.append("%s %s" % (sample_name, _format_value(value)))
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, filename):
+        """Atomically write the metrics to C{filename}."""
+        if not self.enabled:
+            return
+        # The node exporter usually runs as another user.
+        write_binary_file_atomically(
+            filename, self.format().encode("utf-8"), 0o644)
@@ -0,0 +1,233 @@
+"""
+A minimal rtnetlink client, dumping network links and addresses.
+
+A single C{RTM_GETLINK} dump returns the name, flags and hardware address
+of every interface, and a single C{RTM_GETADDR} dump all of their
+addresses. This is much cheaper than querying interfaces one by
+one on hosts with thousands of them.
+
+@see: rtnetlink(7), C{include/uapi/linux/rtnetlink.h} and
+    C{include/uapi/linux/if_link.h}.
+"""
+import errno
+import os
+import socket
+import struct
+
+__all__ = ["NetlinkError", "dump_links", "dump_addresses"]
+
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+
+IFLA_ADDRESS = 1
+IFLA_BROADCAST = 2
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+NLMSG_ERROR_CODE = struct.Struct("=i")
+RTATTR_HEADER = struct.Struct("=HH")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBI")
+
+LINK_ATTRIBUTES = frozenset([
+    IFLA_ADDRESS, IFLA_BROADCAST, IFLA_IFNAME, IFLA_MTU])
+
+RECEIVE_BUFFER_SIZE = 65536
+
+
+class NetlinkError(Exception):
+    """Raised when the kernel replies to a netlink request with an error.
+
+    @ivar errno: The error number reported by the kernel.
+    """
+
+    def __init__(self, error_number):
+        self.errno = error_number
+        super(NetlinkError, self).__init__(
+            "Netlink request failed: %s" % os.strerror(error_number))
+
+
+def _align(length):
+    """Round C{length} up to the 4 bytes netlink messages are aligned to."""
+    return (length + 3) & ~3
+
+
+def parse_attributes(data, offset=0, types=None):
+    """Parse the routing attributes found in C{data} from C{offset}.
+
+    @param types: Optionally, the set of attribute types to return. Links
+        carry dozens of attributes, so skipping the unneeded ones saves
+        copying them.
+    @return: A C{dict} mapping attribute types to their payload bytes.
+    """
+    attributes = {}
+    end = len(data)
+    unpack_from = RTATTR_HEADER.unpack_from
+    header_size = RTATTR_HEADER.size
+    while offset + header_size <= end:
+        length, attribute_type = unpack_from(data, offset)
+        if length < header_size:
+            break
+        if types is None or attribute_type in types:
+            attributes[attribute_type] = data[
+                offset + header_size:offset + length]
+        offset += (length + 3) & ~3
+    return attributes
+
+
+def parse_messages(data):
+    """Split a buffer received from a netlink socket into messages.
+
+    @return: A list of C{(type, flags, sequence, payload)} tuples.
+    """
+    messages = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, message_type, flags, sequence, pid = NLMSG_HEADER.unpack_from(
+            data, offset)
+        if length < NLMSG_HEADER.size:
+            break
+        messages.append((message_type, flags, sequence,
+                         data[offset + NLMSG_HEADER.size:offset + length]))
+        offset += _align(length)
+    return messages
+
+
+def _dump(sock, request_type, payload, sequence=1):
+    """Send a dump request and yield the payloads of the replies.
+
+    @raise NetlinkError: If the kernel replied with an error.
+    """
+    header = NLMSG_HEADER.pack(
+        NLMSG_HEADER.size + len(payload), request_type,
+        NLM_F_REQUEST | NLM_F_DUMP, sequence, 0)
+    sock.send(header + payload)
+    while True:
+        data = sock.recv(RECEIVE_BUFFER_SIZE)
+        if not data:
+            raise NetlinkError(errno.EIO)
+        for message_type, flags, reply_sequence, body in parse_messages(data):
+            if reply_sequence != sequence:
+                continue
+            if message_type == NLMSG_DONE:
+                return
+            if message_type == NLMSG_ERROR:
+                code = NLMSG_ERROR_CODE.unpack_from(body)[0]
+                if code:
+                    raise NetlinkError(-code)
+                return
+            yield message_type, body
+
+
+def _open_socket():
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    sock.bind((0, 0))
+    return sock
+
+
+def _format_hardware_address(data):
+    return ":".join("%02x" % byte for byte in bytearray(data))
+
+
+def _decode_name(data):
+    return data.split(b"\0", 1)[0].decode("utf-8", "replace")
+
+
+def parse_link(body):
+    """Parse the payload of a C{RTM_NEWLINK} message.
+
+    @return: A C{dict} with C{index}, C{name}, C{flags}, C{address},
+        C{broadcast} and C{mtu} keys. The addresses are formatted as colon
+        separated hexadecimal bytes, or C{None} if the link has none.
+    """
+    family, link_type, index, flags, change = IFINFOMSG.unpack_from(body)
+    attributes = parse_attributes(body, IFINFOMSG.size, LINK_ATTRIBUTES)
+    link = {"index": index, "flags": flags,
+            "name": _decode_name(attributes.get(IFLA_IFNAME, b"")),
+            "address": None, "broadcast": None, "mtu": None}
+    if IFLA_ADDRESS in attributes:
+        link["address"] = _format_hardware_address(attributes[IFLA_ADDRESS])
+    if IFLA_BROADCAST in attributes:
+        link["broadcast"] = _format_hardware_address(
+            attributes[IFLA_BROADCAST])
+    if IFLA_MTU in attributes:
+        link["mtu"] = struct.unpack("=I", attributes[IFLA_MTU][:4])[0]
+    return link
+
+
+def parse_address(body):
+    """Parse the payload of a C{RTM_NEWADDR} message.
+
+    @return: A C{dict} with C{index}, C{family}, C{prefixlen}, C{scope},
+        C{address}, C{local}, C{broadcast} and C{label} keys. Addresses are
+        formatted with L{socket.inet_ntop}, or C{None} if missing.
+    """
+    family, prefixlen, flags, scope, index = IFADDRMSG.unpack_from(body)
+    attributes = parse_attributes(body, IFADDRMSG.size)
+    address = {"index": index, "family": family, "prefixlen": prefixlen,
+               "scope": scope, "label": None}
+    for key, attribute_type in (("address", IFA_ADDRESS),
+                                ("local", IFA_LOCAL),
+                                ("broadcast", IFA_BROADCAST)):
+        data = attributes.get(attribute_type)
+        address[key] = None
+        if data is not None:
+            address[key] = socket.inet_ntop(family, data)
+    if IFA_LABEL in attributes:
+        address["label"] = _decode_name(attributes[IFA_LABEL])
+    return address
+
+
+def dump_links(sock=None):
+    """Return information about all network links, with a single request.
+
+    @param sock: Optionally, the C{NETLINK_ROUTE} socket to use.
+    @return: A list of C{dict}s as returned by L{parse_link}, in interface
+        index order.
+    @raise NetlinkError: If the kernel rejects the request.
+    @raise socket.error: If netlink sockets aren't available.
+    """
+    return _dump_all(sock, RTM_GETLINK, IFINFOMSG.pack(0, 0, 0, 0, 0),
+                     RTM_NEWLINK, parse_link)
+
+
+def dump_addresses(sock=None):
+    """Return all the addresses of all network links, with a single request.
+
+    @param sock: Optionally, the C{NETLINK_ROUTE} socket to use.
+    @return: A list of C{dict}s as returned by L{parse_address}.
+    @raise NetlinkError: If the kernel rejects the request.
+    @raise socket.error: If netlink sockets aren't available.
+    """
+    return _dump_all(sock, RTM_GETADDR, IFADDRMSG.pack(0, 0, 0, 0, 0),
+                     RTM_NEWADDR, parse_address)
+
+
+def _dump_all(sock, request_type, payload, reply_type, parse):
+    own_socket = sock is None
+    if own_socket:
+        sock = _open_socket()
+    try:
+        return [parse(body) for message_type, body
+                in _dump(sock, request_type, payload)
+                if message_type == reply_type]
+    finally:
+        if own_socket:
+            sock.close()
@@ -1,7 +1,8 @@
 from __future__ import absolute_import
 
 """
-Network introspection utilities using ioctl and the /proc filesystem.
+Network introspection utilities using netlink, ioctl and the /proc
+filesystem.
 """
 import array
 import fcntl
@@ -13,10 +14,16 @@ import logging
 import netifaces
 from twisted.python.compat import long
 
+from landscape.lib.netlink import NetlinkError, dump_addresses, dump_links
+
 __all__ = ["get_active_device_info", "get_network_traffic"]
 
 
 SIOCGIFFLAGS = 0x8913  # from header /usr/include/bits/ioctls.h
+IFF_BROADCAST = 0x2  # from header /usr/include/linux/if.h
+IFF_LOOPBACK = 0x8
+IFF_POINTOPOINT = 0x10
+RT_SCOPE_LINK = 253  # from header /usr/include/linux/rtnetlink.h
 SIOCETHTOOL = 0x8946  # As defined in include/uapi/linux/sockios.h
 ETHTOOL_GSET = 0x00000001  # Get status command.
 
@@ -138,6 +145,110 @@ def get_flags(sock, interface):
     return struct.unpack("H", data[16:18])[0]
 
 
+def get_netlink_interfaces():
+    """Return the name, flags and addresses of all network interfaces.
+
+    Everything is fetched with two rtnetlink dump requests, instead of one
+    C{getifaddrs} call and one C{SIOCGIFFLAGS} ioctl per interface.
+
+    @return: A list of C{(interface, flags, ifaddresses)} tuples, where
+        C{flags} is the value L{get_flags} would return and C{ifaddresses}
+        is formatted like L{netifaces.ifaddresses}. Like with L{netifaces},
+        aliases with an IPv4 address label are listed as their own
+        interface.
+    @raise NetlinkError: If a netlink request failed.
+    @raise socket.error: If netlink sockets aren't available.
+    """
+    links = dump_links()
+    addresses = dump_addresses()
+    interfaces = []
+    by_name = {}
+    by_index = {}
+    for link in links:
+        # SIOCGIFFLAGS only returns the lower 16 bits of the flags.
+        flags = link["flags"] & 0xffff
+        ifaddresses = {}
+        if link["address"] is not None:
+            ifaddresses[netifaces.AF_LINK] = [
+                _get_address_info(flags, link["address"], link["broadcast"])]
+        interface = (link["name"], flags, ifaddresses)
+        interfaces.append(interface)
+        by_name[link["name"]] = interface
+        by_index[link["index"]] = interface
+
+    for address in addresses:
+        if address["index"] not in by_index:
+            continue
+        name, flags, ifaddresses = by_index[address["index"]]
+        family = address["family"]
+        if family == socket.AF_INET:
+            label = address["label"] or name
+            if label not in by_name:
+                by_name[label] = (label, flags, {})
+                interfaces.append(by_name[label])
+            ifaddresses = by_name[label][2]
+            info = _get_address_info(
+                flags, address["local"] or address["address"],
+                address["broadcast"], address["address"])
+            info["netmask"] = _get_ipv4_netmask(address["prefixlen"])
+        elif family == socket.AF_INET6:
+            addr = address["address"] or address["local"]
+            if address["scope"] == RT_SCOPE_LINK:
+                addr = "%s%%%s" % (addr, name)
+            info = {"addr": addr,
+                    "netmask": _get_ipv6_netmask(address["prefixlen"])}
+        else:
+            continue
+        ifaddresses.setdefault(family, []).append(info)
+    return interfaces
+
+
+def _get_address_info(flags, addr, broadcast, peer=None):
+    """Return an address C{dict} like the ones of L{netifaces.ifaddresses}."""
+    info = {"addr": addr}
+    if flags & IFF_BROADCAST:
+        if broadcast is not None:
+            info["broadcast"] = broadcast
+    elif flags & (IFF_LOOPBACK | IFF_POINTOPOINT):
+        info["peer"] = peer or broadcast or addr
+    return info
+
+
+def _get_ipv4_netmask(prefixlen):
+    mask = (0xffffffff << (32 - prefixlen)) & 0xffffffff
+    return socket.inet_ntoa(struct.pack("!I", mask))
+
+
+def _get_ipv6_netmask(prefixlen):
+    mask = (1 << 128) - (1 << (128 - prefixlen))
+    packed = struct.pack("!QQ", mask >> 64, mask & 0xffffffffffffffff)
+    return "%s/%d" % (socket.inet_ntop(socket.AF_INET6, packed), prefixlen)
+
+
+def _get_interfaces_with_flags(sock):
+    """
+    Generator yields (interface, flags, address data) tuples for interfaces
+    with an IP address, using a netlink dump if possible, or
+    L{get_active_interfaces} and L{get_flags} otherwise.
+    """
+    try:
+        interfaces = get_netlink_interfaces()
+    except (NetlinkError, socket.error) as error:
+        logging.debug("Couldn't list interfaces using netlink, falling "
+                      "back to per-interface queries: %s" % error)
+    else:
+        for interface, flags, ifaddresses in interfaces:
+            inet_addr = ifaddresses.get(netifaces.AF_INET, [{}])[0].get("addr")
+            inet6_addr = ifaddresses.get(
+                netifaces.AF_INET6, [{}])[0].get("addr")
+            if inet_addr or inet6_addr:
+                yield interface, flags, ifaddresses
+        return
+
+    for interface, ifaddresses in get_active_interfaces():
+        yield interface, None, ifaddresses
+
+
 def get_active_device_info(skipped_interfaces=("lo",),
                            skip_vlan=True, skip_alias=True, extended=False):
     """
@@ -148,14 +259,15 @@ def get_active_device_info(skipped_interfaces=("lo",),
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
                              socket.IPPROTO_IP)
-        for interface, ifaddresses in get_active_interfaces():
+        for interface, flags, ifaddresses in _get_interfaces_with_flags(sock):
             if interface in skipped_interfaces:
                 continue
             if skip_vlan and "." in interface:
                 continue
             if skip_alias and ":" in interface:
                 continue
-            flags = get_flags(sock, interface.encode())
+            if flags is None:
+                flags = get_flags(sock, interface.encode())
             if not is_up(flags):
                 continue
             interface_info = {"interface": interface}
@@ -4,11 +4,19 @@ Extend the regular Twisted reactor with event-handling features.
 from __future__ import absolute_import
 
 import logging
+import sys
+import threading
 import time
+import traceback
 
 from twisted.internet.threads import deferToThread
 
+from landscape.lib.compat import thread
 from landscape.lib.format import format_object
+from landscape.lib.metrics import MetricsRegistry
+
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
 
 
 class InvalidID(Exception):
@@ -45,6 +53,36 @@ class EventHandlingReactorMixin(object):
     def __init__(self):
         super(EventHandlingReactorMixin, self).__init__()
         self._event_handlers = {}
+        self._current_call = None
+        self.lag_monitor = None
+
+    def describe_current_call(self):
+        """Return a description of the handler being run, or C{None}.
+
+        Only event handlers, and functions scheduled while a
+        L{ReactorLagMonitor} is running, are known.
+        """
+        if self._current_call is None:
+            return None
+        handler, event_type = self._current_call
+        if event_type is None:
+            return format_object(handler)
+        return "%s for event %r" % (format_object(handler), event_type)
+
+    def _trace_call(self, f):
+        """Wrap C{f} so that L{describe_current_call} knows it's running."""
+        if self.lag_monitor is None:
+            return f
+
+        def traced(*args, **kwargs):
+            previous = self._current_call
+            self._current_call = (f, None)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self._current_call = previous
+
+        return traced
 
     def call_on(self, event_type, handler, priority=0):
         """Register an event handler.
@@ -83,7 +121,9 @@ class EventHandlingReactorMixin(object):
         # time, so we have a stable list in case handlers are cancelled
         # dynamically by executing the handlers themselves.
         handlers = list(self._event_handlers.get(event_type, ()))
+        previous_call = self._current_call
         for handler, priority in handlers:
+            self._current_call = (handler, event_type)
             try:
                 logging.debug("Calling %s for %s with priority %d.",
                               format_object(handler), event_type, priority)
@@ -100,6 +140,8 @@ class EventHandlingReactorMixin(object):
                                   "event type %r with args %r %r.",
                                   format_object(handler), event_type,
                                   args, kwargs)
+            finally:
+                self._current_call = previous_call
         logging.debug("Finished firing %s.", event_type)
         return results
 
@@ -144,15 +186,17 @@ class EventHandlingReactor(EventHandlingReactorMixin):
         """
         return time.time()
 
-    def call_later(self, *args, **kwargs):
+    def call_later(self, seconds, f, *args, **kwargs):
         """Call a function later.
 
-        Simply call C{callLater(*args, **kwargs)} and return its result.
+        Simply call C{callLater(seconds, f, *args, **kwargs)} and return its
+        result.
 
         @see: L{twisted.internet.interfaces.IReactorTime.callLater}.
 
         """
-        return self._reactor.callLater(*args, **kwargs)
+        return self._reactor.callLater(
+            seconds, self._trace_call(f), *args, **kwargs)
 
     def call_every(self, seconds, f, *args, **kwargs):
         """Call a function repeatedly.
@@ -162,7 +206,7 @@ class EventHandlingReactor(EventHandlingReactorMixin):
 
         @return: the created C{LoopingCall} object.
         """
-        lc = self._LoopingCall(f, *args, **kwargs)
+        lc = self._LoopingCall(self._trace_call(f), *args, **kwargs)
         lc.start(seconds, now=False)
         return lc
 
@@ -249,3 +293,108 @@ class EventHandlingReactor(EventHandlingReactorMixin):
         for call in self._reactor.getDelayedCalls():
             if call.active():
                 call.cancel()
+
+
+class ReactorLagMonitor(object):
+    """Measure how late the reactor runs timed calls, and trace stalls.
+
+    A call is scheduled every C{interval} seconds, and the delay between the
+    time it was due and the time it ran is recorded in a histogram. A helper
+    thread watches for calls which are late by more than C{threshold}
+    seconds, and logs the stack of the reactor thread, along with the event
+    handler or timed call it's running, while it's still blocked.
+
+    @param reactor: The L{EventHandlingReactor} to monitor.
+    @param threshold: The lag in seconds after which stalls are reported.
+    @param interval: The number of seconds between measurements.
+    @ivar stalls: The number of stalls reported.
+    """
+
+    def __init__(self, reactor, threshold, interval=1):
+        self._reactor = reactor
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.metrics = MetricsRegistry()
+        self._lag = self.metrics.histogram(
+            "landscape_reactor_lag_seconds",
+            "Delay of the reactor in running timed calls.", LAG_BUCKETS)
+        self._expected = None
+        self._reported = None
+        self._call = None
+        self._stopped = threading.Event()
+        self._thread_id = None
+
+    def start(self):
+        """Start measuring, from the reactor thread."""
+        self._reactor.lag_monitor = self
+        self._thread_id = thread.get_ident()
+        self._schedule()
+        watcher = threading.Thread(target=self._watch,
+                                   name="reactor-lag-monitor")
+        watcher.daemon = True
+        watcher.start()
+
+    def stop(self):
+        """Stop measuring."""
+        self._stopped.set()
+        if self._call is not None:
+            self._reactor.cancel_call(self._call)
+            self._call = None
+        if self._reactor.lag_monitor is self:
+            self._reactor.lag_monitor = None
+
+    def _schedule(self):
+        self._expected = self._reactor.time() + self.interval
+        self._call = self._reactor.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        lag = max(0.0, self._reactor.time() - self._expected)
+        self._lag.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.threshold and self._reported != self._expected:
+            # The stall was too short for the helper thread to catch it.
+            self.stalls += 1
+            logging.warning("Reactor was blocked for %.2f seconds.", lag)
+        self._schedule()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2.0):
+            self.check()
+
+    def check(self):
+        """Report a stall if the next measurement is late by too much.
+
+        This is called from the helper thread, and reports each stall once.
+        """
+        expected = self._expected
+        if expected is None or expected == self._reported:
+            return
+        lag = self._reactor.time() - expected
+        if lag < self.threshold:
+            return
+        self._reported = expected
+        self.stalls += 1
+        frame = sys._current_frames().get(self._thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        logging.warning(
+            "Reactor blocked for %.2f seconds, running %s:\n%s", lag,
+            self._reactor.describe_current_call() or "an unknown call",
+            stack)
+
+    def get_stats(self):
+        """Return the lag measurements, as a C{dict} safe to send over AMP.
+
+        The C{"buckets"} key holds C{[bound, count]} pairs, with the number
+        of measurements up to each bound in seconds, and C{"overflow"} the
+        number of measurements above the last bound.
+        """
+        histogram = self._lag
+        return {"count": histogram.count,
+                "sum": histogram.sum,
+                "max": self.max_lag,
+                "stalls": self.stalls,
+                "buckets": [[bound, count] for bound, count in
+                            zip(histogram.buckets[:-1], histogram.counts)],
+                "overflow": histogram.counts[-1]}
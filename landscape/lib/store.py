@@ -1,4 +1,6 @@
 """Functions used by all sqlite-backed stores."""
+import os
+from contextlib import contextmanager
 
 try:
     import sqlite3
@@ -6,6 +8,90 @@ except ImportError:
     from pysqlite2 import dbapi2 as sqlite3
 
 
+class ConnectionProfile(object):
+    """Settings applied to the SQLite connections of a store.
+
+    The defaults are the ones of C{sqlite3.connect}. Stores opened by
+    several processes at once are better off with a write-ahead log, which
+    lets readers and a writer work concurrently.
+
+    @param journal_mode: The journal mode, like C{"wal"}, or C{None} to keep
+        the one of the database.
+    @param synchronous: The C{synchronous} setting, like C{"normal"}, or
+        C{None} for the default.
+    @param mmap_size: The number of bytes of the database to memory-map.
+    @param busy_timeout: The number of seconds to wait for locks held by
+        other connections before failing.
+    @param cache_size: The size of the page cache in KiB, or C{None} for the
+        default.
+
+    In WAL mode, the C{-wal} and C{-shm} files next to the database are
+    given the owner of the database when connecting as root, so that
+    processes running as the owner, like the monitor, can still open it
+    after a process running as root, like the changer, did.
+    """
+
+    def __init__(self, journal_mode=None, synchronous=None, mmap_size=0,
+                 busy_timeout=5, cache_size=None):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+
+    def connect(self, filename):
+        """Return a new connection to C{filename}, with these settings."""
+        db = sqlite3.connect(filename, timeout=self.busy_timeout)
+        if self.journal_mode is not None:
+            db.execute("PRAGMA journal_mode = %s" % self.journal_mode)
+            if self.journal_mode.lower() == "wal":
+                _fix_wal_ownership(filename)
+        if self.synchronous is not None:
+            db.execute("PRAGMA synchronous = %s" % self.synchronous)
+        if self.mmap_size:
+            db.execute("PRAGMA mmap_size = %d" % self.mmap_size)
+        if self.cache_size is not None:
+            db.execute("PRAGMA cache_size = %d" % -self.cache_size)
+        return db
+
+
+def _fix_wal_ownership(filename):
+    """Give the WAL files of C{filename} the owner of the database.
+
+    SQLite already does this for the files it creates as root, this fixes
+    the ones left behind by versions which didn't.
+    """
+    if os.getuid() != 0 or not os.path.exists(filename):
+        return
+    stat = os.stat(filename)
+    for suffix in ("-wal", "-shm"):
+        path = filename + suffix
+        if os.path.exists(path):
+            os.chown(path, stat.st_uid, stat.st_gid)
+
+
+DEFAULT_PROFILE = ConnectionProfile()
+
+
+def _connect(store):
+    """Connect C{store} to its database, if it's not connected yet."""
+    if not store._db:
+        # Create the database connection only when we start to actually
+        # use it. This is essentially just a workaroud of a sqlite bug
+        # happening when 2 concurrent processes try to create the tables
+        # around the same time, the one which fails having an incorrect
+        # cache and not seeing the tables
+        profile = getattr(store, "connection_profile", None)
+        if profile is None:
+            profile = DEFAULT_PROFILE
+        connection_pool = getattr(store, "_connection_pool", None)
+        if connection_pool is None:
+            store._db = profile.connect(store._filename)
+        else:
+            store._db = connection_pool.connect(store._filename, profile)
+        store._ensure_schema()
+
+
 def with_cursor(method):
     """Decorator that encloses the method in a database transaction.
 
@@ -14,17 +100,19 @@ def with_cursor(method):
     until the cursor was closed.  With this in mind, instead of using
     the autocommit mode, we explicitly terminate transactions and enforce
     cursor closing with this decorator.
+
+    Within a L{transaction}, the method is part of the enclosing
+    transaction instead.
     """
 
     def inner(self, *args, **kwargs):
-        if not self._db:
-            # Create the database connection only when we start to actually
-            # use it. This is essentially just a workaroud of a sqlite bug
-            # happening when 2 concurrent processes try to create the tables
-            # around the same time, the one which fails having an incorrect
-            # cache and not seeing the tables
-            self._db = sqlite3.connect(self._filename)
-            self._ensure_schema()
+        _connect(self)
+        if getattr(self, "_transaction_depth", 0):
+            cursor = self._db.cursor()
+            try:
+                return method(self, cursor, *args, **kwargs)
+            finally:
+                cursor.close()
         try:
             cursor = self._db.cursor()
             try:
@@ -37,3 +125,108 @@ def with_cursor(method):
             raise
         return result
     return inner
+
+
+@contextmanager
+def transaction(store):
+    """Run the L{with_cursor} methods of C{store} in a single transaction.
+
+    The transaction takes the write lock of the database when it starts,
+    so that batches of changes made by concurrent processes are serialized
+    instead of failing half-way, and is committed at the end of the block,
+    or rolled back if it raises. Transactions can be nested, only the
+    outermost one is committed.
+    """
+    _connect(store)
+    depth = getattr(store, "_transaction_depth", 0)
+    if not depth:
+        store._db.execute("BEGIN IMMEDIATE")
+    store._transaction_depth = depth + 1
+    try:
+        yield store
+    except BaseException:
+        store._transaction_depth = depth
+        if not depth:
+            store._db.rollback()
+        raise
+    store._transaction_depth = depth
+    if not depth:
+        store._db.commit()
+
+
+def apply_migrations(db, migrations):
+    """Bring the schema of a database up to date.
+
+    The version of the schema is kept in a C{patch} table. Migrations which
+    weren't applied yet are applied in order, each one in a transaction
+    along with the update of the version, so that concurrent processes
+    opening the database don't apply them twice. The transactions are
+    managed explicitly, with the connection in autocommit mode, since the
+    C{sqlite3} module of Python 2 commits implicitly before any schema
+    change, which would release the lock in the middle of a migration.
+
+    @param db: A connection to a SQLite database.
+    @param migrations: A list of functions taking a cursor, the one at index
+        C{i} bringing the schema from version C{i} to version C{i + 1}.
+    """
+    isolation_level = db.isolation_level
+    db.isolation_level = None
+    cursor = db.cursor()
+    try:
+        try:
+            cursor.execute("SELECT MAX(version) FROM patch")
+            version = cursor.fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            version = 0
+        while version < len(migrations):
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(
+                    "CREATE TABLE IF NOT EXISTS patch (version INTEGER)")
+                # Another process may have migrated the database while we
+                # were waiting for the lock.
+                cursor.execute("SELECT MAX(version) FROM patch")
+                version = cursor.fetchone()[0] or 0
+                if version < len(migrations):
+                    migrations[version](cursor)
+                    version += 1
+                    cursor.execute("INSERT INTO patch VALUES (?)",
+                                   (version,))
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+    finally:
+        cursor.close()
+        db.isolation_level = isolation_level
+
+
+class ConnectionPool(object):
+    """Share SQLite connections to the same files.
+
+    Stores with a C{_connection_pool} get their connection from it, so that
+    the stores of a file, like the ones of the in-process clones of a
+    service, use a single connection and file descriptor. The connections
+    must only be used from one thread.
+    """
+
+    def __init__(self):
+        self._connections = {}
+
+    def connect(self, filename, profile=DEFAULT_PROFILE):
+        """Return the connection to C{filename}, opening it if needed.
+
+        @param profile: The L{ConnectionProfile} to open the connection with.
+        """
+        filename = os.path.abspath(filename)
+        connection = self._connections.get(filename)
+        if connection is None:
+            connection = profile.connect(filename)
+            self._connections[filename] = connection
+        return connection
+
+    def close(self):
+        """Close all the connections."""
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 import unittest
 
 from mock import patch
@@ -6,6 +8,8 @@ from mock import patch
 from landscape.lib import testing
 from landscape.lib.disk import (
     get_filesystem_for_path, get_mount_info, is_device_removable,
+    parse_mounts, stat_mounts,
+    find_filesystem_for_path, StatvfsPool, StatvfsTimeout,
     _get_device_removable_file_path)
 
 
@@ -119,6 +123,162 @@ class DiskUtilitiesTest(BaseTestCase):
                     "filesystem": "ext4", "total-space": 3, "free-space": 1}
         self.assertEqual([expected], result)
 
+    def test_parse_mounts(self):
+        """
+        L{parse_mounts} yields the device, mount point and filesystem of
+        the whitelisted filesystems, decoding escapes in mount points.
+        """
+        lines = ["/dev/sda1 /home/my\\040music ext4 rw 0 0",
+                 "none /run/lock tmpfs rw 0 0",
+                 "garbage"]
+        self.assertEqual(
+            [("/dev/sda1", "/home/my music", "ext4")],
+            list(parse_mounts(lines)))
+
+    def test_find_filesystem_for_path(self):
+        """
+        L{find_filesystem_for_path} looks up a path in the given mount
+        information.
+        """
+        self.set_mount_points(["/", "/home"])
+        infos = list(get_mount_info(self.mount_file, self.statvfs))
+        info = find_filesystem_for_path("/home/user", infos)
+        self.assertEqual(info["mount-point"], "/home")
+
+
+class StatvfsPoolTest(BaseTestCase):
+
+    def setUp(self):
+        super(StatvfsPoolTest, self).setUp()
+        self.result = os.statvfs_result((4096, 0, 1000, 500, 0, 0, 0, 0, 0, 0))
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.hang = False
+        self.calls = []
+
+    def statvfs(self, path):
+        self.calls.append(path)
+        if self.hang:
+            self.release.wait()
+        return self.result
+
+    def test_call(self):
+        """
+        L{StatvfsPool} returns the result of C{statvfs} and records how long
+        it took.
+        """
+        pool = StatvfsPool(self.statvfs)
+        self.assertEqual(self.result, pool("/"))
+        self.assertEqual(["/"], self.calls)
+        self.assertEqual(set(), pool.stale)
+        self.assertIn("/", pool.latencies)
+
+    def test_error(self):
+        """Errors raised by C{statvfs} are passed on to the caller."""
+        def statvfs(path):
+            raise OSError("Permission denied")
+
+        pool = StatvfsPool(statvfs)
+        self.assertRaises(OSError, pool, "/")
+
+    def test_timeout_without_previous_result(self):
+        """
+        If C{statvfs} doesn't complete in time and there's no previous
+        result, L{StatvfsTimeout} is raised.
+        """
+        self.hang = True
+        pool = StatvfsPool(self.statvfs, timeout=0.01)
+        self.assertRaises(StatvfsTimeout, pool, "/nfs")
+        self.assertEqual(set(["/nfs"]), pool.stale)
+
+    def test_timeout_returns_stale_result(self):
+        """
+        If C{statvfs} doesn't complete in time, the last known result is
+        returned and the path is marked as stale until a call succeeds.
+        """
+        pool = StatvfsPool(self.statvfs, timeout=0.01)
+        pool("/nfs")
+        self.hang = True
+        self.assertEqual(self.result, pool("/nfs"))
+        self.assertEqual(set(["/nfs"]), pool.stale)
+        # While the call hangs, no new call is made.
+        self.assertEqual(self.result, pool("/nfs"))
+        self.assertEqual(["/nfs", "/nfs"], self.calls)
+
+        self.hang = False
+        call = pool._pending["/nfs"]
+        self.release.set()
+        call.done.wait(5)
+        pool.timeout = 5
+        self.assertEqual(self.result, pool("/nfs"))
+        self.assertEqual(set(), pool.stale)
+
+    def test_prefetch(self):
+        """
+        L{StatvfsPool.prefetch} starts the calls for several paths at once,
+        and the timeout of each call counts from when it was started, so
+        waiting for slow paths one after the other takes at most C{timeout}
+        seconds overall.
+        """
+        self.hang = True
+        now = [0]
+        pool = StatvfsPool(self.statvfs, timeout=5,
+                           create_time=lambda: now[0])
+        pool.prefetch(["/nfs1", "/nfs2"])
+        for _ in range(100):
+            if len(self.calls) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(["/nfs1", "/nfs2"], sorted(self.calls))
+        now[0] = 5
+        self.assertRaises(StatvfsTimeout, pool, "/nfs1")
+        self.assertRaises(StatvfsTimeout, pool, "/nfs2")
+        self.assertEqual(set(["/nfs1", "/nfs2"]), pool.stale)
+        self.assertEqual({"/nfs1": 5, "/nfs2": 5}, pool.latencies)
+
+    def test_hung_calls_dont_block_other_paths(self):
+        """
+        Calls hanging on some paths don't prevent the calls for other paths
+        from running.
+        """
+        hung_paths = ["/nfs%d" % i for i in range(10)]
+
+        def statvfs(path):
+            if path in hung_paths:
+                self.release.wait()
+            return self.result
+
+        pool = StatvfsPool(statvfs, timeout=0.01)
+        for path in hung_paths:
+            self.assertRaises(StatvfsTimeout, pool, path)
+        pool.timeout = 5
+        self.assertEqual(self.result, pool("/"))
+        self.assertEqual(set(hung_paths), pool.stale)
+
+    def test_stat_mounts_prefetches(self):
+        """
+        L{stat_mounts} starts the C{statvfs} calls of all the mounts before
+        waiting for them.
+        """
+        pool = StatvfsPool(self.statvfs)
+        with patch.object(pool, "prefetch") as prefetch:
+            infos = list(stat_mounts(
+                [("/dev/sda1", "/", "ext4"), ("/dev/sda2", "/home", "ext4")],
+                pool))
+        prefetch.assert_called_once_with(["/", "/home"])
+        self.assertEqual(["/", "/home"],
+                         [info["mount-point"] for info in infos])
+
+    def test_get_mount_info_skips_hung_mounts(self):
+        """
+        Mount points whose C{statvfs} times out without a previous result
+        are skipped by L{get_mount_info}.
+        """
+        self.hang = True
+        mount_file = self.makeFile("/dev/sda1 / ext4 rw 0 0\n")
+        pool = StatvfsPool(self.statvfs, timeout=0.01)
+        self.assertEqual([], list(get_mount_info(mount_file, pool)))
+
 
 class RemovableDiskTest(BaseTestCase):
 
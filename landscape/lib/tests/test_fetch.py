@@ -1,3 +1,4 @@
+import hashlib
 import os
 from threading import local
 import unittest
@@ -9,8 +10,10 @@ from twisted.python.compat import unicode
 
 from landscape.lib import testing
 from landscape.lib.fetch import (
-    fetch, fetch_async, fetch_many_async, fetch_to_files,
-    url_to_filename, HTTPCodeError, PyCurlError)
+    fetch, fetch_async, fetch_many_async, fetch_to_file, fetch_to_file_async,
+    fetch_to_files, url_to_filename, HashMismatchError, HTTPCodeError,
+    PyCurlError, SizeLimitError)
+from landscape.lib.fs import create_binary_file, read_binary_file
 
 
 class CurlStub(object):
@@ -41,6 +44,9 @@ class CurlStub(object):
             raise self.error
         if self.performed:
             raise AssertionError("Can't perform twice")
+        if pycurl.HEADERFUNCTION in self.options:
+            self.options[pycurl.HEADERFUNCTION](
+                b"HTTP/1.1 %d Whatever\r\n" % self.infos[pycurl.HTTP_CODE])
         self.options[pycurl.WRITEFUNCTION](self.result)
         self.performed = True
 
@@ -348,6 +354,212 @@ class FetchTest(testing.FSTestCase, testing.TwistedTestCase,
         self.assertFailure(d, HTTPCodeError)
         return d
 
+    def test_fetch_to_file(self):
+        """
+        L{fetch_to_file} writes the content of the URL to the given file.
+        """
+        curl = CurlStub(b"result")
+        filename = self.makeFile()
+        fetch_to_file("http://example.com", filename, curl=curl)
+        with open(filename, "rb") as fd:
+            self.assertEqual(b"result", fd.read())
+        self.assertNotIn(pycurl.RANGE, curl.options)
+        self.assertFalse(os.path.exists(filename + ".partial"))
+
+    def test_fetch_to_file_atomic(self):
+        """
+        The content is written to a partial file, which replaces the target
+        file only once complete.
+        """
+        filename = self.makeFile("old")
+        contents = []
+
+        def progress(received, total):
+            contents.append(read_binary_file(filename))
+            contents.append(os.path.exists(filename + ".partial"))
+
+        fetch_to_file("http://example.com", filename, curl=CurlStub(b"new"),
+                      progress=progress)
+        self.assertEqual([b"old", True], contents)
+        self.assertEqual(b"new", read_binary_file(filename))
+
+    def test_fetch_to_file_resume(self):
+        """
+        If C{resume} is set and a previous download left a partial file,
+        only the missing bytes are requested and appended to it.
+        """
+        curl = CurlStub(b"ult", {pycurl.HTTP_CODE: 206})
+        filename = self.makeFile()
+        create_binary_file(filename + ".partial", b"res")
+        fetch_to_file("http://example.com", filename, resume=True, curl=curl)
+        with open(filename, "rb") as fd:
+            self.assertEqual(b"result", fd.read())
+        self.assertEqual(b"3-", curl.options[pycurl.RANGE])
+        self.assertFalse(os.path.exists(filename + ".partial"))
+
+    def test_fetch_to_file_resume_not_supported(self):
+        """
+        If the server ignores the range request and sends the whole content,
+        the partial file is rewritten from scratch.
+        """
+        curl = CurlStub(b"result")
+        filename = self.makeFile()
+        create_binary_file(filename + ".partial", b"res")
+        fetch_to_file("http://example.com", filename, resume=True, curl=curl)
+        with open(filename, "rb") as fd:
+            self.assertEqual(b"result", fd.read())
+
+    def test_fetch_to_file_resume_complete(self):
+        """
+        A 416 reply to a range request means the partial file is already
+        complete.
+        """
+        curl = CurlStub(b"", {pycurl.HTTP_CODE: 416})
+        filename = self.makeFile()
+        create_binary_file(filename + ".partial", b"result")
+        fetch_to_file("http://example.com", filename, resume=True, curl=curl)
+        with open(filename, "rb") as fd:
+            self.assertEqual(b"result", fd.read())
+
+    def test_fetch_to_file_resume_network_error(self):
+        """
+        If C{resume} is set, the partial file is kept after network errors,
+        so that the download can be resumed.
+        """
+        curl = CurlStub(error=pycurl.error(18, "transfer closed"))
+        filename = self.makeFile()
+        create_binary_file(filename + ".partial", b"res")
+        self.assertRaises(PyCurlError, fetch_to_file, "http://example.com",
+                          filename, resume=True, curl=curl)
+        self.assertEqual(b"res", read_binary_file(filename + ".partial"))
+
+    def test_fetch_to_file_network_error(self):
+        """
+        Without C{resume}, partial files are removed after network errors.
+        """
+        curl = CurlStub(error=pycurl.error(18, "transfer closed"))
+        filename = self.makeFile()
+        create_binary_file(filename + ".partial", b"res")
+        self.assertRaises(PyCurlError, fetch_to_file, "http://example.com",
+                          filename, curl=curl)
+        self.assertFalse(os.path.exists(filename + ".partial"))
+
+    def test_fetch_to_file_non_200_result(self):
+        """
+        When the server replies with an error, L{HTTPCodeError} is raised with
+        the body of the reply and the files are left untouched.
+        """
+        curl = CurlStub(b"not found", {pycurl.HTTP_CODE: 404})
+        filename = self.makeFile("result")
+        create_binary_file(filename + ".partial", b"res")
+        try:
+            fetch_to_file(
+                "http://example.com", filename, resume=True, curl=curl)
+        except HTTPCodeError as error:
+            self.assertEqual(error.http_code, 404)
+            self.assertEqual(error.body, b"not found")
+        else:
+            self.fail("HTTPCodeError not raised")
+        self.assertEqual(b"result", read_binary_file(filename))
+        self.assertEqual(b"res", read_binary_file(filename + ".partial"))
+
+    def test_fetch_to_file_sha256(self):
+        """
+        The content is checked against the given C{sha256} digest, including
+        the part of resumed downloads which was already on disk.
+        """
+        curl = CurlStub(b"ult", {pycurl.HTTP_CODE: 206})
+        filename = self.makeFile()
+        create_binary_file(filename + ".partial", b"res")
+        fetch_to_file("http://example.com", filename, resume=True, curl=curl,
+                      sha256=hashlib.sha256(b"result").hexdigest())
+        self.assertEqual(b"result", read_binary_file(filename))
+
+    def test_fetch_to_file_sha256_mismatch(self):
+        """
+        If the content doesn't match the given C{sha256} digest,
+        L{HashMismatchError} is raised and nothing is kept.
+        """
+        filename = self.makeFile("old")
+        expected = hashlib.sha256(b"other").hexdigest()
+        try:
+            fetch_to_file("http://example.com", filename,
+                          curl=CurlStub(b"result"), sha256=expected)
+        except HashMismatchError as error:
+            self.assertEqual(expected, error.expected)
+            self.assertEqual(hashlib.sha256(b"result").hexdigest(),
+                             error.actual)
+        else:
+            self.fail("HashMismatchError not raised")
+        self.assertEqual(b"old", read_binary_file(filename))
+        self.assertFalse(os.path.exists(filename + ".partial"))
+
+    def test_fetch_to_file_max_size(self):
+        """
+        If the content is larger than C{max_size}, L{SizeLimitError} is
+        raised and nothing is kept.
+        """
+        filename = self.makeFile("old")
+        error = self.assertRaises(
+            SizeLimitError, fetch_to_file, "http://example.com", filename,
+            curl=CurlStub(b"result"), max_size=5)
+        self.assertEqual("Content is larger than 5 bytes", str(error))
+        self.assertEqual(b"old", read_binary_file(filename))
+        self.assertFalse(os.path.exists(filename + ".partial"))
+
+    def test_fetch_to_file_max_size_aborted(self):
+        """
+        Transfers aborted because the content is too large raise
+        L{SizeLimitError}.
+        """
+
+        class AbortingCurlStub(CurlStub):
+
+            def perform(self):
+                if self.options[pycurl.WRITEFUNCTION](self.result) == 0:
+                    raise pycurl.error(23, "Failed writing body")
+
+        filename = self.makeFile()
+        self.assertRaises(
+            SizeLimitError, fetch_to_file, "http://example.com", filename,
+            curl=AbortingCurlStub(b"result"), max_size=5)
+        self.assertFalse(os.path.exists(filename + ".partial"))
+
+    def test_fetch_to_file_progress(self):
+        """
+        The C{progress} function is called with the number of bytes received
+        and the total size of the content, counting resumed bytes.
+        """
+
+        class HeaderCurlStub(CurlStub):
+
+            def perform(self):
+                header = self.options[pycurl.HEADERFUNCTION]
+                header(b"HTTP/1.1 206 Partial Content\r\n")
+                header(b"Content-Length: 3\r\n")
+                self.options[pycurl.WRITEFUNCTION](b"u")
+                self.options[pycurl.WRITEFUNCTION](b"lt")
+                self.performed = True
+
+        calls = []
+        filename = self.makeFile()
+        create_binary_file(filename + ".partial", b"res")
+        curl = HeaderCurlStub(infos={pycurl.HTTP_CODE: 206})
+        fetch_to_file("http://example.com", filename, resume=True, curl=curl,
+                      progress=lambda *args: calls.append(args))
+        self.assertEqual([(4, 6), (6, 6)], calls)
+        self.assertEqual(b"result", read_binary_file(filename))
+
+    def test_fetch_to_file_async(self):
+        curl = CurlStub(b"result")
+        filename = self.makeFile()
+        d = fetch_to_file_async("http://example.com/", filename, curl=curl)
+
+        def got_result(result):
+            with open(filename, "rb") as fd:
+                self.assertEqual(b"result", fd.read())
+        return d.addCallback(got_result)
+
     def test_fetch_many_async(self):
         """
         L{fetch_many_async} retrieves multiple URLs, and returns a
@@ -496,7 +708,7 @@ class FetchTest(testing.FSTestCase, testing.TwistedTestCase,
             error = str(failure.value.subFailure.value)
             self.assertEqual(error,
                              ("[Errno 2] No such file or directory: "
-                              "'i/dont/exist/right'"))
+                              "'i/dont/exist/right.partial'"))
             self.assertFalse(os.path.exists(os.path.join(directory, "right")))
 
         result.addErrback(check_error)
@@ -10,6 +10,7 @@ from twisted.python.compat import long
 from landscape.lib import testing
 from landscape.lib.fs import append_text_file, append_binary_file, touch_file
 from landscape.lib.fs import read_text_file, read_binary_file
+from landscape.lib.fs import write_binary_file_atomically
 
 
 class BaseTestCase(testing.FSTestCase, unittest.TestCase):
@@ -180,3 +181,43 @@ class AppendFileTest(BaseTestCase):
         new_file = os.path.join(self.makeDir(), "new_file")
         append_binary_file(new_file, b"contents \xe2\x98\x83")
         self.assertFileContent(new_file, b"contents \xe2\x98\x83")
+
+
+class WriteFileAtomicallyTest(BaseTestCase):
+
+    def test_write_binary_file_atomically(self):
+        """
+        L{write_binary_file_atomically} replaces the file with the given
+        content and permissions, leaving no temporary file behind.
+        """
+        directory = self.makeDir()
+        path = self.makeFile("old content", dirname=directory)
+        write_binary_file_atomically(path, b"new content", 0o644)
+        self.assertEqual(b"new content", read_binary_file(path))
+        self.assertEqual(0o644, os.stat(path).st_mode & 0o777)
+        self.assertEqual([os.path.basename(path)], os.listdir(directory))
+
+    def test_write_binary_file_atomically_doesnt_follow_symlinks(self):
+        """
+        L{write_binary_file_atomically} replaces symlinks instead of writing
+        to their target.
+        """
+        target = self.makeFile("target")
+        path = self.makeFile()
+        os.symlink(target, path)
+        write_binary_file_atomically(path, b"content")
+        self.assertFalse(os.path.islink(path))
+        self.assertEqual(b"content", read_binary_file(path))
+        self.assertEqual(b"target", read_binary_file(target))
+
+    def test_write_binary_file_atomically_error(self):
+        """
+        If writing fails, the file is left alone and the temporary file is
+        removed.
+        """
+        directory = self.makeDir()
+        path = self.makeFile("old content", dirname=directory)
+        self.assertRaises(TypeError, write_binary_file_atomically, path,
+                          u"not bytes")
+        self.assertEqual(b"old content", read_binary_file(path))
+        self.assertEqual([os.path.basename(path)], os.listdir(directory))
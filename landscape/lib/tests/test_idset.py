@@ -0,0 +1,89 @@
+import unittest
+from array import array
+
+from landscape.lib.idset import IdSet
+
+
+class IdSetTest(unittest.TestCase):
+
+    def test_iter(self):
+        """L{IdSet}s iterate over their ids in increasing order."""
+        ids = IdSet([1000, 64, 3, 63, 0, 3])
+        self.assertEqual([0, 3, 63, 64, 1000], list(ids))
+        self.assertEqual(5, len(ids))
+
+    def test_iter_blocks(self):
+        """
+        L{IdSet}s iterate over ids separated by long runs of missing ones.
+        """
+        ids = list(range(1000)) + list(range(100000, 102000, 3))
+        id_set = IdSet(ids)
+        self.assertIsNotNone(id_set._bits)
+        self.assertEqual(ids, list(id_set))
+        self.assertEqual(ids[-1:], list(id_set - IdSet(ids[:-1])))
+
+    def test_array(self):
+        """L{IdSet}s can be created from arrays and iterables of ids."""
+        self.assertEqual(IdSet([1, 2]), IdSet(array("l", [2, 1])))
+        self.assertEqual(IdSet([1, 2]), IdSet(iter([1, 2])))
+
+    def test_empty(self):
+        ids = IdSet()
+        self.assertFalse(ids)
+        self.assertEqual([], list(ids))
+        self.assertEqual(0, len(ids))
+
+    def test_negative(self):
+        """Ids can't be negative."""
+        self.assertRaises(ValueError, IdSet, [1, -1])
+
+    def test_contains(self):
+        ids = IdSet([1, 100])
+        self.assertIn(100, ids)
+        self.assertNotIn(2, ids)
+        self.assertNotIn(-1, ids)
+
+    def test_operations(self):
+        """
+        L{IdSet}s support differences, intersections and unions, like
+        C{set}s.
+        """
+        ids1 = IdSet([1, 2, 3, 200])
+        ids2 = IdSet([2, 3, 4])
+        self.assertEqual([1, 200], list(ids1 - ids2))
+        self.assertEqual([4], list(ids2 - ids1))
+        self.assertEqual([2, 3], list(ids1 & ids2))
+        self.assertEqual([1, 2, 3, 4, 200], list(ids1 | ids2))
+        self.assertFalse(ids1 - ids1)
+
+    def test_equality(self):
+        self.assertEqual(IdSet([1, 2]), IdSet([2, 1]))
+        self.assertNotEqual(IdSet([1, 2]), IdSet([1]))
+        self.assertNotEqual(IdSet([1, 2]), set([1, 2]))
+
+    def test_sparse(self):
+        """
+        Sparse L{IdSet}s are kept in C{frozenset}s, instead of bitmaps not
+        much smaller than them.
+        """
+        ids = IdSet([10 ** 8, 5, 10 ** 6, 5])
+        self.assertIsNone(ids._bits)
+        self.assertEqual([5, 10 ** 6, 10 ** 8], list(ids))
+        self.assertEqual(3, len(ids))
+        self.assertIn(10 ** 6, ids)
+        self.assertNotIn(6, ids)
+        self.assertEqual(IdSet([5, 10 ** 8, 10 ** 6]), ids)
+
+    def test_sparse_operations(self):
+        """
+        Sparse L{IdSet}s support the same operations as dense ones, and
+        can be mixed with them.
+        """
+        sparse = IdSet([2, 10 ** 8])
+        dense = IdSet([1, 2, 3])
+        self.assertEqual([10 ** 8], list(sparse - dense))
+        self.assertEqual([1, 3], list(dense - sparse))
+        self.assertEqual([2], list(sparse & dense))
+        self.assertEqual([1, 2, 3, 10 ** 8], list(sparse | dense))
+        self.assertEqual(dense, sparse - IdSet([10 ** 8]) | dense)
+        self.assertFalse(sparse - sparse)
@@ -0,0 +1,86 @@
+import os
+import unittest
+
+from landscape.lib import testing
+from landscape.lib.metrics import MetricsRegistry, NULL_METRIC
+
+
+class MetricsRegistryTest(testing.FSTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(MetricsRegistryTest, self).setUp()
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        """Counters are formatted with their help and type."""
+        counter = self.registry.counter("requests_total", "Requests.")
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(
+            "# HELP requests_total Requests.\n"
+            "# TYPE requests_total counter\n"
+            "requests_total 3\n",
+            self.registry.format())
+
+    def test_gauge(self):
+        """Gauges hold the last value they were set to."""
+        gauge = self.registry.gauge("queue_size", "Queue size.")
+        gauge.set(10)
+        gauge.set(4)
+        self.assertIn("queue_size 4\n", self.registry.format())
+
+    def test_histogram(self):
+        """
+        Histograms are formatted with cumulative buckets, the sum and the
+        count of observations.
+        """
+        histogram = self.registry.histogram(
+            "duration_seconds", "Duration.", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(
+            "# HELP duration_seconds Duration.\n"
+            "# TYPE duration_seconds histogram\n"
+            "duration_seconds_bucket{le=\"0.1\"} 1\n"
+            "duration_seconds_bucket{le=\"1\"} 2\n"
+            "duration_seconds_bucket{le=\"+Inf\"} 3\n"
+            "duration_seconds_sum 5.55\n"
+            "duration_seconds_count 3\n",
+            self.registry.format())
+
+    def test_same_metric(self):
+        """
+        Asking for a metric by name returns the existing one, which must be
+        of the same type.
+        """
+        counter = self.registry.counter("requests_total", "Requests.")
+        self.assertIs(counter,
+                      self.registry.counter("requests_total", "Requests."))
+        self.assertRaises(ValueError, self.registry.gauge, "requests_total",
+                          "Requests.")
+
+    def test_disabled(self):
+        """Disabled registries hand out metrics which record nothing."""
+        registry = MetricsRegistry(enabled=False)
+        counter = registry.counter("requests_total", "Requests.")
+        self.assertIs(NULL_METRIC, counter)
+        counter.inc()
+        self.assertEqual("", registry.format())
+
+    def test_write(self):
+        """L{MetricsRegistry.write} writes the metrics to a file."""
+        self.registry.counter("requests_total", "Requests.").inc()
+        filename = os.path.join(self.makeDir(), "landscape.prom")
+        self.registry.write(filename)
+        with open(filename) as fd:
+            self.assertEqual(self.registry.format(), fd.read())
+        self.assertEqual(["landscape.prom"],
+                         os.listdir(os.path.dirname(filename)))
+        self.assertEqual(0o644, os.stat(filename).st_mode & 0o777)
+
+    def test_write_disabled(self):
+        """Disabled registries don't write anything."""
+        filename = self.makeFile()
+        MetricsRegistry(enabled=False).write(filename)
+        self.assertFalse(os.path.exists(filename))
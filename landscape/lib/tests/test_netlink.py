@@ -0,0 +1,155 @@
+import errno
+import socket
+import struct
+import unittest
+
+from landscape.lib import testing
+from landscape.lib.netlink import (
+    NetlinkError, dump_addresses, dump_links, parse_attributes,
+    IFA_ADDRESS, IFA_BROADCAST, IFA_LABEL, IFA_LOCAL, IFADDRMSG,
+    IFINFOMSG, IFLA_ADDRESS, IFLA_BROADCAST, IFLA_IFNAME, IFLA_MTU,
+    NLM_F_MULTI, NLMSG_DONE, NLMSG_ERROR, NLMSG_HEADER, RTATTR_HEADER,
+    RTM_NEWADDR, RTM_NEWLINK)
+
+
+def pack_attribute(attribute_type, data):
+    length = RTATTR_HEADER.size + len(data)
+    padding = b"\0" * (((length + 3) & ~3) - length)
+    return RTATTR_HEADER.pack(length, attribute_type) + data + padding
+
+
+def pack_message(message_type, body, sequence=1):
+    return NLMSG_HEADER.pack(
+        NLMSG_HEADER.size + len(body), message_type, NLM_F_MULTI,
+        sequence, 0) + body
+
+
+def pack_link(index, name, flags=0, address=None):
+    body = IFINFOMSG.pack(0, 1, index, flags, 0)
+    body += pack_attribute(IFLA_IFNAME, name.encode("utf-8") + b"\0")
+    body += pack_attribute(IFLA_MTU, struct.pack("=I", 1500))
+    # An attribute we don't need.
+    body += pack_attribute(23, b"\0" * 184)
+    if address is not None:
+        body += pack_attribute(IFLA_ADDRESS, address)
+        body += pack_attribute(IFLA_BROADCAST, b"\xff" * len(address))
+    return pack_message(RTM_NEWLINK, body)
+
+
+def pack_address(index, family, address, prefixlen, local=None,
+                 broadcast=None, label=None, scope=0):
+    body = IFADDRMSG.pack(family, prefixlen, 0, scope, index)
+    body += pack_attribute(IFA_ADDRESS, socket.inet_pton(family, address))
+    if local is not None:
+        body += pack_attribute(IFA_LOCAL, socket.inet_pton(family, local))
+    if broadcast is not None:
+        body += pack_attribute(
+            IFA_BROADCAST, socket.inet_pton(family, broadcast))
+    if label is not None:
+        body += pack_attribute(IFA_LABEL, label.encode("utf-8") + b"\0")
+    return pack_message(RTM_NEWADDR, body)
+
+
+def pack_done(sequence=1):
+    return pack_message(NLMSG_DONE, struct.pack("=i", 0), sequence)
+
+
+class FakeNetlinkSocket(object):
+    """A socket replying to any request with the given buffers."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def recv(self, size):
+        if self.replies:
+            return self.replies.pop(0)
+        return b""
+
+
+class NetlinkTest(testing.HelperTestCase, unittest.TestCase):
+
+    def test_parse_attributes(self):
+        """
+        L{parse_attributes} splits aligned routing attributes, keyed by
+        type.
+        """
+        data = pack_attribute(1, b"abc") + pack_attribute(2, b"defgh")
+        self.assertEqual({1: b"abc", 2: b"defgh"}, parse_attributes(data))
+        self.assertEqual({2: b"defgh"}, parse_attributes(data, types=[2]))
+
+    def test_dump_links(self):
+        """
+        L{dump_links} sends a single dump request, and parses the link
+        replies spread over several buffers until C{NLMSG_DONE}.
+        """
+        sock = FakeNetlinkSocket([
+            pack_link(1, "lo", flags=73, address=b"\0" * 6) +
+            pack_link(2, "eth0", flags=4163,
+                      address=b"\x02\xfc\0\0\0\x01"),
+            pack_done()])
+        links = dump_links(sock)
+        self.assertEqual(1, len(sock.sent))
+        self.assertEqual(
+            [(1, "lo", 73, "00:00:00:00:00:00"),
+             (2, "eth0", 4163, "02:fc:00:00:00:01")],
+            [(link["index"], link["name"], link["flags"], link["address"])
+             for link in links])
+        self.assertEqual("ff:ff:ff:ff:ff:ff", links[1]["broadcast"])
+        self.assertEqual(1500, links[1]["mtu"])
+
+    def test_dump_addresses(self):
+        """L{dump_addresses} parses IPv4 and IPv6 address replies."""
+        sock = FakeNetlinkSocket([
+            pack_address(2, socket.AF_INET, "10.0.0.1", 24, local="10.0.0.1",
+                         broadcast="10.0.0.255", label="eth0:1") +
+            pack_address(2, socket.AF_INET6, "fe80::1", 64, scope=253) +
+            pack_done()])
+        addresses = dump_addresses(sock)
+        self.assertEqual(
+            [{"index": 2, "family": socket.AF_INET, "prefixlen": 24,
+              "scope": 0, "address": "10.0.0.1", "local": "10.0.0.1",
+              "broadcast": "10.0.0.255", "label": "eth0:1"},
+             {"index": 2, "family": socket.AF_INET6, "prefixlen": 64,
+              "scope": 253, "address": "fe80::1", "local": None,
+              "broadcast": None, "label": None}],
+            addresses)
+
+    def test_ignore_other_sequences(self):
+        """Replies to other requests are ignored."""
+        sock = FakeNetlinkSocket([
+            pack_message(RTM_NEWLINK, b"", sequence=7) +
+            pack_link(1, "lo") + pack_done()])
+        self.assertEqual(["lo"], [link["name"] for link in dump_links(sock)])
+
+    def test_error(self):
+        """An error reply raises a L{NetlinkError}."""
+        sock = FakeNetlinkSocket([
+            pack_message(NLMSG_ERROR, struct.pack("=i", -errno.EPERM))])
+        with self.assertRaises(NetlinkError) as context:
+            dump_links(sock)
+        self.assertEqual(errno.EPERM, context.exception.errno)
+
+    def test_closed_socket(self):
+        """
+        A L{NetlinkError} is raised if the socket is closed before the dump
+        is over.
+        """
+        sock = FakeNetlinkSocket([pack_link(1, "lo")])
+        self.assertRaises(NetlinkError, dump_links, sock)
+
+    def test_dump_links_from_kernel(self):
+        """
+        L{dump_links} returns the same interfaces as C{/proc/net/dev}.
+        """
+        try:
+            links = dump_links()
+        except (NetlinkError, socket.error):
+            self.skipTest("netlink sockets not available")
+        with open("/proc/net/dev") as netdev:
+            names = set(line.split(":")[0].strip()
+                        for line in netdev.readlines()[2:])
+        self.assertEqual(names, set(link["name"] for link in links))
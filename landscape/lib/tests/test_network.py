@@ -1,3 +1,4 @@
+import errno
 import socket
 import unittest
 
@@ -13,9 +14,10 @@ from netifaces import (
 from subprocess import Popen, PIPE
 
 from landscape.lib import testing
+from landscape.lib.netlink import NetlinkError
 from landscape.lib.network import (
     get_network_traffic, get_active_device_info, get_active_interfaces,
-    get_fqdn, get_network_interface_speed, is_up)
+    get_fqdn, get_network_interface_speed, is_up, get_netlink_interfaces)
 
 
 class BaseTestCase(testing.HelperTestCase, unittest.TestCase):
@@ -24,6 +26,15 @@ class BaseTestCase(testing.HelperTestCase, unittest.TestCase):
 
 class NetworkInfoTest(BaseTestCase):
 
+    def setUp(self):
+        super(NetworkInfoTest, self).setUp()
+        # These tests cover the fallback used when netlink isn't available.
+        for name in ("dump_links", "dump_addresses"):
+            patcher = patch("landscape.lib.network.%s" % name,
+                            side_effect=NetlinkError(errno.EPERM))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     @patch("landscape.lib.network.get_network_interface_speed")
     def test_get_active_device_info(self, mock_get_network_interface_speed):
         """
@@ -330,6 +341,105 @@ test_proc_net_dev_parsed = {
              "send_compressed": 0}}
 
 
+class NetlinkNetworkInfoTest(BaseTestCase):
+
+    links = [
+        {"index": 1, "name": "lo", "flags": 0x10049,
+         "address": "00:00:00:00:00:00", "broadcast": "00:00:00:00:00:00",
+         "mtu": 65536},
+        {"index": 2, "name": "eth0", "flags": 0x11043,
+         "address": "aa:bb:cc:dd:ee:f0", "broadcast": "ff:ff:ff:ff:ff:ff",
+         "mtu": 1500},
+        {"index": 3, "name": "veth0", "flags": 0x1003,
+         "address": "aa:bb:cc:dd:ee:f1", "broadcast": "ff:ff:ff:ff:ff:ff",
+         "mtu": 1500}]
+
+    addresses = [
+        {"index": 1, "family": AF_INET, "prefixlen": 8, "scope": 254,
+         "address": "127.0.0.1", "local": "127.0.0.1", "broadcast": None,
+         "label": "lo"},
+        {"index": 2, "family": AF_INET, "prefixlen": 24, "scope": 0,
+         "address": "192.168.1.50", "local": "192.168.1.50",
+         "broadcast": "192.168.1.255", "label": "eth0"},
+        {"index": 2, "family": AF_INET, "prefixlen": 16, "scope": 0,
+         "address": "10.1.0.1", "local": "10.1.0.1",
+         "broadcast": "10.1.255.255", "label": "eth0:1"},
+        {"index": 2, "family": AF_INET6, "prefixlen": 64, "scope": 0,
+         "address": "2001::1", "local": None, "broadcast": None,
+         "label": None},
+        {"index": 2, "family": AF_INET6, "prefixlen": 64, "scope": 253,
+         "address": "fe80::1", "local": None, "broadcast": None,
+         "label": None}]
+
+    def setUp(self):
+        super(NetlinkNetworkInfoTest, self).setUp()
+        for name, value in (("dump_links", self.links),
+                            ("dump_addresses", self.addresses)):
+            patcher = patch("landscape.lib.network.%s" % name,
+                            return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_get_netlink_interfaces(self):
+        """
+        L{get_netlink_interfaces} returns the flags and the addresses of
+        the interfaces, formatted like L{netifaces.ifaddresses} does.
+        """
+        self.assertEqual(
+            [("lo", 0x49, {
+                AF_LINK: [{"addr": "00:00:00:00:00:00",
+                           "peer": "00:00:00:00:00:00"}],
+                AF_INET: [{"addr": "127.0.0.1", "netmask": "255.0.0.0",
+                           "peer": "127.0.0.1"}]}),
+             ("eth0", 0x1043, {
+                 AF_LINK: [{"addr": "aa:bb:cc:dd:ee:f0",
+                            "broadcast": "ff:ff:ff:ff:ff:ff"}],
+                 AF_INET: [{"addr": "192.168.1.50",
+                            "netmask": "255.255.255.0",
+                            "broadcast": "192.168.1.255"}],
+                 AF_INET6: [{"addr": "2001::1",
+                             "netmask": "ffff:ffff:ffff:ffff::/64"},
+                            {"addr": "fe80::1%eth0",
+                             "netmask": "ffff:ffff:ffff:ffff::/64"}]}),
+             ("veth0", 0x1003, {
+                 AF_LINK: [{"addr": "aa:bb:cc:dd:ee:f1",
+                            "broadcast": "ff:ff:ff:ff:ff:ff"}]}),
+             ("eth0:1", 0x1043, {
+                 AF_INET: [{"addr": "10.1.0.1", "netmask": "255.255.0.0",
+                            "broadcast": "10.1.255.255"}]})],
+            get_netlink_interfaces())
+
+    @patch("landscape.lib.network.get_network_interface_speed")
+    @patch("landscape.lib.network.get_flags")
+    def test_get_active_device_info(
+            self, mock_get_flags, mock_get_network_interface_speed):
+        """
+        L{get_active_device_info} uses the flags and addresses returned by
+        netlink, without per-interface ioctls for the flags.
+        """
+        mock_get_network_interface_speed.return_value = (100, True)
+        device_info = get_active_device_info(skip_alias=False)
+        self.assertEqual(
+            [{"interface": "eth0",
+              "ip_address": "192.168.1.50",
+              "mac_address": "aa:bb:cc:dd:ee:f0",
+              "broadcast_address": "192.168.1.255",
+              "netmask": "255.255.255.0",
+              "flags": 0x1043,
+              "speed": 100,
+              "duplex": True},
+             {"interface": "eth0:1",
+              "ip_address": "10.1.0.1",
+              "mac_address": "",
+              "broadcast_address": "10.1.255.255",
+              "netmask": "255.255.0.0",
+              "flags": 0x1043,
+              "speed": 100,
+              "duplex": True}],
+            device_info)
+        self.assertFalse(mock_get_flags.called)
+
+
 class FQDNTest(BaseTestCase):
 
     def test_default_fqdn(self):
@@ -4,7 +4,7 @@ import unittest
 
 from landscape.lib import testing
 from landscape.lib.compat import thread
-from landscape.lib.reactor import EventHandlingReactor
+from landscape.lib.reactor import EventHandlingReactor, ReactorLagMonitor
 from landscape.lib.testing import FakeReactor
 
 
@@ -394,6 +394,23 @@ class ReactorTestMixin(object):
         reactor.fire("foobar")
         self.assertEqual([True], calls)
 
+    def test_describe_current_call(self):
+        """
+        L{describe_current_call} tells which event handler is running.
+        """
+        reactor = self.get_reactor()
+        descriptions = []
+
+        def handler():
+            descriptions.append(reactor.describe_current_call())
+
+        reactor.call_on("foobar", handler)
+        reactor.fire("foobar")
+        self.assertIsNone(reactor.describe_current_call())
+        [description] = descriptions
+        self.assertIn("handler", description)
+        self.assertIn("for event 'foobar'", description)
+
 
 class FakeReactorTest(testing.HelperTestCase, ReactorTestMixin,
                       unittest.TestCase):
@@ -444,3 +461,80 @@ class EventHandlingReactorTest(testing.HelperTestCase, ReactorTestMixin,
     def test_real_time(self):
         reactor = self.get_reactor()
         self.assertTrue(reactor.time() - time.time() < 3)
+
+    def test_lag_monitor_stall(self):
+        """
+        When the reactor is blocked for longer than the threshold, the lag
+        monitor logs the stack of the reactor thread and the call it's
+        running, and records the lag.
+        """
+        reactor = self.get_reactor()
+        monitor = ReactorLagMonitor(reactor, 0.2, interval=0.05)
+        monitor.start()
+        self.addCleanup(monitor.stop)
+
+        def blocking_call():
+            time.sleep(0.5)
+
+        reactor.call_later(0.1, blocking_call)
+        reactor.call_later(0.8, reactor.stop)
+        reactor.run()
+        stats = monitor.get_stats()
+        self.assertEqual(1, stats["stalls"])
+        self.assertTrue(stats["max"] >= 0.2)
+        self.assertTrue(stats["count"] > 1)
+        log = self.logfile.getvalue()
+        self.assertIn("Reactor blocked for", log)
+        self.assertIn("blocking_call():", log)
+        self.assertIn("time.sleep(0.5)", log)
+
+    def test_lag_monitor_stop(self):
+        """
+        Stopping the lag monitor cancels its measurements and detaches it from
+        the reactor.
+        """
+        reactor = self.get_reactor()
+        monitor = ReactorLagMonitor(reactor, 1)
+        monitor.start()
+        self.assertIs(monitor, reactor.lag_monitor)
+        monitor.stop()
+        self.assertIsNone(reactor.lag_monitor)
+        self.assertEqual([], reactor._reactor.getDelayedCalls())
+
+
+class ReactorLagMonitorTest(testing.HelperTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(ReactorLagMonitorTest, self).setUp()
+        self.reactor = FakeReactor()
+        self.monitor = ReactorLagMonitor(self.reactor, 2)
+
+    def test_get_stats(self):
+        """
+        L{ReactorLagMonitor.get_stats} returns the number of measurements, in
+        buckets by lag.
+        """
+        self.monitor._schedule()
+        self.reactor.advance(3)
+        stats = self.monitor.get_stats()
+        self.assertEqual(3, stats["count"])
+        self.assertEqual(0, stats["sum"])
+        self.assertEqual(0, stats["stalls"])
+        self.assertEqual([0.001, 3], stats["buckets"][0])
+        self.assertEqual(0, stats["overflow"])
+
+    def test_check(self):
+        """
+        L{ReactorLagMonitor.check} reports a stall once, when the next
+        measurement is late by more than the threshold.
+        """
+        self.monitor._schedule()
+        self.monitor._expected -= 2
+        self.monitor.check()
+        self.assertEqual(0, self.monitor.stalls)
+        self.monitor._expected -= 1.5
+        self.monitor.check()
+        self.monitor.check()
+        self.assertEqual(1, self.monitor.stalls)
+        self.assertIn("Reactor blocked for 2.50 seconds, running an unknown "
+                      "call", self.logfile.getvalue())
@@ -0,0 +1,239 @@
+import os
+import sqlite3
+import unittest
+
+import mock
+
+from landscape.lib import testing
+from landscape.lib.store import (
+    apply_migrations, transaction, with_cursor, ConnectionPool,
+    ConnectionProfile)
+
+
+class Store(object):
+
+    _db = None
+
+    def __init__(self, filename, connection_profile=None):
+        self._filename = filename
+        self.connection_profile = connection_profile
+
+    def _ensure_schema(self):
+        self._db.execute("CREATE TABLE IF NOT EXISTS item (id INTEGER)")
+        self._db.commit()
+
+    @with_cursor
+    def add_item(self, cursor, id):
+        cursor.execute("INSERT INTO item VALUES (?)", (id,))
+
+    @with_cursor
+    def get_items(self, cursor):
+        cursor.execute("SELECT id FROM item ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+
+
+class ConnectionProfileTest(testing.FSTestCase, unittest.TestCase):
+
+    def test_connect(self):
+        """
+        L{ConnectionProfile.connect} opens connections with the given
+        settings.
+        """
+        profile = ConnectionProfile(journal_mode="wal", synchronous="normal",
+                                    mmap_size=4096, cache_size=1024)
+        db = profile.connect(self.makeFile())
+        self.addCleanup(db.close)
+        self.assertEqual(
+            "wal", db.execute("PRAGMA journal_mode").fetchone()[0])
+        self.assertEqual(1, db.execute("PRAGMA synchronous").fetchone()[0])
+        self.assertEqual(-1024, db.execute("PRAGMA cache_size").fetchone()[0])
+
+    def test_connect_defaults(self):
+        """By default, the settings of the database are kept."""
+        db = ConnectionProfile().connect(self.makeFile())
+        self.addCleanup(db.close)
+        self.assertEqual(
+            "delete", db.execute("PRAGMA journal_mode").fetchone()[0])
+
+    def test_store_profile(self):
+        """
+        Stores with a C{connection_profile} are connected with it.
+        """
+        store = Store(self.makeFile(),
+                      ConnectionProfile(journal_mode="wal"))
+        store.add_item(1)
+        self.assertEqual(
+            "wal", store._db.execute("PRAGMA journal_mode").fetchone()[0])
+
+    def test_connection_pool_profile(self):
+        """
+        L{ConnectionPool.connect} opens connections with the given profile.
+        """
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        db = pool.connect(self.makeFile(), ConnectionProfile(
+            journal_mode="wal"))
+        self.assertEqual(
+            "wal", db.execute("PRAGMA journal_mode").fetchone()[0])
+
+    @mock.patch("os.chown")
+    @mock.patch("os.getuid", return_value=0)
+    def test_connect_wal_as_root(self, getuid_mock, chown_mock):
+        """
+        When connecting as root in WAL mode, the WAL files are given the
+        owner of the database.
+        """
+        filename = self.makeFile()
+        other = ConnectionProfile(journal_mode="wal").connect(filename)
+        self.addCleanup(other.close)
+        other.execute("CREATE TABLE item (id INTEGER)")
+        other.commit()
+        db = ConnectionProfile(journal_mode="wal").connect(filename)
+        self.addCleanup(db.close)
+        stat = os.stat(filename)
+        chown_mock.assert_has_calls([
+            mock.call(filename + "-wal", stat.st_uid, stat.st_gid),
+            mock.call(filename + "-shm", stat.st_uid, stat.st_gid)])
+
+    @mock.patch("os.chown")
+    @mock.patch("os.getuid", return_value=1000)
+    def test_connect_wal_as_user(self, getuid_mock, chown_mock):
+        """The ownership of the WAL files is only fixed as root."""
+        db = ConnectionProfile(journal_mode="wal").connect(self.makeFile())
+        self.addCleanup(db.close)
+        chown_mock.assert_not_called()
+
+
+class TransactionTest(testing.FSTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(TransactionTest, self).setUp()
+        self.filename = self.makeFile()
+        self.store = Store(self.filename)
+        self.other_store = Store(self.filename)
+
+    def test_transaction(self):
+        """
+        The changes made in a transaction are only visible to other
+        connections once it's committed.
+        """
+        with transaction(self.store):
+            self.store.add_item(1)
+            self.store.add_item(2)
+            self.assertEqual([1, 2], self.store.get_items())
+            self.assertEqual([], Store(self.filename).get_items())
+        self.assertEqual([1, 2], self.other_store.get_items())
+
+    def test_transaction_rolls_back(self):
+        """Transactions are rolled back if they raise."""
+        self.store.add_item(1)
+
+        def add_items():
+            with transaction(self.store):
+                self.store.add_item(2)
+                raise ZeroDivisionError()
+
+        self.assertRaises(ZeroDivisionError, add_items)
+        self.assertEqual([1], self.other_store.get_items())
+        self.store.add_item(3)
+        self.assertEqual([1, 3], self.other_store.get_items())
+
+    def test_nested_transaction(self):
+        """Only the outermost transaction is committed."""
+        with transaction(self.store):
+            with transaction(self.store):
+                self.store.add_item(1)
+            self.assertEqual([], self.other_store.get_items())
+        self.assertEqual([1], self.other_store.get_items())
+
+
+class ApplyMigrationsTest(testing.FSTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(ApplyMigrationsTest, self).setUp()
+        self.db = sqlite3.connect(self.makeFile())
+        self.addCleanup(self.db.close)
+        self.calls = []
+
+        def create_table(cursor):
+            self.calls.append("create")
+            cursor.execute("CREATE TABLE item (id INTEGER, name TEXT)")
+
+        def create_index(cursor):
+            self.calls.append("index")
+            cursor.execute("CREATE INDEX item_name ON item (name)")
+
+        self.migrations = [create_table, create_index]
+
+    def get_version(self):
+        return self.db.execute("SELECT MAX(version) FROM patch").fetchone()[0]
+
+    def test_apply_migrations(self):
+        """
+        L{apply_migrations} applies the migrations in order, and records the
+        version of the schema.
+        """
+        apply_migrations(self.db, self.migrations)
+        self.assertEqual(["create", "index"], self.calls)
+        self.assertEqual(2, self.get_version())
+        self.assertEqual(
+            [("item_name",)],
+            self.db.execute("SELECT name FROM sqlite_master "
+                            "WHERE type='index'").fetchall())
+
+    def test_apply_new_migrations(self):
+        """Only the migrations which weren't applied yet are applied."""
+        apply_migrations(self.db, self.migrations[:1])
+        apply_migrations(self.db, self.migrations)
+        apply_migrations(self.db, self.migrations)
+        self.assertEqual(["create", "index"], self.calls)
+        self.assertEqual(2, self.get_version())
+
+    def test_migration_holds_lock(self):
+        """
+        Migrations are applied with the write lock held, even when they
+        change the schema, so that other connections can't write until
+        they are done.
+        """
+        filename = self.makeFile()
+        db = sqlite3.connect(filename)
+        self.addCleanup(db.close)
+        other = sqlite3.connect(filename, timeout=0)
+        self.addCleanup(other.close)
+        locked = []
+
+        def create_table(cursor):
+            cursor.execute("CREATE TABLE item (id INTEGER)")
+            try:
+                other.execute("CREATE TABLE other (id INTEGER)")
+            except sqlite3.OperationalError:
+                locked.append(True)
+
+        apply_migrations(db, [create_table])
+        self.assertEqual([True], locked)
+
+    def test_migration_keeps_isolation_level(self):
+        """
+        The isolation level of the connection is restored after the
+        migrations are applied.
+        """
+        apply_migrations(self.db, self.migrations)
+        self.assertEqual("", self.db.isolation_level)
+
+    def test_failed_migration(self):
+        """
+        Failing migrations are rolled back, leaving the database at the
+        version of the last successful one.
+        """
+
+        def fail(cursor):
+            cursor.execute("CREATE TABLE other (id INTEGER)")
+            raise ZeroDivisionError()
+
+        self.assertRaises(ZeroDivisionError, apply_migrations, self.db,
+                          self.migrations[:1] + [fail])
+        self.assertEqual(1, self.get_version())
+        self.assertEqual(
+            [("patch",), ("item",)],
+            self.db.execute("SELECT name FROM sqlite_master "
+                            "WHERE type='table'").fetchall())
@@ -19,7 +19,8 @@ __all__ = [
     "NETWORK_DEVICE", "NETWORK_ACTIVITY",
     "REBOOT_REQUIRED_INFO", "UPDATE_MANAGER_INFO", "CPU_USAGE",
     "CEPH_USAGE", "SWIFT_USAGE", "SWIFT_DEVICE_INFO", "KEYSTONE_TOKEN",
-    "JUJU_UNITS_INFO", "CLOUD_METADATA",
+    "JUJU_UNITS_INFO", "CLOUD_METADATA", "PARTIAL_OPERATION_RESULT",
+    "HARDWARE_INFO_DIFF",
     ]
 
 
@@ -75,6 +76,18 @@ OPERATION_RESULT = Message(
      "result-text": Unicode()},
     optional=["result-code", "result-text"])
 
+# Output printed so far by a long-running operation, sent periodically before
+# the final operation-result. The 'sequence' starts at 0 for each operation
+# and 'skipped-bytes' is the amount of output dropped since the previous
+# message because it didn't fit in the buffer.
+PARTIAL_OPERATION_RESULT = Message(
+    "partial-operation-result",
+    {"operation-id": Int(),
+     "sequence": Int(),
+     "result-text": Unicode(),
+     "skipped-bytes": Int()},
+    optional=["skipped-bytes"])
+
 COMPUTER_INFO = Message(
     "computer-info",
     {"hostname": Unicode(),
@@ -120,6 +133,13 @@ HARDWARE_INVENTORY = Message("hardware-inventory", {
 HARDWARE_INFO = Message("hardware-info", {
     "data": Unicode()})
 
+# A unified diff turning the hardware-info report with digest 'base-digest'
+# into the one with digest 'digest', both being SHA256 hex digests.
+HARDWARE_INFO_DIFF = Message("hardware-info-diff", {
+    "base-digest": Unicode(),
+    "digest": Unicode(),
+    "diff": Unicode()})
+
 juju_data = {"environment-uuid": Unicode(),
              "api-addresses": List(Unicode()),
              "unit-name": Unicode(),
@@ -518,4 +538,5 @@ message_schemas = (
     NETWORK_DEVICE, NETWORK_ACTIVITY,
     REBOOT_REQUIRED_INFO, UPDATE_MANAGER_INFO, CPU_USAGE,
     CEPH_USAGE, SWIFT_USAGE, SWIFT_DEVICE_INFO, KEYSTONE_TOKEN,
-    JUJU_UNITS_INFO, CLOUD_METADATA)
+    JUJU_UNITS_INFO, CLOUD_METADATA, PARTIAL_OPERATION_RESULT,
+    HARDWARE_INFO_DIFF)
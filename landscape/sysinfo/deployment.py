@@ -5,13 +5,18 @@ from logging import getLogger, Formatter
 from logging.handlers import RotatingFileHandler
 
 from twisted.python.reflect import namedClass
-from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
 
 from landscape import VERSION
 from landscape.lib.config import BaseConfiguration
+from landscape.sysinfo.snapshot import (
+    DEFAULT_SNAPSHOT_FILE, DEFAULT_SNAPSHOT_TTL, read_snapshot,
+    write_snapshot)
 from landscape.sysinfo.sysinfo import SysInfoPluginRegistry, format_sysinfo
 
 
+DEFAULT_PLUGIN_TIMEOUT = 5
+
 ALL_PLUGINS = ["Load", "Disk", "Memory", "Temperature", "Processes",
                "LoggedInUsers", "Network"]
 
@@ -50,6 +55,37 @@ class SysInfoConfiguration(BaseConfiguration):
                                "NOT use. This always take precedence over "
                                "plugins to include.")
 
+        parser.add_option("--use-snapshot", action="store_true",
+                          default=False,
+                          help="Print the snapshot written by "
+                               "--write-snapshot if it's still fresh, and "
+                               "only run the plugins otherwise.")
+
+        parser.add_option("--write-snapshot", action="store_true",
+                          default=False,
+                          help="Write a snapshot of the output, to be used "
+                               "by --use-snapshot.")
+
+        parser.add_option("--snapshot-file", metavar="FILE",
+                          default=DEFAULT_SNAPSHOT_FILE,
+                          help="The snapshot file (default: '%s')."
+                               % DEFAULT_SNAPSHOT_FILE)
+
+        parser.add_option("--snapshot-ttl", metavar="SECONDS", type="int",
+                          default=DEFAULT_SNAPSHOT_TTL,
+                          help="The number of seconds a snapshot stays "
+                               "fresh (default: %d)." % DEFAULT_SNAPSHOT_TTL)
+
+        parser.add_option("--plugin-timeout", metavar="SECONDS",
+                          type="float", default=DEFAULT_PLUGIN_TIMEOUT,
+                          help="The number of seconds to wait for plugins, "
+                               "after which their information is reported as "
+                               "unavailable, or 0 to wait for them to finish "
+                               "(default: %d)." % DEFAULT_PLUGIN_TIMEOUT)
+
+        parser.add_option("--profile", action="store_true", default=False,
+                          help="Show how long each plugin took to run.")
+
         parser.epilog = "Default plugins: %s" % (", ".join(ALL_PLUGINS))
         return parser
 
@@ -97,6 +133,33 @@ def setup_logging(landscape_dir=None):
     handler.setFormatter(Formatter("%(asctime)s %(levelname)-8s %(message)s"))
 
 
+def save_snapshot(config, output):
+    """
+    Write a snapshot of the output. Failing to do so is only an error if
+    C{--write-snapshot} was passed, since readers serving a stale snapshot
+    typically aren't allowed to refresh it.
+    """
+    try:
+        write_snapshot(config.snapshot_file, output, config.snapshot_ttl)
+    except (IOError, OSError) as error:
+        if config.write_snapshot:
+            logger = getLogger("landscape-sysinfo")
+            logger.error("Unable to write snapshot %s: %s"
+                         % (config.snapshot_file, error))
+
+
+def format_timings(timings, indent=""):
+    """Format the plugin timings returned by L{SysInfoPluginRegistry}."""
+    lines = [indent + "Plugin timings:"]
+    for name, seconds in timings:
+        if seconds is None:
+            timing = "unavailable"
+        else:
+            timing = "%.1f ms" % (seconds * 1000)
+        lines.append("%s  %s: %s" % (indent, name, timing))
+    return "\n".join(lines)
+
+
 def run(args, reactor=None, sysinfo=None):
     """
     @param reactor: The reactor to (optionally) run the sysinfo plugins in.
@@ -106,18 +169,31 @@ def run(args, reactor=None, sysinfo=None):
     except IOError as e:
         sys.exit("Unable to setup logging. %s" % e)
 
-    if sysinfo is None:
-        sysinfo = SysInfoPluginRegistry()
     config = SysInfoConfiguration()
     # landscape-sysinfo needs to work where there's no
     # /etc/landscape/client.conf See lp:1293990
     config.load(args, accept_nonexistent_default_config=True)
+
+    if config.use_snapshot:
+        output = read_snapshot(config.snapshot_file)
+        if output is not None:
+            sys.stdout.write(output)
+            return succeed(None)
+
+    if sysinfo is None:
+        sysinfo = SysInfoPluginRegistry(reactor=reactor,
+                                        timeout=config.plugin_timeout)
     for plugin in config.get_plugins():
         sysinfo.add(plugin)
 
     def show_output(result):
-        print(format_sysinfo(sysinfo.get_headers(), sysinfo.get_notes(),
-                             sysinfo.get_footnotes(), indent="  "))
+        output = format_sysinfo(sysinfo.get_headers(), sysinfo.get_notes(),
+                                sysinfo.get_footnotes(), indent="  ")
+        print(output)
+        if config.write_snapshot or config.use_snapshot:
+            save_snapshot(config, output + "\n")
+        if config.profile:
+            print(format_timings(sysinfo.get_timings(), indent="  "))
 
     def run_sysinfo():
         return sysinfo.run().addCallback(show_output)
@@ -4,7 +4,8 @@ import os
 
 from twisted.internet.defer import succeed
 
-from landscape.lib.disk import (get_mount_info, get_filesystem_for_path)
+from landscape.lib.disk import (
+    get_mount_info, find_filesystem_for_path, StatvfsPool)
 
 
 def format_megabytes(megabytes):
@@ -23,22 +24,31 @@ def usage(info):
 
 
 class Disk(object):
+    """
+    Report the usage of the filesystem holding C{/home} and the ones which
+    are almost full.
+
+    Mount points whose C{statvfs} doesn't complete within C{statvfs_timeout}
+    seconds are reported with their last known values, or skipped.
+    """
+
+    run_in_thread = True
+    statvfs_timeout = 2
 
     def __init__(self, mounts_file="/proc/mounts", statvfs=os.statvfs):
         self._mounts_file = mounts_file
-        self._statvfs = statvfs
+        self._statvfs = StatvfsPool(statvfs, timeout=self.statvfs_timeout)
 
     def register(self, sysinfo):
         self._sysinfo = sysinfo
 
     def run(self):
-        main_info = get_filesystem_for_path("/home", self._mounts_file,
-                                            self._statvfs)
+        infos = list(get_mount_info(self._mounts_file, self._statvfs))
+        main_info = find_filesystem_for_path("/home", infos)
         if main_info is not None:
             total = main_info["total-space"]
             if total <= 0:
-                root_main_info = get_filesystem_for_path(
-                    "/", self._mounts_file, self._statvfs)
+                root_main_info = find_filesystem_for_path("/", infos)
                 if root_main_info is not None:
                     total = root_main_info["total-space"]
                     main_info = root_main_info
@@ -53,7 +63,6 @@ class Disk(object):
 
         seen_mounts = set()
         seen_devices = set()
-        infos = list(get_mount_info(self._mounts_file, self._statvfs))
         infos.sort(key=lambda i: len(i["mount-point"]))
         for info in infos:
             total = info["total-space"]
@@ -5,6 +5,8 @@ from twisted.internet.defer import succeed
 
 class Load(object):
 
+    run_in_thread = True
+
     def register(self, sysinfo):
         self._sysinfo = sysinfo
 
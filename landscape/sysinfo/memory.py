@@ -5,6 +5,8 @@ from landscape.lib.sysstats import MemoryStats
 
 class Memory(object):
 
+    run_in_thread = True
+
     def __init__(self, filename="/proc/meminfo"):
         self._filename = filename
 
@@ -14,6 +14,8 @@ class Network(object):
         about network interfaces.  Defaults to L{get_active_device_info}.
     """
 
+    run_in_thread = True
+
     def __init__(self, get_device_info=None):
         if get_device_info is None:
             get_device_info = partial(get_active_device_info, extended=True)
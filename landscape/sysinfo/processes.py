@@ -5,6 +5,8 @@ from landscape.lib.process import ProcessInformation
 
 class Processes(object):
 
+    run_in_thread = True
+
     def __init__(self, proc_dir="/proc"):
         self._proc_dir = proc_dir
 
@@ -0,0 +1,107 @@
+"""
+Snapshots of the output of landscape-sysinfo.
+
+landscape-sysinfo is run at every login, and importing Twisted and running
+all the plugins each time is expensive on busy machines. A snapshot of the
+formatted output can be written periodically with C{--write-snapshot}, and
+C{--use-snapshot} serves it as long as it's fresh.
+
+This module only uses the standard library, so that the landscape-sysinfo
+script can serve a fresh snapshot before importing anything else.
+"""
+import os
+import sys
+import time
+from stat import S_ISREG
+
+
+DEFAULT_SNAPSHOT_FILE = "/var/lib/landscape/sysinfo.snapshot"
+DEFAULT_SNAPSHOT_TTL = 600
+
+
+def write_snapshot(filename, output, ttl, create_time=time.time):
+    """Atomically write a snapshot of the sysinfo output.
+
+    The snapshot is written by root into a directory the C{landscape} user
+    owns, so it goes through a temporary file with an unpredictable name.
+
+    @param filename: The file to write the snapshot to.
+    @param output: The formatted sysinfo output, as text.
+    @param ttl: The number of seconds the snapshot stays fresh.
+    """
+    # Imported here, since serving a snapshot must not import Twisted.
+    from landscape.lib.fs import write_binary_file_atomically
+
+    expires = int(create_time() + ttl)
+    content = ("%d\n%s" % (expires, output)).encode("utf-8")
+    # Users logging in read the snapshot with their own privileges.
+    write_binary_file_atomically(filename, content, 0o644)
+
+
+def read_snapshot(filename, create_time=time.time):
+    """Return the sysinfo output stored in a snapshot, if it's fresh.
+
+    Snapshots are only trusted if they're regular files owned by root or by
+    the current user, so that other users can't forge the output shown at
+    login.
+
+    @return: The formatted sysinfo output as text, or C{None} if there's no
+        readable and trusted snapshot or it expired.
+    """
+    try:
+        fd = os.open(filename, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    except (IOError, OSError):
+        return None
+    with os.fdopen(fd, "rb") as snapshot_file:
+        stat = os.fstat(fd)
+        if (not S_ISREG(stat.st_mode) or
+                stat.st_uid not in (0, os.getuid())):
+            return None
+        try:
+            content = snapshot_file.read()
+        except (IOError, OSError):
+            return None
+    expires, _, output = content.partition(b"\n")
+    try:
+        expires = int(expires)
+    except ValueError:
+        return None
+    if create_time() >= expires:
+        return None
+    return output.decode("utf-8", "replace")
+
+
+def get_snapshot_file(args):
+    """
+    Return the snapshot file to use if C{--use-snapshot} is among the given
+    command line arguments, C{None} otherwise.
+    """
+    if "--use-snapshot" not in args:
+        return None
+    filename = DEFAULT_SNAPSHOT_FILE
+    for index, arg in enumerate(args):
+        if arg.startswith("--snapshot-file="):
+            filename = arg[len("--snapshot-file="):]
+        elif arg == "--snapshot-file" and index + 1 < len(args):
+            filename = args[index + 1]
+    return filename
+
+
+def serve_snapshot(args, stdout=None):
+    """Print a fresh snapshot if C{--use-snapshot} was passed.
+
+    @param args: The command line arguments.
+    @return: C{True} if a snapshot was printed, C{False} if the plugins
+        need to run.
+    """
+    filename = get_snapshot_file(args)
+    if filename is None:
+        return False
+    output = read_snapshot(filename)
+    if output is None:
+        return False
+    if stdout is None:
+        stdout = sys.stdout
+    stdout.write(output)
+    stdout.flush()
+    return True
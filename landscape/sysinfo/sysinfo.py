@@ -1,15 +1,133 @@
+import logging
 import textwrap
 from logging import getLogger
 import math
 import os
+import threading
+import time
 
+from twisted.internet.defer import Deferred
 from twisted.python.failure import Failure
 
+from landscape.lib.format import format_object
 from landscape.lib.log import log_failure
 from landscape.lib.plugin import PluginRegistry
 from landscape.lib.twisted_util import gather_results
 
 
+class SysInfoOutput(object):
+    """The headers, notes and footnotes added by a plugin running in a thread.
+
+    It takes the place of the plugin's details in the registry until they're
+    complete, so that plugins running concurrently keep their order.
+    """
+
+    def __init__(self):
+        self._header_index = {}
+        self.headers = []
+        self.notes = []
+        self.footnotes = []
+        self.discarded = False
+
+    def add_header(self, name, value):
+        if not self.discarded:
+            _add_header(self.headers, self._header_index, name, value)
+
+    def add_note(self, note):
+        if not self.discarded:
+            self.notes.append(note)
+
+    def add_footnote(self, note):
+        if not self.discarded:
+            self.footnotes.append(note)
+
+    def discard(self):
+        """Ignore what was and will be added, for plugins that timed out."""
+        self.discarded = True
+
+
+def _add_header(headers, header_index, name, value):
+    index = header_index.get(name)
+    if index is None:
+        header_index[name] = len(headers)
+        headers.append((name, value))
+    else:
+        index += 1
+        header_index[name] = index
+        headers.insert(index, (name, value))
+
+
+def _expand(items, attribute):
+    """Replace the L{SysInfoOutput}s in C{items} with what they hold."""
+    expanded = []
+    for item in items:
+        if isinstance(item, SysInfoOutput):
+            if not item.discarded:
+                expanded.extend(getattr(item, attribute))
+        else:
+            expanded.append(item)
+    return expanded
+
+
+class PluginOutputProxy(object):
+    """The registry as seen by a plugin.
+
+    What the plugin adds goes to C{output}, which is the registry itself
+    unless the plugin is running in a thread.
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+        self.output = registry
+
+    def add_header(self, name, value):
+        self.output.add_header(name, value)
+
+    def add_note(self, note):
+        self.output.add_note(note)
+
+    def add_footnote(self, note):
+        self.output.add_footnote(note)
+
+    def __getattr__(self, name):
+        return getattr(self._registry, name)
+
+
+def defer_to_daemon_thread(reactor, function):
+    """Call C{function} in a new daemon thread.
+
+    Unlike the reactor's thread pool, a daemon thread stuck in a system
+    call (like a C{statvfs} of a hung NFS mount) doesn't keep the process
+    from exiting.
+
+    @return: A L{Deferred} firing with the result of C{function} in the
+        reactor thread.
+    """
+    deferred = Deferred()
+
+    def worker():
+        try:
+            result = function()
+        except Exception:
+            reactor.callFromThread(deferred.errback, Failure())
+        else:
+            reactor.callFromThread(deferred.callback, result)
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    return deferred
+
+
+def _run_now(plugin):
+    """Run a plugin doing its work synchronously, returning its result."""
+    results = []
+    plugin.run().addBoth(results.append)
+    if results and isinstance(results[0], Failure):
+        results[0].raiseException()
+    return results[0] if results else None
+
+
 class SysInfoPluginRegistry(PluginRegistry):
     """
     When the sysinfo plugin registry is run, it will run each of the
@@ -34,15 +152,43 @@ class SysInfoPluginRegistry(PluginRegistry):
     contain eventual information, such as warnings of high temperatures,
     and low disk space.  Finally, footnotes contain pointers to further
     information such as URLs.
+
+    Plugins with a true C{run_in_thread} attribute do blocking work, and
+    when a reactor is given they run concurrently in their own threads.
+    The details of plugins which aren't done after C{timeout} seconds are
+    left out, and reported as unavailable in a note.
+
+    @param reactor: Optionally, the running reactor to run plugins with.
+    @param timeout: Optionally, the number of seconds to wait for plugins.
     """
 
-    def __init__(self):
+    def __init__(self, reactor=None, timeout=None):
         super(SysInfoPluginRegistry, self).__init__()
+        self._reactor = reactor
+        self._timeout = timeout
+        self._proxies = []
         self._header_index = {}
         self._headers = []
         self._notes = []
         self._footnotes = []
         self._plugin_error = False
+        self._timed_out = []
+        self._timings = []
+
+    def add(self, plugin):
+        """Register a plugin.
+
+        The plugin's C{register} method is called with a
+        L{PluginOutputProxy} of this registry, so that what the plugin adds
+        can be kept apart while it runs in a thread.
+        """
+        logging.info("Registering plugin %s.", format_object(plugin))
+        proxy = PluginOutputProxy(self)
+        self._plugins.append(plugin)
+        self._proxies.append(proxy)
+        if hasattr(plugin, "plugin_name"):
+            self._plugin_names[plugin.plugin_name] = plugin
+        plugin.register(proxy)
 
     def add_header(self, name, value):
         """Add a new information header to be displayed to the user.
@@ -54,14 +200,7 @@ class SysInfoPluginRegistry(PluginRegistry):
         explored to create a deterministic ordering even when dealing
         with values obtained asynchornously.
         """
-        index = self._header_index.get(name)
-        if index is None:
-            self._header_index[name] = len(self._headers)
-            self._headers.append((name, value))
-        else:
-            index += 1
-            self._header_index[name] = index
-            self._headers.insert(index, (name, value))
+        _add_header(self._headers, self._header_index, name, value)
 
     def get_headers(self):
         """Get all information headers to be displayed to the user.
@@ -69,7 +208,8 @@ class SysInfoPluginRegistry(PluginRegistry):
         Headers which were added with value None are not included in
         the result.
         """
-        return [pair for pair in self._headers if pair[1] is not None]
+        return [pair for pair in _expand(self._headers, "headers")
+                if pair[1] is not None]
 
     def add_note(self, note):
         """Add a new eventual note to be shown up to the administrator."""
@@ -77,7 +217,7 @@ class SysInfoPluginRegistry(PluginRegistry):
 
     def get_notes(self):
         """Get all eventual notes to be shown up to the administrator."""
-        return self._notes
+        return _expand(self._notes, "notes")
 
     def add_footnote(self, note):
         """Add a new footnote to be shown up to the administrator."""
@@ -85,7 +225,16 @@ class SysInfoPluginRegistry(PluginRegistry):
 
     def get_footnotes(self):
         """Get all footnotes to be shown up to the administrator."""
-        return self._footnotes
+        return _expand(self._footnotes, "footnotes")
+
+    def get_timings(self):
+        """Get how long each plugin took to run, after L{run}.
+
+        @return: A list of C{(plugin name, seconds)} tuples in plugin order,
+            with C{None} seconds for plugins that timed out or raised an
+            exception.
+        """
+        return [(name, timing[0]) for name, timing in self._timings]
 
     def run(self):
         """Run all plugins, and return a deferred aggregating their results.
@@ -94,15 +243,57 @@ class SysInfoPluginRegistry(PluginRegistry):
         and return a deferred which aggregates each resulting deferred.
         """
         deferreds = []
-        for plugin in self.get_plugins():
+        pending = []
+        for plugin, proxy in zip(self.get_plugins(), self._proxies):
+            timing = [None]
+            self._timings.append((plugin.__class__.__name__, timing))
+            output = None
+            if (self._reactor is not None and
+                    getattr(plugin, "run_in_thread", False)):
+                # Reserve the place of the plugin's details.
+                output = SysInfoOutput()
+                for items in (self._headers, self._notes, self._footnotes):
+                    items.append(output)
+                proxy.output = output
             try:
-                result = plugin.run()
+                if output is None:
+                    result = plugin.run()
+                else:
+                    result = defer_to_daemon_thread(
+                        self._reactor, lambda plugin=plugin: _run_now(plugin))
             except Exception:
                 self._log_plugin_error(Failure(), plugin)
-            else:
-                result.addErrback(self._log_plugin_error, plugin)
-                deferreds.append(result)
-        return gather_results(deferreds).addCallback(self._report_error_note)
+                continue
+            done = Deferred()
+            result.addErrback(self._log_plugin_error, plugin)
+            result.addBoth(self._plugin_done, done, timing, time.time())
+            if not done.called:
+                pending.append((plugin, output, done))
+            deferreds.append(done)
+        result = gather_results(deferreds)
+        if pending and self._reactor is not None and self._timeout:
+            call = self._reactor.callLater(
+                self._timeout, self._time_out, pending)
+            result.addBoth(self._cancel_call, call)
+        return result.addCallback(self._report_error_note)
+
+    def _plugin_done(self, result, done, timing, started):
+        if not done.called:
+            timing[0] = time.time() - started
+            done.callback(result)
+
+    def _time_out(self, pending):
+        for plugin, output, done in pending:
+            if not done.called:
+                if output is not None:
+                    output.discard()
+                self._timed_out.append(plugin.__class__.__name__)
+                done.callback(None)
+
+    def _cancel_call(self, result, call):
+        if call.active():
+            call.cancel()
+        return result
 
     def _log_plugin_error(self, failure, plugin):
         self._plugin_error = True
@@ -112,6 +303,11 @@ class SysInfoPluginRegistry(PluginRegistry):
 
     def _report_error_note(self, result):
         from landscape.sysinfo.deployment import get_landscape_log_directory
+        if self._timed_out:
+            self.add_note(
+                "Information unavailable from %s: it took more than %g "
+                "seconds to collect." % (", ".join(self._timed_out),
+                                         self._timeout))
         if self._plugin_error:
             path = os.path.join(get_landscape_log_directory(), "sysinfo.log")
             self.add_note(
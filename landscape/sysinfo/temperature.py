@@ -5,6 +5,8 @@ from landscape.lib.sysstats import get_thermal_zones
 
 class Temperature(object):
 
+    run_in_thread = True
+
     def __init__(self, thermal_zone_path=None):
         self._thermal_zone_path = thermal_zone_path
 
@@ -12,7 +12,8 @@ from landscape.lib.testing import (
 
 from landscape.sysinfo.deployment import (
     SysInfoConfiguration, ALL_PLUGINS, run, setup_logging,
-    get_landscape_log_directory)
+    get_landscape_log_directory, format_timings)
+from landscape.sysinfo.snapshot import read_snapshot, write_snapshot
 from landscape.sysinfo.testplugin import TestPlugin
 from landscape.sysinfo.sysinfo import SysInfoPluginRegistry
 from landscape.sysinfo.load import Load
@@ -196,6 +197,84 @@ class RunTest(HelperTestCase, ConfigTestCase, TwistedTestCase,
             "  Test header: Test value\n\n  => Test note\n\n  Test footnote\n")
         return d
 
+    def test_use_fresh_snapshot(self):
+        """
+        With C{--use-snapshot}, a fresh snapshot is printed and neither the
+        plugins nor the reactor are run.
+        """
+        filename = self.makeFile()
+        write_snapshot(filename, "Snapshot output\n", 60)
+        reactor = FakeReactor()
+        run(["--sysinfo-plugins", "TestPlugin", "--use-snapshot",
+             "--snapshot-file", filename], reactor=reactor)
+        self.assertEqual("Snapshot output\n", self.stdout.getvalue())
+        self.assertFalse(reactor.queued_calls)
+
+    def test_use_stale_snapshot(self):
+        """
+        With C{--use-snapshot}, the plugins are run if the snapshot expired,
+        and the snapshot is refreshed.
+        """
+        filename = self.makeFile()
+        write_snapshot(filename, "Snapshot output\n", 0)
+        run(["--sysinfo-plugins", "TestPlugin", "--use-snapshot",
+             "--snapshot-file", filename])
+        output = ("  Test header: Test value\n\n  => Test note\n\n"
+                  "  Test footnote\n")
+        self.assertEqual(output, self.stdout.getvalue())
+        self.assertEqual(output, read_snapshot(filename))
+
+    def test_write_snapshot(self):
+        """
+        With C{--write-snapshot}, the output is written to the snapshot
+        file with the given TTL.
+        """
+        filename = self.makeFile()
+        run(["--sysinfo-plugins", "TestPlugin", "--write-snapshot",
+             "--snapshot-file", filename, "--snapshot-ttl", "30"])
+        self.assertIn("Test note", read_snapshot(filename))
+        self.assertIsNone(
+            read_snapshot(filename, lambda: os.path.getmtime(filename) + 31))
+
+    def test_profile(self):
+        """
+        With C{--profile}, the time each plugin took to run is shown after
+        the output.
+        """
+        run(["--sysinfo-plugins", "TestPlugin", "--profile"])
+        output = self.stdout.getvalue()
+        self.assertIn("Test note", output)
+        self.assertIn("  Plugin timings:\n    TestPlugin: ", output)
+
+    def test_format_timings(self):
+        self.assertEqual(
+            "Plugin timings:\n  Load: 1.5 ms\n  Disk: unavailable",
+            format_timings([("Load", 0.0015), ("Disk", None)]))
+
+    def test_plugin_timeout(self):
+        """
+        The registry created by L{run} waits for plugins for
+        C{--plugin-timeout} seconds.
+        """
+        with mock.patch("landscape.sysinfo.deployment."
+                        "SysInfoPluginRegistry") as registry:
+            registry.return_value.run.return_value = Deferred()
+            run(["--sysinfo-plugins", "TestPlugin", "--plugin-timeout", "2"])
+        registry.assert_called_once_with(reactor=None, timeout=2)
+
+    def test_write_snapshot_error(self):
+        """
+        Errors writing the snapshot are logged if C{--write-snapshot} was
+        passed.
+        """
+        filename = os.path.join(self.makeDir(), "missing", "snapshot")
+        logger = getLogger("landscape-sysinfo")
+        with mock.patch.object(logger, "error") as error:
+            run(["--sysinfo-plugins", "TestPlugin", "--write-snapshot",
+                 "--snapshot-file", filename])
+        self.assertTrue(error.called)
+        self.assertIn("Test note", self.stdout.getvalue())
+
     def test_stop_scheduled_in_callback(self):
         """
         Because of tm:3011, reactor.stop() must be called in a scheduled call.
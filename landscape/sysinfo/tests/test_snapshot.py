@@ -0,0 +1,112 @@
+import os
+import unittest
+
+import mock
+
+from landscape.lib.compat import StringIO
+
+from landscape.lib import testing
+from landscape.sysinfo.snapshot import (
+    DEFAULT_SNAPSHOT_FILE, get_snapshot_file, read_snapshot, serve_snapshot,
+    write_snapshot)
+
+
+class SnapshotTest(testing.FSTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.filename = self.makeFile()
+
+    def test_write_and_read(self):
+        """
+        L{read_snapshot} returns the output written by L{write_snapshot}
+        until its TTL expires.
+        """
+        write_snapshot(self.filename, u"System load: 0.5\n", 60,
+                       create_time=lambda: 1000)
+        self.assertEqual(0o644, os.stat(self.filename).st_mode & 0o777)
+        self.assertEqual(u"System load: 0.5\n",
+                         read_snapshot(self.filename, lambda: 1059))
+        self.assertIsNone(read_snapshot(self.filename, lambda: 1060))
+
+    def test_read_missing(self):
+        """L{read_snapshot} returns C{None} if there's no snapshot."""
+        self.assertIsNone(read_snapshot(self.makeFile()))
+
+    def test_read_garbage(self):
+        """L{read_snapshot} returns C{None} if the snapshot is garbled."""
+        self.makeFile("garbage\noutput", path=self.filename)
+        self.assertIsNone(read_snapshot(self.filename))
+
+    def test_write_over_symlink(self):
+        """
+        L{write_snapshot} replaces a symlink at the snapshot path, instead of
+        writing to its target.
+        """
+        target = self.makeFile("target")
+        os.symlink(target, self.filename)
+        write_snapshot(self.filename, u"output\n", 60)
+        self.assertFalse(os.path.islink(self.filename))
+        self.assertEqual(u"output\n", read_snapshot(self.filename))
+        with open(target) as fd:
+            self.assertEqual("target", fd.read())
+
+    def test_read_symlink(self):
+        """L{read_snapshot} doesn't follow symlinks."""
+        write_snapshot(self.filename, u"output\n", 60)
+        link = self.makeFile()
+        os.symlink(self.filename, link)
+        self.assertIsNone(read_snapshot(link))
+
+    def test_read_untrusted_owner(self):
+        """
+        L{read_snapshot} ignores snapshots owned by users other than root
+        and the current one.
+        """
+        write_snapshot(self.filename, u"output\n", 60)
+        real_fstat = os.fstat
+
+        def fstat(fd):
+            stat = real_fstat(fd)
+            return os.stat_result(stat[:4] + (1234,) + stat[5:])
+
+        with mock.patch("os.fstat", side_effect=fstat):
+            with mock.patch("os.getuid", return_value=1000):
+                self.assertIsNone(read_snapshot(self.filename))
+            with mock.patch("os.getuid", return_value=1234):
+                self.assertEqual(u"output\n", read_snapshot(self.filename))
+
+    def test_get_snapshot_file(self):
+        """
+        L{get_snapshot_file} finds the snapshot file in the command line
+        arguments, if C{--use-snapshot} is among them.
+        """
+        self.assertIsNone(get_snapshot_file([]))
+        self.assertEqual(DEFAULT_SNAPSHOT_FILE,
+                         get_snapshot_file(["--use-snapshot"]))
+        self.assertEqual(
+            "/snapshot",
+            get_snapshot_file(["--use-snapshot", "--snapshot-file=/snapshot"]))
+        self.assertEqual(
+            "/snapshot",
+            get_snapshot_file(["--snapshot-file", "/snapshot",
+                               "--use-snapshot"]))
+
+    def test_serve_snapshot(self):
+        """L{serve_snapshot} prints a fresh snapshot."""
+        write_snapshot(self.filename, u"output\n", 60)
+        stdout = StringIO()
+        self.assertTrue(serve_snapshot(
+            ["--use-snapshot", "--snapshot-file", self.filename], stdout))
+        self.assertEqual(u"output\n", stdout.getvalue())
+
+    def test_serve_expired_snapshot(self):
+        """
+        L{serve_snapshot} returns C{False} if the snapshot expired, for the
+        plugins to run.
+        """
+        write_snapshot(self.filename, u"output\n", 0)
+        stdout = StringIO()
+        self.assertFalse(serve_snapshot(
+            ["--use-snapshot", "--snapshot-file", self.filename], stdout))
+        self.assertEqual(u"", stdout.getvalue())
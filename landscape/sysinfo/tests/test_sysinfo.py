@@ -1,13 +1,15 @@
 from logging import getLogger, StreamHandler
 import mock
 import os
+import threading
 import unittest
 
+from twisted.internet import reactor
 from twisted.internet.defer import Deferred, succeed, fail
 
 from landscape.lib.compat import StringIO
 from landscape.lib.plugin import PluginRegistry
-from landscape.lib.testing import HelperTestCase
+from landscape.lib.testing import HelperTestCase, TwistedTestCase
 from landscape.sysinfo.sysinfo import SysInfoPluginRegistry, format_sysinfo
 
 
@@ -242,6 +244,132 @@ class SysInfoPluginRegistryTest(HelperTestCase):
             [self.plugin_exception_message % path])
 
 
+class ThreadedPlugin(object):
+
+    run_in_thread = True
+
+    def __init__(self, name, release=None):
+        self.name = name
+        self.release = release
+        self.thread = None
+
+    def register(self, registry):
+        self._sysinfo = registry
+
+    def run(self):
+        self.thread = threading.current_thread()
+        if self.release is not None:
+            self.release.wait(10)
+        self._sysinfo.add_header(self.name, "threaded")
+        self._sysinfo.add_note(self.name + " note")
+        return succeed(None)
+
+
+class SynchronousPlugin(object):
+
+    def register(self, registry):
+        self._sysinfo = registry
+
+    def run(self):
+        self._sysinfo.add_header("Synchronous", "value")
+        self._sysinfo.add_note("Synchronous note")
+        return succeed(None)
+
+
+class ThreadedSysInfoPluginRegistryTest(HelperTestCase, TwistedTestCase):
+
+    def setUp(self):
+        super(ThreadedSysInfoPluginRegistryTest, self).setUp()
+        self.sysinfo = SysInfoPluginRegistry(reactor=reactor, timeout=5)
+
+    def test_plugins_run_in_threads(self):
+        """
+        Plugins with a true C{run_in_thread} attribute run in their own
+        threads when the registry has a reactor.
+        """
+        plugin = ThreadedPlugin("Threaded")
+        self.sysinfo.add(plugin)
+
+        def check(result):
+            self.assertNotEqual(threading.current_thread(), plugin.thread)
+            self.assertEqual([("Threaded", "threaded")],
+                             self.sysinfo.get_headers())
+        return self.sysinfo.run().addCallback(check)
+
+    def test_plugins_run_synchronously_without_reactor(self):
+        """
+        Without a reactor, all plugins run synchronously.
+        """
+        sysinfo = SysInfoPluginRegistry()
+        plugin = ThreadedPlugin("Threaded")
+        sysinfo.add(plugin)
+        sysinfo.run()
+        self.assertEqual(threading.current_thread(), plugin.thread)
+        self.assertEqual([("Threaded", "threaded")], sysinfo.get_headers())
+
+    def test_threaded_plugins_keep_their_order(self):
+        """
+        The details of plugins running in threads are shown in plugin
+        order, whenever the plugins finish.
+        """
+        release = threading.Event()
+        self.sysinfo.add(ThreadedPlugin("Slow", release))
+        self.sysinfo.add(SynchronousPlugin())
+        self.sysinfo.add(ThreadedPlugin("Fast"))
+        result = self.sysinfo.run()
+        reactor.callLater(0.05, release.set)
+
+        def check(result):
+            self.assertEqual(
+                [("Slow", "threaded"), ("Synchronous", "value"),
+                 ("Fast", "threaded")],
+                self.sysinfo.get_headers())
+            self.assertEqual(
+                ["Slow note", "Synchronous note", "Fast note"],
+                self.sysinfo.get_notes())
+        return result.addCallback(check)
+
+    def test_timeout(self):
+        """
+        The details of plugins which don't finish in time are left out, and
+        a note tells they're unavailable.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.sysinfo = SysInfoPluginRegistry(reactor=reactor, timeout=0.05)
+        self.sysinfo.add(ThreadedPlugin("Hung", release))
+        self.sysinfo.add(SynchronousPlugin())
+
+        def check(result):
+            release.set()
+            self.assertEqual([("Synchronous", "value")],
+                             self.sysinfo.get_headers())
+            self.assertEqual(
+                ["Synchronous note",
+                 "Information unavailable from ThreadedPlugin: it took more "
+                 "than 0.05 seconds to collect."],
+                self.sysinfo.get_notes())
+            self.assertEqual(None, dict(self.sysinfo.get_timings())[
+                "ThreadedPlugin"])
+        return self.sysinfo.run().addCallback(check)
+
+    def test_get_timings(self):
+        """
+        L{SysInfoPluginRegistry.get_timings} returns how long each plugin
+        took to run, in plugin order.
+        """
+        self.sysinfo.add(ThreadedPlugin("Threaded"))
+        self.sysinfo.add(SynchronousPlugin())
+
+        def check(result):
+            timings = self.sysinfo.get_timings()
+            self.assertEqual(["ThreadedPlugin", "SynchronousPlugin"],
+                             [name for name, seconds in timings])
+            for name, seconds in timings:
+                self.assertTrue(seconds >= 0)
+        return self.sysinfo.run().addCallback(check)
+
+
 class FormatTest(unittest.TestCase):
 
     def test_no_headers(self):